@@ -0,0 +1,65 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+"""The same `list` over and over, with the result cache (`data.cache.size`)
+or not, and with a `mod` of a field the query does not refer to, or does,
+before each `list`.
+
+Usage:
+    python -m benchmarks.bench_cache [num_rows] [repeats]
+"""
+import sys
+import tempfile
+
+from benchmarks.common import build_instance, generate_rows, print_table, \
+    Timer
+from minesqlite.command_registry import get_command_info
+
+QUERY = [('department', 'P1'), ('$sort_desc', 'position')]
+
+# (label, kvs of the `mod` before each `list`, if any)
+MUTATIONS = [
+    ('no mod', None),
+    ('mod name', {'name': 'x'}),
+    ('mod position', {'position': 'SDE2'}),
+]
+
+
+def bench_setup(driver: str, cache_size: int, num_rows: int, repeats: int,
+                data_dir: str) -> list:
+    instance = build_instance(**{'data.driver': driver,
+                                 'data.sqlite.path': data_dir + '/sqlite.db',
+                                 'data.cache.size': cache_size})
+    for pk, kvs in generate_rows(num_rows):
+        instance.data.driver.create_one(pk, kvs)
+    command_list = get_command_info('list').handler
+    result = []
+    for _, kvs in MUTATIONS:
+        with Timer() as timer:
+            for _ in range(repeats):
+                if kvs is not None:
+                    instance.data.driver.update_one(0, kvs)
+                list(command_list(instance, list(QUERY)))
+        result.append(timer.elapsed * 1000 / repeats)
+    stats = instance.data.driver.cache_stats()
+    result.append(stats['cache_hit_ratio'])
+    instance.close()
+    return result
+
+
+def main():
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    table = []
+    for driver in ['memory_dict', 'sqlite']:
+        for cache_size in [0, 128]:
+            with tempfile.TemporaryDirectory() as data_dir:
+                table.append([driver, cache_size] + bench_setup(
+                    driver, cache_size, num_rows, repeats, data_dir))
+    print('%d rows, milliseconds per `list %s`:'
+          % (num_rows, ' '.join(' '.join(pair) for pair in QUERY)))
+    print_table(['driver', 'cache size']
+                + [label for label, _ in MUTATIONS] + ['hit ratio'], table)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+"""Throughput and write amplification of the data drivers.
+
+Usage:
+    python -m benchmarks.bench_drivers [num_rows]
+"""
+import sys
+import tempfile
+
+from benchmarks.common import build_instance, generate_rows, print_table, \
+    Timer
+
+DRIVERS = ['memory_dict', 'append_log', 'lsm', 'btree', 'memory_columnar',
+           'sqlite']
+
+
+def bench_driver(data_driver: str, num_rows: int, data_dir: str) -> list:
+    instance = build_instance(**{
+        'data.driver': data_driver,
+        'data.append_log.path': data_dir + '/append.log',
+        'data.lsm.path': data_dir + '/lsm',
+        'data.btree.path': data_dir + '/btree.db',
+        'data.sqlite.path': data_dir + '/sqlite.db',
+    })
+    driver = instance.data.driver
+    rows = list(generate_rows(num_rows))
+
+    with Timer() as insert_timer:
+        for pk, kvs in rows:
+            driver.create_one(pk, kvs)
+    with Timer() as update_timer:
+        for pk, _ in rows[:num_rows // 2]:
+            driver.update_one(pk, {'position': 'SDE0'})
+    with Timer() as read_timer:
+        for pk, _ in rows:
+            driver.read_one(pk)
+    with Timer() as miss_timer:
+        for pk in range(num_rows, num_rows * 2):
+            try:
+                driver.read_one(pk)
+            except Exception:
+                pass
+    with Timer() as cursor_timer:
+        cursor = driver.build_cursor()
+        while cursor:
+            cursor, _ = driver.next_row(cursor)
+    with Timer() as scan_timer:
+        for _ in driver.scan():
+            pass
+
+    stats = driver.stats()
+    driver.close()
+    return [
+        data_driver,
+        num_rows / insert_timer.elapsed,
+        num_rows // 2 / update_timer.elapsed,
+        num_rows / read_timer.elapsed,
+        num_rows / miss_timer.elapsed,
+        num_rows / cursor_timer.elapsed,
+        num_rows / scan_timer.elapsed,
+        stats.get('write_amplification'),
+    ]
+
+
+def main():
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    table = []
+    for data_driver in DRIVERS:
+        with tempfile.TemporaryDirectory() as data_dir:
+            table.append(bench_driver(data_driver, num_rows, data_dir))
+    print('%d rows, operations per second:' % num_rows)
+    print_table(['driver', 'insert', 'update', 'read (hit)', 'read (miss)',
+                 'scan (cursor)', 'scan (batched)', 'write amp.'], table)
+
+
+if __name__ == '__main__':
+    main()
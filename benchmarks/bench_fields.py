@@ -0,0 +1,53 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+"""`list` of all the rows printed as the REPL does, with all the fields or
+with `$fields id,name`, by driver.
+
+Usage:
+    python -m benchmarks.bench_fields [num_rows]
+"""
+import contextlib
+import io
+import sys
+import tempfile
+
+from benchmarks.common import build_instance, generate_rows, print_table, \
+    Timer
+from minesqlite import repl
+from minesqlite.command_registry import get_command_info
+
+QUERIES = {
+    'all fields': [],
+    '$fields id,name': [('$fields', 'id,name')],
+}
+
+
+def bench_driver(driver: str, num_rows: int, data_dir: str) -> list:
+    instance = build_instance(**{'data.driver': driver,
+                                 'data.sqlite.path': data_dir + '/sqlite.db',
+                                 'data.cache.size': 0})
+    for pk, kvs in generate_rows(num_rows):
+        instance.data.driver.create_one(pk, kvs)
+    command_list = get_command_info('list').handler
+    result = []
+    for arguments in QUERIES.values():
+        with Timer() as timer, contextlib.redirect_stdout(io.StringIO()):
+            repl.print_results(instance,
+                               command_list(instance, list(arguments)))
+        result.append(timer.elapsed * 1000)
+    instance.close()
+    return result
+
+
+def main():
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    table = []
+    for driver in ['memory_dict', 'memory_columnar', 'sqlite']:
+        with tempfile.TemporaryDirectory() as data_dir:
+            table.append([driver] + bench_driver(driver, num_rows, data_dir))
+    print('%d rows, milliseconds per `list` printed:' % num_rows)
+    print_table(['driver'] + list(QUERIES), table)
+
+
+if __name__ == '__main__':
+    main()
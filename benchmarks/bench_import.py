@@ -0,0 +1,89 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+"""Rows per second added by `add` lines through the REPL path (splitting,
+analysing the arguments, validating and converting a row at a time), and
+by `import` of a CSV and a JSON Lines file of the same rows, by driver.
+
+Usage:
+    python -m benchmarks.bench_import [num_rows]
+"""
+import contextlib
+import csv
+import io
+import json
+import sys
+import tempfile
+
+from benchmarks.common import build_instance, generate_rows, print_table, \
+    Timer
+from minesqlite import repl
+from minesqlite.command_registry import get_command_info
+from minesqlite.common.split_words_fsm import split_words
+
+DRIVERS = ['memory_dict', 'append_log', 'memory_columnar', 'sqlite']
+
+
+def _strings(pk, kvs) -> dict:
+    row = {'id': pk, **kvs}
+    return {field: value.strftime('%Y-%m-%d')
+            if hasattr(value, 'strftime') else str(value)
+            for field, value in row.items()}
+
+
+def write_files(num_rows: int, data_dir: str) -> list:
+    """The `add` lines of the rows, and write them into employees.csv and
+    employees.jsonl."""
+    rows = [_strings(pk, kvs) for pk, kvs in generate_rows(num_rows)]
+    with open(data_dir + '/employees.csv', 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(list(rows[0]))
+        writer.writerows(row.values() for row in rows)
+    with open(data_dir + '/employees.jsonl', 'w') as f:
+        f.writelines(json.dumps(row) + '\n' for row in rows)
+    return ['add ' + ' '.join('%s "%s"' % item for item in row.items())
+            for row in rows]
+
+
+def add_lines(instance, lines: list):
+    """What the REPL does for each line, the printing aside."""
+    for line in lines:
+        words = split_words(line)
+        command_info = get_command_info(words[0])
+        arguments = repl.analyse_arguments(command_info, words[1:])
+        repl.execute_command(instance, command_info, arguments)
+
+
+def bench_driver(driver: str, lines: list, data_dir: str) -> list:
+    result = []
+    for label in ['add', 'csv', 'jsonl']:
+        instance = build_instance(**{
+            'data.driver': driver,
+            'data.sqlite.path': '%s/%s.%s.db' % (data_dir, driver, label),
+            'data.append_log.path': '%s/%s.%s.log' % (data_dir, driver,
+                                                      label)})
+        command_import = get_command_info('import').handler
+        with Timer() as timer, contextlib.redirect_stdout(io.StringIO()):
+            if label == 'add':
+                add_lines(instance, lines)
+            else:
+                command_import(instance,
+                               ['%s/employees.%s' % (data_dir, label)])
+        instance.close()
+        result.append(len(lines) / timer.elapsed)
+    return result + [result[1] / result[0]]
+
+
+def main():
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    table = []
+    with tempfile.TemporaryDirectory() as data_dir:
+        lines = write_files(num_rows, data_dir)
+        for driver in DRIVERS:
+            table.append([driver] + bench_driver(driver, lines, data_dir))
+    print('%d rows, rows per second:' % num_rows)
+    print_table(['driver', 'add lines', 'import csv', 'import jsonl',
+                 'csv / add'], table)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+"""Latency of `list`, `count` and `group` queries by driver.
+
+In the default schema, `department` and `position` have a bitmap index and
+`in_date` a sorted index. The memory_dict driver is also run without any
+index, and with hash indexes in place of the bitmap ones.
+
+Usage:
+    python -m benchmarks.bench_list [num_rows]
+"""
+import contextlib
+import io
+import sys
+import tempfile
+
+from benchmarks.common import build_instance, generate_rows, print_table, \
+    Timer
+from minesqlite.command_registry import get_command_info
+from minesqlite.data.index import BitmapIndexes, RecordIndexes
+
+QUERIES = {
+    'department': [('department', 'P1')],
+    'department, position': [('department', 'P1'), ('position', 'SDE1')],
+    'position': [('position', 'SDE1')],
+    'department, sorted': [('department', 'P1'), ('$sort_desc', 'in_date')],
+    'in_date range': [('$between', 'in_date=2010-01-01,2010-03-31')],
+    'sorted, limit 10': [('$sort_desc', 'in_date'), ('$limit', '10')],
+}
+COUNT_QUERIES = {
+    'count department': [('department', 'P1')],
+    'count department, position': [('department', 'P1'),
+                                   ('position', 'SDE1')],
+}
+GROUP_QUERIES = {
+    'group department': [('department', '$count')],
+    'group department, position': [('department', '$count'),
+                                   ('position', '$count')],
+}
+
+# (label, sysconf, indexes: None for the schema's ones, or 'none', 'hash')
+SETUPS = [
+    ('memory_dict (no index)', {'data.driver': 'memory_dict'}, 'none'),
+    ('memory_dict (hash)', {'data.driver': 'memory_dict'}, 'hash'),
+    ('memory_dict', {'data.driver': 'memory_dict'}, None),
+    ('sqlite', {'data.driver': 'sqlite'}, None),
+    ('memory_columnar', {'data.driver': 'memory_columnar',
+                         'data.memory_columnar.vectorized': False}, None),
+    ('memory_columnar (numpy)', {'data.driver': 'memory_columnar',
+                                 'data.memory_columnar.vectorized': True},
+     None),
+]
+
+
+def replace_indexes(driver, indexes: str):
+    layout = driver._layout
+    hash_fields = ['department', 'position'] if indexes == 'hash' else []
+    sorted_fields = ['in_date'] if indexes == 'hash' else []
+    driver._indexes = RecordIndexes(layout, hash_fields, sorted_fields)
+    driver._bitmaps = BitmapIndexes(layout, [])
+
+
+def bench_setup(sysconf: dict, indexes: str, num_rows: int,
+                data_dir: str) -> list:
+    instance = build_instance(**{'data.sqlite.path': data_dir + '/sqlite.db',
+                                 **sysconf})
+    driver = instance.data.driver
+    if indexes is not None:
+        replace_indexes(driver, indexes)
+    for pk, kvs in generate_rows(num_rows):
+        driver.create_one(pk, kvs)
+
+    command_list = get_command_info('list').handler
+    command_count = get_command_info('count').handler
+    command_group = get_command_info('group').handler
+    result = []
+    for command, queries in [(command_list, QUERIES),
+                             (command_count, COUNT_QUERIES),
+                             (command_group, GROUP_QUERIES)]:
+        for arguments in queries.values():
+            # `count` and `group` print their result
+            with contextlib.redirect_stdout(io.StringIO()), Timer() as timer:
+                list(command(instance, list(arguments)))
+            result.append(timer.elapsed * 1000)
+    instance.close()
+    return result
+
+
+def main():
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    table = []
+    for label, sysconf, indexes in SETUPS:
+        with tempfile.TemporaryDirectory() as data_dir:
+            table.append([label] + bench_setup(sysconf, indexes, num_rows,
+                                               data_dir))
+    print('%d rows, milliseconds per query:' % num_rows)
+    print_table(['driver'] + list(QUERIES) + list(COUNT_QUERIES)
+                + list(GROUP_QUERIES), table)
+
+
+if __name__ == '__main__':
+    main()
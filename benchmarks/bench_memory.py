@@ -0,0 +1,48 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+"""Memory footprint and full scan speed of the in-memory drivers.
+
+Usage:
+    python -m benchmarks.bench_memory [num_rows]
+"""
+import gc
+import sys
+import tracemalloc
+
+from benchmarks.common import build_instance, generate_rows, print_table, \
+    Timer
+
+DRIVERS = ['memory_dict', 'memory_columnar']
+
+
+def bench_driver(data_driver: str, num_rows: int) -> list:
+    instance = build_instance(**{'data.driver': data_driver})
+    driver = instance.data.driver
+
+    # whatever the driver keeps of the freshly generated rows is measured
+    gc.collect()
+    tracemalloc.start()
+    for pk, kvs in generate_rows(num_rows):
+        driver.create_one(pk, kvs)
+    gc.collect()
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    with Timer() as scan_timer:
+        for _ in driver.scan():
+            pass
+
+    return [data_driver, allocated / num_rows,
+            num_rows / scan_timer.elapsed]
+
+
+def main():
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    table = [bench_driver(data_driver, num_rows) for data_driver in DRIVERS]
+    print('%d rows:' % num_rows)
+    print_table(['driver', 'bytes per row', 'scanned rows per second'],
+                table)
+
+
+if __name__ == '__main__':
+    main()
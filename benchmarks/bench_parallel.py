@@ -0,0 +1,65 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+"""`list` on memory_dict without indexes, with its filter and sort done in a
+pool of threads or processes (`data.parallel.*`), or not.
+
+Usage:
+    python -m benchmarks.bench_parallel [num_rows] [workers...]
+"""
+import concurrent.futures
+import sys
+
+from benchmarks.bench_list import replace_indexes
+from benchmarks.common import build_instance, generate_rows, print_table, \
+    Timer
+from minesqlite.command_registry import get_command_info
+from minesqlite.data.base import DEFAULT_PARALLEL_CHUNK_ROWS
+from minesqlite.data.plan import Parallel
+
+QUERIES = {
+    'filter': [('department', 'P1')],
+    'filter + sort': [('position', 'SDE1'), ('$sort_desc', 'in_date')],
+    'sort': [('$sort_asc', 'name')],
+}
+
+EXECUTORS = {
+    'thread': concurrent.futures.ThreadPoolExecutor,
+    'process': concurrent.futures.ProcessPoolExecutor,
+}
+
+
+def main():
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    all_workers = [int(arg) for arg in sys.argv[2:]] or [2, 4]
+
+    instance = build_instance(**{'data.driver': 'memory_dict'})
+    driver = instance.data.driver
+    replace_indexes(driver, 'none')
+    for pk, kvs in generate_rows(num_rows):
+        driver.create_one(pk, kvs)
+    command_list = get_command_info('list').handler
+
+    setups = [('-', 0, None)] + [(name, workers, executor_type)
+                                 for name, executor_type in EXECUTORS.items()
+                                 for workers in all_workers]
+    table = []
+    for name, workers, executor_type in setups:
+        executor = executor_type(workers) if executor_type else None
+        driver._parallel = executor and Parallel(
+            executor, DEFAULT_PARALLEL_CHUNK_ROWS)
+        result = [name, workers or '-']
+        for arguments in QUERIES.values():
+            with Timer() as timer:
+                list(command_list(instance, list(arguments)))
+            result.append(timer.elapsed * 1000)
+        if executor is not None:
+            executor.shutdown()
+        table.append(result)
+    instance.close()
+
+    print('%d rows, milliseconds per query (executor "-": none):' % num_rows)
+    print_table(['executor', 'workers'] + list(QUERIES), table)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+"""`list` on memory_dict, alone or partitioned across worker processes.
+
+Usage:
+    python -m benchmarks.bench_partitioned [num_rows] [partitions...]
+"""
+import sys
+
+from benchmarks.common import build_instance, generate_rows, print_table, \
+    Timer
+from minesqlite.command_registry import get_command_info
+
+QUERIES = {
+    'scan': [],
+    'filter': [('department', 'P1')],
+    'filter + sort': [('position', 'SDE1'), ('$sort_desc', 'in_date')],
+    'sort': [('$sort_asc', 'name')],
+}
+
+
+def bench_partitions(partitions: int, num_rows: int) -> list:
+    if partitions:
+        instance = build_instance(**{
+            'data.driver': 'partitioned',
+            'data.partitioned.partitions': str(partitions),
+            'data.partitioned.driver': 'memory_dict',
+        })
+    else:
+        instance = build_instance(**{'data.driver': 'memory_dict'})
+    driver = instance.data.driver
+    command_list = get_command_info('list').handler
+
+    with Timer() as insert_timer:
+        for pk, kvs in generate_rows(num_rows):
+            driver.create_one(pk, kvs)
+    result = [partitions or '-', num_rows / insert_timer.elapsed]
+    for arguments in QUERIES.values():
+        with Timer() as timer:
+            list(command_list(instance, list(arguments)))
+        result.append(num_rows / timer.elapsed)
+    instance.close()
+    return result
+
+
+def main():
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    all_partitions = [int(arg) for arg in sys.argv[2:]] or [0, 2, 4]
+    table = [bench_partitions(partitions, num_rows)
+             for partitions in all_partitions]
+    print('%d rows, rows per second (partitions "-": no partitioning):'
+          % num_rows)
+    print_table(['partitions', 'insert'] + ['list (%s)' % name
+                                            for name in QUERIES], table)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+"""Allocations of `list` with a selective filter on memory_dict.
+
+Compares the read-only row views handed out by memory_dict with copying
+every scanned row into a dict, which is what memory_dict used to do.
+
+Usage:
+    python -m benchmarks.bench_row_views [num_rows]
+"""
+import sys
+
+from benchmarks.common import build_instance, generate_rows, print_table, \
+    Timer
+from minesqlite.command_registry import get_command_info
+from minesqlite.data.index import BitmapIndexes, RecordIndexes
+
+# about 0.5% of the generated rows match
+FILTER = [('department', 'P1'), ('position', 'SDE1')]
+
+
+def bench_mode(instance, mode: str, num_rows: int) -> list:
+    driver = instance.data.driver
+    scan = driver.scan
+    allocated = [0]
+
+    def copying_scan(*args):
+        for batch in scan(*args):
+            yield [row.to_dict() for row in batch]
+
+    def counting_scan(*args):
+        for batch in scanning_scan(*args):
+            allocated[0] += sum(map(sys.getsizeof, batch))
+            yield batch
+
+    scanning_scan = copying_scan if mode == 'copy' else scan
+    command_list = get_command_info('list').handler
+    try:
+        driver.scan = scanning_scan
+        with Timer() as timer:
+            rows = list(command_list(instance, list(FILTER)))
+        driver.scan = counting_scan
+        list(command_list(instance, list(FILTER)))
+    finally:
+        del driver.scan
+
+    return [mode, len(rows), allocated[0] / num_rows,
+            num_rows / timer.elapsed]
+
+
+def main():
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    instance = build_instance(**{'data.driver': 'memory_dict'})
+    driver = instance.data.driver
+    # no index, so that `list` goes through the scan
+    driver._indexes = RecordIndexes(driver._layout, [])
+    driver._bitmaps = BitmapIndexes(driver._layout, [])
+    for pk, kvs in generate_rows(num_rows):
+        instance.data.driver.create_one(pk, kvs)
+
+    table = [bench_mode(instance, mode, num_rows)
+             for mode in ['copy', 'view']]
+    print('%d rows, filtered by %s:' % (num_rows, FILTER))
+    print_table(['mode', 'matched', 'row bytes allocated per scanned row',
+                 'scanned rows per second'], table)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+"""`list` and the printing of its rows, as the REPL does: the time until the
+first row is written, the total time, and the peak memory allocated
+meanwhile (tracemalloc, which slows everything down).
+
+Usage:
+    python -m benchmarks.bench_stream [num_rows]
+"""
+import sys
+import time
+import tracemalloc
+
+from benchmarks.common import build_instance, generate_rows, print_table
+from minesqlite import repl
+from minesqlite.command_registry import get_command_info
+
+QUERIES = {
+    'all': [],
+    'department': [('department', 'P1')],
+    'index order': [('$sort_desc', 'in_date')],
+    'sorted': [('$sort_asc', 'name')],
+}
+
+
+class _FirstWriteFile(object):
+    """A sink recording when it is first written to."""
+
+    def __init__(self):
+        self.first_write = None
+
+    def write(self, text: str):
+        if self.first_write is None:
+            self.first_write = time.perf_counter()
+
+    def flush(self):
+        pass
+
+
+def bench_query(instance, arguments: list) -> list:
+    command_list = get_command_info('list').handler
+    sink = _FirstWriteFile()
+    stdout, sys.stdout = sys.stdout, sink
+    try:
+        start = time.perf_counter()
+        repl.print_results(instance, command_list(instance, list(arguments)))
+        elapsed = time.perf_counter() - start
+        tracemalloc.start()
+        repl.print_results(instance, command_list(instance, list(arguments)))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        sys.stdout = stdout
+    return [(sink.first_write - start) * 1000, elapsed * 1000,
+            peak / 2 ** 20]
+
+
+def main():
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    instance = build_instance(**{'data.driver': 'memory_dict',
+                                 'data.cache.size': 0})
+    for pk, kvs in generate_rows(num_rows):
+        instance.data.driver.create_one(pk, kvs)
+    table = [[label] + bench_query(instance, arguments)
+             for label, arguments in QUERIES.items()]
+    instance.close()
+    print('%d rows:' % num_rows)
+    print_table(['query', 'first row (ms)', 'total (ms)', 'peak (MiB)'],
+                table)
+
+
+if __name__ == '__main__':
+    main()
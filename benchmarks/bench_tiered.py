@@ -0,0 +1,67 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+"""Hit rate and read throughput of the tiered driver by memory budget.
+
+The reads are skewed: 90% of them go to 10% of the rows.
+
+Usage:
+    python -m benchmarks.bench_tiered [num_rows] [num_reads]
+"""
+import random
+import sys
+import tempfile
+
+from benchmarks.common import build_instance, generate_rows, print_table, \
+    Timer
+
+# the budget, as a fraction of the memory taken by all the rows
+BUDGETS = [0, 0.5, 0.2, 0.1, 0.05]
+
+
+def generate_reads(num_rows: int, num_reads: int, seed: int = 0) -> list:
+    rand = random.Random(seed)
+    hot_rows = max(num_rows // 10, 1)
+    return [rand.randrange(hot_rows) if rand.random() < 0.9
+            else rand.randrange(num_rows) for _ in range(num_reads)]
+
+
+def bench_budget(budget: float, full_bytes: int, num_rows: int,
+                 reads: list, data_dir: str) -> list:
+    instance = build_instance(**{
+        'data.driver': 'tiered',
+        'data.memory.max_bytes': str(int(full_bytes * budget)),
+        'data.tiered.spill_path': data_dir + '/spill.bin',
+    })
+    driver = instance.data.driver
+    for pk, kvs in generate_rows(num_rows):
+        driver.create_one(pk, kvs)
+    with Timer() as timer:
+        for pk in reads:
+            driver.read_one(pk)
+    stats = driver.stats()
+    instance.close()
+    hits, misses = stats['hits'], stats['misses']
+    return ['%d%%' % (budget * 100) if budget else 'unlimited',
+            stats['hot_bytes'] / 2 ** 20, hits / (hits + misses),
+            len(reads) / timer.elapsed]
+
+
+def main():
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    num_reads = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+    reads = generate_reads(num_rows, num_reads)
+    table, full_bytes = [], 0
+    with tempfile.TemporaryDirectory() as data_dir:
+        for budget in BUDGETS:
+            result = bench_budget(budget, full_bytes, num_rows, reads,
+                                  data_dir)
+            if not budget:
+                full_bytes = int(result[1] * 2 ** 20)
+            table.append(result)
+    print('%d rows, %d skewed reads:' % (num_rows, num_reads))
+    print_table(['budget', 'resident MiB', 'hit rate', 'reads per second'],
+                table)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+"""`list` sorted with `$limit k` on memory_dict without indexes, i.e. a
+full scan whose rows are sorted (or the first k of them kept), by a single
+field or by fields in both directions.
+
+Usage:
+    python -m benchmarks.bench_top [num_rows] [k...]
+"""
+import sys
+
+from benchmarks.bench_list import replace_indexes
+from benchmarks.common import build_instance, generate_rows, print_table, \
+    Timer
+from minesqlite.command_registry import get_command_info
+
+SORTS = {
+    'in_date desc': [('$sort_desc', 'in_date')],
+    'department, in_date desc': [('$sort_asc', 'department'),
+                                 ('$sort_desc', 'in_date')],
+}
+
+
+def main():
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    all_k = [int(arg) for arg in sys.argv[2:]] or [10, 100, 10000]
+
+    instance = build_instance(**{'data.driver': 'memory_dict',
+                                 'data.cache.size': 0})
+    driver = instance.data.driver
+    replace_indexes(driver, 'none')
+    for pk, kvs in generate_rows(num_rows):
+        driver.create_one(pk, kvs)
+    command_list = get_command_info('list').handler
+
+    table = []
+    for k in all_k + [None]:
+        result = [k or 'no limit']
+        for sorts in SORTS.values():
+            arguments = list(sorts)
+            if k is not None:
+                arguments.append(('$limit', str(k)))
+            with Timer() as timer:
+                list(command_list(instance, arguments))
+            result.append(timer.elapsed * 1000)
+        table.append(result)
+    instance.close()
+
+    print('%d rows, milliseconds per query:' % num_rows)
+    print_table(['limit'] + list(SORTS), table)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+"""Filtering rows by the compiled predicate of a query, against evaluating
+its conditions one by one for each row: a loop over the filters and the
+ranges, or a walk of the tree of a `$where` expression.
+
+Then `list` with the same conditions as filters and ranges or as `$where`,
+on memory_dict without indexes.
+
+Usage:
+    python -m benchmarks.bench_where [num_rows]
+"""
+import sys
+
+from benchmarks.bench_list import replace_indexes
+from benchmarks.common import build_instance, generate_rows, print_table, \
+    Timer
+from minesqlite.command_registry import get_command_info
+from minesqlite.data.query import Query
+from minesqlite.data.where import compile_where
+
+# label -> (the arguments with filters and ranges, with `$where`)
+QUERIES = {
+    'department': (
+        [('department', 'P1')],
+        [('$where', 'department == P1')],
+    ),
+    'department, position, in_date': (
+        [('department', 'P1'), ('position', 'SDE1'),
+         ('$gt', 'in_date=2010-01-01')],
+        [('$where', 'department == P1 and position == SDE1 '
+                    'and in_date > 2010-01-01')],
+    ),
+    'in (P1, P2), not SDE1': (
+        None,
+        [('$where', 'department in (P1, P2) and not position == SDE1 '
+                    'and in_date >= 2010-01-01')],
+    ),
+}
+
+
+def match_generic(query, row) -> bool:
+    """The conditions of the query, interpreted for the row."""
+    for field, value in query.filters.items():
+        if row[field] != value:
+            return False
+    for field, range_ in query.ranges.items():
+        if not range_.contains(row.get(field)):
+            return False
+    return query.where is None or evaluate(query.where.node, row)
+
+
+def evaluate(node, row) -> bool:
+    kind = node[0]
+    if kind == 'const':
+        return node[1]
+    if kind == 'and':
+        return all(evaluate(child, row) for child in node[1])
+    if kind == 'or':
+        return any(evaluate(child, row) for child in node[1])
+    if kind == 'not':
+        return not evaluate(node[1], row)
+    value = row.get(node[1])
+    if kind == 'range':
+        return node[2].contains(value)
+    return {'eq': value == node[2], 'ne': value != node[2],
+            'in': value in node[2], 'not_in': value not in node[2]}[kind]
+
+
+def main():
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    instance = build_instance(**{'data.driver': 'memory_dict',
+                                 'data.cache.size': 0})
+    driver = instance.data.driver
+    replace_indexes(driver, 'none')
+    for pk, kvs in generate_rows(num_rows):
+        driver.create_one(pk, kvs)
+    rows = [row for batch in driver.scan() for row in batch]
+    command_list = get_command_info('list').handler
+
+    table = []
+    for label, (arguments, where_arguments) in QUERIES.items():
+        (_, text), = where_arguments
+        query = Query(where=compile_where(instance.schema, text))
+        with Timer() as generic:
+            expect = [row for row in rows if match_generic(query, row)]
+        with Timer() as compiled:
+            got = query.filter(rows)
+        assert got == expect
+        result = [label, len(got), generic.elapsed * 1000,
+                  compiled.elapsed * 1000]
+        for list_arguments in (arguments, where_arguments):
+            if list_arguments is None:
+                result.append(None)
+                continue
+            with Timer() as timer:
+                list(command_list(instance, list(list_arguments)))
+            result.append(timer.elapsed * 1000)
+        table.append(result)
+    instance.close()
+
+    print('%d rows, milliseconds:' % num_rows)
+    print_table(['conditions', 'rows', 'generic filter', 'compiled filter',
+                 'list filters', 'list $where'], table)
+
+
+if __name__ == '__main__':
+    main()
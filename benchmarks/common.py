@@ -0,0 +1,64 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+"""Helpers shared by the benchmarks.
+
+Run a benchmark from the root of the repository, e.g.:
+    python -m benchmarks.bench_drivers
+"""
+import datetime
+import io
+import random
+import time
+import typing
+
+from minesqlite import MineSQLite
+
+DEPARTMENTS = ['P%d' % n for n in range(1, 30)]
+POSITIONS = ['SDE%d' % n for n in range(1, 8)]
+
+
+def build_instance(**sysconf: str) -> MineSQLite:
+    """Build an instance with the default config overridden by `sysconf`.
+
+    No snapshot is loaded unless `data.snapshot.path` is given.
+    """
+    sysconf.setdefault('data.snapshot.path', '')
+    with open('etc/config.ini') as f:
+        lines = f.read().splitlines()
+    lines = [line for line in lines
+             if line.split('=')[0].strip() not in sysconf]
+    lines.extend('%s = %s' % (k, v) for k, v in sysconf.items())
+    return MineSQLite(
+        sysconf_kwargs={'conf_file': io.StringIO('\n'.join(lines))})
+
+
+def generate_rows(num_rows: int, seed: int = 0) \
+        -> typing.Iterator[typing.Tuple[int, dict]]:
+    """Generate `(pk, kvs)` of random employees of the default schema."""
+    rand = random.Random(seed)
+    pks = list(range(num_rows))
+    rand.shuffle(pks)
+    first_day = datetime.datetime(2000, 1, 1)
+    for pk in pks:
+        yield pk, {
+            'name': 'name %d' % pk,
+            'in_date': first_day + datetime.timedelta(
+                days=rand.randrange(8000)),
+            'department': rand.choice(DEPARTMENTS),
+            'position': rand.choice(POSITIONS),
+        }
+
+
+class Timer(object):
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.perf_counter() - self.start
+
+
+def print_table(headers: list[str], table: list[list]):
+    from tabulate import tabulate
+    print(tabulate(table, headers=headers, tablefmt='orgtbl',
+                   floatfmt='.2f', missingval='-'))
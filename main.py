@@ -26,7 +26,10 @@ def main():
     instance = MineSQLite(
         sysconf_kwargs={'conf_file': open(
             'etc/config.ini')})
-    repl_loop(instance)
+    try:
+        repl_loop(instance)
+    finally:
+        instance.close()
 
 
 if __name__ == '__main__':
@@ -14,3 +14,6 @@ class MineSQLite(object):
         self.sysconf = sysconf.SysConfManager(**sysconf_kwargs)
         self.schema = schema.SchemaManager(self.sysconf)
         self.data = data_base.DataManager(self)
+
+    def close(self):
+        self.data.driver.close()
@@ -1,8 +1,11 @@
 # coding=utf-8
 # Author: @hsiaoxychen
+import datetime
 import functools
 import typing
 
+from tabulate import tabulate
+
 from minesqlite import exceptions
 from minesqlite.command_registry import (
     register,
@@ -10,10 +13,35 @@ from minesqlite.command_registry import (
     get_command_info,
 )
 from minesqlite.common import utils
+from minesqlite.data import bulk
+from minesqlite.data.query import (
+    AFTER_KEY,
+    FIELDS_KEY,
+    LIMIT_KEY,
+    OFFSET_KEY,
+    RANGE_KEYS,
+    WHERE_KEY,
+    Page,
+    Query,
+    decode_token,
+    encode_token,
+)
+from minesqlite.data.where import compile_where
 
 if typing.TYPE_CHECKING:
     from minesqlite import MineSQLite
 
+# the types of the fields which ranges apply to
+RANGE_TYPES = ('integer', 'date')
+# the aggregate of the fields grouped by
+COUNT_AGGREGATE = '$count'
+# field type -> the type of its values in the sort key of an `$after` token
+TOKEN_VALUE_TYPES = {
+    'integer': int,
+    'string': str,
+    'date': datetime.datetime,
+}
+
 
 @register(command='add', name='Add', description='Adds an employee.',
           args_format='key-value', min_args=1)
@@ -57,65 +85,228 @@ def command_get(instance: 'MineSQLite',
     return [instance.data.driver.read_one(pk_value)]
 
 
+def _parse_count(value: str) -> int:
+    try:
+        count = int(value)
+    except ValueError:
+        count = -1
+    if count < 0:
+        raise exceptions.CommandInvalidValueArgument(value=value)
+    return count
+
+
+def _add_range(instance: 'MineSQLite', query: Query, magic_key: str,
+               value: str):
+    """Parse the `field=x[,y]` of a range."""
+    field, sep, bounds = value.partition('=')
+    if not sep:
+        raise exceptions.CommandInvalidValueArgument(value=value)
+    instance.schema.validate_keys({field: None}, no_missing=False,
+                                  no_extra=True)
+    if instance.schema.get_field_type(field) not in RANGE_TYPES:
+        raise exceptions.CommandInvalidValueArgument(value=value)
+    query.add_range(magic_key, field, [
+        instance.schema.convert_types({field: bound})[field]
+        for bound in bounds.split(',')])
+
+
+def _parse_fields(instance: 'MineSQLite', value: str) -> list[str]:
+    """Parse the `field1,field2` of `$fields`."""
+    fields = list(dict.fromkeys(
+        field.strip() for field in value.split(',') if field.strip()))
+    if not fields:
+        raise exceptions.CommandInvalidValueArgument(value=value)
+    instance.schema.validate_keys(dict.fromkeys(fields), no_missing=False,
+                                  no_extra=True)
+    return fields
+
+
+def _parse_query(instance: 'MineSQLite',
+                 arguments: list[tuple[str, str]]) -> Query:
+    """Parse the filters, ranges, sorts and paging of `list` and `count`."""
+    query = Query()
+    # magic key -> value, for the ones given at most once
+    paging = {}
+    for key, value in arguments:
+        if key in query.filters or key in paging:
+            raise exceptions.CommandArgumentConflict(key=key)
+        if key in RANGE_KEYS:
+            _add_range(instance, query, key, value)
+        elif key in (LIMIT_KEY, OFFSET_KEY, AFTER_KEY, WHERE_KEY,
+                     FIELDS_KEY):
+            paging[key] = value
+        elif key.startswith('$'):
+            query.add_sort(key, value)
+        else:
+            query.filters[key] = value
+    if LIMIT_KEY in paging:
+        query.limit = _parse_count(paging[LIMIT_KEY])
+    if OFFSET_KEY in paging:
+        query.offset = _parse_count(paging[OFFSET_KEY])
+    if WHERE_KEY in paging:
+        query.where = compile_where(instance.schema, paging[WHERE_KEY])
+    token = paging.get(AFTER_KEY)
+
+    instance.schema.validate_keys(
+        query.filters, no_missing=False, no_extra=True)
+    query.filters = instance.schema.convert_types(query.filters)
+    if query.limit is not None or token is not None:
+        query.break_ties(instance.schema.primary_key)
+    if token is not None:
+        fields, query.after = decode_token(token)
+        # only valid for the order it was issued for, and with values of the
+        # types of the fields, as the token may be made up
+        if fields != [field for field, _ in query.sorts] or any(
+                type(value) is not TOKEN_VALUE_TYPES.get(
+                    instance.schema.get_field_type(field))
+                for field, value in zip(fields, query.after)):
+            raise exceptions.CommandInvalidValueArgument(value=token)
+    if FIELDS_KEY in paging:
+        # along with the primary key, to refresh the cached rows, and the
+        # sorted fields, to merge the rows and resume after the last one
+        query.columns = tuple(dict.fromkeys([
+            *_parse_fields(instance, paging[FIELDS_KEY]),
+            instance.schema.primary_key,
+            *(field for field, _ in query.sorts)]))
+    return query
+
+
 @register('list', 'List', 'List all employees.',
           args_format='key-value')
 def command_list(instance: 'MineSQLite',
-                 arguments: list[tuple[str, str]]) -> list[dict]:
+                 arguments: list[tuple[str, str]]) -> Page:
     """List all employees (after filtering) and sort them.
 
+    `$gt field=x` and `$lt field=x` keep the rows whose field is greater or
+    less than x, `$between field=x,y` the ones within [x, y], for integer
+    and date fields. `$limit n` keeps only the first n rows, after skipping
+    `$offset n` rows.
+
+    `$where <expression>` keeps the rows satisfying an expression of
+    comparisons (`==`, `!=`, `<`, `<=`, `>`, `>=`, `in (x, y)`,
+    `not in (x, y)`) between a field and a value, combined with `and`, `or`,
+    `not` and parentheses. It is checked and compiled once, along with the
+    other filters, into a single function.
+
+    A page of sorted rows followed by more comes with a token, to list the
+    next page by adding `$after <token>` to the same arguments. Unlike an
+    offset, it resumes right after the last row, without going through the
+    skipped rows when an index gives the order. Ties are sorted by `id`.
+
+    The rows are printed as they come from the driver, rather than once
+    they all have: right away unless they have to be sorted first.
+    `$fields field1,field2` prints only these fields, which are the only
+    ones the driver reads (with `id` and the sorted fields).
+
     Example:
         list
         list name "Chen Xiaoyuan" $sort_asc id $sort_desc name
+        list $between in_date=2022-01-01,2022-06-30 $sort_asc in_date
+        list department P1 $gt id=100 $limit 10 $offset 20
+        list $where "in_date >= 2022-01-01 and department in (P1, P2)"
+        list $fields id,name department P1
+        list $sort_desc in_date $limit 10 $after <token of the last page>
+    """
+    query = _parse_query(instance, arguments)
+    fields = None
+    if query.columns is not None:
+        fields = _parse_fields(instance, dict(arguments)[FIELDS_KEY])
+    paged = bool(query.sorts) and bool(query.limit)
+    if paged:
+        # one more row tells whether there is a next page
+        query.limit += 1
+    rows = instance.data.driver.fetch(query)
+    if not paged:
+        return Page(rows, fields=fields)
+    page = Page(fields=fields)
+
+    def hold_back_last_row():
+        last_row = None
+        # up to the end, for the rows to be cached
+        for count, row in enumerate(rows, 1):
+            if count == query.limit:
+                page.next_token = encode_token(
+                    [field for field, _ in query.sorts],
+                    query.key_of(last_row))
+            else:
+                yield row
+                last_row = row
+
+    page.rows = hold_back_last_row()
+    return page
+
+
+@register('explain', 'Explain', 'Show how a `list` is answered.',
+          args_format='key-value')
+def command_explain(instance: 'MineSQLite',
+                    arguments: list[tuple[str, str]]) -> list[dict]:
+    """Run a `list` with the same arguments, and show its plan: the access
+    path chosen, and the estimated and actual row counts of each step.
+
+    Example:
+        explain department P1 $sort_desc in_date $limit 10
+    """
+    query = _parse_query(instance, arguments)
+    for line in instance.data.driver.explain(query).format():
+        print(line)
+    return []
+
+
+@register('count', 'Count', 'Count the employees.',
+          args_format='key-value')
+def command_count(instance: 'MineSQLite',
+                  arguments: list[tuple[str, str]]) -> list[dict]:
+    """Count the employees (after filtering), with the arguments of `list`.
+
+    Example:
+        count
+        count department P1 position SDE1
+        count $between in_date=2022-01-01,2022-06-30
     """
-    magic_params = []
-    filter_params = {}
+    query = _parse_query(instance, arguments)
+    print('%d employee(s)' % instance.data.driver.count(query))
+    return []
+
+
+@register('group', 'Group', 'Count the employees by the values of fields.',
+          args_format='key-value', min_args=1)
+def command_group(instance: 'MineSQLite',
+                  arguments: list[tuple[str, str]]) -> list[dict]:
+    """Count the employees (after filtering) by the values of the fields
+    given with `$count`, with the filters and ranges of `list`.
+
+    The counts by the fields with the `bitmap_index` attribute are kept up
+    to date by the memory_dict driver, rather than counted on demand.
+
+    Example:
+        group department $count
+        group department $count position $count
+        group position $count department P1
+    """
+    group_by, filters = [], []
     for key, value in arguments:
-        if key in filter_params:
-            raise exceptions.CommandArgumentConflict(key=key)
-        if key.startswith('$'):
-            magic_params.append((key, value))
+        if value == COUNT_AGGREGATE:
+            if key not in instance.schema.fields:
+                raise exceptions.CommandInvalidKeyArgument(key=key)
+            if key in group_by:
+                raise exceptions.CommandArgumentConflict(key=key)
+            group_by.append(key)
         else:
-            filter_params[key] = value
-
-    instance.schema.validate_keys(
-        filter_params, no_missing=False, no_extra=True)
-    filter_params = instance.schema.convert_types(filter_params)
-
-    def do_filter(_row: dict) -> bool:
-        for filter_key, filter_value in filter_params.items():
-            if _row[filter_key] != filter_value:
-                return False
-        return True
-
-    cursor = instance.data.driver.build_cursor()
-    rows = []
-    while cursor:
-        cursor, row = instance.data.driver.next_row(cursor)
-        if do_filter(row):
-            rows.append(row)
-
-    def compare(row1: dict, row2: dict) -> int:
-        for magic_key, field_name in magic_params:
-            if magic_key == '$sort_asc':
-                reverse = False
-            elif magic_key == '$sort_desc':
-                reverse = True
-            else:
-                raise exceptions.InternalError(
-                    "invalid magic_key: %s" % magic_key)
-
-            value1, value2 = row1[field_name], row2[field_name]
-            if value1 == value2:
-                continue
-            if not reverse:
-                return 1 if value1 > value2 else -1
-            else:
-                return 1 if value1 < value2 else -1
-        return 0
+            filters.append((key, value))
+    if not group_by:
+        raise exceptions.CommandTooFewArguments(expect=1, real=0)
+    query = _parse_query(instance, filters)
+    if query.sorts or query.limit is not None or query.offset \
+            or query.after is not None:
+        raise exceptions.CommandInvalidKeyArgument(
+            "only filters and ranges apply to `group`")
 
-    if magic_params:
-        rows.sort(key=functools.cmp_to_key(compare))
-    return rows
+    groups = instance.data.driver.aggregate(query, group_by)
+    table = [[*values, count]
+             for values, count in sorted(groups.items())]
+    headers = [field.upper() for field in group_by] + ['COUNT']
+    print(tabulate(table, headers=headers, tablefmt='orgtbl'))
+    return []
 
 
 @register('mod', 'Modify', 'Modify an employee.',
@@ -144,6 +335,106 @@ def command_mod(instance: 'MineSQLite',
     return [instance.data.driver.update_one(pk_value, kvs)]
 
 
+def _get_snapshot_path(instance: 'MineSQLite', arguments: list[str]) -> str:
+    path = arguments[0] if arguments \
+        else instance.sysconf['data.snapshot.path']
+    if not path:
+        raise exceptions.CommandTooFewArguments(expect=1, real=0)
+    return path
+
+
+@register('save', 'Save', 'Save all employees into a snapshot file.',
+          args_format='value', max_args=1)
+def command_save(instance: 'MineSQLite', arguments: list[str]) \
+        -> list[dict]:
+    """Save all employees into a snapshot file.
+
+    The path defaults to `data.snapshot.path`, which is loaded on startup.
+
+    Example:
+        save
+        save backup.snapshot
+    """
+    path = _get_snapshot_path(instance, arguments)
+    count = instance.data.driver.save_snapshot(path)
+    print('%d employee(s) saved into %s' % (count, path))
+    return []
+
+
+@register('load', 'Load', 'Replace all employees with a snapshot file.',
+          args_format='value', max_args=1)
+def command_load(instance: 'MineSQLite', arguments: list[str]) \
+        -> list[dict]:
+    """Replace all employees with the ones in a snapshot file.
+
+    The path defaults to `data.snapshot.path`.
+
+    Example:
+        load
+        load backup.snapshot
+    """
+    path = _get_snapshot_path(instance, arguments)
+    count = instance.data.driver.load_snapshot(path)
+    print('%d employee(s) loaded from %s' % (count, path))
+    return []
+
+
+@register('import', 'Import', 'Add the employees of a CSV or JSONL file.',
+          args_format='value', min_args=1, max_args=2)
+def command_import(instance: 'MineSQLite', arguments: list[str]) \
+        -> list[dict]:
+    """Add the employees of a CSV file, whose header line names the fields,
+    or of a JSON Lines file, an object per line.
+
+    The format defaults to the one of the extension of the file. The file
+    is read, converted and added by batches of rows, each of which is added
+    all at once or not at all: the batches before a bad row stay added.
+
+    Example:
+        import employees.csv
+        import employees.txt jsonl
+    """
+    path = arguments[0]
+    format_ = arguments[1] if len(arguments) > 1 else bulk.format_of(path)
+    schema = instance.schema
+    fields = schema.fields
+    pk = schema.primary_key
+    other_fields = [field for field in fields if field != pk]
+    count = 0
+    try:
+        for columns in bulk.read_columns(path, format_, fields):
+            columns = {field: schema.convert_column(field, values)
+                       for field, values in columns.items()}
+            entries = list(zip(columns[pk], (
+                dict(zip(other_fields, values))
+                for values in zip(*(columns[field]
+                                    for field in other_fields)))))
+            count += instance.data.driver.create_many(entries)
+    except BaseException:
+        print('%d employee(s) imported from %s before the error'
+              % (count, path))
+        raise
+    print('%d employee(s) imported from %s' % (count, path))
+    return []
+
+
+@register('stats', 'Stats', 'Show the counters of the data driver.',
+          args_format='value', max_args=0)
+def command_stats(instance: 'MineSQLite', arguments: list[str]) \
+        -> list[dict]:
+    """Show the counters of the data driver, e.g. its cache hits and misses.
+
+    Example:
+        stats
+    """
+    stats = dict(instance.data.driver.stats())
+    stats.update(instance.data.driver.cache_stats())
+    width = max(map(len, stats), default=0)
+    for key, value in stats.items():
+        print('%-*s  %s' % (width, key, value))
+    return []
+
+
 @register('help', 'Help', 'Show this help message.',
           args_format='value', max_args=1)
 def command_help(instance: 'MineSQLite', arguments: list[str]) \
@@ -0,0 +1,49 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+"""A simple implementation of bloom filter.
+
+The hash positions are derived from a single blake2b digest by double
+hashing, so that the filter is stable across processes and can be persisted.
+"""
+import hashlib
+import math
+import typing
+
+
+__all__ = ['BloomFilter']
+
+
+class BloomFilter(object):
+    def __init__(self, num_bits: int, num_hashes: int,
+                 bits: typing.Optional[bytes] = None):
+        assert num_bits > 0 and num_hashes > 0
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        if bits is None:
+            bits = bytes((num_bits + 7) // 8)
+        self.bits = bytearray(bits)
+
+    @classmethod
+    def for_capacity(cls, capacity: int, bits_per_key: int = 10) \
+            -> 'BloomFilter':
+        """Build an empty filter sized for `capacity` keys."""
+        num_bits = max(64, capacity * bits_per_key)
+        num_hashes = max(1, round(bits_per_key * math.log(2)))
+        return cls(num_bits, num_hashes)
+
+    def _positions(self, key: typing.Any) -> typing.Iterator[int]:
+        digest = hashlib.blake2b(repr(key).encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, key: typing.Any):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key: typing.Any) -> bool:
+        for pos in self._positions(key):
+            if not self.bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
@@ -1,6 +1,8 @@
 # coding=utf-8
 # Author: @hsiaoxychen 2022/06/15
 
+import contextlib
+import gc
 import typing
 
 from minesqlite import exceptions
@@ -17,3 +19,28 @@ def convert_argument_groups_into_dict(
             raise exceptions.CommandArgumentConflict(key=key)
         result[key] = value
     return result
+
+
+def get_sysconf_or_default(sysconf: typing.Mapping[str, typing.Any],
+                           key: str, default: VT) -> VT:
+    """Get a value from sysconf, or `default` if it has not been set."""
+    value = sysconf[key]
+    if value == '':
+        return default
+    return value
+
+
+@contextlib.contextmanager
+def gc_paused():
+    """Pause the cyclic garbage collector while allocating in bulk.
+
+    Otherwise, the collections triggered by the allocations repeatedly
+    traverse every object alive, which makes bulk loading quadratic-ish.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
@@ -1,9 +1,18 @@
 # coding=utf-8
 # Author: @hsiaoxychen
 import abc
+import collections
+import concurrent.futures
+import dataclasses
+import functools
 import typing
 
 from minesqlite import exceptions
+from minesqlite.common import utils
+from minesqlite.data.cache import DEFAULT_CACHE_MAX_ROWS, \
+    DEFAULT_CACHE_SIZE, ResultCache, Versions
+from minesqlite.data.plan import Access, Parallel, PlanNode, Planner
+from minesqlite.data.query import Query
 
 if typing.TYPE_CHECKING:
     from minesqlite import MineSQLite
@@ -12,6 +21,14 @@ if typing.TYPE_CHECKING:
 _KeyType = str
 _RowType = dict
 
+DEFAULT_SCAN_BATCH_SIZE = 1024
+DEFAULT_PARALLEL_CHUNK_ROWS = 65536
+
+_EXECUTORS = {
+    'thread': concurrent.futures.ThreadPoolExecutor,
+    'process': concurrent.futures.ProcessPoolExecutor,
+}
+
 
 class CursorABC(abc.ABC):
     @abc.abstractmethod
@@ -19,9 +36,123 @@ class CursorABC(abc.ABC):
         pass
 
 
+class IteratorCursor(CursorABC):
+    """A cursor walking through an iterator of rows with one row lookahead."""
+    _EXHAUSTED = object()
+
+    def __init__(self, rows: typing.Iterator[_RowType]):
+        self._rows = rows
+        self._next = next(rows, self._EXHAUSTED)
+
+    def __bool__(self):
+        return self._next is not self._EXHAUSTED
+
+    def advance(self) -> _RowType:
+        row = self._next
+        self._next = next(self._rows, self._EXHAUSTED)
+        return row
+
+
+class SlotCursor(CursorABC):
+    """A resumable cursor over rows stored in slots, e.g. of a list.
+
+    Much like the cursor of `SCAN` in redis, it is merely a position: rows
+    never move between slots, so whatever is inserted or deleted meanwhile,
+    every row present from the beginning to the end of a traversal is
+    returned exactly once. Rows inserted meanwhile may or may not be.
+    """
+
+    def __init__(self, slot: int, num_slots: int):
+        self.slot = slot
+        self.num_slots = num_slots
+
+    def __bool__(self):
+        return self.slot < self.num_slots
+
+
+def _bumping_table(method: typing.Callable) -> typing.Callable:
+    """Wrap a mutation of any row, or of all of them."""
+    @functools.wraps(method)
+    def wrapper(self: 'DataManagerABC', *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            # even if it failed, which it may have done halfway
+            self.versions.bump_table()
+    return wrapper
+
+
+def _bumping_fields(method: typing.Callable) -> typing.Callable:
+    """Wrap an update of some fields of a row."""
+    @functools.wraps(method)
+    def wrapper(self: 'DataManagerABC', pk: _KeyType, kvs: _RowType,
+                *args, **kwargs):
+        try:
+            return method(self, pk, kvs, *args, **kwargs)
+        finally:
+            self.versions.bump_fields(kvs)
+    return wrapper
+
+
+def check_unique_pks(pk: str, entries: typing.Iterable[typing.Tuple[
+        _KeyType, _RowType]]):
+    """Raise if a primary key comes twice among the `(pk, kvs)` entries."""
+    seen = set()
+    for pk_value, _ in entries:
+        if pk_value in seen:
+            raise exceptions.DataDuplicateEntry(field=pk, value=pk_value)
+        seen.add(pk_value)
+
+
 class DataManagerABC(abc.ABC):
+    """The mutations of a driver (`create_one`, `create_many`, `update_one`,
+    `delete_one` and `load_snapshot`) bump its `versions`, whatever the
+    driver, to keep the cache of `fetch` fresh.
+    """
+    _MUTATIONS = {
+        'create_one': _bumping_table,
+        'create_many': _bumping_table,
+        'update_one': _bumping_fields,
+        'delete_one': _bumping_table,
+        'load_snapshot': _bumping_table,
+    }
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for name, wrap in cls._MUTATIONS.items():
+            method = cls.__dict__.get(name)
+            if callable(method):
+                setattr(cls, name, wrap(method))
+
     def __init__(self, instance: 'MineSQLite'):
         self.instance = instance
+        self.versions = Versions()
+        self._parallel = self._build_parallel()
+        self._cache = ResultCache(
+            utils.get_sysconf_or_default(
+                instance.sysconf, 'data.cache.size', DEFAULT_CACHE_SIZE),
+            utils.get_sysconf_or_default(
+                instance.sysconf, 'data.cache.max_rows',
+                DEFAULT_CACHE_MAX_ROWS),
+            self.versions, self.pk, self.read_many)
+
+    def _build_parallel(self) -> typing.Optional[Parallel]:
+        """The pool of `data.parallel.workers` workers (threads or
+        processes, by `data.parallel.executor`) to filter and sort the
+        scans in, None if no worker."""
+        sysconf = self.instance.sysconf
+        workers: int = utils.get_sysconf_or_default(
+            sysconf, 'data.parallel.workers', 0)
+        if not workers:
+            return None
+        executor: str = utils.get_sysconf_or_default(
+            sysconf, 'data.parallel.executor', 'thread')
+        if executor not in _EXECUTORS:
+            raise exceptions.InternalError(
+                "unknown data.parallel.executor: %s" % executor)
+        chunk_rows: int = utils.get_sysconf_or_default(
+            sysconf, 'data.parallel.chunk_rows', DEFAULT_PARALLEL_CHUNK_ROWS)
+        return Parallel(_EXECUTORS[executor](max_workers=workers), chunk_rows)
 
     @property
     def pk(self):
@@ -32,10 +163,41 @@ class DataManagerABC(abc.ABC):
     def create_one(self, pk: _KeyType, kvs: _RowType) -> _RowType:
         pass
 
+    def create_many(self, entries: typing.Sequence[typing.Tuple[_KeyType,
+                                                                _RowType]]) \
+            -> int:
+        """Create the rows of the `(pk, kvs)` entries, all of them or none:
+        none is created if one is invalid or already exists. The number of
+        rows created.
+
+        Drivers are expected to override this with something cheaper than
+        creating the rows one by one, e.g. a single transaction.
+        """
+        check_unique_pks(self.pk, entries)
+        created = []
+        try:
+            for pk, kvs in entries:
+                self.create_one(pk, kvs)
+                created.append(pk)
+        except BaseException:
+            for pk in created:
+                self.delete_one(pk)
+            raise
+        return len(created)
+
     @abc.abstractmethod
     def read_one(self, pk: _KeyType) -> _RowType:
         pass
 
+    def read_many(self, pks: typing.Sequence[_KeyType]) \
+            -> typing.List[_RowType]:
+        """The rows of the primary keys, in their order.
+
+        Drivers paying a round trip per `read_one` are expected to override
+        this with a single lookup.
+        """
+        return list(map(self.read_one, pks))
+
     @abc.abstractmethod
     def build_cursor(self) -> CursorABC:
         pass
@@ -53,6 +215,108 @@ class DataManagerABC(abc.ABC):
     def delete_one(self, pk: _KeyType) -> _RowType:
         pass
 
+    def scan(self, batch_size: int = DEFAULT_SCAN_BATCH_SIZE) \
+            -> typing.Iterator[typing.List[_RowType]]:
+        """Yield all the rows, in batches of at most `batch_size` rows.
+
+        Drivers are expected to override this with something cheaper than
+        walking through the rows one by one with a cursor.
+        """
+        cursor = self.build_cursor()
+        while cursor:
+            batch = []
+            while cursor and len(batch) < batch_size:
+                cursor, row = self.next_row(cursor)
+                batch.append(row)
+            yield batch
+
+    def plan(self, query: Query) -> PlanNode:
+        """The plan answering the query (see `plan`): a scan by default.
+
+        Drivers with indexes offer the planner more access paths, and the
+        ones doing the whole query by themselves plan a single node.
+        """
+        num_rows = self.stats().get('rows')
+        return Planner(num_rows, parallel=self._parallel).plan(query, [
+            Access('scan', self.scan, num_rows)])
+
+    def select(self, query: Query,
+               batch_size: int = DEFAULT_SCAN_BATCH_SIZE) \
+            -> typing.Iterator[typing.List[_RowType]]:
+        """Yield the rows matching the query in its order, in batches."""
+        return self.plan(query).execute(batch_size)
+
+    def fetch(self, query: Query) -> typing.Iterator[_RowType]:
+        """Yield the rows `select` yields for the query, as they come, or
+        from the cache of the last `data.cache.size` queries when fresh.
+
+        The rows are cached once all were yielded, unless they are more than
+        `data.cache.max_rows`: they are not kept meanwhile past that.
+        """
+        rows = self._cache.get(query)
+        if rows is not None:
+            yield from rows
+            return
+        versions = self._cache.snapshot(query)
+        kept = [] if self._cache.size > 0 else None
+        for batch in self.select(query):
+            if kept is not None:
+                kept.extend(batch)
+                if len(kept) > self._cache.max_rows:
+                    kept = None
+            yield from batch
+        if kept is not None:
+            self._cache.put(query, kept, versions)
+
+    def cache_stats(self) -> typing.Dict[str, typing.Any]:
+        """The counters of the cache of `fetch`, e.g. its hit ratio."""
+        return self._cache.stats()
+
+    def explain(self, query: Query) -> PlanNode:
+        """Plan the query and run it, counting the rows of each node."""
+        plan = self.plan(query)
+        for _ in plan.execute(DEFAULT_SCAN_BATCH_SIZE):
+            pass
+        return plan
+
+    def count(self, query: Query) -> int:
+        """The number of rows `select` would yield for the query."""
+        if query.after is None:
+            # the order does not matter
+            query = dataclasses.replace(query, sorts=[])
+        return sum(map(len, self.select(query)))
+
+    def aggregate(self, query: Query, group_by: typing.Sequence[str]) \
+            -> typing.Dict[tuple, int]:
+        """The number of rows matching the filters and ranges of the query,
+        by the values of the `group_by` fields (as a tuple)."""
+        query = dataclasses.replace(query, sorts=[], limit=None, offset=0,
+                                    after=None)
+        groups = collections.Counter()
+        for batch in self.select(query):
+            groups.update(tuple(row.get(field) for field in group_by)
+                          for row in batch)
+        return dict(groups)
+
+    def save_snapshot(self, path: str) -> int:
+        """Save all the rows into a snapshot file, returning the row count."""
+        raise exceptions.DataOperationUnsupported(
+            driver=self.__class__.__name__, operation='snapshots')
+
+    def load_snapshot(self, path: str) -> int:
+        """Replace all the rows with a snapshot, returning the row count."""
+        raise exceptions.DataOperationUnsupported(
+            driver=self.__class__.__name__, operation='snapshots')
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        """Driver-specific counters, for benchmarking and monitoring."""
+        return {}
+
+    def close(self):
+        """Release the resources (files, threads, ...) held by the driver."""
+        if self._parallel is not None:
+            self._parallel.executor.shutdown(cancel_futures=True)
+
 
 class DataManager(abc.ABC):
     def __init__(self, instance: 'MineSQLite'):
@@ -64,6 +328,27 @@ class DataManager(abc.ABC):
         if data_driver == 'memory_dict':
             from minesqlite.data.drivers import memory_dict as driver
             self.driver = driver.MemoryDictDataManager(**driver_kwargs)
+        elif data_driver == 'append_log':
+            from minesqlite.data.drivers import append_log as driver
+            self.driver = driver.AppendLogDataManager(**driver_kwargs)
+        elif data_driver == 'lsm':
+            from minesqlite.data.drivers import lsm as driver
+            self.driver = driver.LSMDataManager(**driver_kwargs)
+        elif data_driver == 'btree':
+            from minesqlite.data.drivers import btree as driver
+            self.driver = driver.BTreeDataManager(**driver_kwargs)
+        elif data_driver == 'memory_columnar':
+            from minesqlite.data.drivers import memory_columnar as driver
+            self.driver = driver.MemoryColumnarDataManager(**driver_kwargs)
+        elif data_driver == 'tiered':
+            from minesqlite.data.drivers import tiered as driver
+            self.driver = driver.TieredDataManager(**driver_kwargs)
+        elif data_driver == 'sqlite':
+            from minesqlite.data.drivers import sqlite as driver
+            self.driver = driver.SQLiteDataManager(**driver_kwargs)
+        elif data_driver == 'partitioned':
+            from minesqlite.data.drivers import partitioned as driver
+            self.driver = driver.PartitionedDataManager(**driver_kwargs)
         else:
             raise exceptions.InternalError(
                 "unknown data.driver: %s" % data_driver)
@@ -0,0 +1,116 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+"""Read the rows of a CSV or a JSON Lines file in batches, column by column.
+
+A CSV file starts with a header line naming the fields, in any order, and
+each line of a JSON Lines file is an object of the fields. Every row holds
+all the fields of the schema, as strings (the values of a JSON object are
+turned into strings), to be converted a whole column at a time (see
+`SchemaManager.convert_column`).
+
+The file is streamed: only a batch of `BATCH_ROWS` rows is in memory at a
+time.
+"""
+import csv
+import itertools
+import json
+import os
+import typing
+
+from minesqlite import exceptions
+
+FORMATS = ('csv', 'jsonl')
+BATCH_ROWS = 4096
+
+# field -> its values in a batch, as strings
+ColumnsType = typing.Dict[str, typing.List[str]]
+
+
+def format_of(path: str) -> str:
+    """The format of a file by its extension, e.g. `.jsonl`."""
+    extension = os.path.splitext(path)[1].lstrip('.').lower()
+    if extension == 'json':
+        return 'jsonl'
+    if extension not in FORMATS:
+        raise exceptions.CommandInvalidValueArgument(value=path)
+    return extension
+
+
+def _invalid(line: int, reason: str) -> exceptions.DataEntryInvalid:
+    return exceptions.DataEntryInvalid(reason='line %d: %s' % (line, reason))
+
+
+def _check_fields(line: int, got: typing.Collection[str],
+                  fields: typing.Collection[str]):
+    missing, extra = set(fields) - set(got), set(got) - set(fields)
+    if missing:
+        raise _invalid(line, 'missing keys: %s' % ', '.join(sorted(missing)))
+    if extra:
+        raise _invalid(line, 'unexpected extra keys: %s'
+                       % ', '.join(sorted(extra)))
+
+
+def _read_csv(f: typing.TextIO, fields: typing.Sequence[str],
+              batch_rows: int) -> typing.Iterator[ColumnsType]:
+    reader = csv.reader(f)
+    header = next(reader, None)
+    if header is None:
+        return
+    header = [name.strip() for name in header]
+    _check_fields(1, header, fields)
+    if len(set(header)) != len(header):
+        raise _invalid(1, 'a field is repeated')
+    rows = []
+    for row in reader:
+        if not row:
+            continue
+        if len(row) != len(header):
+            raise _invalid(reader.line_num, 'expect %d values, got %d'
+                           % (len(header), len(row)))
+        rows.append(row)
+        if len(rows) == batch_rows:
+            yield dict(zip(header, map(list, zip(*rows))))
+            rows = []
+    if rows:
+        yield dict(zip(header, map(list, zip(*rows))))
+
+
+def _read_jsonl(f: typing.TextIO, fields: typing.Sequence[str],
+                batch_rows: int) -> typing.Iterator[ColumnsType]:
+    expect_keys = set(fields)
+    lines = enumerate(f, 1)
+    while True:
+        batch = list(itertools.islice(lines, batch_rows))
+        if not batch:
+            return
+        objects = []
+        for number, line in batch:
+            if not line.strip():
+                continue
+            try:
+                obj = json.loads(line)
+            except ValueError as e:
+                raise _invalid(number, 'invalid JSON: %s' % e) from e
+            if not isinstance(obj, dict):
+                raise _invalid(number, 'not an object')
+            if obj.keys() != expect_keys:
+                _check_fields(number, obj, fields)
+            objects.append(obj)
+        if not objects:
+            continue
+        yield {field: [value if type(value) is str else str(value)
+                       for value in (obj[field] for obj in objects)]
+               for field in fields}
+
+
+def read_columns(path: str, format_: str, fields: typing.Sequence[str],
+                 batch_rows: int = BATCH_ROWS) \
+        -> typing.Iterator[ColumnsType]:
+    """Yield the rows of the file by batches of up to `batch_rows` rows (or
+    lines of a JSON Lines file), as the values of each field."""
+    if format_ not in FORMATS:
+        raise exceptions.CommandInvalidValueArgument(value=format_)
+    read = _read_csv if format_ == 'csv' else _read_jsonl
+    with open(path, newline='' if format_ == 'csv' else None,
+              encoding='utf-8') as f:
+        yield from read(f, fields, batch_rows)
@@ -0,0 +1,164 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+"""A cache of the results of `list`, kept fresh by version counters.
+
+Every mutation of a driver bumps versions (see `DataManagerABC`): the
+version of the table when a row is created or deleted, or all the rows are
+replaced, and the versions of the modified fields when a row is updated.
+An entry remembers the versions it was computed at, and is stale as soon
+as the table or one of the fields its query refers to has changed since,
+since then other rows may match or come in another order.
+
+An update of the other fields leaves the primary keys of the result as
+they are, but maybe not the values of its rows: those are read again by
+primary key, which is much cheaper than the query itself.
+"""
+import collections
+import dataclasses
+import sys
+import typing
+
+from minesqlite.data.query import Query, RowType
+
+DEFAULT_CACHE_SIZE = 0
+DEFAULT_CACHE_MAX_ROWS = 65536
+
+
+class Versions(object):
+    """The versions of the table and of its fields, starting at 0."""
+
+    def __init__(self):
+        self.table = 0
+        # incremented by every update, whatever the fields
+        self.updates = 0
+        self._fields: typing.Dict[str, int] = collections.defaultdict(int)
+
+    def of(self, fields: typing.Iterable[str]) -> typing.Dict[str, int]:
+        return {field: self._fields[field] for field in fields}
+
+    def bump_table(self):
+        self.table += 1
+
+    def bump_fields(self, fields: typing.Iterable[str]):
+        for field in fields:
+            self._fields[field] += 1
+        self.updates += 1
+
+
+@dataclasses.dataclass
+class _Entry(object):
+    rows: typing.List[RowType]
+    pks: typing.List[typing.Any]
+    table: int
+    fields: typing.Dict[str, int]
+    updates: int
+    size: int
+
+
+def cache_key(query: Query) -> tuple:
+    """The query as a hashable key, the same whatever the order in which
+    its filters and ranges were given."""
+    return (
+        tuple(sorted(query.filters.items())),
+        tuple(sorted((field, dataclasses.astuple(range_))
+                     for field, range_ in query.ranges.items())),
+        tuple(query.sorts), query.limit, query.offset, query.after,
+        None if query.where is None else query.where.text, query.columns,
+    )
+
+
+def _size_of(rows: typing.List[RowType], pks: typing.List[typing.Any]) \
+        -> int:
+    """The estimated memory footprint of an entry, the values of the rows
+    aside (they are shared with the driver, or small)."""
+    return sys.getsizeof(rows) + sys.getsizeof(pks) \
+        + sum(map(sys.getsizeof, rows))
+
+
+class ResultCache(object):
+    """The rows of the last `size` queries, the least recently used of
+    which is evicted first, if no more than `max_rows` rows each."""
+
+    def __init__(self, size: int, max_rows: int, versions: Versions,
+                 pk: str, read_many: typing.Callable[
+                     [typing.List[typing.Any]], typing.List[RowType]]):
+        self.size = size
+        self.max_rows = max_rows
+        self._versions = versions
+        self._pk = pk
+        self._read_many = read_many
+        self._entries: typing.Dict[tuple, _Entry] = \
+            collections.OrderedDict()
+        self._bytes = 0
+        self._counters = collections.Counter(
+            hits=0, misses=0, refreshes=0, invalidations=0, evictions=0)
+
+    def get(self, query: Query) -> typing.Optional[typing.List[RowType]]:
+        """The rows of the query, None if not cached or stale."""
+        if self.size <= 0:
+            return None
+        key = cache_key(query)
+        entry = self._entries.get(key)
+        if entry is not None and (
+                entry.table != self._versions.table
+                or entry.fields != self._versions.of(entry.fields)):
+            self._pop(key)
+            self._counters['invalidations'] += 1
+            entry = None
+        if entry is None:
+            self._counters['misses'] += 1
+            return None
+        if entry.updates != self._versions.updates:
+            entry.rows = list(map(query.project,
+                                  self._read_many(entry.pks)))
+            entry.updates = self._versions.updates
+            self._counters['refreshes'] += 1
+        self._entries.move_to_end(key)
+        self._counters['hits'] += 1
+        return entry.rows
+
+    def put(self, query: Query, rows: typing.List[RowType],
+            versions: typing.Tuple[int, typing.Dict[str, int], int]):
+        """Cache the rows of the query, computed at `versions` (see
+        `snapshot`)."""
+        if self.size <= 0 or len(rows) > self.max_rows:
+            return
+        if query.columns is not None and self._pk not in query.columns:
+            # no way to refresh them
+            return
+        key = cache_key(query)
+        if key in self._entries:
+            self._pop(key)
+        pks = [row[self._pk] for row in rows]
+        table, fields, updates = versions
+        entry = _Entry(rows, pks, table, fields, updates,
+                       _size_of(rows, pks))
+        self._entries[key] = entry
+        self._bytes += entry.size
+        while len(self._entries) > self.size:
+            self._pop(next(iter(self._entries)))
+            self._counters['evictions'] += 1
+
+    def snapshot(self, query: Query) \
+            -> typing.Tuple[int, typing.Dict[str, int], int]:
+        """The versions the rows of the query depend on, taken before
+        computing them: a mutation meanwhile makes the entry stale."""
+        return (self._versions.table,
+                self._versions.of(query.fields),
+                self._versions.updates)
+
+    def _pop(self, key: tuple):
+        self._bytes -= self._entries.pop(key).size
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        lookups = self._counters['hits'] + self._counters['misses']
+        stats = {
+            'cache_entries': len(self._entries),
+            'cache_size': self.size,
+            'cache_bytes': self._bytes,
+            'cache_hit_ratio': round(self._counters['hits'] / lookups, 4)
+            if lookups else 0.0,
+        }
+        stats.update(('cache_%s' % name, count)
+                     for name, count in self._counters.items())
+        return stats
@@ -0,0 +1,47 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+"""Framed binary records shared by the on-disk data files.
+
+Every record is laid out as ``<length:u32><crc32:u32><payload>``, where the
+payload is a pickled python object. A torn tail (e.g. the process crashed in
+the middle of a write) is detected by its length or checksum and ignored
+while reading.
+"""
+import pickle
+import struct
+import typing
+import zlib
+
+HEADER = struct.Struct('<II')
+
+
+def pack_record(obj: typing.Any) -> bytes:
+    """Serialize an object into a framed record."""
+    payload = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    return HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def iter_records(buffer: typing.Union[bytes, bytearray, memoryview],
+                 offset: int = 0, end: typing.Optional[int] = None) \
+        -> typing.Iterator[typing.Tuple[int, typing.Any]]:
+    """Yield `(end_offset, obj)` of each intact record in `buffer[offset:end]`.
+
+    Iteration stops at the first incomplete or corrupted record, so the last
+    yielded `end_offset` is where the valid data ends.
+    """
+    with memoryview(buffer) as view:
+        size = len(view) if end is None else end
+        while offset + HEADER.size <= size:
+            length, crc = HEADER.unpack_from(view, offset)
+            start = offset + HEADER.size
+            stop = start + length
+            if stop > size:
+                return
+            payload = view[start:stop]
+            if zlib.crc32(payload) != crc:
+                payload.release()
+                return
+            obj = pickle.loads(payload)
+            payload.release()
+            yield stop, obj
+            offset = stop
@@ -0,0 +1,222 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+"""A durable driver: the memory_dict driver backed by an append-only log.
+
+Every successful mutation is appended to a binary log (see `codec`), which
+is replayed on startup to rebuild the in-memory data. To amortize the cost
+of `fsync`, writes are synced in groups: all the records appended within
+`data.append_log.group_commit_ms` milliseconds share a single `fsync`, and a
+background thread syncs the stragglers when the traffic stops. Hence a crash
+loses at most one window of writes; set the window to 0 to sync every write.
+
+Saving a snapshot into `data.snapshot.path`, which is loaded before the log
+is replayed, is a checkpoint: the log is emptied as the snapshot covers it.
+The log starts with its generation, and the snapshot records the generation
+it covers, before the log is reset to the next one. Hence a crash in between
+leaves a log the snapshot covers, which is not replayed on top of it.
+"""
+import os
+import threading
+import time
+import typing
+
+from minesqlite.common import utils
+from minesqlite.data import codec, snapshot
+from minesqlite.data.drivers.memory_dict import (
+    MemoryDictDataManager,
+    PKType,
+    RowType,
+)
+from minesqlite import MineSQLite
+
+OP_CREATE = 1
+OP_UPDATE = 2
+OP_DELETE = 3
+# the first record of a log: (OP_GENERATION, generation, None)
+OP_GENERATION = 4
+
+DEFAULT_PATH = 'data/append.log'
+DEFAULT_GROUP_COMMIT_MS = 10
+
+
+class AppendLogDataManager(MemoryDictDataManager):
+    def __init__(self, instance: MineSQLite):
+        super().__init__(instance)
+        sysconf = instance.sysconf
+        self._path: str = utils.get_sysconf_or_default(
+            sysconf, 'data.append_log.path', DEFAULT_PATH)
+        self._window: float = utils.get_sysconf_or_default(
+            sysconf, 'data.append_log.group_commit_ms',
+            DEFAULT_GROUP_COMMIT_MS) / 1000
+
+        directory = os.path.dirname(self._path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # the generation of the log, see `_replay`
+        self._generation = 1
+        fresh = self._replay()
+
+        self._file: typing.BinaryIO = open(self._path, 'ab')
+        self._lock = threading.Lock()
+        self._pending = 0
+        if fresh:
+            # synced along with the first write
+            self._file.write(self._generation_record())
+            self._pending += 1
+        self._last_sync = time.monotonic()
+        self._stopped = threading.Event()
+        self._flusher: typing.Optional[threading.Thread] = None
+        if self._window > 0:
+            self._flusher = threading.Thread(
+                target=self._flush_loop, name='append-log-flusher',
+                daemon=True)
+            self._flusher.start()
+
+    def _replay(self) -> bool:
+        """Rebuild the in-memory data from the log, dropping a torn tail,
+        unless the snapshot covers the log already.
+
+        Whether the log is to be started anew, as it is empty (or missing),
+        in which case its generation follows the one of the snapshot.
+        """
+        covered = 0
+        if self._snapshot_path and os.path.exists(self._snapshot_path):
+            covered = snapshot.read_generation(self._snapshot_path)
+        self._generation = covered + 1
+        if not os.path.exists(self._path):
+            return True
+        with open(self._path, 'rb') as f:
+            content = f.read()
+
+        valid_end = 0
+        with utils.gc_paused():
+            for valid_end, (op, pk, kvs) in codec.iter_records(content):
+                if op == OP_GENERATION:
+                    if pk <= covered:
+                        # crashed while checkpointing: redo the reset
+                        self._start_log()
+                        return False
+                    self._generation = pk
+                elif op == OP_CREATE:
+                    self._insert(pk, self._layout.pack(pk, kvs))
+                elif op == OP_UPDATE:
+                    self._replace(pk, kvs)
+                elif op == OP_DELETE:
+                    self._remove(pk)
+
+        if valid_end != len(content):
+            with open(self._path, 'r+b') as f:
+                f.truncate(valid_end)
+        return valid_end == 0
+
+    def _generation_record(self) -> bytes:
+        return codec.pack_record((OP_GENERATION, self._generation, None))
+
+    def _start_log(self, records: typing.Iterable[bytes] = ()):
+        """Atomically replace the log with a log of the current generation
+        holding the records."""
+        tmp_path = self._path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(self._generation_record())
+            for record in records:
+                f.write(record)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._path)
+
+    def _reset_log(self, records: typing.Iterable[bytes] = ()):
+        """Atomically replace the log with the records."""
+        with self._lock:
+            self._file.close()
+            self._start_log(records)
+            self._file = open(self._path, 'ab')
+            self._pending = 0
+
+    def _append(self, op: int, pk: PKType, kvs: typing.Optional[RowType]):
+        self._append_many([(op, pk, kvs)])
+
+    def _append_many(self, entries: typing.Sequence[
+            typing.Tuple[int, PKType, typing.Optional[RowType]]]):
+        """Append the `(op, pk, kvs)` records in a single write."""
+        data = b''.join(map(codec.pack_record, entries))
+        with self._lock:
+            self._file.write(data)
+            self._pending += len(entries)
+            if time.monotonic() - self._last_sync >= self._window:
+                self._sync_locked()
+
+    def _sync_locked(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def _flush_loop(self):
+        while not self._stopped.wait(self._window):
+            with self._lock:
+                if self._pending:
+                    self._sync_locked()
+
+    # the writes are logged in the very order they are applied
+
+    def create_one(self, pk: PKType, kvs: RowType) -> RowType:
+        with self._write_lock:
+            ret = super().create_one(pk, kvs)
+            self._append(OP_CREATE, pk, kvs)
+        return ret
+
+    def create_many(self, entries: typing.Sequence[typing.Tuple[PKType,
+                                                                RowType]]) \
+            -> int:
+        with self._write_lock:
+            count = super().create_many(entries)
+            self._append_many([(OP_CREATE, pk, kvs) for pk, kvs in entries])
+        return count
+
+    def update_one(self, pk: PKType, kvs: RowType) -> RowType:
+        with self._write_lock:
+            ret = super().update_one(pk, kvs)
+            self._append(OP_UPDATE, pk, kvs)
+        return ret
+
+    def delete_one(self, pk: PKType) -> RowType:
+        with self._write_lock:
+            ret = super().delete_one(pk)
+            self._append(OP_DELETE, pk, None)
+        return ret
+
+    def save_snapshot(self, path: str) -> int:
+        if path != self._snapshot_path:
+            return super().save_snapshot(path)
+        # no write may slip in between the snapshot and resetting the log
+        with self._write_lock:
+            count = self._write_snapshot(path, self._generation)
+            self._generation += 1
+            self._reset_log()
+        return count
+
+    def load_snapshot(self, path: str) -> int:
+        with self._write_lock:
+            count = super().load_snapshot(path)
+            # the log must not be replayed on top of the stale data any longer
+            if self._snapshot_path:
+                self.save_snapshot(self._snapshot_path)
+            else:
+                pk_index = self._layout.pk_index
+                self._reset_log(
+                    codec.pack_record((OP_CREATE, record[pk_index],
+                                       self._layout.to_kvs(record)))
+                    for record in self._iter_records())
+        return count
+
+    def close(self):
+        super().close()
+        self._stopped.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        with self._lock:
+            if self._file.closed:
+                return
+            if self._pending:
+                self._sync_locked()
+            self._file.close()
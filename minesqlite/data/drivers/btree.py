@@ -0,0 +1,400 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+"""A read-optimized driver: a paged B+tree over a memory-mapped file.
+
+Rows are kept in the leaves of a B+tree keyed by the primary key, and the
+leaves are chained in key order, so a scan walks the chain instead of
+collecting all the keys beforehand. Pages are `data.btree.page_size` bytes
+large and reached through `mmap`; the decoded pages are cached by an LRU
+buffer pool holding at most `data.btree.buffer_pool_pages` pages, and dirty
+pages are written back when evicted, or when the driver is closed.
+
+Deletions do not rebalance the tree: a leaf may become empty, and is skipped
+while scanning. The file is not crash-safe, use `append_log` or `lsm` if
+durability matters.
+"""
+import bisect
+import collections
+import mmap
+import os
+import pickle
+import struct
+import typing
+
+from minesqlite import exceptions
+from minesqlite.common import utils
+from minesqlite.data.base import (
+    DEFAULT_SCAN_BATCH_SIZE,
+    CursorABC,
+    DataManagerABC,
+)
+from minesqlite import MineSQLite
+
+PKType = typing.Any
+RowType = dict
+
+DEFAULT_PATH = 'data/btree.db'
+DEFAULT_PAGE_SIZE = 4096
+DEFAULT_BUFFER_POOL_PAGES = 1024
+MIN_BUFFER_POOL_PAGES = 8
+
+_HEADER = struct.Struct('<4sIIIQ')
+_MAGIC = b'MSBT'
+_VERSION = 1
+_PAGE_LENGTH = struct.Struct('<I')
+
+# page 0 holds the header
+HEADER_PAGE_ID = 0
+
+
+class Node(object):
+    """A decoded page.
+
+    A leaf holds sorted `keys` along with their rows in `values`, and the id
+    of the next leaf. An internal node holds the separator `keys`, and the
+    ids of its children in `values` (one more than the keys).
+    """
+    __slots__ = ('page_id', 'is_leaf', 'keys', 'values', 'next_leaf')
+
+    def __init__(self, page_id: int, is_leaf: bool,
+                 keys: list = None, values: list = None,
+                 next_leaf: int = 0):
+        self.page_id = page_id
+        self.is_leaf = is_leaf
+        self.keys = keys if keys is not None else []
+        self.values = values if values is not None else []
+        self.next_leaf = next_leaf
+
+    def encode(self) -> bytes:
+        payload = pickle.dumps(
+            (self.is_leaf, self.keys, self.values, self.next_leaf),
+            protocol=pickle.HIGHEST_PROTOCOL)
+        return _PAGE_LENGTH.pack(len(payload)) + payload
+
+    @classmethod
+    def decode(cls, page_id: int, page: bytes) -> 'Node':
+        length, = _PAGE_LENGTH.unpack_from(page)
+        start = _PAGE_LENGTH.size
+        return cls(page_id, *pickle.loads(page[start:start + length]))
+
+
+class BufferPool(object):
+    """An LRU cache of decoded pages in front of the memory-mapped file."""
+
+    def __init__(self, path: str, page_size: int, capacity: int):
+        self.page_size = page_size
+        self.capacity = max(capacity, MIN_BUFFER_POOL_PAGES)
+        self._pages: typing.OrderedDict[int, Node] = collections.OrderedDict()
+        self._dirty: typing.Set[int] = set()
+        self.stats = collections.Counter(
+            page_hits=0, page_misses=0, evictions=0, page_writes=0)
+
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            with open(path, 'wb') as f:
+                f.truncate(page_size)
+        self._file = open(path, 'r+b')
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+
+    def read_header(self) -> typing.Optional[tuple]:
+        magic, version, page_size, root_id, page_count = \
+            _HEADER.unpack_from(self._mmap)
+        if magic != _MAGIC:
+            return None
+        if version != _VERSION or page_size != self.page_size:
+            raise exceptions.InternalError(
+                "incompatible btree file: version %d, page size %d"
+                % (version, page_size))
+        return root_id, page_count
+
+    def write_header(self, root_id: int, page_count: int):
+        _HEADER.pack_into(self._mmap, 0, _MAGIC, _VERSION, self.page_size,
+                          root_id, page_count)
+
+    def get(self, page_id: int) -> Node:
+        node = self._pages.get(page_id)
+        if node is not None:
+            self.stats['page_hits'] += 1
+            self._pages.move_to_end(page_id)
+            return node
+
+        self.stats['page_misses'] += 1
+        offset = page_id * self.page_size
+        node = Node.decode(page_id,
+                           self._mmap[offset:offset + self.page_size])
+        self._pages[page_id] = node
+        self._evict()
+        return node
+
+    def put(self, node: Node):
+        """Cache a new or modified node, and mark it dirty."""
+        self._pages[node.page_id] = node
+        self._pages.move_to_end(node.page_id)
+        self._dirty.add(node.page_id)
+        self._evict()
+
+    def _evict(self):
+        while len(self._pages) > self.capacity:
+            page_id, node = self._pages.popitem(last=False)
+            self.stats['evictions'] += 1
+            if page_id in self._dirty:
+                self._write(node)
+
+    def _write(self, node: Node):
+        page = node.encode()
+        offset = node.page_id * self.page_size
+        end = offset + self.page_size
+        if end > len(self._mmap):
+            self._mmap.resize(max(end, len(self._mmap) * 2))
+        self._mmap[offset:offset + len(page)] = page
+        self._dirty.discard(node.page_id)
+        self.stats['page_writes'] += 1
+
+    def fits(self, node: Node) -> bool:
+        return len(node.encode()) <= self.page_size
+
+    def flush(self):
+        for page_id in sorted(self._dirty):
+            self._write(self._pages[page_id])
+        self._mmap.flush()
+
+    @property
+    def closed(self) -> bool:
+        return self._mmap.closed
+
+    def close(self):
+        self.flush()
+        self._mmap.close()
+        self._file.close()
+
+
+class BTreeCursor(CursorABC):
+    """Points to the next row to return, by key and by its (cached) slot.
+
+    The key is authoritative: if the slot no longer holds the key because of
+    a concurrent modification, the cursor seeks from the root again.
+    """
+
+    def __init__(self, key: typing.Any = None, leaf_id: int = 0,
+                 index: int = 0, exhausted: bool = False):
+        self.key = key
+        self.leaf_id = leaf_id
+        self.index = index
+        self.exhausted = exhausted
+
+    def __bool__(self):
+        return not self.exhausted
+
+
+class BTreeDataManager(DataManagerABC):
+    def __init__(self, instance: MineSQLite):
+        super().__init__(instance)
+        sysconf = instance.sysconf
+        path: str = utils.get_sysconf_or_default(
+            sysconf, 'data.btree.path', DEFAULT_PATH)
+        page_size: int = utils.get_sysconf_or_default(
+            sysconf, 'data.btree.page_size', DEFAULT_PAGE_SIZE)
+        buffer_pool_pages: int = utils.get_sysconf_or_default(
+            sysconf, 'data.btree.buffer_pool_pages',
+            DEFAULT_BUFFER_POOL_PAGES)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._pool = BufferPool(path, page_size, buffer_pool_pages)
+        self._max_entry_size = page_size // 4
+        header = self._pool.read_header()
+        if header is not None:
+            self._root_id, self._page_count = header
+        else:
+            self._page_count = HEADER_PAGE_ID + 1
+            self._root_id = self._allocate(is_leaf=True).page_id
+            self._pool.write_header(self._root_id, self._page_count)
+
+    def _allocate(self, is_leaf: bool) -> Node:
+        node = Node(self._page_count, is_leaf)
+        self._page_count += 1
+        self._pool.put(node)
+        return node
+
+    def _find_leaf(self, pk: PKType) -> Node:
+        node = self._pool.get(self._root_id)
+        while not node.is_leaf:
+            n = bisect.bisect_right(node.keys, pk)
+            node = self._pool.get(node.values[n])
+        return node
+
+    def _split(self, node: Node) -> typing.Tuple[PKType, Node]:
+        """Move the upper half of the node into a new right sibling."""
+        right = self._allocate(node.is_leaf)
+        mid = len(node.keys) // 2
+        if node.is_leaf:
+            separator = node.keys[mid]
+            right.keys, node.keys = node.keys[mid:], node.keys[:mid]
+            right.values, node.values = node.values[mid:], node.values[:mid]
+            right.next_leaf, node.next_leaf = node.next_leaf, right.page_id
+        else:
+            separator = node.keys[mid]
+            right.keys, node.keys = node.keys[mid + 1:], node.keys[:mid]
+            right.values, node.values = \
+                node.values[mid + 1:], node.values[:mid + 1]
+        self._pool.put(node)
+        self._pool.put(right)
+        return separator, right
+
+    def _split_if_needed(self, node: Node) \
+            -> typing.List[typing.Tuple[PKType, Node]]:
+        """Split an overflowed node, returning the new right siblings."""
+        if self._pool.fits(node):
+            return []
+        separator, right = self._split(node)
+        return self._split_if_needed(node) + [(separator, right)] \
+            + self._split_if_needed(right)
+
+    def _insert(self, node: Node, pk: PKType, row: RowType) \
+            -> typing.List[typing.Tuple[PKType, Node]]:
+        """Insert or replace a row in the subtree, splitting on the way up."""
+        if node.is_leaf:
+            n = bisect.bisect_left(node.keys, pk)
+            if n < len(node.keys) and node.keys[n] == pk:
+                node.values[n] = row
+            else:
+                node.keys.insert(n, pk)
+                node.values.insert(n, row)
+            self._pool.put(node)
+            return self._split_if_needed(node)
+
+        n = bisect.bisect_right(node.keys, pk)
+        splits = self._insert(self._pool.get(node.values[n]), pk, row)
+        if not splits:
+            return []
+        for offset, (separator, right) in enumerate(splits):
+            node.keys.insert(n + offset, separator)
+            node.values.insert(n + offset + 1, right.page_id)
+        self._pool.put(node)
+        return self._split_if_needed(node)
+
+    def _put(self, pk: PKType, row: RowType):
+        if len(pickle.dumps((pk, row))) > self._max_entry_size:
+            raise exceptions.DataEntryInvalid(
+                reason="the entry is too large to fit in a page")
+        root = self._pool.get(self._root_id)
+        splits = self._insert(root, pk, row)
+        if splits:
+            new_root = self._allocate(is_leaf=False)
+            new_root.keys = [separator for separator, _ in splits]
+            new_root.values = [root.page_id] + \
+                              [right.page_id for _, right in splits]
+            self._pool.put(new_root)
+            self._root_id = new_root.page_id
+        self._pool.write_header(self._root_id, self._page_count)
+
+    def _get(self, pk: PKType) -> typing.Optional[RowType]:
+        leaf = self._find_leaf(pk)
+        n = bisect.bisect_left(leaf.keys, pk)
+        if n < len(leaf.keys) and leaf.keys[n] == pk:
+            return leaf.values[n]
+        return None
+
+    def _build_row(self, pk: PKType, row: RowType) -> RowType:
+        ret = row.copy()
+        ret[self.pk] = pk
+        return ret
+
+    def create_one(self, pk: PKType, kvs: RowType) -> RowType:
+        if self._get(pk) is not None:
+            raise exceptions.DataDuplicateEntry(field=self.pk, value=pk)
+        self._put(pk, kvs)
+        return self._build_row(pk, kvs)
+
+    def read_one(self, pk: PKType) -> RowType:
+        row = self._get(pk)
+        if row is None:
+            raise exceptions.DataEntryNotFound(field=self.pk, value=pk)
+        return self._build_row(pk, row)
+
+    def _seek(self, leaf: Node, index: int) -> BTreeCursor:
+        """Build a cursor at the slot, skipping the exhausted leaves."""
+        while index >= len(leaf.keys):
+            if not leaf.next_leaf:
+                return BTreeCursor(exhausted=True)
+            leaf, index = self._pool.get(leaf.next_leaf), 0
+        return BTreeCursor(leaf.keys[index], leaf.page_id, index)
+
+    def build_cursor(self) -> BTreeCursor:
+        node = self._pool.get(self._root_id)
+        while not node.is_leaf:
+            node = self._pool.get(node.values[0])
+        return self._seek(node, 0)
+
+    def next_row(self, cursor: typing.Optional[BTreeCursor] = None) \
+            -> typing.Tuple[BTreeCursor, RowType]:
+        leaf = self._pool.get(cursor.leaf_id)
+        index = cursor.index
+        if index >= len(leaf.keys) or leaf.keys[index] != cursor.key:
+            # the row has been moved by a split, or deleted meanwhile
+            key = cursor.key
+            leaf = self._find_leaf(key)
+            cursor = self._seek(leaf, bisect.bisect_left(leaf.keys, key))
+            if not cursor:
+                raise exceptions.DataEntryNotFound(field=self.pk, value=key)
+            leaf, index = self._pool.get(cursor.leaf_id), cursor.index
+
+        row = self._build_row(leaf.keys[index], leaf.values[index])
+        return self._seek(leaf, index + 1), row
+
+    def scan(self, batch_size: int = DEFAULT_SCAN_BATCH_SIZE) \
+            -> typing.Iterator[typing.List[RowType]]:
+        leaf = self._pool.get(self._root_id)
+        while not leaf.is_leaf:
+            leaf = self._pool.get(leaf.values[0])
+        index = 0
+        while True:
+            batch = []
+            while len(batch) < batch_size:
+                if index >= len(leaf.keys):
+                    if not leaf.next_leaf:
+                        break
+                    leaf, index = self._pool.get(leaf.next_leaf), 0
+                    continue
+                stop = index + batch_size - len(batch)
+                batch.extend(map(self._build_row, leaf.keys[index:stop],
+                                 leaf.values[index:stop]))
+                index = stop
+            if not batch:
+                return
+            last_key = batch[-1][self.pk]
+            yield batch
+            # the tree may have been modified meanwhile, seek by key again
+            leaf = self._find_leaf(last_key)
+            index = bisect.bisect_right(leaf.keys, last_key)
+
+    def update_one(self, pk: PKType, kvs: RowType) -> RowType:
+        row = self._get(pk)
+        if row is None:
+            raise exceptions.DataEntryNotFound(field=self.pk, value=pk)
+        row = row.copy()
+        row.update(kvs)
+        self._put(pk, row)
+        return self._build_row(pk, row)
+
+    def delete_one(self, pk: PKType) -> RowType:
+        leaf = self._find_leaf(pk)
+        n = bisect.bisect_left(leaf.keys, pk)
+        if n >= len(leaf.keys) or leaf.keys[n] != pk:
+            raise exceptions.DataEntryNotFound(field=self.pk, value=pk)
+        del leaf.keys[n]
+        row = leaf.values.pop(n)
+        self._pool.put(leaf)
+        return self._build_row(pk, row)
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        stats = dict(self._pool.stats)
+        stats['pages'] = self._page_count
+        return stats
+
+    def close(self):
+        super().close()
+        if self._pool.closed:
+            return
+        self._pool.write_header(self._root_id, self._page_count)
+        self._pool.close()
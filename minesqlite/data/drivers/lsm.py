@@ -0,0 +1,412 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+"""A log-structured merge (LSM) tree driver.
+
+Writes go to a WAL and to an in-memory memtable. Once the memtable holds
+`data.lsm.memtable_rows` rows, it is flushed into an immutable sorted run.
+Each run carries a sparse index and a bloom filter, so that looking up a
+missing key rarely touches the disk. When `data.lsm.max_runs` runs have
+piled up, a background thread merges all of them into a single run
+(size-tiered compaction), dropping the shadowed versions and tombstones.
+
+The WAL is handed over to the OS on every write, and synced when the driver
+is closed; a flushed run is synced before the WAL is reset.
+
+Layout of the data directory `data.lsm.path`:
+    MANIFEST    names of the live runs, oldest first
+    wal.log     mutations that have not been flushed into a run yet
+    <seq>.run   the sorted runs
+"""
+import bisect
+import collections
+import heapq
+import itertools
+import mmap
+import operator
+import os
+import struct
+import threading
+import typing
+
+from minesqlite import exceptions
+from minesqlite.common import utils
+from minesqlite.common.bloom import BloomFilter
+from minesqlite.data import codec
+from minesqlite.data.base import (
+    DEFAULT_SCAN_BATCH_SIZE,
+    DataManagerABC,
+    IteratorCursor,
+)
+from minesqlite import MineSQLite
+
+PKType = typing.Any
+RowType = dict
+EntryType = typing.Tuple[PKType, typing.Optional[RowType]]
+
+# a deleted row is stored as a tombstone, shadowing its older versions
+TOMBSTONE = None
+
+DEFAULT_PATH = 'data/lsm'
+DEFAULT_MEMTABLE_ROWS = 10000
+DEFAULT_MAX_RUNS = 4
+DEFAULT_BLOOM_BITS_PER_KEY = 10
+
+# a key of every INDEX_INTERVAL entries goes into the sparse index
+INDEX_INTERVAL = 16
+
+_FOOTER = struct.Struct('<Q4s')
+_MAGIC = b'LSMR'
+
+
+class SortedRun(object):
+    """An immutable sorted run file, memory-mapped for lock-free reads.
+
+    The file is laid out as `<entries><meta><footer>`, where the entries are
+    `(pk, row)` records sorted by pk, the meta record holds the sparse index
+    and the bloom filter, and the footer points to the meta record.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.name = os.path.basename(path)
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.size = len(self._mmap)
+
+        meta_offset, magic = _FOOTER.unpack_from(
+            self._mmap, self.size - _FOOTER.size)
+        if magic != _MAGIC:
+            raise exceptions.InternalError("corrupted run file: %s" % path)
+        records = codec.iter_records(self._mmap, meta_offset)
+        _, meta = next(records)
+        records.close()
+
+        self._data_end: int = meta_offset
+        self.count: int = meta['count']
+        self.index_keys: list = meta['index_keys']
+        self.index_offsets: list[int] = meta['index_offsets']
+        self.bloom = BloomFilter(
+            meta['bloom_bits'], meta['bloom_hashes'], meta['bloom'])
+
+    @classmethod
+    def write(cls, path: str, entries: typing.Iterable[EntryType],
+              capacity: int, bits_per_key: int) -> 'SortedRun':
+        """Write the sorted entries into a new run file."""
+        bloom = BloomFilter.for_capacity(capacity, bits_per_key)
+        index_keys, index_offsets = [], []
+        offset = count = 0
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            for pk, row in entries:
+                if count % INDEX_INTERVAL == 0:
+                    index_keys.append(pk)
+                    index_offsets.append(offset)
+                bloom.add(pk)
+                record = codec.pack_record((pk, row))
+                f.write(record)
+                offset += len(record)
+                count += 1
+
+            f.write(codec.pack_record({
+                'count': count,
+                'index_keys': index_keys,
+                'index_offsets': index_offsets,
+                'bloom_bits': bloom.num_bits,
+                'bloom_hashes': bloom.num_hashes,
+                'bloom': bytes(bloom.bits),
+            }))
+            f.write(_FOOTER.pack(offset, _MAGIC))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return cls(path)
+
+    def get(self, pk: PKType) -> typing.Tuple[bool, typing.Optional[RowType]]:
+        """Look up a key, returning `(found, row_or_tombstone)`."""
+        n = bisect.bisect_right(self.index_keys, pk) - 1
+        if n < 0:
+            return False, None
+        records = codec.iter_records(
+            self._mmap, self.index_offsets[n], self._data_end)
+        try:
+            for _, (key, row) in itertools.islice(records, INDEX_INTERVAL):
+                if key == pk:
+                    return True, row
+                if key > pk:
+                    break
+        finally:
+            records.close()
+        return False, None
+
+    def items(self) -> typing.Iterator[EntryType]:
+        records = codec.iter_records(self._mmap, 0, self._data_end)
+        try:
+            for _, entry in records:
+                yield entry
+        finally:
+            records.close()
+
+    def close(self):
+        self._mmap.close()
+
+
+def _tag_entries(entries: typing.Iterable[EntryType], rank: int):
+    for pk, row in entries:
+        yield pk, rank, row
+
+
+def merge_entries(sources: list[typing.Iterable[EntryType]],
+                  drop_tombstones: bool) -> typing.Iterator[EntryType]:
+    """Merge sorted sources (newest first), keeping the newest versions."""
+    tagged = [_tag_entries(source, rank)
+              for rank, source in enumerate(sources)]
+    last_pk = _no_pk = object()
+    for pk, _, row in heapq.merge(*tagged):
+        if last_pk is not _no_pk and pk == last_pk:
+            continue  # an older version of the same key
+        last_pk = pk
+        if row is TOMBSTONE and drop_tombstones:
+            continue
+        yield pk, row
+
+
+class LSMDataManager(DataManagerABC):
+    def __init__(self, instance: MineSQLite):
+        super().__init__(instance)
+        sysconf = instance.sysconf
+        self._path: str = utils.get_sysconf_or_default(
+            sysconf, 'data.lsm.path', DEFAULT_PATH)
+        self._memtable_rows: int = utils.get_sysconf_or_default(
+            sysconf, 'data.lsm.memtable_rows', DEFAULT_MEMTABLE_ROWS)
+        self._max_runs: int = utils.get_sysconf_or_default(
+            sysconf, 'data.lsm.max_runs', DEFAULT_MAX_RUNS)
+        self._bits_per_key: int = utils.get_sysconf_or_default(
+            sysconf, 'data.lsm.bloom_bits_per_key',
+            DEFAULT_BLOOM_BITS_PER_KEY)
+        os.makedirs(self._path, exist_ok=True)
+
+        # `_runs` (oldest first) is replaced rather than mutated, so readers
+        # can grab it without locking; `_lock` serializes the writers of it
+        self._lock = threading.Lock()
+        self._compaction_lock = threading.Lock()
+        self._runs: list[SortedRun] = []
+        self._next_seq = 0
+        self._memtable: typing.Dict[PKType, typing.Optional[RowType]] = {}
+        self._stats = collections.Counter()
+        self._load_manifest()
+        self._replay_wal()
+        self._wal: typing.BinaryIO = open(self._wal_path, 'ab')
+
+        self._stopped = threading.Event()
+        self._compaction_wanted = threading.Event()
+        self._compactor = threading.Thread(
+            target=self._compaction_loop, name='lsm-compactor', daemon=True)
+        self._compactor.start()
+
+    @property
+    def _manifest_path(self) -> str:
+        return os.path.join(self._path, 'MANIFEST')
+
+    @property
+    def _wal_path(self) -> str:
+        return os.path.join(self._path, 'wal.log')
+
+    def _load_manifest(self):
+        names = []
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path, 'rb') as f:
+                for _, names in codec.iter_records(f.read()):
+                    pass
+        self._runs = [SortedRun(os.path.join(self._path, name))
+                      for name in names]
+
+        # clean up the leftovers of an interrupted flush or compaction
+        for filename in os.listdir(self._path):
+            if filename.endswith('.tmp') or (
+                    filename.endswith('.run') and filename not in names):
+                os.remove(os.path.join(self._path, filename))
+            if filename.endswith('.run'):
+                seq = int(filename[:-len('.run')])
+                self._next_seq = max(self._next_seq, seq + 1)
+
+    def _write_manifest(self):
+        """Atomically replace the MANIFEST. The caller must hold `_lock`."""
+        tmp_path = self._manifest_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(codec.pack_record([run.name for run in self._runs]))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._manifest_path)
+
+    def _replay_wal(self):
+        if not os.path.exists(self._wal_path):
+            return
+        with open(self._wal_path, 'rb') as f:
+            content = f.read()
+        valid_end = 0
+        for valid_end, (pk, row) in codec.iter_records(content):
+            self._memtable[pk] = row
+        if valid_end != len(content):
+            with open(self._wal_path, 'r+b') as f:
+                f.truncate(valid_end)
+
+    def _new_run_path(self) -> str:
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+        return os.path.join(self._path, '%08d.run' % seq)
+
+    def _lookup(self, pk: PKType) -> typing.Optional[RowType]:
+        """Get the newest version of a row, or None if there's none."""
+        if pk in self._memtable:
+            return self._memtable[pk]
+        for run in reversed(self._runs):
+            if pk not in run.bloom:
+                self._stats['bloom_skips'] += 1
+                continue
+            self._stats['run_probes'] += 1
+            found, row = run.get(pk)
+            if found:
+                return row
+        return TOMBSTONE
+
+    def _put(self, pk: PKType, row: typing.Optional[RowType]):
+        record = codec.pack_record((pk, row))
+        self._wal.write(record)
+        self._wal.flush()
+        self._stats['user_bytes'] += len(record)
+        self._stats['wal_bytes'] += len(record)
+
+        self._memtable[pk] = row
+        if len(self._memtable) >= self._memtable_rows:
+            self.flush()
+
+    def _build_row(self, pk: PKType, row: RowType) -> RowType:
+        ret = row.copy()
+        ret[self.pk] = pk
+        return ret
+
+    def flush(self):
+        """Flush the memtable into a new sorted run, then reset the WAL."""
+        if not self._memtable:
+            return
+        entries = sorted(self._memtable.items(), key=operator.itemgetter(0))
+        run = SortedRun.write(self._new_run_path(), entries,
+                              len(entries), self._bits_per_key)
+        self._stats['flush_bytes'] += run.size
+        with self._lock:
+            self._runs = self._runs + [run]
+            self._write_manifest()
+            num_runs = len(self._runs)
+
+        self._memtable = {}
+        self._wal.truncate(0)
+        if num_runs >= self._max_runs:
+            self._compaction_wanted.set()
+
+    def compact(self):
+        """Merge all the runs into one (size-tiered compaction)."""
+        with self._compaction_lock:
+            runs = self._runs
+            if len(runs) < 2:
+                return
+            # all the runs are merged, so nothing older can be shadowed by
+            # the tombstones any longer
+            entries = merge_entries(
+                [run.items() for run in reversed(runs)],
+                drop_tombstones=True)
+            merged = SortedRun.write(
+                self._new_run_path(), entries,
+                sum(run.count for run in runs), self._bits_per_key)
+            self._stats['compaction_bytes'] += merged.size
+            self._stats['compactions'] += 1
+
+            with self._lock:
+                # only flushes may have happened meanwhile, which append
+                self._runs = [merged] + self._runs[len(runs):]
+                self._write_manifest()
+            # concurrent readers may still hold the old runs, whose mappings
+            # are released once the last reference goes away
+            for run in runs:
+                os.remove(run.path)
+
+    def _compaction_loop(self):
+        while True:
+            self._compaction_wanted.wait()
+            self._compaction_wanted.clear()
+            if self._stopped.is_set():
+                return
+            self.compact()
+
+    def create_one(self, pk: PKType, kvs: RowType) -> RowType:
+        if self._lookup(pk) is not TOMBSTONE:
+            raise exceptions.DataDuplicateEntry(field=self.pk, value=pk)
+        self._put(pk, kvs)
+        return self._build_row(pk, kvs)
+
+    def read_one(self, pk: PKType) -> RowType:
+        row = self._lookup(pk)
+        if row is TOMBSTONE:
+            raise exceptions.DataEntryNotFound(field=self.pk, value=pk)
+        return self._build_row(pk, row)
+
+    def _iter_rows(self) -> typing.Iterator[RowType]:
+        memtable = sorted(self._memtable.items(), key=operator.itemgetter(0))
+        sources = [memtable] + [run.items() for run in reversed(self._runs)]
+        for pk, row in merge_entries(sources, drop_tombstones=True):
+            yield self._build_row(pk, row)
+
+    def build_cursor(self) -> IteratorCursor:
+        return IteratorCursor(self._iter_rows())
+
+    def scan(self, batch_size: int = DEFAULT_SCAN_BATCH_SIZE) \
+            -> typing.Iterator[typing.List[RowType]]:
+        rows = self._iter_rows()
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                return
+            yield batch
+
+    def next_row(self, cursor: typing.Optional[IteratorCursor] = None) \
+            -> typing.Tuple[IteratorCursor, RowType]:
+        return cursor, cursor.advance()
+
+    def update_one(self, pk: PKType, kvs: RowType) -> RowType:
+        row = self._lookup(pk)
+        if row is TOMBSTONE:
+            raise exceptions.DataEntryNotFound(field=self.pk, value=pk)
+        row = row.copy()
+        row.update(kvs)
+        self._put(pk, row)
+        return self._build_row(pk, row)
+
+    def delete_one(self, pk: PKType) -> RowType:
+        row = self._lookup(pk)
+        if row is TOMBSTONE:
+            raise exceptions.DataEntryNotFound(field=self.pk, value=pk)
+        self._put(pk, TOMBSTONE)
+        return self._build_row(pk, row)
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        stats = dict(self._stats)
+        stats['runs'] = len(self._runs)
+        stats['memtable_rows'] = len(self._memtable)
+        written = sum(self._stats[key] for key in
+                      ['wal_bytes', 'flush_bytes', 'compaction_bytes'])
+        user_bytes = self._stats['user_bytes']
+        stats['write_amplification'] = \
+            written / user_bytes if user_bytes else 0.0
+        return stats
+
+    def close(self):
+        super().close()
+        self._stopped.set()
+        self._compaction_wanted.set()
+        self._compactor.join()
+        if not self._wal.closed:
+            self._wal.flush()
+            os.fsync(self._wal.fileno())
+            self._wal.close()
+        for run in self._runs:
+            run.close()
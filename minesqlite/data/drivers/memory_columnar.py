@@ -0,0 +1,615 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+"""An in-memory driver laying out each column as a typed array.
+
+Integers are kept in `array('q')`, dates as day ordinals in `array('i')`, and
+strings are dictionary-encoded into `array('i')` codes. A string column with
+many distinct values (e.g. names) switches to a heap of utf-8 bytes
+addressed by offsets instead, since its dictionary would cost more than the
+strings themselves. A row is addressed by its slot in the arrays, found
+through an open-addressing pk->slot index; slots of deleted rows are reused
+by later insertions. Rows are only built on output.
+
+The dictionary of a string column only grows: values no longer referenced
+by any row are kept until restart.
+
+With `data.memory_columnar.vectorized` on and NumPy installed, `select`
+filters and sorts the columns as NumPy arrays (see `vectorized`), and only
+builds the rows of the result. A query on a string column in the heap
+encoding is still answered row by row.
+"""
+import array
+import bisect
+import dataclasses
+import datetime
+import functools
+import os
+import typing
+
+from minesqlite import exceptions
+from minesqlite.common import utils
+from minesqlite.data import snapshot, vectorized
+from minesqlite.data.base import (
+    DEFAULT_SCAN_BATCH_SIZE,
+    DataManagerABC,
+    SlotCursor,
+    check_unique_pks,
+)
+from minesqlite.data.plan import Access, PlanNode, Project
+from minesqlite.data.query import Query, batched
+from minesqlite.data.vectorized import KeyColumn, numpy
+from minesqlite import MineSQLite
+
+PKType = typing.Any
+RowType = dict
+
+# a dictionary-encoded string column switches to the heap encoding once its
+# dictionary holds more values than both of these
+DICTIONARY_MIN_VALUES = 4096
+DICTIONARY_MAX_RATIO = 0.5
+
+
+class Column(object):
+    """A column of values addressed by slot, stored as they are."""
+    # whether to vectorize the queries over the column, as the values of an
+    # unknown type may not all be hashable and comparable with each other
+    vectorizable = False
+
+    def __init__(self):
+        self.values = []
+
+    def encode(self, value: typing.Any) -> typing.Any:
+        return value
+
+    def decode(self, encoded: typing.Any) -> typing.Any:
+        return encoded
+
+    def append(self, encoded: typing.Any):
+        self.values.append(encoded)
+
+    def __setitem__(self, slot: int, encoded: typing.Any):
+        self.values[slot] = encoded
+
+    def __getitem__(self, slot: int) -> typing.Any:
+        return self.decode(self.values[slot])
+
+    def get_range(self, start: int, stop: int) -> typing.List[typing.Any]:
+        """Decode the values of the slots in `[start, stop)` in bulk."""
+        return list(map(self.decode, self.values[start:stop]))
+
+    def take(self, slots: typing.List[int]) -> typing.List[typing.Any]:
+        """Decode the values of the slots in bulk."""
+        return list(map(self.decode, map(self.values.__getitem__, slots)))
+
+    def key_column(self) -> KeyColumn:
+        """The values as an array of keys (see `vectorized`), here the ranks
+        of the values."""
+        distinct = sorted(set(self.values))
+        ranks = {value: rank for rank, value in enumerate(distinct)}
+        keys = numpy.fromiter(map(ranks.__getitem__, self.values), dtype='i',
+                              count=len(self.values))
+        return KeyColumn(keys, _rank_key_of(distinct), distinct.__getitem__)
+
+    def nbytes(self) -> int:
+        return 8 * len(self.values)
+
+
+def _rank_key_of(distinct: typing.List[typing.Any]) \
+        -> typing.Callable[[typing.Any], float]:
+    """The key of a value among the sorted distinct values: its rank, or
+    halfway between two ranks for a value not among them."""
+    def key_of(value: typing.Any) -> float:
+        rank = bisect.bisect_left(distinct, value)
+        if rank < len(distinct) and distinct[rank] == value:
+            return rank
+        return rank - 0.5
+
+    return key_of
+
+
+def _copy_array(values: array.array, dtype: str) -> 'numpy.ndarray':
+    # not a view, which would prevent the array from growing
+    return numpy.frombuffer(values, dtype=dtype).copy()
+
+
+class IntegerColumn(Column):
+    vectorizable = True
+
+    def __init__(self):
+        super().__init__()
+        self.values = array.array('q')
+
+    def encode(self, value: int) -> int:
+        if not -2 ** 63 <= value < 2 ** 63:
+            raise exceptions.DataEntryInvalid(
+                reason="integer out of range: %s" % value)
+        return value
+
+    def get_range(self, start: int, stop: int) -> typing.List[int]:
+        return self.values[start:stop].tolist()
+
+    def take(self, slots: typing.List[int]) -> typing.List[int]:
+        return list(map(self.values.__getitem__, slots))
+
+    def key_column(self) -> KeyColumn:
+        return KeyColumn(_copy_array(self.values, 'q'), int, int)
+
+    def nbytes(self) -> int:
+        return self.values.itemsize * len(self.values)
+
+
+class DateColumn(Column):
+    vectorizable = True
+
+    def __init__(self):
+        super().__init__()
+        self.values = array.array('i')
+        # there are few distinct days, and the decoded dates are immutable
+        self._decoded: typing.Dict[int, datetime.datetime] = {}
+
+    def encode(self, value: datetime.datetime) -> int:
+        return value.toordinal()
+
+    def decode(self, encoded: int) -> datetime.datetime:
+        value = self._decoded.get(encoded)
+        if value is None:
+            value = self._decoded[encoded] = \
+                datetime.datetime.fromordinal(encoded)
+        return value
+
+    def key_column(self) -> KeyColumn:
+        return KeyColumn(_copy_array(self.values, 'i'), self.encode,
+                         self.decode)
+
+    def nbytes(self) -> int:
+        return self.values.itemsize * len(self.values)
+
+
+class StringColumn(Column):
+    """Dictionary-encoded strings, or a heap of utf-8 bytes.
+
+    In the heap encoding, `values` are offsets into `heap` and `lengths` the
+    byte lengths. Overwritten strings are left as garbage in the heap, which
+    is compacted once the garbage takes up half of it.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.values = array.array('i')
+        self.dictionary: typing.Optional[typing.List[str]] = []
+        self._codes: typing.Dict[str, int] = {}
+
+        self.heap: typing.Optional[bytearray] = None
+        self.lengths = array.array('i')
+        self._garbage = 0
+
+    def _switch_to_heap(self):
+        dictionary, codes = self.dictionary, self.values
+        self.dictionary, self._codes = None, {}
+        self.heap = bytearray()
+        self.values = array.array('q')
+        for code in codes:
+            self.append(dictionary[code].encode())
+
+    def encode(self, value: str) -> typing.Union[int, bytes]:
+        if self.heap is not None:
+            return value.encode()
+
+        code = self._codes.get(value)
+        if code is None:
+            if len(self.dictionary) >= max(
+                    DICTIONARY_MIN_VALUES,
+                    DICTIONARY_MAX_RATIO * len(self.values)):
+                self._switch_to_heap()
+                return value.encode()
+            code = self._codes[value] = len(self.dictionary)
+            self.dictionary.append(value)
+        return code
+
+    def decode(self, encoded: int) -> str:
+        return self.dictionary[encoded]
+
+    def append(self, encoded: typing.Union[int, bytes]):
+        if self.heap is None:
+            self.values.append(encoded)
+            return
+        self.values.append(len(self.heap))
+        self.lengths.append(len(encoded))
+        self.heap += encoded
+
+    def __setitem__(self, slot: int, encoded: typing.Union[int, bytes]):
+        if self.heap is None:
+            self.values[slot] = encoded
+            return
+        self._garbage += self.lengths[slot]
+        self.values[slot] = len(self.heap)
+        self.lengths[slot] = len(encoded)
+        self.heap += encoded
+        if self._garbage * 2 > len(self.heap):
+            self._compact()
+
+    def __getitem__(self, slot: int) -> str:
+        if self.heap is None:
+            return self.dictionary[self.values[slot]]
+        offset = self.values[slot]
+        return self.heap[offset:offset + self.lengths[slot]].decode()
+
+    def get_range(self, start: int, stop: int) -> typing.List[str]:
+        if self.heap is None:
+            return list(map(self.dictionary.__getitem__,
+                            self.values[start:stop]))
+        heap = self.heap
+        return [heap[offset:offset + length].decode()
+                for offset, length in zip(self.values[start:stop],
+                                          self.lengths[start:stop])]
+
+    @property
+    def vectorizable(self) -> bool:
+        return self.heap is None
+
+    def key_column(self) -> KeyColumn:
+        """The ranks of the strings, as the dictionary is not sorted."""
+        dictionary = sorted(self.dictionary)
+        ranks = numpy.empty(len(dictionary), dtype='i')
+        ranks[[self._codes[value] for value in dictionary]] = \
+            numpy.arange(len(dictionary), dtype='i')
+        return KeyColumn(ranks[_copy_array(self.values, 'i')],
+                         _rank_key_of(dictionary), dictionary.__getitem__)
+
+    def take(self, slots: typing.List[int]) -> typing.List[str]:
+        if self.heap is None:
+            return list(map(self.dictionary.__getitem__,
+                            map(self.values.__getitem__, slots)))
+        return list(map(self.__getitem__, slots))
+
+    def _compact(self):
+        heap, offsets = self.heap, self.values
+        self.heap, self.values = bytearray(), array.array('q')
+        for offset, length in zip(offsets, self.lengths):
+            self.values.append(len(self.heap))
+            self.heap += heap[offset:offset + length]
+        self._garbage = 0
+
+    def nbytes(self) -> int:
+        if self.heap is None:
+            return self.values.itemsize * len(self.values) \
+                + sum(len(value) for value in self.dictionary)
+        return (self.values.itemsize + self.lengths.itemsize) \
+            * len(self.values) + len(self.heap)
+
+
+column_types: typing.Dict[str, typing.Type[Column]] = {
+    'integer': IntegerColumn,
+    'date': DateColumn,
+    'string': StringColumn,
+}
+
+
+class SlotIndex(object):
+    """An open-addressing hash table of pk -> slot, over `array('q')`.
+
+    Unlike a dict, it holds no python object per entry: the keys of the
+    entries are looked up in the primary key column.
+    """
+    EMPTY = -1
+    DELETED = -2
+    MIN_CAPACITY = 8
+
+    def __init__(self, pk_column: Column):
+        self._pk_column = pk_column
+        self._table = array.array('q', [self.EMPTY]) * self.MIN_CAPACITY
+        self._bits = self.MIN_CAPACITY.bit_length() - 1
+        self._used = 0  # live entries
+        self._filled = 0  # live or deleted entries
+
+    def __len__(self) -> int:
+        return self._used
+
+    def _probe(self, pk: PKType) -> typing.Tuple[int, int]:
+        """Return `(position of the pk or -1, first free position)`."""
+        table, pk_column = self._table, self._pk_column
+        mask = len(table) - 1
+        # fibonacci hashing scatters consecutive integer keys
+        pos = ((hash(pk) * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) \
+            >> (64 - self._bits)
+        free = -1
+        while True:
+            slot = table[pos]
+            if slot == self.EMPTY:
+                return -1, pos if free < 0 else free
+            if slot == self.DELETED:
+                if free < 0:
+                    free = pos
+            elif pk_column[slot] == pk:
+                return pos, free
+            pos = (pos + 1) & mask
+
+    def get(self, pk: PKType) -> typing.Optional[int]:
+        pos, _ = self._probe(pk)
+        return self._table[pos] if pos >= 0 else None
+
+    def __contains__(self, pk: PKType) -> bool:
+        return self._probe(pk)[0] >= 0
+
+    def add(self, pk: PKType, slot: int):
+        """Add the slot of a pk which is not indexed yet."""
+        _, pos = self._probe(pk)
+        if self._table[pos] == self.EMPTY:
+            self._filled += 1
+        self._table[pos] = slot
+        self._used += 1
+        if self._filled * 3 >= len(self._table) * 2:
+            self._resize()
+
+    def remove(self, pk: PKType):
+        pos, _ = self._probe(pk)
+        self._table[pos] = self.DELETED
+        self._used -= 1
+
+    def _resize(self):
+        slots = [slot for slot in self._table if slot >= 0]
+        capacity = self.MIN_CAPACITY
+        while capacity < len(slots) * 3:
+            capacity *= 2
+        self._table = array.array('q', [self.EMPTY]) * capacity
+        self._bits = capacity.bit_length() - 1
+        self._used = self._filled = 0
+        for slot in slots:
+            self.add(self._pk_column[slot], slot)
+
+    def nbytes(self) -> int:
+        return self._table.itemsize * len(self._table)
+
+
+class MemoryColumnarDataManager(DataManagerABC):
+    def __init__(self, instance: MineSQLite):
+        super().__init__(instance)
+        self._fields: typing.List[str] = instance.schema.fields
+        self._columns: typing.Dict[str, Column] = {}
+        self._slots: typing.Optional[SlotIndex] = None
+        self._alive = bytearray()
+        self._free_slots: typing.List[int] = []
+        self._reset()
+        self._vectorized: bool = numpy is not None \
+            and utils.get_sysconf_or_default(
+                instance.sysconf, 'data.memory_columnar.vectorized', False)
+
+        snapshot_path: str = utils.get_sysconf_or_default(
+            instance.sysconf, 'data.snapshot.path', '')
+        if snapshot_path and os.path.exists(snapshot_path):
+            self.load_snapshot(snapshot_path)
+
+    def _reset(self):
+        schema = self.instance.schema
+        self._columns = {
+            field: column_types.get(schema.get_field_type(field), Column)()
+            for field in self._fields}
+        self._slots = SlotIndex(self._columns[self.pk])
+        self._alive = bytearray()
+        self._free_slots = []
+
+    def _encode(self, row: RowType) -> typing.Dict[str, typing.Any]:
+        unknown_fields = set(row) - set(self._columns)
+        if unknown_fields:
+            raise exceptions.DataEntryInvalid(
+                reason="unexpected extra keys: %s"
+                       % ', '.join(sorted(unknown_fields)))
+        return {field: self._columns[field].encode(value)
+                for field, value in row.items()}
+
+    def _build_row(self, slot: int) -> RowType:
+        return {field: column[slot] for field, column in self._columns.items()}
+
+    def _get_slot(self, pk: PKType) -> int:
+        slot = self._slots.get(pk)
+        if slot is None:
+            raise exceptions.DataEntryNotFound(field=self.pk, value=pk)
+        return slot
+
+    def _insert(self, pk: PKType, encoded: typing.Dict[str, typing.Any]):
+        """Insert a row just encoded, as a string column encodes its values
+        differently once it switched to the heap encoding."""
+        # all the values first, not to leave the columns out of step
+        missing_fields = set(self._columns) - set(encoded)
+        if missing_fields:
+            raise exceptions.DataEntryInvalid(
+                reason="missing keys: %s" % ', '.join(sorted(missing_fields)))
+        values = [(column, encoded[field])
+                  for field, column in self._columns.items()]
+        if self._free_slots:
+            slot = self._free_slots.pop()
+            for column, value in values:
+                column[slot] = value
+            self._alive[slot] = 1
+        else:
+            slot = len(self._alive)
+            for column, value in values:
+                column.append(value)
+            self._alive.append(1)
+        self._slots.add(pk, slot)
+        return slot
+
+    def _iter_alive_slots(self) -> typing.Iterator[int]:
+        return (slot for slot, alive in enumerate(self._alive) if alive)
+
+    def create_one(self, pk: PKType, kvs: RowType) -> RowType:
+        if pk in self._slots:
+            raise exceptions.DataDuplicateEntry(field=self.pk, value=pk)
+        row = dict(kvs)
+        row[self.pk] = pk
+        return self._build_row(self._insert(pk, self._encode(row)))
+
+    def create_many(self, entries: typing.Sequence[typing.Tuple[PKType,
+                                                                RowType]]) \
+            -> int:
+        """Check the keys of all the rows first, then encode and insert them
+        one by one, deleting them again if a value is invalid."""
+        check_unique_pks(self.pk, entries)
+        fields = set(self._columns)
+        for pk, kvs in entries:
+            if pk in self._slots:
+                raise exceptions.DataDuplicateEntry(field=self.pk, value=pk)
+            unknown_fields = set(kvs) - fields
+            if unknown_fields:
+                raise exceptions.DataEntryInvalid(
+                    reason="unexpected extra keys: %s"
+                           % ', '.join(sorted(unknown_fields)))
+            missing_fields = fields - set(kvs) - {self.pk}
+            if missing_fields:
+                raise exceptions.DataEntryInvalid(
+                    reason="missing keys: %s"
+                           % ', '.join(sorted(missing_fields)))
+        created = []
+        try:
+            for pk, kvs in entries:
+                row = dict(kvs)
+                row[self.pk] = pk
+                self._insert(pk, self._encode(row))
+                created.append(pk)
+        except BaseException:
+            for pk in created:
+                self.delete_one(pk)
+            raise
+        return len(created)
+
+    def read_one(self, pk: PKType) -> RowType:
+        return self._build_row(self._get_slot(pk))
+
+    def build_cursor(self) -> SlotCursor:
+        cursor = SlotCursor(0, len(self._alive))
+        self._skip_dead_slots(cursor)
+        return cursor
+
+    def _skip_dead_slots(self, cursor: SlotCursor):
+        alive = self._alive
+        while cursor.slot < cursor.num_slots and not alive[cursor.slot]:
+            cursor.slot += 1
+
+    def next_row(self, cursor: typing.Optional[SlotCursor] = None) \
+            -> typing.Tuple[SlotCursor, RowType]:
+        # the row may have been deleted since the cursor was advanced
+        slot = cursor.slot
+        self._skip_dead_slots(cursor)
+        if not cursor:
+            raise exceptions.DataEntryNotFound(field='slot', value=slot)
+        row = self._build_row(cursor.slot)
+        cursor.slot += 1
+        self._skip_dead_slots(cursor)
+        return cursor, row
+
+    def scan(self, batch_size: int = DEFAULT_SCAN_BATCH_SIZE) \
+            -> typing.Iterator[typing.List[RowType]]:
+        fields = list(self._columns)
+        start = 0
+        # the rows may be modified whenever a batch is yielded
+        while start < len(self._alive):
+            stop = min(start + batch_size, len(self._alive))
+            columns = [column.get_range(start, stop)
+                       for column in self._columns.values()]
+            batch = [dict(zip(fields, values))
+                     for alive, *values in zip(self._alive[start:stop],
+                                               *columns)
+                     if alive]
+            start = stop
+            if batch:
+                yield batch
+
+    def _can_vectorize(self, query: Query,
+                       group_by: typing.Sequence[str] = ()) -> bool:
+        return self._vectorized and all(
+            self._columns[field].vectorizable
+            for field in query.fields.union(group_by))
+
+    def _key_columns(self, query: Query,
+                     group_by: typing.Sequence[str] = ()) \
+            -> typing.Tuple[typing.Dict[str, KeyColumn], 'numpy.ndarray']:
+        """The key columns of the fields of the query, and whether each
+        slot holds a row."""
+        columns = {field: self._columns[field].key_column()
+                   for field in query.fields.union(group_by)}
+        alive = numpy.frombuffer(self._alive, dtype='B').astype(bool)
+        return columns, alive
+
+    def _select_vectorized(self, query: Query, batch_size: int) \
+            -> typing.Iterator[typing.List[RowType]]:
+        if not self._can_vectorize(query):
+            # a string column switched to the heap encoding since planned
+            yield from super().plan(query).execute(batch_size)
+            return
+        slots = vectorized.select_slots(
+            query, *self._key_columns(query)).tolist()
+        # all built before the rows may be modified, of the columns asked
+        # for only
+        fields = list(self._columns if query.columns is None
+                      else query.columns)
+        rows = [dict(zip(fields, values)) for values in zip(
+            *(self._columns[field].take(slots) for field in fields))]
+        yield from batched(rows, batch_size)
+
+    def plan(self, query: Query) -> PlanNode:
+        if not self._can_vectorize(query):
+            return super().plan(query)
+        return Project(Access(
+            'vectorized', functools.partial(self._select_vectorized, query),
+            len(self._slots)), query, pushed_down=True)
+
+    def count(self, query: Query) -> int:
+        if not self._can_vectorize(query):
+            return super().count(query)
+        return query.clip(vectorized.count(query,
+                                           *self._key_columns(query)))
+
+    def aggregate(self, query: Query, group_by: typing.Sequence[str]) \
+            -> typing.Dict[tuple, int]:
+        if not self._can_vectorize(query, group_by):
+            return super().aggregate(query, group_by)
+        query = dataclasses.replace(query, sorts=[], limit=None, offset=0,
+                                    after=None)
+        return vectorized.count_groups(
+            query, *self._key_columns(query, group_by), group_by)
+
+    def update_one(self, pk: PKType, kvs: RowType) -> RowType:
+        slot = self._get_slot(pk)
+        if self.pk in kvs:
+            raise exceptions.DataEntryInvalid(
+                reason="cannot modify primary key `%s`" % self.pk)
+        for field, encoded in self._encode(kvs).items():
+            self._columns[field][slot] = encoded
+        return self._build_row(slot)
+
+    def delete_one(self, pk: PKType) -> RowType:
+        slot = self._get_slot(pk)
+        row = self._build_row(slot)
+        self._slots.remove(pk)
+        self._alive[slot] = 0
+        self._free_slots.append(slot)
+        return row
+
+    def save_snapshot(self, path: str) -> int:
+        pk_column = self._columns[self.pk]
+        fields = [field for field in self._fields if field != self.pk]
+        columns = [self._columns[field] for field in fields]
+        entries = ((pk_column[slot], [column[slot] for column in columns])
+                   for slot in self._iter_alive_slots())
+        with utils.gc_paused():
+            snapshot.write_snapshot(path, fields, entries, len(self._slots))
+        return len(self._slots)
+
+    def load_snapshot(self, path: str) -> int:
+        self._reset()
+        with utils.gc_paused():
+            for fields, (pks, rows) in snapshot.read_snapshot(path):
+                for pk, values in zip(pks, rows):
+                    row = dict(zip(fields, values))
+                    row[self.pk] = pk
+                    self._insert(pk, self._encode(row))
+        return len(self._slots)
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        return {
+            'rows': len(self._slots),
+            'slots': len(self._alive),
+            'column_bytes': sum(column.nbytes()
+                                for column in self._columns.values()),
+            'index_bytes': self._slots.nbytes(),
+        }
@@ -1,78 +1,430 @@
 # coding=utf-8
 # Author: @hsiaoxychen
+import functools
+import os
+import threading
 import typing
 
 from minesqlite import exceptions
-from minesqlite.data.base import DataManagerABC, CursorABC
+from minesqlite.common import utils
+from minesqlite.data import snapshot
+from minesqlite.data.base import (
+    DEFAULT_SCAN_BATCH_SIZE,
+    DataManagerABC,
+    SlotCursor,
+    check_unique_pks,
+)
+from minesqlite.data.index import (
+    BitmapIndexes,
+    KeyType,
+    RecordIndexes,
+    SortedIndex,
+    bitmap_positions,
+)
+from minesqlite.data.mvcc import Snapshot, VersionStore
+from minesqlite.data.plan import Access, PlanNode, Planner
+from minesqlite.data.query import Query, Range, batched
+from minesqlite.data.row import RecordType, RowLayout, RowView
 from minesqlite import MineSQLite
 
 PKType = str
 RowType = dict
 
 
-class Cursor(CursorABC):
-    def __init__(self, keys: typing.List[str],
-                 index: int = 0):
-        self.keys = keys
-        self.index = index
+class SnapshotCursor(SlotCursor):
+    """A slot cursor reading the rows as of the snapshot it was built at."""
 
-    def __bool__(self):
-        return self.index < len(self.keys)
-
-    def next_cursor(self):
-        new_cursor = Cursor(self.keys)
-        new_cursor.index = self.index + 1
-        return new_cursor
+    def __init__(self, snapshot: Snapshot):
+        super().__init__(0, snapshot.num_slots)
+        self.snapshot = snapshot
 
 
 class MemoryDictDataManager(DataManagerABC):
+    """Rows are kept as compact records (see `row`), and handed out as
+    read-only views over them rather than as copies.
+
+    The records live in the slots of a multi-version store (see `mvcc`),
+    indexed by a pk -> slot dict. Scans and cursors read a snapshot of the
+    store, hence never see a write made after they start, and writers are
+    not blocked meanwhile. Slots of deleted rows are reused, but a record
+    never moves to another slot.
+
+    The fields with `attribute: index` are hash-indexed, the ones with
+    `attribute: sorted_index` are kept in order, and the ones with
+    `attribute: bitmap_index` have a bitmap per value over the slots (see
+    `index`): the planner weighs them against a scan for each query (see
+    `plan`), and `count` answers the filters on bitmap-indexed fields from
+    the bitmaps alone.
+    """
+
     def __init__(self, instance: MineSQLite):
         super().__init__(instance)
-        self._inner_data: typing.Dict[PKType, RowType] = {}
+        self._layout = RowLayout(instance.schema.fields,
+                                 instance.schema.primary_key)
+        self._slots: typing.Dict[PKType, int] = {}
+        self._store = VersionStore()
+        self._free_slots: typing.List[int] = []
+        self._indexes = RecordIndexes(self._layout,
+                                      instance.schema.indexed_fields,
+                                      instance.schema.sorted_indexed_fields)
+        self._bitmaps = BitmapIndexes(self._layout,
+                                      instance.schema.bitmap_indexed_fields)
+        # serializes the writers, as a write is a read-modify-write
+        self._write_lock = threading.RLock()
+
+        self._snapshot_path: str = utils.get_sysconf_or_default(
+            instance.sysconf, 'data.snapshot.path', '')
+        if self._snapshot_path and os.path.exists(self._snapshot_path):
+            self._restore_snapshot(self._snapshot_path)
 
     def _check_exists(self, pk: PKType) -> bool:
-        if pk in self._inner_data:
+        if pk in self._slots:
             return True
         return False
 
+    def _reset(self, entries: typing.Iterable[typing.Tuple[PKType,
+                                                           RecordType]]):
+        """Replace all the rows with the `(pk, record)` entries."""
+        slots, records = {}, []
+        for pk, record in entries:
+            slots[pk] = len(records)
+            records.append(record)
+        with self._write_lock:
+            # the snapshots in use keep reading the former store
+            self._store = VersionStore(self._store.commit_ts)
+            self._store.extend(records)
+            self._slots = slots
+            self._free_slots = []
+            self._indexes.rebuild((pk, records[slot])
+                                  for pk, slot in slots.items())
+            self._bitmaps.rebuild(records)
+
+    def _insert(self, pk: PKType, record: RecordType):
+        if self._free_slots:
+            slot = self._free_slots.pop()
+            self._store.write(slot, record)
+        else:
+            slot = self._store.append(record)
+        self._slots[pk] = slot
+        self._indexes.insert(pk, record)
+        self._bitmaps.insert(slot, record)
+
+    def _insert_many(self, records: typing.Sequence[typing.Tuple[
+            PKType, RecordType]]):
+        """Like `_insert`, with the records past the free slots committed
+        into new slots at once, and the indexes updated in bulk."""
+        reused = min(len(self._free_slots), len(records))
+        for pk, record in records[:reused]:
+            slot = self._free_slots.pop()
+            self._store.write(slot, record)
+            self._slots[pk] = slot
+            self._bitmaps.insert(slot, record)
+        start = len(self._store)
+        self._store.extend([record for _, record in records[reused:]])
+        for slot, (pk, record) in enumerate(records[reused:], start):
+            self._slots[pk] = slot
+            self._bitmaps.insert(slot, record)
+        self._indexes.insert_many(records)
+
+    def _remove(self, pk: PKType) -> RecordType:
+        slot = self._slots.pop(pk)
+        record = self._store.records[slot]
+        self._store.write(slot, None)
+        self._free_slots.append(slot)
+        self._indexes.remove(pk, record)
+        self._bitmaps.remove(slot, record)
+        return record
+
+    def _replace(self, pk: PKType, kvs: RowType) -> RecordType:
+        slot = self._slots[pk]
+        old = self._store.records[slot]
+        record = self._layout.replace(old, kvs)
+        self._store.write(slot, record)
+        self._indexes.replace(pk, old, record)
+        self._bitmaps.replace(slot, old, record)
+        return record
+
+    def _iter_records(self) -> typing.Iterator[RecordType]:
+        """Iterate over the latest records, to be called with writes held."""
+        return (record for record in self._store.records
+                if record is not None)
+
     def create_one(self, pk: PKType, kvs: RowType) -> RowType:
-        if self._check_exists(pk):
-            raise exceptions.DataDuplicateEntry(field=self.pk, value=pk)
-        self._inner_data[pk] = kvs
-        ret = self._inner_data[pk].copy()
-        ret[self.instance.schema.primary_key] = pk
-        return ret
+        record = self._layout.pack(pk, kvs)
+        with self._write_lock:
+            if self._check_exists(pk):
+                raise exceptions.DataDuplicateEntry(field=self.pk, value=pk)
+            self._insert(pk, record)
+        return RowView(self._layout, record)
+
+    def create_many(self, entries: typing.Sequence[typing.Tuple[PKType,
+                                                                RowType]]) \
+            -> int:
+        """Pack all the records first, then insert them with the writes held
+        once, the new slots committed together."""
+        check_unique_pks(self.pk, entries)
+        pack = self._layout.pack
+        records = [(pk, pack(pk, kvs)) for pk, kvs in entries]
+        with self._write_lock:
+            for pk, _ in records:
+                if pk in self._slots:
+                    raise exceptions.DataDuplicateEntry(field=self.pk,
+                                                        value=pk)
+            self._insert_many(records)
+        return len(records)
 
     def read_one(self, pk: PKType) -> RowType:
-        if not self._check_exists(pk):
+        slot = self._slots.get(pk)
+        if slot is None:
             raise exceptions.DataEntryNotFound(field=self.pk, value=pk)
-        ret = self._inner_data[pk].copy()
-        ret[self.instance.schema.primary_key] = pk
-        return ret
+        return RowView(self._layout, self._store.records[slot])
+
+    def _skip_empty_slots(self, cursor: SnapshotCursor):
+        snapshot = cursor.snapshot
+        while cursor.slot < cursor.num_slots \
+                and snapshot.get(cursor.slot) is None:
+            cursor.slot += 1
+        if not cursor:
+            # let the versions pinned by the cursor go as early as possible
+            snapshot.release()
+
+    def build_cursor(self) -> SnapshotCursor:
+        cursor = SnapshotCursor(self._store.snapshot())
+        self._skip_empty_slots(cursor)
+        return cursor
+
+    def next_row(self, cursor: typing.Optional[SnapshotCursor] = None) \
+            -> typing.Tuple[SnapshotCursor, RowType]:
+        if not cursor:
+            raise exceptions.DataEntryNotFound(field='slot', value=cursor.slot)
+        row = RowView(self._layout, cursor.snapshot.get(cursor.slot))
+        cursor.slot += 1
+        self._skip_empty_slots(cursor)
+        return cursor, row
+
+    def scan(self, batch_size: int = DEFAULT_SCAN_BATCH_SIZE) \
+            -> typing.Iterator[typing.List[RowType]]:
+        layout = self._layout
+        with self._store.snapshot() as snapshot:
+            for start in range(0, snapshot.num_slots, batch_size):
+                batch = [RowView(layout, record) for record
+                         in snapshot.read(start, start + batch_size)
+                         if record is not None]
+                if batch:
+                    yield batch
+
+    def _iter_sorted(self, index: SortedIndex, reverse: bool,
+                     range_: typing.Optional[Range],
+                     after: typing.Optional[KeyType], batch_size: int) \
+            -> typing.Iterator[typing.List[RowType]]:
+        """Yield the rows in the order of a sorted index, chunk by chunk,
+        from the one after the key `after` if any.
+
+        The writes are only held while reading a chunk, the walk resumes
+        after the last key of the previous chunk.
+        """
+        layout = self._layout
+        while True:
+            with self._write_lock:
+                keys = index.keys(range_, reverse, after, batch_size)
+                records = [self._store.records[self._slots[pk]]
+                           for _, pk in keys]
+            if not keys:
+                return
+            after = keys[-1]
+            yield [RowView(layout, record) for record in records]
+
+    def _read_slots(self, lookup: typing.Callable[[], typing.List[int]],
+                    batch_size: int) -> typing.Iterator[typing.List[RowType]]:
+        """Yield the rows in the slots looked up, in the order of a scan.
 
-    def build_cursor(self) -> Cursor:
-        return Cursor(list(self._inner_data.keys()))
+        Unlike a scan, it reads the latest rows rather than a snapshot.
+        """
+        with self._write_lock:
+            records = list(map(self._store.records.__getitem__, lookup()))
+        layout = self._layout
+        yield from batched((RowView(layout, record) for record in records),
+                           batch_size)
 
-    def next_row(self, cursor: typing.Optional[Cursor] = None) \
-            -> typing.Tuple[Cursor, RowType]:
-        # TODO: how does redis implement cursor?
-        pk = cursor.keys[cursor.index]
-        ret = self._inner_data[pk].copy()
-        ret[self.instance.schema.primary_key] = pk
-        return cursor.next_cursor(), ret
+    def _hash_slots(self, field: str, value: typing.Any) -> typing.List[int]:
+        return sorted(map(self._slots.__getitem__,
+                          self._indexes.lookup({field: value})))
+
+    def _bitmap_slots(self, filters: typing.Dict[str, typing.Any]) \
+            -> typing.List[int]:
+        return bitmap_positions(self._bitmaps.lookup(filters))
+
+    def _range_slots(self, index: SortedIndex, range_: Range) \
+            -> typing.List[int]:
+        return sorted(self._slots[pk] for _, pk in index.keys(range_))
+
+    def _count_equal(self, field: str, value: typing.Any) \
+            -> typing.Optional[int]:
+        count = self._indexes.count(field, value)
+        if count is None:
+            count = self._bitmaps.count({field: value})
+        return count
+
+    def _count_range(self, field: str, range_: Range) \
+            -> typing.Optional[int]:
+        index = self._indexes.sorted_index(field)
+        return index.count(range_) if index is not None else None
+
+    def _access_paths(self, query: Query, planner: Planner) \
+            -> typing.List[Access]:
+        """The ways to get the candidates of the query, with writes held."""
+        paths = [Access('scan', self.scan, len(self._slots))]
+        bitmap_filters = {}
+        for field, value in query.filters.items():
+            count = self._indexes.count(field, value)
+            if count is not None:
+                paths.append(Access(
+                    'hash_lookup', functools.partial(
+                        self._read_slots,
+                        functools.partial(self._hash_slots, field, value)),
+                    count, 'on %s' % field))
+            elif self._bitmaps.covers({field: value}):
+                bitmap_filters[field] = value
+        if bitmap_filters:
+            # at most the rows of the least frequent value
+            estimate = min(self._bitmaps.count({field: value})
+                           for field, value in bitmap_filters.items())
+            paths.append(Access(
+                'bitmap_and', functools.partial(
+                    self._read_slots,
+                    functools.partial(self._bitmap_slots, bitmap_filters)),
+                estimate, 'on %s' % ', '.join(bitmap_filters)))
+        for field, range_ in query.ranges.items():
+            index = self._indexes.sorted_index(field)
+            if index is not None:
+                paths.append(Access(
+                    'index_range', functools.partial(
+                        self._read_slots,
+                        functools.partial(self._range_slots, index, range_)),
+                    index.count(range_), 'on %s' % field))
+        sorts = query.sorts
+        if len(sorts) == 2 and sorts[1] == (self.pk, sorts[0][1]):
+            # the ties of a sorted index are in the order of the pks
+            sorts = sorts[:1]
+        if len(sorts) == 1:
+            field, reverse = sorts[0]
+            index = self._indexes.sorted_index(field)
+            if index is not None:
+                range_ = query.ranges.get(field)
+                # the key in the index of the row to resume after, i.e. the
+                # first and the last of the sort key (the same if by pk)
+                after = None if query.after is None \
+                    else (query.after[0], query.after[-1])
+                paths.append(Access(
+                    'index_order', functools.partial(
+                        self._iter_sorted, index, reverse, range_, after),
+                    planner.ordered_reads(query, index.count(range_)),
+                    'on %s%s' % (field, ' desc' if reverse else ''),
+                    ordered=True))
+        return paths
+
+    def plan(self, query: Query) -> PlanNode:
+        """Plan the query on the cheapest of a scan and the indexes.
+
+        - an equality filter on a hash-indexed field reads the rows of its
+          set of pks,
+        - the equality filters on bitmap-indexed fields read the rows of the
+          AND of their bitmaps,
+        - a range on a field with a sorted index reads the rows within it,
+        - a single sort on a field with a sorted index walks the rows in its
+          order (ties by primary key), from the `after` key of a page if
+          any, until the limit if any.
+
+        The estimates come from the indexes: the number of pks of a value,
+        the bits set in its bitmap, or the keys within a range.
+        """
+        with self._write_lock:
+            planner = Planner(len(self._slots), self._count_equal,
+                              self._count_range, self._parallel)
+            return planner.plan(query, self._access_paths(query, planner))
+
+    def count(self, query: Query) -> int:
+        """Count from the bitmaps alone if all the filters are on
+        bitmap-indexed fields, or from the pk -> slot dict if none."""
+        if query.ranges or query.after is not None \
+                or query.where is not None \
+                or not self._bitmaps.covers(query.filters):
+            return super().count(query)
+        with self._write_lock:
+            count = self._bitmaps.count(query.filters) if query.filters \
+                else len(self._slots)
+        return query.clip(count)
+
+    def aggregate(self, query: Query, group_by: typing.Sequence[str]) \
+            -> typing.Dict[tuple, int]:
+        """Count from the bitmaps alone if the fields grouped by and the
+        filters are all bitmap-indexed."""
+        if query.ranges or query.after is not None \
+                or query.where is not None \
+                or not self._bitmaps.covers(query.filters) \
+                or not self._bitmaps.covers(group_by):
+            return super().aggregate(query, group_by)
+        with self._write_lock:
+            return self._bitmaps.group(group_by, query.filters)
 
     def update_one(self, pk: PKType, kvs: RowType) -> RowType:
-        if not self._check_exists(pk):
-            raise exceptions.DataEntryNotFound(field=self.pk, value=pk)
-        self._inner_data.setdefault(pk, {})
-        self._inner_data[pk].update(kvs)
-        ret = self._inner_data[pk].copy()
-        ret[self.instance.schema.primary_key] = pk
-        return ret
+        if self.pk in kvs:
+            raise exceptions.DataEntryInvalid(
+                reason="cannot modify primary key `%s`" % self.pk)
+        with self._write_lock:
+            if not self._check_exists(pk):
+                raise exceptions.DataEntryNotFound(field=self.pk, value=pk)
+            return RowView(self._layout, self._replace(pk, kvs))
 
     def delete_one(self, pk: PKType) -> RowType:
-        if not self._check_exists(pk):
-            raise exceptions.DataEntryNotFound(field=self.pk, value=pk)
-        ret = self._inner_data.pop(pk)  # no need to copy
-        ret[self.instance.schema.primary_key] = pk
-        return ret
+        with self._write_lock:
+            if not self._check_exists(pk):
+                raise exceptions.DataEntryNotFound(field=self.pk, value=pk)
+            return RowView(self._layout, self._remove(pk))
+
+    def save_snapshot(self, path: str) -> int:
+        return self._write_snapshot(path)
+
+    def _write_snapshot(self, path: str, generation: int = 0) -> int:
+        fields = [field for field in self._layout.fields if field != self.pk]
+        pk_index = self._layout.pk_index
+        value_indexes = [self._layout.indexes[field] for field in fields]
+        with self._store.snapshot() as view:
+            records = [record for record in view.read(0, view.num_slots)
+                       if record is not None]
+        entries = ((record[pk_index], [record[i] for i in value_indexes])
+                   for record in records)
+        with utils.gc_paused():
+            snapshot.write_snapshot(path, fields, entries, len(records),
+                                    generation)
+        return len(records)
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        stats = self._store.stats()
+        stats['rows'] = len(self._slots)
+        stats.update(self._indexes.stats())
+        stats.update(self._bitmaps.stats())
+        return stats
+
+    def _read_snapshot(self, path: str) \
+            -> typing.Iterator[typing.Tuple[PKType, RecordType]]:
+        layout = self._layout
+        for fields, (pks, rows) in snapshot.read_snapshot(path):
+            if tuple(fields) == layout.fields[:layout.pk_index] \
+                    + layout.fields[layout.pk_index + 1:]:
+                # the usual case: splice the pk into the values
+                i = layout.pk_index
+                yield from ((pk, row[:i] + (pk,) + row[i:])
+                            for pk, row in zip(pks, rows))
+            else:
+                yield from ((pk, layout.pack(pk, dict(zip(fields, row))))
+                            for pk, row in zip(pks, rows))
+
+    def _restore_snapshot(self, path: str):
+        with utils.gc_paused():
+            # read it all first, not to be left half-loaded by a bad file
+            self._reset(list(self._read_snapshot(path)))
+
+    def load_snapshot(self, path: str) -> int:
+        self._restore_snapshot(path)
+        return len(self._slots)
@@ -0,0 +1,376 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+"""A driver hash-partitioning the rows across a pool of worker processes.
+
+Each of the `data.partitioned.partitions` workers runs its own driver (of
+type `data.partitioned.driver`) over the rows whose primary key hashes to
+it. Point operations are routed to a single partition. A `select` is sent
+to all of them, so that they filter and sort their rows in parallel; their
+results are streamed back in batches of `data.partitioned.batch_size` rows,
+and merged in order (a k-way merge on the sort keys) by the main process.
+
+The file paths configured for the inner drivers (`data.*.path`) get the
+partition index appended, hence each partition keeps its own files: the
+partition count must not change between runs.
+
+Rows travel between the processes as records (see `row`), and the errors as
+their type and message.
+"""
+import collections
+import dataclasses
+import functools
+import heapq
+import io
+import multiprocessing
+import multiprocessing.connection
+import os
+import typing
+import zlib
+
+import yaml
+
+from minesqlite import exceptions
+from minesqlite.common import utils
+from minesqlite.data.base import (
+    DEFAULT_SCAN_BATCH_SIZE,
+    DataManager,
+    DataManagerABC,
+    IteratorCursor,
+    check_unique_pks,
+)
+from minesqlite.data.plan import Access, PlanNode, Project
+from minesqlite.data.query import Query, batched
+from minesqlite.data.row import RecordType, RowLayout, RowView
+from minesqlite.schema import SchemaManager
+from minesqlite import MineSQLite
+
+PKType = typing.Any
+RowType = dict
+
+DEFAULT_DRIVER = 'memory_dict'
+DEFAULT_BATCH_SIZE = 1024
+
+_STATUS_OK = 0
+_STATUS_ERROR = 1
+_STATUS_BATCH = 2
+_STATUS_DONE = 3
+
+# the methods returning a row, which travels as a record
+_ROW_METHODS = {'create_one', 'read_one', 'update_one', 'delete_one'}
+
+
+class _WorkerInstance(object):
+    """What a driver needs of a `MineSQLite` instance."""
+
+    def __init__(self, sysconf: typing.Dict[str, typing.Any],
+                 definition: dict):
+        self.sysconf = collections.defaultdict(str, sysconf)
+        self.sysconf['schema.read.infile'] = io.StringIO(
+            yaml.safe_dump(definition))
+        self.schema = SchemaManager(self.sysconf)
+
+
+def _serve(conn: multiprocessing.connection.Connection,
+           sysconf: typing.Dict[str, typing.Any], definition: dict,
+           batch_size: int):
+    """The main loop of a worker: runs the requests of the main process."""
+    instance = _WorkerInstance(sysconf, definition)
+    driver = DataManager(instance).driver
+    layout = RowLayout(instance.schema.fields, instance.schema.primary_key)
+
+    while True:
+        method, args = conn.recv()
+        try:
+            if method == 'select':
+                for batch in driver.select(args[0], batch_size):
+                    conn.send((_STATUS_BATCH,
+                               [layout.record_of(row) for row in batch]))
+                conn.send((_STATUS_DONE, None))
+                continue
+
+            result = getattr(driver, method)(*args)
+            if method in _ROW_METHODS:
+                result = layout.record_of(result)
+            conn.send((_STATUS_OK, result))
+        except Exception as e:
+            conn.send((_STATUS_ERROR, (type(e), str(e))))
+        if method == 'close':
+            conn.close()
+            return
+
+
+class Partition(object):
+    def __init__(self, index: int, sysconf: typing.Dict[str, typing.Any],
+                 definition: dict, batch_size: int):
+        self.index = index
+        self._conn, child_conn = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(
+            target=_serve, args=(child_conn, sysconf, definition, batch_size),
+            name='partition-%d' % index, daemon=True)
+        self._process.start()
+        child_conn.close()
+        # whether the batches of a select are still to be received
+        self._streaming = False
+
+    @staticmethod
+    def _raise(error: typing.Tuple[type, str]):
+        exc_type, message = error
+        if issubclass(exc_type, exceptions.MineSQLiteException):
+            raise exc_type('%(message)s', message=message)
+        raise exceptions.InternalError(
+            msg="%s in partition: %s" % (exc_type.__name__, message))
+
+    def send(self, method: str, *args):
+        if self._streaming:
+            # an abandoned select, whose remaining batches are dropped
+            for _ in self.iter_batches():
+                pass
+        self._conn.send((method, args))
+        self._streaming = method == 'select'
+
+    def recv(self) -> typing.Any:
+        status, result = self._conn.recv()
+        if status == _STATUS_ERROR:
+            self._raise(result)
+        return result
+
+    def call(self, method: str, *args) -> typing.Any:
+        self.send(method, *args)
+        return self.recv()
+
+    def iter_batches(self) -> typing.Iterator[typing.List[RecordType]]:
+        """Receive the batches of the select sent."""
+        while self._streaming:
+            status, result = self._conn.recv()
+            if status == _STATUS_BATCH:
+                yield result
+                continue
+            self._streaming = False
+            if status == _STATUS_ERROR:
+                self._raise(result)
+
+    @property
+    def connection(self) -> multiprocessing.connection.Connection:
+        return self._conn
+
+    def close(self):
+        if not self._process.is_alive():
+            return
+        try:
+            self.call('close')
+        finally:
+            self._conn.close()
+            self._process.join()
+
+
+class PartitionedDataManager(DataManagerABC):
+    def __init__(self, instance: MineSQLite):
+        super().__init__(instance)
+        sysconf = instance.sysconf
+        num_partitions: int = utils.get_sysconf_or_default(
+            sysconf, 'data.partitioned.partitions', os.cpu_count() or 1)
+        inner_driver: str = utils.get_sysconf_or_default(
+            sysconf, 'data.partitioned.driver', DEFAULT_DRIVER)
+        batch_size: int = utils.get_sysconf_or_default(
+            sysconf, 'data.partitioned.batch_size', DEFAULT_BATCH_SIZE)
+        if inner_driver == 'partitioned':
+            raise exceptions.InternalError(
+                msg="partitions cannot be partitioned again")
+
+        self._layout = RowLayout(instance.schema.fields,
+                                 instance.schema.primary_key)
+        self._partitions: typing.List[Partition] = []
+        try:
+            for index in range(num_partitions):
+                self._partitions.append(Partition(
+                    index, self._build_sysconf(index, inner_driver),
+                    instance.schema.definition, batch_size))
+        except BaseException:
+            self.close()
+            raise
+
+    def _build_sysconf(self, index: int, inner_driver: str) \
+            -> typing.Dict[str, typing.Any]:
+        """The sysconf of a partition, without what cannot be pickled."""
+        sysconf = {}
+        for key, value in self.instance.sysconf.items():
+            if not isinstance(value, (str, int, bool)):
+                continue
+            if key.startswith('data.') and key.endswith('.path') and value:
+                value = '%s.%d' % (value, index)
+            sysconf[key] = value
+        sysconf['data.driver'] = inner_driver
+        # the partitions already run in parallel
+        sysconf['data.parallel.workers'] = 0
+        # the results are cached by this driver, not by the partitions
+        sysconf['data.cache.size'] = 0
+        return sysconf
+
+    def _route(self, pk: PKType) -> Partition:
+        # not `hash()`, which is salted differently by each process
+        digest = zlib.crc32(repr(pk).encode())
+        return self._partitions[digest % len(self._partitions)]
+
+    def _call_row_method(self, method: str, pk: PKType, *args) -> RowType:
+        return RowView(self._layout,
+                       self._route(pk).call(method, pk, *args))
+
+    @staticmethod
+    def _recv_all(partitions: typing.Iterable[Partition]) \
+            -> typing.List[typing.Any]:
+        """Receive the reply of every partition, then raise the first error
+        if any: no reply is left behind, to be taken for the reply of the
+        next call."""
+        results, error = [], None
+        for partition in partitions:
+            try:
+                results.append(partition.recv())
+            except exceptions.MineSQLiteException as e:
+                error = error or e
+        if error is not None:
+            raise error
+        return results
+
+    def _call_all(self, method: str, *args) -> typing.List[typing.Any]:
+        """Call a method of every partition, all in parallel."""
+        for partition in self._partitions:
+            partition.send(method, *args)
+        return self._recv_all(self._partitions)
+
+    def create_one(self, pk: PKType, kvs: RowType) -> RowType:
+        return self._call_row_method('create_one', pk, kvs)
+
+    def create_many(self, entries: typing.Sequence[typing.Tuple[PKType,
+                                                                RowType]]) \
+            -> int:
+        """Send each partition its share of the rows in one message, all in
+        parallel. The rows created by the other partitions are deleted if
+        one of them fails."""
+        check_unique_pks(self.pk, entries)
+        shares = collections.defaultdict(list)
+        for pk, kvs in entries:
+            shares[self._route(pk)].append((pk, kvs))
+        for partition, share in shares.items():
+            partition.send('create_many', share)
+        created, error = [], None
+        for partition, share in shares.items():
+            try:
+                partition.recv()
+                created.extend((partition, pk) for pk, _ in share)
+            except exceptions.MineSQLiteException as e:
+                error = error or e
+        if error is not None:
+            for partition, pk in created:
+                partition.call('delete_one', pk)
+            raise error
+        return len(entries)
+
+    def read_one(self, pk: PKType) -> RowType:
+        return self._call_row_method('read_one', pk)
+
+    def update_one(self, pk: PKType, kvs: RowType) -> RowType:
+        return self._call_row_method('update_one', pk, kvs)
+
+    def delete_one(self, pk: PKType) -> RowType:
+        return self._call_row_method('delete_one', pk)
+
+    def _iter_unordered(self) -> typing.Iterator[typing.List[RecordType]]:
+        """Receive the batches of all the partitions as they come."""
+        streams = {partition.connection: partition.iter_batches()
+                   for partition in self._partitions}
+        while streams:
+            for conn in multiprocessing.connection.wait(list(streams)):
+                batch = next(streams[conn], None)
+                if batch is None:
+                    del streams[conn]
+                elif batch:
+                    yield batch
+
+    def _iter_ordered(self, query: Query) -> typing.Iterator[RowType]:
+        """Merge the sorted rows of all the partitions."""
+        layout = self._layout
+
+        def iter_rows(partition: Partition) -> typing.Iterator[RowType]:
+            for batch in partition.iter_batches():
+                for record in batch:
+                    yield RowView(layout, record)
+
+        return heapq.merge(*map(iter_rows, self._partitions),
+                           key=query.sort_key, reverse=query.sort_reverse)
+
+    def select(self, query: Query,
+               batch_size: int = DEFAULT_SCAN_BATCH_SIZE) \
+            -> typing.Iterator[typing.List[RowType]]:
+        # the offset only applies to the merged rows
+        partition_query = query if not query.offset else dataclasses.replace(
+            query, offset=0,
+            limit=None if query.limit is None
+            else query.limit + query.offset)
+        for partition in self._partitions:
+            partition.send('select', partition_query)
+
+        layout = self._layout
+        if not query.sorts:
+            yield from query.truncate(
+                [RowView(layout, record) for record in batch]
+                for batch in self._iter_unordered())
+            return
+
+        rows = self._iter_ordered(query)
+        yield from query.truncate(batched(rows, batch_size))
+
+    def plan(self, query: Query) -> PlanNode:
+        # the partitions project their rows
+        return Project(Access(
+            'parallel_select', functools.partial(self.select, query),
+            detail='%d partitions%s' % (len(self._partitions),
+                                        ', merged' if query.sorts else '')),
+            query, pushed_down=True)
+
+    def count(self, query: Query) -> int:
+        partition_query = dataclasses.replace(query, offset=0, limit=None)
+        return query.clip(sum(self._call_all('count', partition_query)))
+
+    def aggregate(self, query: Query, group_by: typing.Sequence[str]) \
+            -> typing.Dict[tuple, int]:
+        groups = collections.Counter()
+        for partition_groups in self._call_all('aggregate', query, group_by):
+            groups.update(partition_groups)
+        return dict(groups)
+
+    def scan(self, batch_size: int = DEFAULT_SCAN_BATCH_SIZE) \
+            -> typing.Iterator[typing.List[RowType]]:
+        return self.select(Query(), batch_size)
+
+    def build_cursor(self) -> IteratorCursor:
+        return IteratorCursor(row for batch in self.scan() for row in batch)
+
+    def next_row(self, cursor: typing.Optional[IteratorCursor] = None) \
+            -> typing.Tuple[IteratorCursor, RowType]:
+        return cursor, cursor.advance()
+
+    def save_snapshot(self, path: str) -> int:
+        """Save each partition into its own file, suffixed by its index."""
+        for partition in self._partitions:
+            partition.send('save_snapshot',
+                           '%s.%d' % (path, partition.index))
+        return sum(self._recv_all(self._partitions))
+
+    def load_snapshot(self, path: str) -> int:
+        for partition in self._partitions:
+            partition.send('load_snapshot',
+                           '%s.%d' % (path, partition.index))
+        return sum(self._recv_all(self._partitions))
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        stats = {'partitions': len(self._partitions)}
+        for partition, partition_stats in zip(self._partitions,
+                                              self._call_all('stats')):
+            for key, value in partition_stats.items():
+                stats['partition%d.%s' % (partition.index, key)] = value
+        return stats
+
+    def close(self):
+        super().close()
+        for partition in self._partitions:
+            partition.close()
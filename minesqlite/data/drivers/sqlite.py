@@ -0,0 +1,476 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+"""A driver storing the rows in a table of an sqlite3 database.
+
+The table is generated from the schema: a column per field, the primary key
+as its primary key, and an index on each field with the `index`, the
+`sorted_index` or the `bitmap_index` attribute (all of which are B-trees to
+sqlite). Dates are stored as day ordinals, absent values
+as NULL.
+
+The SQL of every operation is built once, so that the statement cache of
+`sqlite3` hands back the same prepared statement each time. Single-row
+writes autocommit; bulk writes (loading a snapshot) run in one explicit
+transaction. The database is in WAL mode, with `data.sqlite.synchronous`
+and `data.sqlite.cache_size` passed through as pragmas.
+
+`select` is translated into SQL: the filters, ranges and the key to resume
+after become the WHERE clause, the sorts the ORDER BY clause and the limit
+and offset the LIMIT clause, so none of them is done in Python. `count` is
+a `SELECT COUNT(*)` with the same WHERE clause. The plan of a query is
+left to sqlite, whose `EXPLAIN QUERY PLAN` is what `explain` shows.
+"""
+import contextlib
+import datetime
+import functools
+import os
+import sqlite3
+import typing
+
+from minesqlite import exceptions
+from minesqlite.common import utils
+from minesqlite.data import snapshot
+from minesqlite.data.base import (
+    DEFAULT_SCAN_BATCH_SIZE,
+    DataManagerABC,
+    IteratorCursor,
+    check_unique_pks,
+)
+from minesqlite.data.plan import Access, PlanNode, Project
+from minesqlite.data.query import Query
+from minesqlite.data.where import Node
+from minesqlite import MineSQLite
+
+PKType = typing.Any
+RowType = dict
+
+DEFAULT_PATH = 'data/minesqlite.db'
+DEFAULT_SYNCHRONOUS = 'NORMAL'
+# negative: in KiB rather than in pages
+DEFAULT_CACHE_SIZE = -16384
+SYNCHRONOUS_MODES = {'OFF', 'NORMAL', 'FULL', 'EXTRA'}
+
+TABLE = 'employees'
+# below the 999 parameters of a statement of the SQLite before 3.32
+READ_MANY_BATCH_SIZE = 500
+
+# type -> (column type, encoder, decoder), None meaning no conversion
+_COLUMN_TYPES = {
+    'integer': ('INTEGER', None, None),
+    'string': ('TEXT', None, None),
+    'date': ('INTEGER', datetime.datetime.toordinal,
+             datetime.datetime.fromordinal),
+}
+
+
+def _quote(identifier: str) -> str:
+    return '"%s"' % identifier.replace('"', '""')
+
+
+class SQLiteDataManager(DataManagerABC):
+    def __init__(self, instance: MineSQLite):
+        super().__init__(instance)
+        sysconf = instance.sysconf
+        path: str = utils.get_sysconf_or_default(
+            sysconf, 'data.sqlite.path', DEFAULT_PATH)
+        synchronous: str = utils.get_sysconf_or_default(
+            sysconf, 'data.sqlite.synchronous', DEFAULT_SYNCHRONOUS).upper()
+        cache_size: int = utils.get_sysconf_or_default(
+            sysconf, 'data.sqlite.cache_size', DEFAULT_CACHE_SIZE)
+        if synchronous not in SYNCHRONOUS_MODES:
+            raise exceptions.InternalError(
+                "invalid data.sqlite.synchronous: %s" % synchronous)
+
+        schema = instance.schema
+        self._fields: typing.List[str] = list(schema.fields)
+        self._encoders: typing.Dict[str, typing.Callable] = {}
+        self._decoders: typing.List[typing.Optional[typing.Callable]] = []
+        column_defs = []
+        for field in self._fields:
+            column_type, encoder, decoder = \
+                _COLUMN_TYPES[schema.get_field_type(field)]
+            if encoder is not None:
+                self._encoders[field] = encoder
+            self._decoders.append(decoder)
+            column_def = '%s %s' % (_quote(field), column_type)
+            if field == self.pk:
+                column_def += ' PRIMARY KEY NOT NULL'
+            column_defs.append(column_def)
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # autocommit, transactions are begun explicitly
+        self._conn = sqlite3.connect(path, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode = WAL')
+        self._conn.execute('PRAGMA synchronous = %s' % synchronous)
+        self._conn.execute('PRAGMA cache_size = %d' % cache_size)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS %s (%s)'
+                           % (_quote(TABLE), ', '.join(column_defs)))
+        for field in dict.fromkeys(schema.indexed_fields
+                                   + schema.sorted_indexed_fields
+                                   + schema.bitmap_indexed_fields):
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS %s ON %s (%s)'
+                % (_quote('%s_%s' % (TABLE, field)), _quote(TABLE),
+                   _quote(field)))
+
+        columns = ', '.join(map(_quote, self._fields))
+        pk = _quote(self.pk)
+        self._pk_index = self._fields.index(self.pk)
+        self._sql_select = 'SELECT %s FROM %s' % (columns, _quote(TABLE))
+        self._sql_read = '%s WHERE %s = ?' % (self._sql_select, pk)
+        self._sql_scan = '%s WHERE %s > ? ORDER BY %s LIMIT ?' \
+                         % (self._sql_select, pk, pk)
+        self._sql_scan_first = '%s ORDER BY %s LIMIT ?' \
+                               % (self._sql_select, pk)
+        self._sql_insert = 'INSERT INTO %s (%s) VALUES (%s)' \
+                           % (_quote(TABLE), columns,
+                              ', '.join('?' * len(self._fields)))
+        self._sql_delete = 'DELETE FROM %s WHERE %s = ?' % (_quote(TABLE), pk)
+        self._sql_delete_all = 'DELETE FROM %s' % _quote(TABLE)
+        self._sql_count = 'SELECT COUNT(*) FROM %s' % _quote(TABLE)
+        # fields updated -> sql
+        self._sql_updates: typing.Dict[typing.Tuple[str, ...], str] = {}
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        self._conn.execute('BEGIN')
+        try:
+            yield
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+        self._conn.execute('COMMIT')
+
+    def _check_fields(self, kvs: RowType):
+        unknown_fields = kvs.keys() - set(self._fields)
+        if unknown_fields:
+            raise exceptions.DataEntryInvalid(
+                reason="unexpected extra keys: %s"
+                       % ', '.join(sorted(unknown_fields)))
+
+    def _encode(self, field: str, value: typing.Any) -> typing.Any:
+        encoder = self._encoders.get(field)
+        if encoder is None or value is None:
+            return value
+        return encoder(value)
+
+    def _encode_row(self, pk: PKType, kvs: RowType) -> list:
+        values = [self._encode(field, kvs[field]) if field in kvs else None
+                  for field in self._fields]
+        values[self._pk_index] = pk
+        return values
+
+    def _build_row(self, values: typing.Sequence,
+                   fields: typing.Optional[typing.Sequence[str]] = None,
+                   decoders: typing.Optional[typing.Sequence] = None) \
+            -> RowType:
+        """The row of the values of `fields` (with their `decoders`), all
+        the fields by default."""
+        if fields is None:
+            fields, decoders = self._fields, self._decoders
+        row = {}
+        for field, decoder, value in zip(fields, decoders, values):
+            if value is not None:
+                row[field] = value if decoder is None else decoder(value)
+        return row
+
+    def _get(self, pk: PKType) -> RowType:
+        values = self._conn.execute(self._sql_read, (pk,)).fetchone()
+        if values is None:
+            raise exceptions.DataEntryNotFound(field=self.pk, value=pk)
+        return self._build_row(values)
+
+    def create_one(self, pk: PKType, kvs: RowType) -> RowType:
+        self._check_fields(kvs)
+        try:
+            self._conn.execute(self._sql_insert, self._encode_row(pk, kvs))
+        except sqlite3.IntegrityError as e:
+            raise exceptions.DataDuplicateEntry(
+                field=self.pk, value=pk) from e
+        row = kvs.copy()
+        row[self.pk] = pk
+        return row
+
+    def create_many(self, entries: typing.Sequence[typing.Tuple[PKType,
+                                                                RowType]]) \
+            -> int:
+        """Insert all the rows in a single transaction."""
+        check_unique_pks(self.pk, entries)
+        for _, kvs in entries:
+            self._check_fields(kvs)
+        try:
+            with self._transaction():
+                self._conn.executemany(
+                    self._sql_insert,
+                    (self._encode_row(pk, kvs) for pk, kvs in entries))
+        except sqlite3.IntegrityError as e:
+            existing = self._existing_pks([pk for pk, _ in entries])
+            if not existing:
+                raise exceptions.DataEntryInvalid(reason=str(e)) from e
+            raise exceptions.DataDuplicateEntry(
+                field=self.pk, value=existing[0]) from e
+        return len(entries)
+
+    def _existing_pks(self, pks: typing.Sequence[PKType]) -> list:
+        """The ones of the primary keys which are in the table."""
+        existing = set()
+        for start in range(0, len(pks), READ_MANY_BATCH_SIZE):
+            batch = pks[start:start + READ_MANY_BATCH_SIZE]
+            existing.update(pk for pk, in self._conn.execute(
+                'SELECT %s FROM %s WHERE %s IN (%s)' % (
+                    _quote(self.pk), _quote(TABLE), _quote(self.pk),
+                    ', '.join('?' * len(batch))), batch))
+        return [pk for pk in pks if pk in existing]
+
+    def read_one(self, pk: PKType) -> RowType:
+        return self._get(pk)
+
+    def read_many(self, pks: typing.Sequence[PKType]) -> typing.List[RowType]:
+        rows = {}
+        for start in range(0, len(pks), READ_MANY_BATCH_SIZE):
+            batch = pks[start:start + READ_MANY_BATCH_SIZE]
+            for values in self._conn.execute(
+                    '%s WHERE %s IN (%s)' % (self._sql_select,
+                                             _quote(self.pk),
+                                             ', '.join('?' * len(batch))),
+                    batch):
+                rows[values[self._pk_index]] = self._build_row(values)
+        for pk in pks:
+            if pk not in rows:
+                raise exceptions.DataEntryNotFound(field=self.pk, value=pk)
+        return [rows[pk] for pk in pks]
+
+    def update_one(self, pk: PKType, kvs: RowType) -> RowType:
+        self._check_fields(kvs)
+        if self.pk in kvs:
+            raise exceptions.DataEntryInvalid(
+                reason="cannot modify primary key `%s`" % self.pk)
+        fields = tuple(kvs)
+        sql = self._sql_updates.get(fields)
+        if sql is None:
+            sql = 'UPDATE %s SET %s WHERE %s = ?' % (
+                _quote(TABLE),
+                ', '.join('%s = ?' % _quote(field) for field in fields),
+                _quote(self.pk))
+            self._sql_updates[fields] = sql
+        params = [self._encode(field, kvs[field]) for field in fields]
+        params.append(pk)
+        if not self._conn.execute(sql, params).rowcount:
+            raise exceptions.DataEntryNotFound(field=self.pk, value=pk)
+        return self._get(pk)
+
+    def delete_one(self, pk: PKType) -> RowType:
+        with self._transaction():
+            row = self._get(pk)
+            self._conn.execute(self._sql_delete, (pk,))
+        return row
+
+    def scan(self, batch_size: int = DEFAULT_SCAN_BATCH_SIZE) \
+            -> typing.Iterator[typing.List[RowType]]:
+        """Yield the rows by primary key, seeking past the last one each time.
+
+        No statement is left open between the batches, hence the table may
+        be modified meanwhile.
+        """
+        batch = self._conn.execute(self._sql_scan_first,
+                                   (batch_size,)).fetchall()
+        while batch:
+            last_pk = batch[-1][self._pk_index]
+            yield list(map(self._build_row, batch))
+            batch = self._conn.execute(self._sql_scan,
+                                       (last_pk, batch_size)).fetchall()
+
+    def build_cursor(self) -> IteratorCursor:
+        return IteratorCursor(row for batch in self.scan() for row in batch)
+
+    def next_row(self, cursor: typing.Optional[IteratorCursor] = None) \
+            -> typing.Tuple[IteratorCursor, RowType]:
+        return cursor, cursor.advance()
+
+    def _build_where(self, query: Query) -> typing.Tuple[str, list]:
+        """The WHERE clause (and its parameters) of the filters, ranges and
+        `$where`."""
+        conditions, params = [], []
+        for field, value in query.filters.items():
+            conditions.append('%s = ?' % _quote(field))
+            params.append(self._encode(field, value))
+        for field, range_ in query.ranges.items():
+            if range_.lower is not None:
+                conditions.append('%s %s ?' % (
+                    _quote(field), '>=' if range_.lower_inclusive else '>'))
+                params.append(self._encode(field, range_.lower))
+            if range_.upper is not None:
+                conditions.append('%s %s ?' % (
+                    _quote(field), '<=' if range_.upper_inclusive else '<'))
+                params.append(self._encode(field, range_.upper))
+        if query.where is not None:
+            conditions.append(self._build_expression(query.where.node,
+                                                     params))
+        if query.after is not None:
+            condition, after_params = self._build_after(query)
+            conditions.append(condition)
+            params.extend(after_params)
+        if not conditions:
+            return '', params
+        return ' WHERE ' + ' AND '.join(conditions), params
+
+    def _build_expression(self, node: Node, params: list) -> str:
+        """The condition of a `$where` node, appending its parameters."""
+        kind = node[0]
+        if kind == 'const':
+            return '1' if node[1] else '0'
+        if kind in ('and', 'or'):
+            return '(%s)' % (' %s ' % kind.upper()).join(
+                self._build_expression(child, params) for child in node[1])
+        if kind == 'not':
+            return '(NOT %s)' % self._build_expression(node[1], params)
+        field = node[1]
+        if kind == 'range':
+            range_ = node[2]
+            conditions = []
+            if range_.lower is not None:
+                conditions.append('%s %s ?' % (
+                    _quote(field), '>=' if range_.lower_inclusive else '>'))
+                params.append(self._encode(field, range_.lower))
+            if range_.upper is not None:
+                conditions.append('%s %s ?' % (
+                    _quote(field), '<=' if range_.upper_inclusive else '<'))
+                params.append(self._encode(field, range_.upper))
+            return '(%s)' % ' AND '.join(conditions)
+        if kind in ('in', 'not_in'):
+            # sorted, for the same SQL whatever the order of the set
+            values = sorted(node[2])
+            params.extend(self._encode(field, value) for value in values)
+            return '%s %s (%s)' % (_quote(field),
+                                   'IN' if kind == 'in' else 'NOT IN',
+                                   ', '.join('?' * len(values)))
+        params.append(self._encode(field, node[2]))
+        return '%s %s ?' % (_quote(field), '=' if kind == 'eq' else '!=')
+
+    def _build_after(self, query: Query) -> typing.Tuple[str, list]:
+        """The condition keeping the rows after the sort key `after`:
+        greater on the first field, or equal on it and greater on the
+        second one, and so on (lower for the descending ones).
+
+        The OR does not tell sqlite which range of an index on the first
+        field to walk, hence the redundant bound on it ahead."""
+        first, reverse = query.sorts[0]
+        bound = '%s %s ?' % (_quote(first), '<=' if reverse else '>=')
+        alternatives, params = [], [self._encode(first, query.after[0])]
+        for i, ((field, reverse), value) in enumerate(zip(query.sorts,
+                                                          query.after)):
+            terms = ['%s = ?' % _quote(prior)
+                     for prior, _ in query.sorts[:i]]
+            terms.append('%s %s ?' % (_quote(field), '<' if reverse else '>'))
+            alternatives.append('(%s)' % ' AND '.join(terms))
+            params.extend(self._encode(prior, prior_value)
+                          for (prior, _), prior_value
+                          in zip(query.sorts[:i], query.after))
+            params.append(self._encode(field, value))
+        return '%s AND (%s)' % (bound, ' OR '.join(alternatives)), params
+
+    def build_sql(self, query: Query) -> typing.Tuple[str, list]:
+        """The SQL (and its parameters) selecting what the query asks for."""
+        where, params = self._build_where(query)
+        sql = self._sql_select
+        if query.columns is not None:
+            sql = 'SELECT %s FROM %s' % (', '.join(map(_quote, query.columns)),
+                                         _quote(TABLE))
+        sql += where
+        if query.sorts:
+            sql += ' ORDER BY ' + ', '.join(
+                _quote(field) + (' DESC' if reverse else '')
+                for field, reverse in query.sorts)
+        if query.limit is not None or query.offset:
+            # a negative limit stands for none
+            sql += ' LIMIT ?'
+            params.append(-1 if query.limit is None else query.limit)
+        if query.offset:
+            sql += ' OFFSET ?'
+            params.append(query.offset)
+        return sql, params
+
+    def select(self, query: Query,
+               batch_size: int = DEFAULT_SCAN_BATCH_SIZE) \
+            -> typing.Iterator[typing.List[RowType]]:
+        build_row = self._build_row
+        if query.columns is not None:
+            build_row = functools.partial(
+                self._build_row, fields=query.columns,
+                decoders=[self._decoders[self._fields.index(field)]
+                          for field in query.columns])
+        cursor = self._conn.execute(*self.build_sql(query))
+        try:
+            while True:
+                batch = cursor.fetchmany(batch_size)
+                if not batch:
+                    return
+                yield list(map(build_row, batch))
+        finally:
+            cursor.close()
+
+    def plan(self, query: Query) -> PlanNode:
+        sql, params = self.build_sql(query)
+        steps = self._conn.execute('EXPLAIN QUERY PLAN ' + sql,
+                                   params).fetchall()
+        detail = '; '.join(step[-1] for step in steps)
+        return Project(Access('sqlite', functools.partial(self.select, query),
+                              detail=detail), query, pushed_down=True)
+
+    def count(self, query: Query) -> int:
+        where, params = self._build_where(query)
+        count = self._conn.execute(self._sql_count + where,
+                                   params).fetchone()[0]
+        return query.clip(count)
+
+    def aggregate(self, query: Query, group_by: typing.Sequence[str]) \
+            -> typing.Dict[tuple, int]:
+        self._check_fields(dict.fromkeys(group_by))
+        columns = ', '.join(map(_quote, group_by))
+        where, params = self._build_where(query)
+        sql = 'SELECT %s, COUNT(*) FROM %s%s GROUP BY %s' % (
+            columns, _quote(TABLE), where, columns)
+        decoders = [self._decoders[self._fields.index(field)]
+                    for field in group_by]
+        groups = {}
+        for values in self._conn.execute(sql, params):
+            key = tuple(value if decoder is None or value is None
+                        else decoder(value)
+                        for decoder, value in zip(decoders, values))
+            groups[key] = values[-1]
+        return groups
+
+    def save_snapshot(self, path: str) -> int:
+        fields = [field for field in self._fields if field != self.pk]
+        entries = ((row[self.pk], [row.get(field) for field in fields])
+                   for batch in self.scan() for row in batch)
+        count = self._conn.execute(self._sql_count).fetchone()[0]
+        with utils.gc_paused():
+            snapshot.write_snapshot(path, fields, entries, count)
+        return count
+
+    def load_snapshot(self, path: str) -> int:
+        count = 0
+        with self._transaction(), utils.gc_paused():
+            self._conn.execute(self._sql_delete_all)
+            for fields, (pks, rows) in snapshot.read_snapshot(path):
+                self._check_fields(dict.fromkeys(fields))
+                self._conn.executemany(self._sql_insert, (
+                    self._encode_row(pk, dict(zip(fields, values)))
+                    for pk, values in zip(pks, rows)))
+                count += len(pks)
+        return count
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        pragma = self._conn.execute
+        return {
+            'rows': pragma(self._sql_count).fetchone()[0],
+            'pages': pragma('PRAGMA page_count').fetchone()[0],
+            'page_size': pragma('PRAGMA page_size').fetchone()[0],
+        }
+
+    def close(self):
+        super().close()
+        self._conn.close()
@@ -0,0 +1,293 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+"""An in-memory driver within a memory budget, spilling cold rows to disk.
+
+The rows are kept as records (see `row`) in an LRU-ordered dict, as long as
+their estimated size stays within `data.memory.max_bytes`. Beyond that, the
+least recently used ones are evicted into a spill file, and faulted back
+into memory the next time they are read or modified. A row faulted back
+keeps its copy in the spill file, hence evicting it again costs no write
+unless it has been modified meanwhile.
+
+Scans and cursors read the spilled rows straight from the spill file
+without promoting them, so that one full scan does not flush all the hot
+rows out of memory.
+
+The spill file is scratch space, emptied on startup: use snapshots to
+persist the rows. The primary keys of the spilled rows, along with their
+location in the spill file, are kept in memory and are not counted within
+the budget.
+"""
+import collections
+import os
+import sys
+import typing
+
+from minesqlite import exceptions
+from minesqlite.common import utils
+from minesqlite.data import codec, snapshot
+from minesqlite.data.base import (
+    DEFAULT_SCAN_BATCH_SIZE,
+    DataManagerABC,
+    IteratorCursor,
+)
+from minesqlite.data.row import RecordType, RowLayout, RowView
+from minesqlite import MineSQLite
+
+PKType = typing.Any
+RowType = dict
+
+DEFAULT_SPILL_PATH = 'data/spill.bin'
+# the spill file is compacted once it is mostly garbage
+COMPACTION_MIN_BYTES = 1 << 20
+
+# a location in the spill file, packed into an int as `offset << 32 | size`
+_SIZE_BITS = 32
+_SIZE_MASK = (1 << _SIZE_BITS) - 1
+
+
+def record_size(record: RecordType) -> int:
+    """The estimated memory footprint of a record."""
+    return sys.getsizeof(record) + sum(map(sys.getsizeof, record))
+
+
+class TieredDataManager(DataManagerABC):
+    def __init__(self, instance: MineSQLite):
+        super().__init__(instance)
+        sysconf = instance.sysconf
+        # 0 stands for no budget at all
+        self._max_bytes: int = utils.get_sysconf_or_default(
+            sysconf, 'data.memory.max_bytes', 0)
+        self._spill_path: str = utils.get_sysconf_or_default(
+            sysconf, 'data.tiered.spill_path', DEFAULT_SPILL_PATH)
+
+        self._layout = RowLayout(instance.schema.fields,
+                                 instance.schema.primary_key)
+        # pk -> record, from the least to the most recently used
+        self._hot: typing.OrderedDict[PKType, RecordType] = \
+            collections.OrderedDict()
+        self._hot_bytes = 0
+        # pk -> location of its latest record in the spill file
+        self._cold: typing.Dict[PKType, int] = {}
+        self._num_rows = 0
+        self._counters = collections.Counter(
+            hits=0, misses=0, evictions=0, spill_writes=0, spill_reads=0,
+            compactions=0)
+
+        directory = os.path.dirname(self._spill_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._spill_fd = os.open(self._spill_path,
+                                 os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        self._spill_bytes = 0
+        self._garbage_bytes = 0
+
+        snapshot_path: str = utils.get_sysconf_or_default(
+            sysconf, 'data.snapshot.path', '')
+        if snapshot_path and os.path.exists(snapshot_path):
+            self.load_snapshot(snapshot_path)
+
+    def _spill(self, record: RecordType) -> int:
+        """Append a record to the spill file, returning its location."""
+        data = codec.pack_record(record)
+        offset = self._spill_bytes
+        os.pwrite(self._spill_fd, data, offset)
+        self._spill_bytes += len(data)
+        self._counters['spill_writes'] += 1
+        return offset << _SIZE_BITS | len(data)
+
+    def _unspill(self, location: int) -> RecordType:
+        """Read a record back from the spill file."""
+        offset, size = location >> _SIZE_BITS, location & _SIZE_MASK
+        data = os.pread(self._spill_fd, size, offset)
+        self._counters['spill_reads'] += 1
+        return next(codec.iter_records(data))[1]
+
+    def _discard_spilled(self, pk: PKType):
+        """Forget the copy of a row in the spill file, if any."""
+        location = self._cold.pop(pk, None)
+        if location is None:
+            return
+        self._garbage_bytes += location & _SIZE_MASK
+        if self._garbage_bytes >= COMPACTION_MIN_BYTES \
+                and self._garbage_bytes * 2 >= self._spill_bytes:
+            self._compact()
+
+    def _compact(self):
+        """Rewrite the spill file with the live records only."""
+        tmp_path = self._spill_path + '.tmp'
+        old_fd, old_cold = self._spill_fd, self._cold
+        self._spill_fd = os.open(tmp_path,
+                                 os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        self._spill_bytes = self._garbage_bytes = 0
+        self._cold = {}
+        for pk, location in old_cold.items():
+            offset, size = location >> _SIZE_BITS, location & _SIZE_MASK
+            data = os.pread(old_fd, size, offset)
+            os.pwrite(self._spill_fd, data, self._spill_bytes)
+            self._cold[pk] = self._spill_bytes << _SIZE_BITS | size
+            self._spill_bytes += size
+        os.close(old_fd)
+        os.replace(tmp_path, self._spill_path)
+        self._counters['compactions'] += 1
+
+    def _evict(self):
+        """Evict the least recently used rows until within the budget.
+
+        The most recently used row always stays, even if it alone exceeds
+        the budget.
+        """
+        if not self._max_bytes:
+            return
+        while self._hot_bytes > self._max_bytes and len(self._hot) > 1:
+            pk, record = self._hot.popitem(last=False)
+            self._hot_bytes -= record_size(record)
+            if pk not in self._cold:
+                self._cold[pk] = self._spill(record)
+            self._counters['evictions'] += 1
+
+    def _put(self, pk: PKType, record: RecordType):
+        """Put a modified record into memory, as the most recently used."""
+        self._discard_spilled(pk)
+        old = self._hot.pop(pk, None)
+        if old is not None:
+            self._hot_bytes -= record_size(old)
+        self._hot[pk] = record
+        self._hot_bytes += record_size(record)
+        self._evict()
+
+    def _get(self, pk: PKType) -> RecordType:
+        """Get a record, faulting it into memory if it has been spilled."""
+        record = self._hot.get(pk)
+        if record is not None:
+            self._hot.move_to_end(pk)
+            self._counters['hits'] += 1
+            return record
+
+        location = self._cold.get(pk)
+        if location is None:
+            raise exceptions.DataEntryNotFound(field=self.pk, value=pk)
+        self._counters['misses'] += 1
+        record = self._unspill(location)
+        self._hot[pk] = record
+        self._hot_bytes += record_size(record)
+        self._evict()
+        return record
+
+    def _contains(self, pk: PKType) -> bool:
+        return pk in self._hot or pk in self._cold
+
+    def create_one(self, pk: PKType, kvs: RowType) -> RowType:
+        record = self._layout.pack(pk, kvs)
+        if self._contains(pk):
+            raise exceptions.DataDuplicateEntry(field=self.pk, value=pk)
+        self._put(pk, record)
+        self._num_rows += 1
+        return RowView(self._layout, record)
+
+    def read_one(self, pk: PKType) -> RowType:
+        return RowView(self._layout, self._get(pk))
+
+    def update_one(self, pk: PKType, kvs: RowType) -> RowType:
+        if self.pk in kvs:
+            raise exceptions.DataEntryInvalid(
+                reason="cannot modify primary key `%s`" % self.pk)
+        record = self._layout.replace(self._get(pk), kvs)
+        self._put(pk, record)
+        return RowView(self._layout, record)
+
+    def delete_one(self, pk: PKType) -> RowType:
+        if not self._contains(pk):
+            raise exceptions.DataEntryNotFound(field=self.pk, value=pk)
+        record = self._hot.pop(pk, None)
+        if record is not None:
+            self._hot_bytes -= record_size(record)
+        else:
+            record = self._unspill(self._cold[pk])
+        self._discard_spilled(pk)
+        self._num_rows -= 1
+        return RowView(self._layout, record)
+
+    def _iter_pks(self) -> typing.List[PKType]:
+        pks = list(self._hot)
+        pks.extend(pk for pk in self._cold if pk not in self._hot)
+        return pks
+
+    def scan(self, batch_size: int = DEFAULT_SCAN_BATCH_SIZE) \
+            -> typing.Iterator[typing.List[RowType]]:
+        """Yield the rows known at the start, skipping the deleted ones.
+
+        Spilled rows are read from the spill file, but not promoted.
+        """
+        layout = self._layout
+        pks = self._iter_pks()
+        for start in range(0, len(pks), batch_size):
+            batch = []
+            for pk in pks[start:start + batch_size]:
+                record = self._hot.get(pk)
+                if record is None:
+                    location = self._cold.get(pk)
+                    if location is None:
+                        continue
+                    record = self._unspill(location)
+                batch.append(RowView(layout, record))
+            if batch:
+                yield batch
+
+    def build_cursor(self) -> IteratorCursor:
+        return IteratorCursor(row for batch in self.scan() for row in batch)
+
+    def next_row(self, cursor: typing.Optional[IteratorCursor] = None) \
+            -> typing.Tuple[IteratorCursor, RowType]:
+        return cursor, cursor.advance()
+
+    def _reset(self):
+        self._hot.clear()
+        self._hot_bytes = 0
+        self._cold.clear()
+        self._num_rows = 0
+        os.ftruncate(self._spill_fd, 0)
+        self._spill_bytes = self._garbage_bytes = 0
+
+    def save_snapshot(self, path: str) -> int:
+        layout = self._layout
+        fields = [field for field in layout.fields if field != self.pk]
+        value_indexes = [layout.indexes[field] for field in fields]
+        records = (record for batch in self.scan()
+                   for record in map(layout.record_of, batch))
+        entries = ((record[layout.pk_index],
+                    [record[i] for i in value_indexes])
+                   for record in records)
+        with utils.gc_paused():
+            snapshot.write_snapshot(path, fields, entries, self._num_rows)
+        return self._num_rows
+
+    def load_snapshot(self, path: str) -> int:
+        # read it all first, not to be left half-loaded by a bad file
+        with utils.gc_paused():
+            chunks = list(snapshot.read_snapshot(path))
+        self._reset()
+        for fields, (pks, rows) in chunks:
+            for pk, row in zip(pks, rows):
+                self._put(pk, self._layout.pack(pk, dict(zip(fields, row))))
+                self._num_rows += 1
+        return self._num_rows
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        stats = {
+            'rows': self._num_rows,
+            'hot_rows': len(self._hot),
+            'hot_bytes': self._hot_bytes,
+            'max_bytes': self._max_bytes,
+            'spill_bytes': self._spill_bytes,
+            'spill_garbage_bytes': self._garbage_bytes,
+        }
+        stats.update(self._counters)
+        return stats
+
+    def close(self):
+        super().close()
+        if self._spill_fd < 0:
+            return
+        os.close(self._spill_fd)
+        self._spill_fd = -1
@@ -0,0 +1,513 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+"""Secondary indexes over the fields declared with `attribute: index`,
+`attribute: sorted_index` or `attribute: bitmap_index`.
+
+A hash index maps each value of its field to the set of primary keys of the
+rows holding that value, hence an equality filter on the field is answered
+without looking at the other rows. When a query filters on several indexed
+fields, the smallest of their sets is taken as the candidates, and the
+other filters are verified on the candidate rows only.
+
+A sorted index keeps the `(value, pk)` keys of its field in order, in a
+list of sorted buckets of a bounded size, so that an insertion moves
+a bucket rather than the whole index. It serves the ranges on the field,
+and the rows ordered by it.
+
+A bitmap index is meant for the fields with few distinct values: each value
+has a bitset of the slots (dense row ids, see `memory_dict`) of the rows
+holding it, one bit per slot, in a mutable bytearray. The equality filters
+on several such fields are combined by a bitwise AND of their bitsets, as
+Python ints, before any row is looked at, and the rows matching them are
+counted by a popcount.
+
+Absent values (see `row.MISSING`) are not indexed: no filter matches them.
+"""
+import bisect
+import itertools
+import re
+import sys
+import typing
+
+from minesqlite.data.query import Range
+from minesqlite.data.row import MISSING, RecordType, RowLayout
+
+PKType = typing.Any
+
+KeyType = typing.Tuple[typing.Any, PKType]
+
+_EMPTY: typing.FrozenSet = frozenset()
+# a position in a sorted index: (bucket, index within the bucket)
+_PositionType = typing.Tuple[int, int]
+
+
+class _Top(object):
+    """Greater than anything else."""
+
+    def __gt__(self, other) -> bool:
+        return self is not other
+
+    def __lt__(self, other) -> bool:
+        return False
+
+
+_TOP = _Top()
+
+
+class HashIndex(object):
+    def __init__(self, field: str):
+        self.field = field
+        self._pks: typing.Dict[typing.Any, typing.Set[PKType]] = {}
+
+    def __len__(self) -> int:
+        """The number of distinct values."""
+        return len(self._pks)
+
+    def add(self, value: typing.Any, pk: PKType):
+        if value is MISSING:
+            return
+        pks = self._pks.get(value)
+        if pks is None:
+            self._pks[value] = {pk}
+        else:
+            pks.add(pk)
+
+    def discard(self, value: typing.Any, pk: PKType):
+        pks = self._pks.get(value)
+        if pks is None:
+            return
+        pks.discard(pk)
+        if not pks:
+            del self._pks[value]
+
+    def lookup(self, value: typing.Any) -> typing.AbstractSet[PKType]:
+        """The pks of the rows holding the value, not to be modified."""
+        return self._pks.get(value, _EMPTY)
+
+    def clear(self):
+        self._pks.clear()
+
+
+class SortedIndex(object):
+    # a bucket is split once it holds twice as many keys
+    BUCKET_SIZE = 512
+
+    def __init__(self, field: str):
+        self.field = field
+        self._buckets: typing.List[typing.List[KeyType]] = []
+        # the last key of each bucket
+        self._maxes: typing.List[KeyType] = []
+        self._len = 0
+
+    def __len__(self) -> int:
+        """The number of keys."""
+        return self._len
+
+    def add(self, value: typing.Any, pk: PKType):
+        if value is MISSING:
+            return
+        key = (value, pk)
+        self._len += 1
+        if not self._buckets:
+            self._buckets.append([key])
+            self._maxes.append(key)
+            return
+        i = min(bisect.bisect_left(self._maxes, key), len(self._maxes) - 1)
+        bucket = self._buckets[i]
+        bisect.insort(bucket, key)
+        self._maxes[i] = bucket[-1]
+        if len(bucket) > 2 * self.BUCKET_SIZE:
+            half = self.BUCKET_SIZE
+            self._buckets[i:i + 1] = [bucket[:half], bucket[half:]]
+            self._maxes[i:i + 1] = [bucket[half - 1], bucket[-1]]
+
+    def discard(self, value: typing.Any, pk: PKType):
+        key = (value, pk)
+        i = bisect.bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            return
+        bucket = self._buckets[i]
+        j = bisect.bisect_left(bucket, key)
+        if j == len(bucket) or bucket[j] != key:
+            return
+        del bucket[j]
+        self._len -= 1
+        if bucket:
+            self._maxes[i] = bucket[-1]
+        else:
+            del self._buckets[i]
+            del self._maxes[i]
+
+    def update(self, keys: typing.Iterable[KeyType]):
+        """Add many keys: one by one when they are few compared with the
+        keys held, otherwise merged with them by a single sort."""
+        keys = [key for key in keys if key[0] is not MISSING]
+        if len(keys) * 8 < self._len:
+            for value, pk in keys:
+                self.add(value, pk)
+            return
+        self.load(itertools.chain(
+            itertools.chain.from_iterable(self._buckets), keys))
+
+    def load(self, keys: typing.Iterable[KeyType]):
+        """Replace all the keys at once."""
+        keys = sorted(key for key in keys if key[0] is not MISSING)
+        size = self.BUCKET_SIZE
+        self._buckets = [keys[i:i + size] for i in range(0, len(keys), size)]
+        self._maxes = [bucket[-1] for bucket in self._buckets]
+        self._len = len(keys)
+
+    def clear(self):
+        self.load(())
+
+    def _position(self, target: typing.Any, right: bool,
+                  by_value: bool) -> _PositionType:
+        """Where `target` (a value, or a key) would be inserted."""
+        search = bisect.bisect_right if right else bisect.bisect_left
+        if by_value:
+            # a key before, or after, all the keys of the value
+            target = (target, _TOP) if right else (target,)
+        i = search(self._maxes, target)
+        if i == len(self._maxes):
+            return i, 0
+        return i, search(self._buckets[i], target)
+
+    def _bounds(self, range_: typing.Optional[Range]) \
+            -> typing.Tuple[_PositionType, _PositionType]:
+        """The positions of the first key within the range and past the
+        last one."""
+        start, stop = (0, 0), (len(self._buckets), 0)
+        if range_ is not None and range_.lower is not None:
+            start = self._position(range_.lower,
+                                   not range_.lower_inclusive, True)
+        if range_ is not None and range_.upper is not None:
+            stop = self._position(range_.upper, range_.upper_inclusive, True)
+        return start, stop
+
+    def _rank(self, position: _PositionType) -> int:
+        """The number of keys before a position."""
+        i, j = position
+        return sum(map(len, itertools.islice(self._buckets, i))) + j
+
+    def count(self, range_: typing.Optional[Range] = None) -> int:
+        """The number of keys within the range."""
+        start, stop = self._bounds(range_)
+        return max(self._rank(stop) - self._rank(start), 0)
+
+    def keys(self, range_: typing.Optional[Range] = None,
+             reverse: bool = False, after: typing.Optional[KeyType] = None,
+             limit: typing.Optional[int] = None) -> typing.List[KeyType]:
+        """The keys within the range, in order, from the one after `after`.
+
+        Hence the keys can be walked through chunk by chunk, by passing the
+        last one of each chunk as `after` for the next one.
+        """
+        start, stop = self._bounds(range_)
+        if after is not None and not reverse:
+            start = max(start, self._position(after, True, False))
+        elif after is not None:
+            stop = min(stop, self._position(after, False, False))
+        if limit is None:
+            limit = sys.maxsize
+
+        keys = []
+        if not reverse:
+            i, j = start
+            while (i, j) < stop and len(keys) < limit:
+                bucket = self._buckets[i]
+                end = stop[1] if i == stop[0] else len(bucket)
+                keys.extend(bucket[j:min(end, j + limit - len(keys))])
+                i, j = i + 1, 0
+        else:
+            i, j = stop
+            while (i, j) > start and len(keys) < limit:
+                if j == 0:
+                    i -= 1
+                    j = len(self._buckets[i])
+                    continue
+                bucket = self._buckets[i]
+                begin = start[1] if i == start[0] else 0
+                n = min(j - begin, limit - len(keys))
+                keys.extend(reversed(bucket[j - n:j]))
+                j -= n
+        return keys
+
+
+_NONZERO_BYTE = re.compile(b'[^\x00]')
+# byte -> the positions of its set bits
+_BYTE_BITS = [tuple(bit for bit in range(8) if byte >> bit & 1)
+              for byte in range(256)]
+
+
+def popcount(bitmap: int) -> int:
+    """The number of set bits of a bitmap (`int.bit_count` is 3.10+)."""
+    return bin(bitmap).count('1')
+
+
+def bitmap_positions(bitmap: int) -> typing.List[int]:
+    """The positions of the set bits of a bitmap, in increasing order."""
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    positions = []
+    for match in _NONZERO_BYTE.finditer(data):
+        offset = match.start()
+        base = offset << 3
+        positions.extend(base + bit for bit in _BYTE_BITS[data[offset]])
+    return positions
+
+
+class BitmapIndex(object):
+    def __init__(self, field: str):
+        self.field = field
+        self._bitmaps: typing.Dict[typing.Any, bytearray] = {}
+        # value -> the number of bits set in its bitmap
+        self._counts: typing.Dict[typing.Any, int] = {}
+
+    def __len__(self) -> int:
+        """The number of distinct values."""
+        return len(self._bitmaps)
+
+    def add(self, value: typing.Any, slot: int):
+        if value is MISSING:
+            return
+        bitmap = self._bitmaps.get(value)
+        if bitmap is None:
+            bitmap = self._bitmaps[value] = bytearray()
+            self._counts[value] = 0
+        offset = slot >> 3
+        if offset >= len(bitmap):
+            # grow geometrically, as the slots are mostly appended
+            bitmap.extend(bytes(max(offset + 1 - len(bitmap), len(bitmap))))
+        bit = 1 << (slot & 7)
+        if not bitmap[offset] & bit:
+            bitmap[offset] |= bit
+            self._counts[value] += 1
+
+    def discard(self, value: typing.Any, slot: int):
+        bitmap = self._bitmaps.get(value)
+        offset = slot >> 3
+        if bitmap is None or offset >= len(bitmap):
+            return
+        bit = 1 << (slot & 7)
+        if not bitmap[offset] & bit:
+            return
+        bitmap[offset] &= ~bit
+        self._counts[value] -= 1
+        if not self._counts[value]:
+            del self._bitmaps[value]
+            del self._counts[value]
+
+    def lookup(self, value: typing.Any) -> int:
+        """The bitmap of the value, as an int."""
+        bitmap = self._bitmaps.get(value)
+        if bitmap is None:
+            return 0
+        return int.from_bytes(bitmap, 'little')
+
+    def count(self, value: typing.Any) -> int:
+        return self._counts.get(value, 0)
+
+    def counts(self) -> typing.Dict[typing.Any, int]:
+        """The number of rows holding each value, kept up to date by `add`
+        and `discard` rather than counted."""
+        return dict(self._counts)
+
+    def nbytes(self) -> int:
+        return sum(map(len, self._bitmaps.values()))
+
+    def clear(self):
+        self._bitmaps.clear()
+        self._counts.clear()
+
+
+class BitmapIndexes(object):
+    """The bitmap indexes of a table of records addressed by slots.
+
+    Like `RecordIndexes`, it is up to the driver to serialize the calls with
+    its writes.
+    """
+
+    def __init__(self, layout: RowLayout, fields: typing.Iterable[str]):
+        self._indexes: typing.Dict[str, typing.Tuple[int, BitmapIndex]] = {
+            field: (layout.indexes[field], BitmapIndex(field))
+            for field in fields}
+
+    def insert(self, slot: int, record: RecordType):
+        for i, index in self._indexes.values():
+            index.add(record[i], slot)
+
+    def remove(self, slot: int, record: RecordType):
+        for i, index in self._indexes.values():
+            index.discard(record[i], slot)
+
+    def replace(self, slot: int, old: RecordType, new: RecordType):
+        for i, index in self._indexes.values():
+            if old[i] != new[i]:
+                index.discard(old[i], slot)
+                index.add(new[i], slot)
+
+    def rebuild(self, records: typing.Sequence[typing.Optional[RecordType]]):
+        """Rebuild from all the records by slot, None for the empty slots."""
+        for i, index in self._indexes.values():
+            index.clear()
+            for slot, record in enumerate(records):
+                if record is not None:
+                    index.add(record[i], slot)
+
+    def covers(self, filters: typing.Mapping[str, typing.Any]) -> bool:
+        """Whether all the filters are on fields with a bitmap index."""
+        return all(field in self._indexes for field in filters)
+
+    def count(self, filters: typing.Mapping[str, typing.Any]) \
+            -> typing.Optional[int]:
+        """The number of rows matching the filters on bitmap-indexed fields,
+        None if none is."""
+        fields = [field for field in filters if field in self._indexes]
+        if not fields:
+            return None
+        if len(fields) == 1:
+            # no need to build an int for a single filter
+            field = fields[0]
+            return self._indexes[field][1].count(filters[field])
+        return popcount(self.lookup(filters))
+
+    def group(self, fields: typing.Sequence[str],
+              filters: typing.Mapping[str, typing.Any]) \
+            -> typing.Dict[tuple, int]:
+        """The number of rows matching the filters by the values of the
+        fields (as a tuple), all of which must be bitmap-indexed.
+
+        Without any filter, the counts of a single field are at hand, in
+        O(values). Otherwise it is the popcount of the AND of the bitmaps,
+        for every combination of values found in the rows matching so far.
+        """
+        indexes = [self._indexes[field][1] for field in fields]
+        if not filters and len(indexes) == 1:
+            return {(value,): count
+                    for value, count in indexes[0].counts().items()}
+        groups = {}
+        # (values so far, their bitmap: None for all the rows)
+        stack = [((), self.lookup(filters) if filters else None)]
+        while stack:
+            values, bitmap = stack.pop()
+            index = indexes[len(values)]
+            last = len(values) + 1 == len(indexes)
+            for value in index.counts():
+                value_bitmap = index.lookup(value)
+                if bitmap is not None:
+                    value_bitmap &= bitmap
+                if not value_bitmap:
+                    continue
+                if last:
+                    groups[values + (value,)] = popcount(value_bitmap)
+                else:
+                    stack.append((values + (value,), value_bitmap))
+        return groups
+
+    def lookup(self, filters: typing.Mapping[str, typing.Any]) \
+            -> typing.Optional[int]:
+        """The AND of the bitmaps of the filters on bitmap-indexed fields,
+        None if none is."""
+        bitmap = None
+        for field, value in filters.items():
+            if field not in self._indexes:
+                continue
+            index_bitmap = self._indexes[field][1].lookup(value)
+            bitmap = index_bitmap if bitmap is None else bitmap & index_bitmap
+            if not bitmap:
+                break
+        return bitmap
+
+    def stats(self) -> typing.Dict[str, int]:
+        stats = {}
+        for field, (_, index) in self._indexes.items():
+            stats['bitmap_index.%s.values' % field] = len(index)
+            stats['bitmap_index.%s.bytes' % field] = index.nbytes()
+        return stats
+
+
+class RecordIndexes(object):
+    """The indexes of a table of records, kept up to date by the driver.
+
+    It is up to the driver to serialize the calls with its writes.
+    """
+
+    def __init__(self, layout: RowLayout, fields: typing.Iterable[str],
+                 sorted_fields: typing.Iterable[str] = ()):
+        self._layout = layout
+        # (index of the field in the records, index)
+        self._indexes: typing.Dict[str, typing.Tuple[int, HashIndex]] = {
+            field: (layout.indexes[field], HashIndex(field))
+            for field in fields if field != layout.pk}
+        self._sorted_indexes: typing.Dict[
+            str, typing.Tuple[int, SortedIndex]] = {
+            field: (layout.indexes[field], SortedIndex(field))
+            for field in sorted_fields}
+        self._all = list(self._indexes.values()) \
+            + list(self._sorted_indexes.values())
+
+    def __bool__(self):
+        return bool(self._all)
+
+    def insert(self, pk: PKType, record: RecordType):
+        for i, index in self._all:
+            index.add(record[i], pk)
+
+    def insert_many(self, entries: typing.Sequence[typing.Tuple[
+            PKType, RecordType]]):
+        for i, index in self._indexes.values():
+            for pk, record in entries:
+                index.add(record[i], pk)
+        for i, index in self._sorted_indexes.values():
+            index.update((record[i], pk) for pk, record in entries)
+
+    def remove(self, pk: PKType, record: RecordType):
+        for i, index in self._all:
+            index.discard(record[i], pk)
+
+    def replace(self, pk: PKType, old: RecordType, new: RecordType):
+        for i, index in self._all:
+            if old[i] != new[i]:
+                index.discard(old[i], pk)
+                index.add(new[i], pk)
+
+    def rebuild(self, entries: typing.Iterable[typing.Tuple[PKType,
+                                                            RecordType]]):
+        entries = list(entries)
+        for i, index in self._indexes.values():
+            index.clear()
+            for pk, record in entries:
+                index.add(record[i], pk)
+        for i, index in self._sorted_indexes.values():
+            index.load((record[i], pk) for pk, record in entries)
+
+    def lookup(self, filters: typing.Mapping[str, typing.Any]) \
+            -> typing.Optional[typing.AbstractSet[PKType]]:
+        """The candidate pks for the filters, None if none is indexed.
+
+        The candidates are a superset of the matching rows, as only the
+        most selective of the indexed filters has been applied.
+        """
+        candidates = None
+        for field, value in filters.items():
+            if field not in self._indexes:
+                continue
+            pks = self._indexes[field][1].lookup(value)
+            if candidates is None or len(pks) < len(candidates):
+                candidates = pks
+        return candidates
+
+    def count(self, field: str, value: typing.Any) -> typing.Optional[int]:
+        """The number of rows holding the value, None if not hash-indexed."""
+        entry = self._indexes.get(field)
+        return len(entry[1].lookup(value)) if entry is not None else None
+
+    def sorted_index(self, field: str) -> typing.Optional[SortedIndex]:
+        entry = self._sorted_indexes.get(field)
+        return entry[1] if entry is not None else None
+
+    def stats(self) -> typing.Dict[str, int]:
+        stats = {'index.%s.values' % field: len(index)
+                 for field, (_, index) in self._indexes.items()}
+        stats.update({'sorted_index.%s.keys' % field: len(index)
+                      for field, (_, index) in self._sorted_indexes.items()})
+        return stats
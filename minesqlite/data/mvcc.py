@@ -0,0 +1,160 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+"""Multi-version records in slots, readable as of a commit timestamp.
+
+Every write to a slot is a commit, stamped with the next value of a global
+commit counter. Taking a snapshot is merely noting the current timestamp:
+reads through the snapshot then return, for each slot, the version which was
+the latest one at that timestamp, whatever has been written since.
+
+Only the latest versions are kept in the slots. A superseded version is
+moved into the history of its slot, along with the timestamps delimiting its
+lifetime, if and only if some active snapshot may still need it; versions
+are dropped from the history once every snapshot older than their end has
+been released. Hence, without active snapshots, there is no overhead but a
+timestamp per slot.
+"""
+import array
+import collections
+import itertools
+import threading
+import typing
+import weakref
+
+from minesqlite.data.row import RecordType
+
+# (begin_ts, end_ts, record): the record was the latest in [begin, end)
+VersionType = typing.Tuple[int, int, RecordType]
+
+
+class Snapshot(object):
+    """A consistent view of a `VersionStore` as of a commit timestamp.
+
+    It must be released once done with, so that the versions it pins can be
+    garbage-collected; that happens at the latest when it is collected.
+    """
+
+    def __init__(self, store: 'VersionStore', ts: int, num_slots: int):
+        self.store = store
+        self.ts = ts
+        # slots appended later hold nothing visible to the snapshot
+        self.num_slots = num_slots
+        self._finalizer = weakref.finalize(self, store._release, ts)
+
+    def get(self, slot: int) -> typing.Optional[RecordType]:
+        return self.store.read(self.ts, slot, slot + 1)[0]
+
+    def read(self, start: int, stop: int) \
+            -> typing.List[typing.Optional[RecordType]]:
+        return self.store.read(self.ts, start, min(stop, self.num_slots))
+
+    def release(self):
+        self._finalizer()
+
+    def __enter__(self) -> 'Snapshot':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class VersionStore(object):
+    def __init__(self, commit_ts: int = 0):
+        self.commit_ts = commit_ts
+        # the latest versions, None for the empty slots
+        self.records: typing.List[typing.Optional[RecordType]] = []
+        self._begin_ts = array.array('q')
+        self._history: typing.Dict[int, typing.List[VersionType]] = {}
+        # (end_ts, slot) of the versions in the history, by end_ts
+        self._garbage: typing.Deque[typing.Tuple[int, int]] = \
+            collections.deque()
+        self._snapshots: typing.Counter[int] = collections.Counter()
+        # reentrant, as snapshots may be released by the garbage collector
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def append(self, record: typing.Optional[RecordType]) -> int:
+        """Commit a record into a new slot, returning the slot."""
+        with self._lock:
+            self.commit_ts += 1
+            self.records.append(record)
+            self._begin_ts.append(self.commit_ts)
+            return len(self.records) - 1
+
+    def extend(self, records: typing.List[RecordType]):
+        """Commit records into new slots, all at once."""
+        with self._lock:
+            self.commit_ts += 1
+            self.records.extend(records)
+            self._begin_ts.extend(
+                itertools.repeat(self.commit_ts, len(records)))
+
+    def write(self, slot: int, record: typing.Optional[RecordType]):
+        """Commit a record (None to empty the slot) into a slot."""
+        with self._lock:
+            self.commit_ts += 1
+            old = self.records[slot]
+            begin_ts = self._begin_ts[slot]
+            if old is not None and self._snapshots \
+                    and max(self._snapshots) >= begin_ts:
+                self._history.setdefault(slot, []).append(
+                    (begin_ts, self.commit_ts, old))
+                self._garbage.append((self.commit_ts, slot))
+            self._begin_ts[slot] = self.commit_ts
+            self.records[slot] = record
+
+    def read(self, ts: int, start: int, stop: int) \
+            -> typing.List[typing.Optional[RecordType]]:
+        """The versions of the slots in `[start, stop)` as of `ts`."""
+        with self._lock:
+            begin_ts = self._begin_ts[start:stop]
+            if not begin_ts or max(begin_ts) <= ts:
+                return self.records[start:stop]
+
+            records = []
+            for slot, begin in enumerate(begin_ts, start):
+                record = None
+                if begin <= ts:
+                    record = self.records[slot]
+                else:
+                    for version_begin, version_end, version in \
+                            self._history.get(slot, ()):
+                        if version_begin <= ts < version_end:
+                            record = version
+                            break
+                records.append(record)
+            return records
+
+    def snapshot(self) -> Snapshot:
+        with self._lock:
+            self._snapshots[self.commit_ts] += 1
+            return Snapshot(self, self.commit_ts, len(self.records))
+
+    def _release(self, ts: int):
+        with self._lock:
+            self._snapshots[ts] -= 1
+            if not self._snapshots[ts]:
+                del self._snapshots[ts]
+            if not self._snapshots:
+                self._history.clear()
+                self._garbage.clear()
+                return
+            oldest_ts = min(self._snapshots)
+            garbage, history = self._garbage, self._history
+            while garbage and garbage[0][0] <= oldest_ts:
+                _, slot = garbage.popleft()
+                versions = history[slot]
+                # the versions of a slot are ordered by end_ts as well
+                del versions[0]
+                if not versions:
+                    del history[slot]
+
+    def stats(self) -> typing.Dict[str, int]:
+        with self._lock:
+            return {
+                'commit_ts': self.commit_ts,
+                'snapshots': sum(self._snapshots.values()),
+                'old_versions': len(self._garbage),
+            }
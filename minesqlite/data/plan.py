@@ -0,0 +1,414 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+"""How a driver answers a `Query`: a chain of operators, each pulling the
+batches of rows of the one below it.
+
+    project <- limit <- sort <- filter <- access path
+
+The access path (a scan, or an index lookup) yields the candidate rows, the
+filter keeps the ones matching the query, and so on. A node is left out
+when it has nothing to do, e.g. the sort when the access path already yields
+the rows in order. Under a limit, the sort only keeps the rows up to it, in
+a heap (`TopK`).
+
+The `Planner` picks the cheapest of the access paths a driver offers, from
+the number of rows each is estimated to read. The estimates come from the
+statistics the driver has at hand (its row count, and the number of rows
+holding a value or within a range, which its indexes tell), falling back to
+a fixed selectivity for the fields without any.
+
+Each node carries the number of rows it is estimated to yield, and counts
+the ones it actually yields while executed, which `explain` prints.
+
+Given a pool of workers (see `Parallel`), the filter and the sort of a scan
+are done in parallel instead: the scan is split into chunks of rows, which
+the workers filter and sort on their own, and the sorted chunks are merged.
+"""
+import abc
+import concurrent.futures
+import datetime
+import heapq
+import itertools
+import math
+import typing
+
+from minesqlite.data.query import Query, Range, batched
+
+RowType = typing.Mapping[str, typing.Any]
+BatchesType = typing.Iterator[typing.List[RowType]]
+
+
+class PlanNode(abc.ABC):
+    operator = ''
+
+    def __init__(self, child: typing.Optional['PlanNode'] = None,
+                 estimate: typing.Optional[int] = None):
+        self.child = child
+        # None when unknown
+        self.estimate = estimate
+        # the number of rows yielded by the last execution
+        self.actual: typing.Optional[int] = None
+
+    def describe(self) -> str:
+        return self.operator
+
+    @abc.abstractmethod
+    def _run(self, batch_size: int) -> BatchesType:
+        pass
+
+    def execute(self, batch_size: int) -> BatchesType:
+        self.actual = 0
+        for batch in self._run(batch_size):
+            self.actual += len(batch)
+            yield batch
+
+    def walk(self) -> typing.Iterator['PlanNode']:
+        """The nodes from this one down to the access path."""
+        node = self
+        while node is not None:
+            yield node
+            node = node.child
+
+    def format(self) -> typing.List[str]:
+        lines = []
+        for depth, node in enumerate(self.walk()):
+            prefix = '   ' * (depth - 1) + '-> ' if depth else ''
+            lines.append('%s%s  (estimated %s, actual %s)' % (
+                prefix, node.describe(), _format_count(node.estimate),
+                _format_count(node.actual)))
+        return lines
+
+
+def _format_count(count: typing.Optional[int]) -> str:
+    return '?' if count is None else str(count)
+
+
+class Access(PlanNode):
+    """Where the rows come from, e.g. `scan`, or a lookup in an index."""
+
+    def __init__(self, operator: str,
+                 source: typing.Callable[[int], BatchesType],
+                 estimate: typing.Optional[int] = None, detail: str = '',
+                 ordered: bool = False):
+        super().__init__(None, estimate)
+        self.operator = operator
+        self.detail = detail
+        # batch_size -> batches
+        self.source = source
+        # whether the rows come in the order the query asks for
+        self.ordered = ordered
+
+    def describe(self) -> str:
+        if not self.detail:
+            return self.operator
+        return '%s %s' % (self.operator, self.detail)
+
+    def _run(self, batch_size: int) -> BatchesType:
+        return self.source(batch_size)
+
+
+def _format_value(value: typing.Any) -> str:
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%Y-%m-%d')
+    return str(value)
+
+
+def describe_range(field: str, range_: Range) -> str:
+    conditions = []
+    if range_.lower is not None:
+        conditions.append('%s %s %s' % (
+            field, '>=' if range_.lower_inclusive else '>',
+            _format_value(range_.lower)))
+    if range_.upper is not None:
+        conditions.append('%s %s %s' % (
+            field, '<=' if range_.upper_inclusive else '<',
+            _format_value(range_.upper)))
+    return ' and '.join(conditions)
+
+
+def _describe_conditions(query: Query) -> str:
+    conditions = ['%s = %s' % (field, _format_value(value))
+                  for field, value in query.filters.items()]
+    conditions.extend(describe_range(field, range_)
+                      for field, range_ in query.ranges.items())
+    if query.where is not None:
+        conditions.append('where %s' % query.where.text)
+    if query.after is not None:
+        conditions.append('after (%s)' % ', '.join(
+            map(_format_value, query.after)))
+    return ', '.join(conditions)
+
+
+def _describe_sorts(query: Query) -> str:
+    return ', '.join(field + (' desc' if reverse else '')
+                     for field, reverse in query.sorts)
+
+
+class Filter(PlanNode):
+    operator = 'filter'
+
+    def __init__(self, child: PlanNode, query: Query,
+                 estimate: typing.Optional[int] = None):
+        super().__init__(child, estimate)
+        self.query = query
+
+    def describe(self) -> str:
+        return '%s %s' % (self.operator, _describe_conditions(self.query))
+
+    def _run(self, batch_size: int) -> BatchesType:
+        for batch in self.child.execute(batch_size):
+            batch = self.query.filter(batch)
+            if batch:
+                yield batch
+
+
+class Sort(PlanNode):
+    operator = 'sort'
+
+    def __init__(self, child: PlanNode, query: Query,
+                 estimate: typing.Optional[int] = None):
+        super().__init__(child, estimate)
+        self.query = query
+
+    def describe(self) -> str:
+        return '%s %s' % (self.operator, _describe_sorts(self.query))
+
+    def _run(self, batch_size: int) -> BatchesType:
+        rows = []
+        for batch in self.child.execute(batch_size):
+            rows.extend(batch)
+        self.query.sort(rows)
+        return batched(rows, batch_size)
+
+
+class TopK(PlanNode):
+    """The sort of a query with a limit, keeping only the first rows up to
+    the limit (and the offset) in a heap, rather than all of them."""
+    operator = 'top'
+
+    def __init__(self, child: PlanNode, query: Query,
+                 estimate: typing.Optional[int] = None):
+        super().__init__(child, estimate)
+        self.query = query
+        self.count = query.limit + query.offset
+
+    def describe(self) -> str:
+        return '%s %d by %s' % (self.operator, self.count,
+                                _describe_sorts(self.query))
+
+    def _run(self, batch_size: int) -> BatchesType:
+        rows = self.query.top(itertools.chain.from_iterable(
+            self.child.execute(batch_size)), self.count)
+        return batched(rows, batch_size)
+
+
+class Parallel(typing.NamedTuple):
+    """A pool of workers to filter and sort the chunks of a scan in."""
+    executor: concurrent.futures.Executor
+    # the number of rows of a chunk
+    chunk_rows: int
+
+
+def _filter_and_sort(query: Query, rows: typing.List[RowType]) \
+        -> typing.List[RowType]:
+    """Run by a worker, possibly in another process."""
+    rows = query.filter(rows)
+    if query.sorts and query.limit is not None:
+        # the rows past it in a chunk are past it in the merge too
+        return query.top(rows, query.limit + query.offset)
+    query.sort(rows)
+    return rows
+
+
+class ParallelFilterSort(PlanNode):
+    """The filter and the sort, done chunk by chunk in a pool of workers,
+    whose sorted chunks are then merged."""
+    operator = 'parallel'
+
+    def __init__(self, child: PlanNode, query: Query, parallel: Parallel,
+                 estimate: typing.Optional[int] = None):
+        super().__init__(child, estimate)
+        self.query = query
+        self.parallel = parallel
+
+    def describe(self) -> str:
+        steps = []
+        if self.query.has_conditions:
+            steps.append('filter %s' % _describe_conditions(self.query))
+        if self.query.sorts:
+            steps.append('sort %s' % _describe_sorts(self.query))
+        return '%s %s, in chunks of %d rows' % (
+            self.operator, ', '.join(steps), self.parallel.chunk_rows)
+
+    def _run(self, batch_size: int) -> BatchesType:
+        executor = self.parallel.executor
+        futures = [executor.submit(_filter_and_sort, self.query, chunk)
+                   for chunk in self.child.execute(self.parallel.chunk_rows)]
+        try:
+            if not self.query.sorts:
+                for future in futures:
+                    rows = future.result()
+                    if rows:
+                        yield rows
+                return
+            # stable: the ties come in the order of the chunks
+            rows = heapq.merge(*(future.result() for future in futures),
+                               key=self.query.sort_key,
+                               reverse=self.query.sort_reverse)
+            yield from batched(rows, batch_size)
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+class Limit(PlanNode):
+    operator = 'limit'
+
+    def __init__(self, child: PlanNode, query: Query,
+                 estimate: typing.Optional[int] = None):
+        super().__init__(child, estimate)
+        self.query = query
+
+    def describe(self) -> str:
+        limit = 'all' if self.query.limit is None else self.query.limit
+        if not self.query.offset:
+            return '%s %s' % (self.operator, limit)
+        return '%s %s offset %d' % (self.operator, limit, self.query.offset)
+
+    def _run(self, batch_size: int) -> BatchesType:
+        return self.query.truncate(self.child.execute(batch_size))
+
+
+class Project(PlanNode):
+    """Keep only the `columns` of the query, if any, of the rows.
+
+    A driver reading only these columns in the first place (`pushed_down`)
+    hands the rows of its access path over as they are.
+    """
+    operator = 'project'
+
+    def __init__(self, child: PlanNode, query: Query,
+                 estimate: typing.Optional[int] = None,
+                 pushed_down: bool = False):
+        super().__init__(child, estimate)
+        self.query = query
+        self.pushed_down = pushed_down
+
+    def describe(self) -> str:
+        if self.query.columns is None:
+            return '%s *' % self.operator
+        return '%s %s%s' % (self.operator, ', '.join(self.query.columns),
+                            ', pushed down' if self.pushed_down else '')
+
+    def _run(self, batch_size: int) -> BatchesType:
+        if self.query.columns is None or self.pushed_down:
+            return self.child.execute(batch_size)
+        project = self.query.project
+        return (list(map(project, batch))
+                for batch in self.child.execute(batch_size))
+
+
+class Planner(object):
+    """Estimates the rows matching a query, and plans it on the cheapest of
+    the access paths offered."""
+    # the fractions of the rows assumed to match an equality and a range,
+    # for the fields which no statistics tell about
+    EQUAL_SELECTIVITY = 0.1
+    RANGE_SELECTIVITY = 1 / 3
+
+    def __init__(self, num_rows: typing.Optional[int],
+                 count_equal: typing.Callable[[str, typing.Any],
+                                              typing.Optional[int]]
+                 = lambda field, value: None,
+                 count_range: typing.Callable[[str, Range],
+                                              typing.Optional[int]]
+                 = lambda field, range_: None,
+                 parallel: typing.Optional[Parallel] = None):
+        # None when unknown, then so are all the estimates
+        self.num_rows = num_rows
+        self._count_equal = count_equal
+        self._count_range = count_range
+        self.parallel = parallel
+
+    def estimate(self, query: Query) -> typing.Optional[int]:
+        """The estimated number of rows matching the filters and ranges."""
+        if self.num_rows is None:
+            return None
+        if not self.num_rows:
+            return 0
+        selectivity = 1.0
+        for field, value in query.filters.items():
+            count = self._count_equal(field, value)
+            selectivity *= self.EQUAL_SELECTIVITY if count is None \
+                else count / self.num_rows
+        for field, range_ in query.ranges.items():
+            count = self._count_range(field, range_)
+            selectivity *= self.RANGE_SELECTIVITY if count is None \
+                else count / self.num_rows
+        if query.where is not None:
+            # whatever the expression
+            selectivity *= self.RANGE_SELECTIVITY
+        if query.after is not None:
+            # a range on the sort key
+            selectivity *= self.RANGE_SELECTIVITY
+        return math.ceil(self.num_rows * selectivity)
+
+    def ordered_reads(self, query: Query, total: int) -> int:
+        """The estimated number of rows read by walking `total` rows in
+        order, before the limit of the query is reached."""
+        matches = self.estimate(query)
+        if query.limit is None or not matches:
+            return total
+        wanted = query.limit + query.offset
+        return min(total, math.ceil(wanted * total / matches))
+
+    def cost(self, access: Access, query: Query) -> float:
+        """The rows read, plus sorting the matching ones if not in order,
+        in a heap of the rows up to the limit if any."""
+        cost = float(access.estimate)
+        matches = min(access.estimate, self.estimate(query))
+        if query.sorts and not access.ordered and matches > 1:
+            kept = matches if query.limit is None \
+                else min(matches, query.limit + query.offset)
+            cost += matches * math.log2(kept + 1)
+        return cost
+
+    def parallelizes(self, access: Access, query: Query) -> bool:
+        """Whether to filter and sort the rows of the access path in the
+        pool of workers: when there are several chunks of them to, and all
+        are to be read anyway, i.e. no limit stops the scan early."""
+        if self.parallel is None or access.ordered:
+            return False
+        if not query.sorts and (query.limit is not None
+                                or not query.has_conditions):
+            return False
+        return access.estimate is None \
+            or access.estimate > self.parallel.chunk_rows
+
+    def plan(self, query: Query, paths: typing.Sequence[Access]) -> PlanNode:
+        """Chain the operators of the query on the cheapest access path."""
+        access = paths[0] if len(paths) == 1 else min(
+            paths, key=lambda path: self.cost(path, query))
+        node = access
+        estimate = self.estimate(query)
+        if estimate is not None and access.estimate is not None:
+            estimate = min(estimate, access.estimate)
+            if access.ordered and query.limit is not None:
+                # the walk stops once the limit is reached
+                estimate = min(estimate, query.limit + query.offset)
+        if self.parallelizes(access, query):
+            node = ParallelFilterSort(node, query, self.parallel, estimate)
+        else:
+            if query.has_conditions:
+                node = Filter(node, query, estimate)
+            if query.sorts and not access.ordered:
+                if query.limit is None:
+                    node = Sort(node, query, estimate)
+                else:
+                    node = TopK(node, query, None if estimate is None
+                                else min(estimate,
+                                         query.limit + query.offset))
+        if query.limit is not None or query.offset:
+            node = Limit(node, query, None if estimate is None
+                         else query.clip(estimate))
+        return Project(node, query, node.estimate)
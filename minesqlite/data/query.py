@@ -0,0 +1,368 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+"""What `list` asks the data layer for: which rows, and in which order.
+
+A `Query` is handed down to `DataManagerABC.select`, so that a driver able to
+do better than filtering and sorting a full scan (e.g. in parallel, or with
+an index) can do so.
+
+A sorted result can be paged through by keyset: a page ends with a token
+holding the sort key of its last row, and `$after <token>` resumes the query
+right after that row, i.e. keeps only the rows after it in the order of the
+query. The primary key breaks the ties of the sorts (see `break_ties`), so
+that the order is total and no row is skipped nor repeated across pages.
+"""
+import base64
+import binascii
+import datetime
+import functools
+import heapq
+import itertools
+import json
+import operator
+import typing
+from dataclasses import dataclass, field
+
+from minesqlite import exceptions
+
+if typing.TYPE_CHECKING:
+    from minesqlite.data.where import Where
+
+RowType = typing.Mapping[str, typing.Any]
+
+SORT_KEYS = {'$sort_asc': False, '$sort_desc': True}
+RANGE_KEYS = ('$gt', '$lt', '$between')
+LIMIT_KEY = '$limit'
+OFFSET_KEY = '$offset'
+AFTER_KEY = '$after'
+WHERE_KEY = '$where'
+FIELDS_KEY = '$fields'
+MAGIC_KEYS = (*SORT_KEYS, *RANGE_KEYS, LIMIT_KEY, OFFSET_KEY, AFTER_KEY,
+              WHERE_KEY, FIELDS_KEY)
+
+
+@dataclass
+class Range(object):
+    """An interval of values, unbounded on the sides which are None."""
+    lower: typing.Any = None
+    upper: typing.Any = None
+    lower_inclusive: bool = True
+    upper_inclusive: bool = True
+
+    def contains(self, value: typing.Any) -> bool:
+        if value is None:
+            return False
+        if self.lower is not None:
+            if value < self.lower \
+                    or (value == self.lower and not self.lower_inclusive):
+                return False
+        if self.upper is not None:
+            if value > self.upper \
+                    or (value == self.upper and not self.upper_inclusive):
+                return False
+        return True
+
+    def intersect(self, other: 'Range') -> 'Range':
+        lower, lower_inclusive = self.lower, self.lower_inclusive
+        if other.lower is not None and (
+                lower is None or other.lower > lower
+                or (other.lower == lower and not other.lower_inclusive)):
+            lower, lower_inclusive = other.lower, other.lower_inclusive
+        upper, upper_inclusive = self.upper, self.upper_inclusive
+        if other.upper is not None and (
+                upper is None or other.upper < upper
+                or (other.upper == upper and not other.upper_inclusive)):
+            upper, upper_inclusive = other.upper, other.upper_inclusive
+        return Range(lower, upper, lower_inclusive, upper_inclusive)
+
+
+@dataclass
+class Query(object):
+    # field -> value, all of which a row must equal
+    filters: typing.Dict[str, typing.Any] = field(default_factory=dict)
+    # field -> range, all of which a row must fall within
+    ranges: typing.Dict[str, Range] = field(default_factory=dict)
+    # (field, reverse) by priority
+    sorts: typing.List[typing.Tuple[str, bool]] = field(default_factory=list)
+    # the maximum number of rows, None for no limit
+    limit: typing.Optional[int] = None
+    # the number of rows skipped before the limit applies
+    offset: int = 0
+    # the sort key (see `key_of`) which the rows must come after, if any
+    after: typing.Optional[typing.Tuple[typing.Any, ...]] = None
+    # an expression which the rows must satisfy too, if any
+    where: typing.Optional['Where'] = None
+    # the fields of the rows to return, None for all of them; the sorted
+    # ones are to be among them, for the rows to be merged or paged through
+    columns: typing.Optional[typing.Tuple[str, ...]] = None
+
+    def add_sort(self, magic_key: str, field_name: str):
+        if magic_key not in SORT_KEYS:
+            raise exceptions.InternalError(
+                "invalid magic_key: %s" % magic_key)
+        self.sorts.append((field_name, SORT_KEYS[magic_key]))
+
+    def add_range(self, magic_key: str, field_name: str,
+                  bounds: typing.List[typing.Any]):
+        """Restrict a field to `$gt x`, `$lt x` or `$between x,y`.
+
+        `$gt` and `$lt` are exclusive, `$between` is inclusive on both sides.
+        A field restricted several times falls within all the ranges.
+        """
+        if magic_key not in RANGE_KEYS:
+            raise exceptions.InternalError(
+                "invalid magic_key: %s" % magic_key)
+        if len(bounds) != (2 if magic_key == '$between' else 1):
+            raise exceptions.CommandInvalidValueArgument(
+                value=','.join(map(str, bounds)))
+        if magic_key == '$gt':
+            new_range = Range(lower=bounds[0], lower_inclusive=False)
+        elif magic_key == '$lt':
+            new_range = Range(upper=bounds[0], upper_inclusive=False)
+        else:
+            new_range = Range(lower=bounds[0], upper=bounds[1])
+        old_range = self.ranges.get(field_name)
+        self.ranges[field_name] = new_range if old_range is None \
+            else old_range.intersect(new_range)
+
+    def break_ties(self, pk: str):
+        """Sort the ties by primary key, in the direction of the last sort,
+        so that the order is total."""
+        if self.sorts and pk not in (field_name for field_name, _
+                                     in self.sorts):
+            self.sorts.append((pk, self.sorts[-1][1]))
+
+    def key_of(self, row: RowType) -> typing.Tuple[typing.Any, ...]:
+        """The values of the sorted fields of a row, to resume after it."""
+        return tuple(row[field_name] for field_name, _ in self.sorts)
+
+    def is_after(self, row: RowType) -> bool:
+        """Whether a row comes after `after` in the order of the sorts."""
+        for (field_name, reverse), value in zip(self.sorts, self.after):
+            row_value = row[field_name]
+            if row_value != value:
+                return (row_value > value) != reverse
+        return False
+
+    @functools.cached_property
+    def predicate(self) -> typing.Callable[[RowType], bool]:
+        """A function of a row telling whether it matches the filters, the
+        ranges and `where`, compiled together (see `where`).
+
+        Built once, on first use, hence not before the query is complete.
+        """
+        from minesqlite.data.where import compile_predicate, fold
+
+        nodes = [('eq', field_name, value)
+                 for field_name, value in self.filters.items()]
+        nodes.extend(('range', field_name, range_)
+                     for field_name, range_ in self.ranges.items())
+        if self.where is not None:
+            nodes.append(self.where.node)
+        return compile_predicate(fold(('and', tuple(nodes))))
+
+    def __getstate__(self) -> dict:
+        # the compiled predicate is not picklable, and cheap to build again
+        state = self.__dict__.copy()
+        state.pop('predicate', None)
+        return state
+
+    def match(self, row: RowType) -> bool:
+        if not self.predicate(row):
+            return False
+        if self.after is not None and not self.is_after(row):
+            return False
+        return True
+
+    @property
+    def fields(self) -> typing.Set[str]:
+        """The fields which the rows matching and their order depend on."""
+        return {*self.filters, *self.ranges,
+                *(field_name for field_name, _ in self.sorts),
+                *(self.where.fields if self.where is not None else ())}
+
+    @property
+    def has_conditions(self) -> bool:
+        """Whether the query keeps only some of the rows (before a limit)."""
+        return bool(self.filters or self.ranges) or self.after is not None \
+            or self.where is not None
+
+    def filter(self, rows: typing.List[RowType]) -> typing.List[RowType]:
+        if not self.has_conditions:
+            return rows
+        if self.filters or self.ranges or self.where is not None:
+            rows = list(filter(self.predicate, rows))
+        if self.after is not None:
+            rows = list(filter(self.is_after, rows))
+        return rows
+
+    @property
+    def sort_reverse(self) -> bool:
+        """Whether to sort by `sort_key` in descending order: that of the
+        first sort."""
+        return bool(self.sorts) and self.sorts[0][1]
+
+    @property
+    def _one_direction(self) -> bool:
+        return all(reverse == self.sort_reverse for _, reverse in self.sorts)
+
+    @property
+    def sort_key(self) -> typing.Callable[[RowType], typing.Any]:
+        """The key of a row, to sort by (in the direction of
+        `sort_reverse`) in the order of the query.
+
+        It is the value of the sorted field, or a tuple of the values of
+        the sorted fields, compared by tuples in C. Only the values sorted
+        in the other direction than the first sort are wrapped into
+        `_Reversed`, which compare in Python.
+        """
+        fields = [field_name for field_name, _ in self.sorts]
+        if self._one_direction:
+            return operator.itemgetter(*fields)
+        key = tuple((field_name, reverse != self.sort_reverse)
+                    for field_name, reverse in self.sorts)
+        return lambda row: tuple(_Reversed(row[field_name]) if reversed_
+                                 else row[field_name]
+                                 for field_name, reversed_ in key)
+
+    def sort(self, rows: typing.List[RowType]):
+        if not self.sorts:
+            return
+        if self._one_direction:
+            rows.sort(key=self.sort_key, reverse=self.sort_reverse)
+            return
+        # rather than `_Reversed` keys: stable sorts by each field from the
+        # last one, whose values compare in C
+        for field_name, reverse in reversed(self.sorts):
+            rows.sort(key=operator.itemgetter(field_name), reverse=reverse)
+
+    def top(self, rows: typing.Iterable[RowType], count: int) \
+            -> typing.List[RowType]:
+        """The first `count` rows in the order of the query, as `sort`
+        would give them, in a single pass over the rows keeping only
+        `count` of them: O(n log count) rather than O(n log n)."""
+        select = heapq.nlargest if self.sort_reverse else heapq.nsmallest
+        return select(count, rows, key=self.sort_key)
+
+    def project(self, row: RowType) -> RowType:
+        """The row with only the `columns` it has, if any."""
+        if self.columns is None:
+            return row
+        return {field_name: row[field_name] for field_name in self.columns
+                if field_name in row}
+
+    def clip(self, count: int) -> int:
+        """The number of rows left of `count` by the offset and the limit."""
+        count = max(count - self.offset, 0)
+        return count if self.limit is None else min(count, self.limit)
+
+    def truncate(self, batches: typing.Iterable[typing.List[RowType]]) \
+            -> typing.Iterator[typing.List[RowType]]:
+        """Skip the batches up to the offset, and stop them at the limit."""
+        if self.offset:
+            batches = _skip(batches, self.offset)
+        if self.limit is None:
+            yield from batches
+            return
+        remaining = self.limit
+        if remaining <= 0:
+            return
+        for batch in batches:
+            batch = batch[:remaining]
+            remaining -= len(batch)
+            yield batch
+            if remaining <= 0:
+                # not to pull one more batch for nothing
+                return
+
+
+@functools.total_ordering
+class _Reversed(object):
+    """A value comparing the other way round."""
+    __slots__ = ('value',)
+
+    def __init__(self, value: typing.Any):
+        self.value = value
+
+    def __eq__(self, other: '_Reversed') -> bool:
+        return self.value == other.value
+
+    def __lt__(self, other: '_Reversed') -> bool:
+        return other.value < self.value
+
+
+class Page(object):
+    """The rows of a page, along with the token to resume after it, and the
+    fields to show of them (None for all of the schema).
+
+    The rows may be an iterator, pulled as the page is iterated over (once
+    then), in which case the token is only known after the last row.
+    """
+
+    def __init__(self, rows: typing.Iterable[RowType] = (),
+                 next_token: typing.Optional[str] = None,
+                 fields: typing.Optional[typing.Sequence[str]] = None):
+        self.rows = rows
+        self.next_token = next_token
+        self.fields = fields
+
+    def __iter__(self) -> typing.Iterator[RowType]:
+        return iter(self.rows)
+
+
+def _skip(batches: typing.Iterable[typing.List[RowType]], count: int) \
+        -> typing.Iterator[typing.List[RowType]]:
+    """Skip the first `count` rows of the batches."""
+    batches = iter(batches)
+    for batch in batches:
+        if len(batch) > count:
+            yield batch[count:]
+            break
+        count -= len(batch)
+    yield from batches
+
+
+def _encode_value(value: typing.Any) -> typing.Any:
+    if isinstance(value, datetime.datetime):
+        return {'$date': value.isoformat()}
+    return value
+
+
+def _decode_value(value: typing.Any) -> typing.Any:
+    if isinstance(value, dict):
+        return datetime.datetime.fromisoformat(value['$date'])
+    return value
+
+
+def encode_token(fields: typing.Sequence[str],
+                 key: typing.Sequence[typing.Any]) -> str:
+    """An opaque token for `$after`, holding a sort key and its fields."""
+    data = json.dumps([list(fields), list(map(_encode_value, key))],
+                      separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_token(token: str) \
+        -> typing.Tuple[typing.List[str], typing.Tuple[typing.Any, ...]]:
+    """The fields and the sort key of a token, which is not to be trusted:
+    JSON rather than pickle."""
+    try:
+        data = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        fields, key = json.loads(data)
+        if not isinstance(fields, list) or not isinstance(key, list) \
+                or len(fields) != len(key):
+            raise ValueError(token)
+        return fields, tuple(map(_decode_value, key))
+    except (binascii.Error, ValueError, TypeError, KeyError) as e:
+        raise exceptions.CommandInvalidValueArgument(value=token) from e
+
+
+def batched(rows: typing.Iterable[RowType], batch_size: int) \
+        -> typing.Iterator[typing.List[RowType]]:
+    """Split rows into batches of at most `batch_size` rows."""
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
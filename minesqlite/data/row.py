@@ -0,0 +1,117 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+"""Compact row records and read-only views over them.
+
+A record is a plain tuple holding the values of a row, primary key included,
+laid out by the field order of a `RowLayout`. It costs a fraction of a dict
+keyed by field names, and being immutable, it can be handed out without
+being copied: callers get a `RowView`, a read-only mapping over the record,
+which is only turned into a dict when somebody asks for one.
+"""
+import collections.abc
+import typing
+
+from minesqlite import exceptions
+
+RecordType = tuple
+
+
+class _Missing(object):
+    """The value of a field absent from a row."""
+    __slots__ = ()
+
+    def __repr__(self):
+        return 'MISSING'
+
+    def __reduce__(self):
+        # keeps the singleton a singleton through pickling
+        return 'MISSING'
+
+
+MISSING = _Missing()
+
+
+class RowLayout(object):
+    def __init__(self, fields: typing.Iterable[str], pk: str):
+        fields = list(fields)
+        if pk not in fields:
+            fields.insert(0, pk)
+        self.fields: typing.Tuple[str, ...] = tuple(fields)
+        self.pk = pk
+        self.indexes: typing.Dict[str, int] = {
+            field: index for index, field in enumerate(self.fields)}
+        self.pk_index = self.indexes[pk]
+
+    def _check_fields(self, kvs: dict):
+        unknown_fields = kvs.keys() - self.indexes.keys()
+        if unknown_fields:
+            raise exceptions.DataEntryInvalid(
+                reason="unexpected extra keys: %s"
+                       % ', '.join(sorted(unknown_fields)))
+
+    def pack(self, pk: typing.Any, kvs: dict) -> RecordType:
+        """Build the record of a row from its primary key and other values."""
+        self._check_fields(kvs)
+        values = [kvs.get(field, MISSING) for field in self.fields]
+        values[self.pk_index] = pk
+        return tuple(values)
+
+    def replace(self, record: RecordType, kvs: dict) -> RecordType:
+        """Build a new record with some of the values replaced."""
+        self._check_fields(kvs)
+        values = list(record)
+        for field, value in kvs.items():
+            values[self.indexes[field]] = value
+        return tuple(values)
+
+    def to_kvs(self, record: RecordType) -> dict:
+        """The values of a record except for the primary key, as a dict."""
+        return {field: value for field, value in zip(self.fields, record)
+                if value is not MISSING and field != self.pk}
+
+    def record_of(self, row: typing.Mapping[str, typing.Any]) -> RecordType:
+        """The record of any row, laid out by this layout."""
+        if type(row) is RowView and row._layout.fields == self.fields:
+            return row._record
+        return tuple(row.get(field, MISSING) for field in self.fields)
+
+    def view(self, record: RecordType) -> 'RowView':
+        return RowView(self, record)
+
+
+class RowView(collections.abc.Mapping):
+    """A read-only mapping of field -> value over a record.
+
+    The record is immutable, hence a view keeps showing the row as it was
+    when the view was made, whatever happens to the row afterwards.
+    """
+    __slots__ = ('_layout', '_record')
+
+    def __init__(self, layout: RowLayout, record: RecordType):
+        self._layout = layout
+        self._record = record
+
+    def __getitem__(self, field: str) -> typing.Any:
+        value = self._record[self._layout.indexes[field]]
+        if value is MISSING:
+            raise KeyError(field)
+        return value
+
+    def __iter__(self) -> typing.Iterator[str]:
+        return (field for field, value in zip(self._layout.fields,
+                                               self._record)
+                if value is not MISSING)
+
+    def __len__(self) -> int:
+        return len(self._record) - self._record.count(MISSING)
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.to_dict())
+
+    def to_dict(self) -> dict:
+        """Materialize the row as a standalone dict."""
+        return {field: value for field, value in zip(self._layout.fields,
+                                                     self._record)
+                if value is not MISSING}
+
+    copy = to_dict
@@ -0,0 +1,139 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+"""Versioned binary snapshots of a whole table.
+
+A snapshot file is laid out as `<header><chunk>*`. The header holds a magic
+number, the format version, the number of rows and the generation of the log
+the snapshot checkpoints (see `append_log`, 0 for none); each chunk is a framed
+record (see `codec`) of up to `CHUNK_ROWS` rows, stored column by column so
+that both writing and loading are bulk, sequential operations. Columns of
+dates are packed into arrays of day ordinals, which are several times
+faster to (un)pickle than `datetime` objects.
+"""
+import array
+import datetime
+import itertools
+import mmap
+import os
+import struct
+import typing
+
+from minesqlite import exceptions
+from minesqlite.data import codec
+
+_HEADER = struct.Struct('<4sHQQ')
+# the header of the first version, without the generation
+_HEADER_V1 = struct.Struct('<4sHQ')
+_MAGIC = b'MSQS'
+VERSION = 2
+
+CHUNK_ROWS = 65536
+
+_COLUMN_VALUES = 0
+_COLUMN_DATES = 1
+
+ChunkType = typing.Tuple[typing.List[typing.Any],
+                         typing.List[typing.Tuple[typing.Any, ...]]]
+
+
+def _is_date(value: typing.Any) -> bool:
+    return type(value) is datetime.datetime \
+        and value == datetime.datetime(value.year, value.month, value.day)
+
+
+def _encode_column(values: typing.Sequence) -> tuple:
+    if values and all(map(_is_date, values)):
+        ordinals = array.array('i', map(datetime.datetime.toordinal, values))
+        return _COLUMN_DATES, ordinals.tobytes()
+    return _COLUMN_VALUES, list(values)
+
+
+def _decode_column(column: tuple) -> typing.List[typing.Any]:
+    kind, data = column
+    if kind == _COLUMN_DATES:
+        ordinals = array.array('i')
+        ordinals.frombytes(data)
+        return list(map(datetime.datetime.fromordinal, ordinals))
+    return data
+
+
+def write_snapshot(path: str, fields: typing.List[str],
+                   entries: typing.Iterable[
+                       typing.Tuple[typing.Any, typing.Sequence]],
+                   count: int, generation: int = 0):
+    """Atomically write the `(pk, values)` entries into a snapshot file.
+
+    `values` of each entry are the values of the `fields`, in order.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, VERSION, count, generation))
+        entries = iter(entries)
+        while True:
+            chunk = list(itertools.islice(entries, CHUNK_ROWS))
+            if not chunk:
+                break
+            pks, rows = zip(*chunk)
+            columns = [_encode_column(column) for column in zip(*rows)] \
+                if fields else []
+            f.write(codec.pack_record((list(pks), fields, columns)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _read_header(path: str, content: typing.Union[bytes, mmap.mmap]) \
+        -> typing.Tuple[int, int, int]:
+    """The number of rows, the generation and the size of the header."""
+    if len(content) < _HEADER_V1.size:
+        raise exceptions.DataSnapshotInvalid(
+            path=path, reason="truncated header")
+    magic, version, count = _HEADER_V1.unpack_from(content)
+    if magic != _MAGIC:
+        raise exceptions.DataSnapshotInvalid(
+            path=path, reason="not a snapshot file")
+    if version == 1:
+        return count, 0, _HEADER_V1.size
+    if version != VERSION:
+        raise exceptions.DataSnapshotInvalid(
+            path=path, reason="unsupported version %d" % version)
+    if len(content) < _HEADER.size:
+        raise exceptions.DataSnapshotInvalid(
+            path=path, reason="truncated header")
+    _, _, count, generation = _HEADER.unpack_from(content)
+    return count, generation, _HEADER.size
+
+
+def read_generation(path: str) -> int:
+    """The generation of the log a snapshot file checkpoints, 0 for none."""
+    with open(path, 'rb') as f:
+        return _read_header(path, f.read(_HEADER.size))[1]
+
+
+def read_snapshot(path: str) \
+        -> typing.Iterator[typing.Tuple[typing.List[str], ChunkType]]:
+    """Yield `(fields, (pks, rows))` of each chunk of a snapshot file.
+
+    `rows` are tuples holding the values of the `fields`, in order.
+    """
+    with open(path, 'rb') as f:
+        # an empty file cannot be mapped
+        if os.fstat(f.fileno()).st_size < _HEADER_V1.size:
+            raise exceptions.DataSnapshotInvalid(
+                path=path, reason="truncated header")
+        content = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    with content:
+        count, _, end = _read_header(path, content)
+        loaded = 0
+        for end, (pks, fields, columns) in \
+                codec.iter_records(content, end):
+            columns = [_decode_column(column) for column in columns]
+            rows = list(zip(*columns)) if columns else [()] * len(pks)
+            loaded += len(pks)
+            yield fields, (pks, rows)
+        if loaded != count or end != len(content):
+            raise exceptions.DataSnapshotInvalid(
+                path=path, reason="truncated or corrupted data")
@@ -0,0 +1,146 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+"""Filter and sort whole columns with NumPy, rather than row by row.
+
+A column is seen as an array of keys, one per slot, which compare like the
+values they stand for: integers as they are, dates as day ordinals and
+strings as their rank among the distinct values. The filters, ranges,
+`$where` and `$after` of a query become boolean masks over those arrays, and
+its sorts a `numpy.lexsort`, the descending ones on the negated keys. Only
+the slots left are turned into rows, by the driver. Counts are the sums of
+the masks, and the counts by group those of `numpy.unique`.
+
+NumPy is optional: `numpy` is None when it is not installed, in which case
+the drivers keep to the row-by-row operators of `plan`.
+"""
+import typing
+
+from minesqlite.data.query import Query, Range
+from minesqlite.data.where import Node
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class KeyColumn(typing.NamedTuple):
+    # the key of each slot
+    keys: 'numpy.ndarray'
+    # value -> a key comparing with `keys` like the value with the values,
+    # e.g. halfway between two ranks for a string not in the column
+    key_of: typing.Callable[[typing.Any], typing.Any]
+    # key (of a row) -> value
+    value_of: typing.Callable[[int], typing.Any]
+
+
+def _range_mask(column: KeyColumn, range_: Range) -> 'numpy.ndarray':
+    mask = numpy.ones(len(column.keys), dtype=bool)
+    if range_.lower is not None:
+        lower = column.key_of(range_.lower)
+        mask &= column.keys >= lower if range_.lower_inclusive \
+            else column.keys > lower
+    if range_.upper is not None:
+        upper = column.key_of(range_.upper)
+        mask &= column.keys <= upper if range_.upper_inclusive \
+            else column.keys < upper
+    return mask
+
+
+def _where_mask(node: Node, columns: typing.Mapping[str, KeyColumn],
+                size: int) -> 'numpy.ndarray':
+    """Which of the slots satisfy a `$where` node."""
+    kind = node[0]
+    if kind == 'const':
+        return numpy.full(size, node[1], dtype=bool)
+    if kind in ('and', 'or'):
+        masks = [_where_mask(child, columns, size) for child in node[1]]
+        combine = numpy.logical_and if kind == 'and' else numpy.logical_or
+        return combine.reduce(masks)
+    if kind == 'not':
+        return ~_where_mask(node[1], columns, size)
+    column = columns[node[1]]
+    if kind == 'range':
+        return _range_mask(column, node[2])
+    if kind in ('in', 'not_in'):
+        mask = numpy.isin(column.keys, [column.key_of(value)
+                                        for value in node[2]])
+        return mask if kind == 'in' else ~mask
+    mask = column.keys == column.key_of(node[2])
+    return mask if kind == 'eq' else ~mask
+
+
+def _mask(query: Query, columns: typing.Mapping[str, KeyColumn],
+          alive: 'numpy.ndarray') -> 'numpy.ndarray':
+    """Which of the slots hold a row matching the query."""
+    mask = alive.copy()
+    for field, value in query.filters.items():
+        column = columns[field]
+        mask &= column.keys == column.key_of(value)
+    for field, range_ in query.ranges.items():
+        mask &= _range_mask(columns[field], range_)
+    if query.where is not None:
+        mask &= _where_mask(query.where.node, columns, len(mask))
+    if query.after is not None:
+        # greater on the first field, or equal on it and greater on the
+        # second one, and so on (lower for the descending ones)
+        after = numpy.zeros_like(mask)
+        equal = numpy.ones_like(mask)
+        for (field, reverse), value in zip(query.sorts, query.after):
+            column = columns[field]
+            key = column.key_of(value)
+            after |= equal & (column.keys < key if reverse
+                              else column.keys > key)
+            equal &= column.keys == key
+        mask &= after
+    return mask
+
+
+def select_slots(query: Query, columns: typing.Mapping[str, KeyColumn],
+                 alive: 'numpy.ndarray') -> 'numpy.ndarray':
+    """The slots of the rows matching the query, in its order, after its
+    offset and up to its limit.
+
+    `columns` holds the fields the query refers to, and `alive` whether
+    each slot holds a row.
+    """
+    slots = numpy.flatnonzero(_mask(query, columns, alive))
+    if query.sorts:
+        # the last key of `lexsort` is the primary one
+        keys = [columns[field].keys[slots] for field, _ in query.sorts]
+        keys = [-key if reverse else key
+                for key, (_, reverse) in zip(keys, query.sorts)]
+        slots = slots[numpy.lexsort(keys[::-1])]
+    stop = None if query.limit is None else query.offset + query.limit
+    return slots[query.offset:stop]
+
+
+def count(query: Query, columns: typing.Mapping[str, KeyColumn],
+          alive: 'numpy.ndarray') -> int:
+    """The number of rows matching the query, before its offset and
+    limit."""
+    return int(numpy.count_nonzero(_mask(query, columns, alive)))
+
+
+def count_groups(query: Query, columns: typing.Mapping[str, KeyColumn],
+                 alive: 'numpy.ndarray', group_by: typing.Sequence[str]) \
+        -> typing.Dict[tuple, int]:
+    """The number of rows matching the query by the values of the
+    `group_by` fields (as a tuple)."""
+    mask = _mask(query, columns, alive)
+    if not mask.any():
+        return {}
+    # the distinct keys of each field, and the position of each row's key
+    # among them, which combine into a single number per group
+    distinct, positions = zip(*(
+        numpy.unique(columns[field].keys[mask], return_inverse=True)
+        for field in group_by))
+    shape = [len(keys) for keys in distinct]
+    groups, counts = numpy.unique(
+        numpy.ravel_multi_index(positions, shape), return_counts=True)
+    keys = [field_keys[field_positions].tolist()
+            for field_keys, field_positions
+            in zip(distinct, numpy.unravel_index(groups, shape))]
+    value_of = [columns[field].value_of for field in group_by]
+    return {tuple(func(key) for func, key in zip(value_of, group)): count
+            for group, count in zip(zip(*keys), counts.tolist())}
@@ -0,0 +1,400 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+"""The conditions of a query, compiled into a Python function.
+
+`$where` takes an expression of comparisons between a field and a value,
+combined with `and`, `or`, `not` and parentheses, e.g.
+
+    in_date >= 2022-01-01 and department in (P1, P2) and not position == SDE1
+
+It is parsed into a tree of tuples (see `Node`), checked against the schema,
+with its values converted once by the converters of `field_types`, then
+simplified: nested `and`s and `or`s are flattened, `not`s pushed down to the
+comparisons, the ranges on a field intersected, and what is always true or
+false folded into a constant.
+
+The filters, ranges and `$where` of a query are compiled together into the
+source of a single function (see `compile_predicate`), reading each field
+straight from the row, e.g.
+
+    def predicate(row):
+        return (row['department'] in _c[0] and row['position'] != _c[1]
+                and ((_v := row.get('in_date')) is not None and _c[2] <= _v))
+
+The function of a given source is only compiled once, and the tree of a
+given expression only parsed once, for repeated queries to skip both.
+"""
+import functools
+import re
+import typing
+
+from minesqlite import exceptions
+from minesqlite.data.query import Range
+
+if typing.TYPE_CHECKING:
+    from minesqlite.schema import SchemaManager
+
+# ('eq' | 'ne', field, value)
+# ('in' | 'not_in', field, frozenset of values)
+# ('range', field, Range)
+# ('not', node)
+# ('and' | 'or', tuple of nodes)
+# ('const', bool)
+Node = tuple
+
+TRUE: Node = ('const', True)
+FALSE: Node = ('const', False)
+
+_TOKEN = re.compile(r'''
+    \s*(?:
+        (?P<op>==|!=|<=|>=|<|>|=)
+      | (?P<punct>[(),])
+      | '(?P<single>[^']*)'
+      | "(?P<double>[^"]*)"
+      | (?P<word>[^\s(),'"<>=!]+)
+    )''', re.VERBOSE)
+
+# op -> the range of the values it keeps, from the value compared with
+_RANGES = {
+    '<': lambda value: Range(upper=value, upper_inclusive=False),
+    '<=': lambda value: Range(upper=value),
+    '>': lambda value: Range(lower=value, lower_inclusive=False),
+    '>=': lambda value: Range(lower=value),
+}
+_KEYWORDS = ('and', 'or', 'not', 'in')
+
+
+class Where(typing.NamedTuple):
+    """A `$where` expression, checked and simplified."""
+    text: str
+    node: Node
+    fields: typing.FrozenSet[str]
+
+
+class _Token(typing.NamedTuple):
+    kind: str  # 'op', 'punct', 'value' or 'keyword'
+    text: str
+
+
+class _Parser(object):
+    """Recursive descent, from the lowest precedence:
+
+        or         := and ('or' and)*
+        and        := not ('and' not)*
+        not        := 'not' not | '(' or ')' | comparison
+        comparison := field op value | field ['not'] 'in' '(' values ')'
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.tokens = self._tokenize(text)
+        self.position = 0
+
+    def _error(self, reason: str) -> exceptions.CommandInvalidExpression:
+        return exceptions.CommandInvalidExpression(
+            expression=self.text, reason=reason)
+
+    def _tokenize(self, text: str) -> typing.List[_Token]:
+        tokens = []
+        position = 0
+        text = text.rstrip()
+        while position < len(text):
+            match = _TOKEN.match(text, position)
+            if match is None:
+                raise self._error('unexpected `%s`' % text[position:].strip())
+            position = match.end()
+            if match['op'] is not None:
+                tokens.append(_Token('op', match['op']))
+            elif match['punct'] is not None:
+                tokens.append(_Token('punct', match['punct']))
+            elif match['word'] is not None \
+                    and match['word'].lower() in _KEYWORDS:
+                tokens.append(_Token('keyword', match['word'].lower()))
+            else:
+                # quoted or not, e.g. a field, or a value
+                value = match['word']
+                if value is None:
+                    value = match['single'] if match['single'] is not None \
+                        else match['double']
+                tokens.append(_Token('value', value))
+        return tokens
+
+    def _peek(self) -> typing.Optional[_Token]:
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None
+
+    def _accept(self, kind: str, text: typing.Optional[str] = None) \
+            -> typing.Optional[_Token]:
+        token = self._peek()
+        if token is None or token.kind != kind \
+                or (text is not None and token.text != text):
+            return None
+        self.position += 1
+        return token
+
+    def _expect(self, kind: str, text: typing.Optional[str] = None) \
+            -> _Token:
+        token = self._accept(kind, text)
+        if token is None:
+            found = self._peek()
+            raise self._error('expected %s, found %s' % (
+                '`%s`' % text if text else 'a ' + kind,
+                'the end' if found is None else '`%s`' % found.text))
+        return token
+
+    def parse(self) -> Node:
+        if not self.tokens:
+            raise self._error('empty')
+        node = self._parse_or()
+        token = self._peek()
+        if token is not None:
+            raise self._error('unexpected `%s`' % token.text)
+        return node
+
+    def _parse_or(self) -> Node:
+        nodes = [self._parse_and()]
+        while self._accept('keyword', 'or'):
+            nodes.append(self._parse_and())
+        return nodes[0] if len(nodes) == 1 else ('or', tuple(nodes))
+
+    def _parse_and(self) -> Node:
+        nodes = [self._parse_not()]
+        while self._accept('keyword', 'and'):
+            nodes.append(self._parse_not())
+        return nodes[0] if len(nodes) == 1 else ('and', tuple(nodes))
+
+    def _parse_not(self) -> Node:
+        if self._accept('keyword', 'not'):
+            return 'not', self._parse_not()
+        if self._accept('punct', '('):
+            node = self._parse_or()
+            self._expect('punct', ')')
+            return node
+        return self._parse_comparison()
+
+    def _parse_comparison(self) -> Node:
+        field = self._expect('value').text
+        negated = self._accept('keyword', 'not') is not None
+        if negated or self._accept('keyword', 'in'):
+            if negated:
+                self._expect('keyword', 'in')
+            self._expect('punct', '(')
+            values = [self._expect('value').text]
+            while self._accept('punct', ','):
+                values.append(self._expect('value').text)
+            self._expect('punct', ')')
+            return 'not_in' if negated else 'in', field, tuple(values)
+        op = self._expect('op').text
+        value = self._expect('value').text
+        if op in ('=', '=='):
+            return 'eq', field, value
+        if op == '!=':
+            return 'ne', field, value
+        return 'range', field, _RANGES[op](value)
+
+
+def _bind(node: Node, convert: typing.Callable[[str, str], typing.Any]) \
+        -> Node:
+    """Convert the values of the tree, by `convert(field, value)`."""
+    kind = node[0]
+    if kind in ('and', 'or'):
+        return kind, tuple(_bind(child, convert) for child in node[1])
+    if kind == 'not':
+        return kind, _bind(node[1], convert)
+    field = node[1]
+    if kind in ('in', 'not_in'):
+        return kind, field, frozenset(convert(field, value)
+                                      for value in node[2])
+    if kind == 'range':
+        range_ = node[2]
+        return kind, field, Range(
+            None if range_.lower is None else convert(field, range_.lower),
+            None if range_.upper is None else convert(field, range_.upper),
+            range_.lower_inclusive, range_.upper_inclusive)
+    return kind, field, convert(field, node[2])
+
+
+def _is_empty(range_: Range) -> bool:
+    if range_.lower is None or range_.upper is None:
+        return False
+    return range_.lower > range_.upper or (
+        range_.lower == range_.upper
+        and not (range_.lower_inclusive and range_.upper_inclusive))
+
+
+def _negate(node: Node) -> Node:
+    """`not` the node, pushed down to the comparisons where possible."""
+    kind = node[0]
+    if kind == 'const':
+        return 'const', not node[1]
+    if kind == 'not':
+        return node[1]
+    if kind in ('eq', 'ne'):
+        return 'ne' if kind == 'eq' else 'eq', node[1], node[2]
+    if kind in ('in', 'not_in'):
+        return 'not_in' if kind == 'in' else 'in', node[1], node[2]
+    if kind in ('and', 'or'):
+        # De Morgan
+        return fold(('or' if kind == 'and' else 'and',
+                     tuple(_negate(child) for child in node[1])))
+    # below or above the range, rather than `not` within it, so that a row
+    # without a value is in neither, like in sqlite
+    field, range_ = node[1], node[2]
+    below = None if range_.lower is None else (
+        'range', field,
+        Range(upper=range_.lower, upper_inclusive=not range_.lower_inclusive))
+    above = None if range_.upper is None else (
+        'range', field,
+        Range(lower=range_.upper, lower_inclusive=not range_.upper_inclusive))
+    if below is None or above is None:
+        return below or above
+    return 'or', (below, above)
+
+
+def _fold_and(children: typing.Iterable[Node]) -> Node:
+    nodes = []
+    # field -> the index in `nodes` of its range, or its value
+    ranges: typing.Dict[str, int] = {}
+    equals: typing.Dict[str, typing.Any] = {}
+    for child in children:
+        kind = child[0]
+        if child == TRUE:
+            continue
+        if child == FALSE:
+            return FALSE
+        if kind == 'eq':
+            field, value = child[1], child[2]
+            if field in equals and equals[field] != value:
+                return FALSE
+            equals[field] = value
+        if kind == 'range' and child[1] in ranges:
+            index = ranges[child[1]]
+            range_ = nodes[index][2].intersect(child[2])
+            if _is_empty(range_):
+                return FALSE
+            nodes[index] = ('range', child[1], range_)
+            continue
+        if kind == 'range':
+            if _is_empty(child[2]):
+                return FALSE
+            ranges[child[1]] = len(nodes)
+        nodes.append(child)
+    if not nodes:
+        return TRUE
+    return nodes[0] if len(nodes) == 1 else ('and', tuple(nodes))
+
+
+def _fold_or(children: typing.Iterable[Node]) -> Node:
+    nodes = []
+    for child in children:
+        if child == FALSE:
+            continue
+        if child == TRUE:
+            return TRUE
+        nodes.append(child)
+    if not nodes:
+        return FALSE
+    return nodes[0] if len(nodes) == 1 else ('or', tuple(nodes))
+
+
+def fold(node: Node) -> Node:
+    """Simplify the tree, e.g. into a constant if always true or false."""
+    kind = node[0]
+    if kind in ('and', 'or'):
+        children = []
+        for child in map(fold, node[1]):
+            # flatten the nested ones of the same kind
+            children.extend(child[1] if child[0] == kind else [child])
+        return _fold_and(children) if kind == 'and' else _fold_or(children)
+    if kind == 'not':
+        return _negate(fold(node[1]))
+    if kind in ('in', 'not_in') and len(node[2]) == 1:
+        value, = node[2]
+        return 'eq' if kind == 'in' else 'ne', node[1], value
+    if kind == 'range' and _is_empty(node[2]):
+        return FALSE
+    return node
+
+
+def fields_of(node: Node) -> typing.FrozenSet[str]:
+    kind = node[0]
+    if kind == 'const':
+        return frozenset()
+    if kind in ('and', 'or'):
+        return frozenset().union(*map(fields_of, node[1]))
+    if kind == 'not':
+        return fields_of(node[1])
+    return frozenset([node[1]])
+
+
+@functools.lru_cache(maxsize=256)
+def compile_where(schema: 'SchemaManager', text: str) -> Where:
+    """Parse a `$where` expression, checking its fields against the schema
+    and converting its values to their types."""
+    from minesqlite.schema import field_types
+
+    fields = set(schema.fields)
+
+    def convert(field: str, value: str) -> typing.Any:
+        if field not in fields:
+            raise exceptions.CommandInvalidExpression(
+                expression=text, reason='unknown field `%s`' % field)
+        converter = field_types[schema.get_field_type(field)].converter
+        return converter(value)
+
+    node = fold(_bind(_Parser(text).parse(), convert))
+    return Where(text, node, fields_of(node))
+
+
+def _generate(node: Node, constants: list) -> str:
+    """The Python expression of the node, on `row`, whose values are the
+    `_c[i]` of `constants`."""
+    kind = node[0]
+    if kind == 'const':
+        return repr(node[1])
+    if kind in ('and', 'or'):
+        return '(%s)' % (' %s ' % kind).join(
+            _generate(child, constants) for child in node[1])
+    if kind == 'not':
+        return '(not %s)' % _generate(node[1], constants)
+
+    def constant(value: typing.Any) -> str:
+        constants.append(value)
+        return '_c[%d]' % (len(constants) - 1)
+
+    field = node[1]
+    if kind == 'range':
+        # like `Range.contains`: no value is in no range
+        range_ = node[2]
+        bounds = '_v'
+        if range_.lower is not None:
+            bounds = '%s %s %s' % (constant(range_.lower),
+                                   '<=' if range_.lower_inclusive else '<',
+                                   bounds)
+        if range_.upper is not None:
+            bounds = '%s %s %s' % (bounds,
+                                   '<=' if range_.upper_inclusive else '<',
+                                   constant(range_.upper))
+        return '((_v := row.get(%r)) is not None and %s)' % (field, bounds)
+    op = {'eq': '==', 'ne': '!=', 'in': 'in', 'not_in': 'not in'}[kind]
+    return '(row[%r] %s %s)' % (field, op, constant(node[2]))
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_source(source: str) -> typing.Callable:
+    """The factory of the predicates of a source, from their constants."""
+    namespace = {}
+    exec(compile(source, '<predicate>', 'exec'), namespace)
+    return namespace['make_predicate']
+
+
+def compile_predicate(node: Node) -> typing.Callable[[typing.Any], bool]:
+    """A function of a row telling whether it matches the node."""
+    constants = []
+    expression = _generate(node, constants)
+    source = ('def make_predicate(_c):\n'
+              '    def predicate(row):\n'
+              '        return %s\n'
+              '    return predicate\n' % expression)
+    return _compile_source(source)(tuple(constants))
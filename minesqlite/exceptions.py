@@ -56,6 +56,11 @@ class CommandArgumentConflict(MineSQLiteException):
     message_format = "conflict argument: %(key)s"
 
 
+class CommandInvalidExpression(MineSQLiteException):
+    errcode = '0x101007'
+    message_format = "invalid expression `%(expression)s`: %(reason)s"
+
+
 class DataDuplicateEntry(MineSQLiteException):
     errcode = '0x102001'
     message_format = 'duplicate entry: there is already an entry ' \
@@ -70,3 +75,14 @@ class DataEntryNotFound(MineSQLiteException):
 class DataEntryInvalid(MineSQLiteException):
     errcode = '0x102003'
     message_format = 'invalid entry: %(reason)s'
+
+
+class DataOperationUnsupported(MineSQLiteException):
+    errcode = '0x102004'
+    message_format = 'the data driver `%(driver)s` does not support ' \
+                     '%(operation)s'
+
+
+class DataSnapshotInvalid(MineSQLiteException):
+    errcode = '0x102005'
+    message_format = 'invalid snapshot file %(path)s: %(reason)s'
@@ -8,8 +8,12 @@ from tabulate import tabulate
 from minesqlite import exceptions
 from minesqlite.command_registry import get_command_info, CommandInfo
 from minesqlite.common.split_words_fsm import split_words
+from minesqlite.data.query import AFTER_KEY, MAGIC_KEYS, batched
 from minesqlite import MineSQLite
 
+# the number of rows printed at a time
+PRINT_CHUNK_ROWS = 1024
+
 
 def read_lines(instance: MineSQLite) -> typing.Iterator[str]:
     """Prints prompts, reads the input, then yields each lines of them."""
@@ -31,8 +35,7 @@ def read_lines(instance: MineSQLite) -> typing.Iterator[str]:
 
 
 def validate_key(key: str):
-    magic_params = ['$sort_asc', '$sort_desc']
-    if key in magic_params:
+    if key in MAGIC_KEYS:
         return
     if re.match(r'^[a-zA-Z_]\w*$', key, flags=re.ASCII) is None:
         raise exceptions.CommandInvalidKeyArgument(key=key)
@@ -82,19 +85,47 @@ def execute_command(instance: 'MineSQLite',
     return command_info.handler(instance, arguments)
 
 
+def _cut(value: typing.Any, width: int) -> typing.Any:
+    """The value, or its text cut to the width if it is longer."""
+    if value is None or len(str(value)) <= width:
+        return value
+    return str(value)[:width - 1] + '…'
+
+
 def print_results(instance: MineSQLite, rows: typing.Iterable[dict]):
-    """Print the results of a command."""
-    if not rows:
-        return
+    """Print the results of a command as an org-mode table, a chunk of rows
+    at a time as they come, rather than all at once.
 
-    headers = [field.upper() for field in instance.schema.fields]
-    table = []
-    for row_dict in rows:
-        row_list = []
-        for field in instance.schema.fields:
-            row_list.append(row_dict[field])
-        table.append(row_list)
-    print(tabulate(table, headers=headers, tablefmt='orgtbl'))
+    The columns are as wide as `tabulate` makes them for the first chunk;
+    a longer value in a next chunk is cut to fit.
+    """
+    # only the ones asked for, e.g. by `list $fields`
+    fields = getattr(rows, 'fields', None) or instance.schema.fields
+    headers = [field.upper() for field in fields]
+    widths = None
+    for chunk in batched(rows, PRINT_CHUNK_ROWS):
+        table = [[row.get(field) for field in fields] for row in chunk]
+        if widths is None:
+            lines = tabulate(table, headers=headers,
+                             tablefmt='orgtbl').split('\n')
+            # the separator line is `|---+---|`, with 1 space around cells
+            widths = [len(dashes) - 2
+                      for dashes in lines[1][1:-1].split('+')]
+        else:
+            # headers as wide as the columns keep them from narrowing; `-2`
+            # is for the spaces `tabulate` adds around the headers
+            table = [[_cut(value, width)
+                      for value, width in zip(cells, widths)]
+                     for cells in table]
+            lines = tabulate(table, headers=[header.ljust(width - 2)
+                                             for header, width
+                                             in zip(headers, widths)],
+                             tablefmt='orgtbl').split('\n')[2:]
+        print('\n'.join(lines), flush=True)
+
+    next_token = getattr(rows, 'next_token', None)
+    if next_token is not None:
+        print('next page: %s %s' % (AFTER_KEY, next_token))
 
 
 def repl_loop(instance: MineSQLite):
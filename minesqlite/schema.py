@@ -2,6 +2,7 @@
 # Author: @hsiaoxychen 2022/06/05
 import collections
 import datetime
+import re
 import typing
 from dataclasses import dataclass
 
@@ -12,6 +13,8 @@ from minesqlite import exceptions
 if typing.TYPE_CHECKING:
     from minesqlite.sysconf import SysConfManager
 
+_ISO_DATE = re.compile(r'\d{4}-\d{2}-\d{2}', re.ASCII)
+
 
 @dataclass
 class FieldType(object):
@@ -61,6 +64,11 @@ class SchemaManager(object):
             raise exceptions.InternalError(
                 "no primary_key found within schema definition")
 
+    @property
+    def definition(self) -> dict:
+        """The schema definition, as loaded from the yaml."""
+        return self._inner_data
+
     @property
     def fields(self):
         return [col['name'] for col in self._inner_data['columns']]
@@ -69,6 +77,31 @@ class SchemaManager(object):
     def primary_key(self):
         return self._primary_key['name']
 
+    def _fields_with_attribute(self, attribute: str) -> typing.List[str]:
+        return [col['name'] for col in self._inner_data['columns']
+                if attribute in col.get('attribute', '').split(',')]
+
+    @property
+    def indexed_fields(self) -> typing.List[str]:
+        """The fields with the `index` attribute, to be looked up quickly."""
+        return self._fields_with_attribute('index')
+
+    @property
+    def sorted_indexed_fields(self) -> typing.List[str]:
+        """The fields with the `sorted_index` attribute, kept in order."""
+        return self._fields_with_attribute('sorted_index')
+
+    @property
+    def bitmap_indexed_fields(self) -> typing.List[str]:
+        """The fields with the `bitmap_index` attribute, of few values."""
+        return self._fields_with_attribute('bitmap_index')
+
+    def get_field_type(self, field: str) -> str:
+        for col in self._inner_data['columns']:
+            if col['name'] == field:
+                return col['type']
+        raise exceptions.InternalError("unknown field: %s" % field)
+
     def validate_keys(self, entry: dict, no_missing=True, no_extra=True):
         """To ensure that no extra keys or missing keys in the entry."""
         got_keys = set(entry.keys())
@@ -93,6 +126,14 @@ class SchemaManager(object):
             entry[col['name']] = converted
         return entry
 
+    def convert_column(self, field: str,
+                       values: typing.Sequence[str]) -> typing.List:
+        """Convert the values of a field in bulk, each distinct value only
+        once, e.g. the dates or the departments of many rows."""
+        converter = field_types[self.get_field_type(field)].converter
+        converted = {value: converter(value) for value in set(values)}
+        return list(map(converted.__getitem__, values))
+
     def convert_primary_key_type(self, pk_value: str) -> typing.Any:
         field_type = self._primary_key['type']
         return field_types[field_type].converter(pk_value)
@@ -114,6 +155,13 @@ class SchemaManager(object):
     @staticmethod
     @register_field_helper("date")
     def _convert_date_type(value: str):
+        # the usual zero-padded dates skip the (much slower) strptime, which
+        # still takes the other forms it accepts, e.g. 2022-1-5
+        if _ISO_DATE.fullmatch(value):
+            try:
+                return datetime.datetime.fromisoformat(value)
+            except ValueError:
+                pass
         try:
             return datetime.datetime.strptime(value, '%Y-%m-%d')
         except ValueError as e:
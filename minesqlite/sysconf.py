@@ -67,6 +67,15 @@ class SysConfManager(collections.abc.MutableMapping):
         raise exceptions.InternalError(
             "invalid boolean value in config %s: %s" % (k, v))
 
+    @staticmethod
+    def _set_integer_helper(k: KT, v: VT) -> VT:
+        """A helper function that handles integer values."""
+        try:
+            return int(v)
+        except ValueError as e:
+            raise exceptions.InternalError(
+                "invalid integer value in config %s: %s" % (k, v)) from e
+
     @staticmethod
     def _hook_set_repl_read_infile(k: KT, v: VT) -> VT:
         return SysConfManager._set_filename_helper(k, v)
@@ -78,3 +87,63 @@ class SysConfManager(collections.abc.MutableMapping):
     @staticmethod
     def _hook_set_general_debug(k: KT, v: VT) -> VT:
         return SysConfManager._set_boolean_helper(k, v)
+
+    @staticmethod
+    def _hook_set_data_append_log_group_commit_ms(k: KT, v: VT) -> VT:
+        return SysConfManager._set_integer_helper(k, v)
+
+    @staticmethod
+    def _hook_set_data_lsm_memtable_rows(k: KT, v: VT) -> VT:
+        return SysConfManager._set_integer_helper(k, v)
+
+    @staticmethod
+    def _hook_set_data_lsm_max_runs(k: KT, v: VT) -> VT:
+        return SysConfManager._set_integer_helper(k, v)
+
+    @staticmethod
+    def _hook_set_data_lsm_bloom_bits_per_key(k: KT, v: VT) -> VT:
+        return SysConfManager._set_integer_helper(k, v)
+
+    @staticmethod
+    def _hook_set_data_btree_page_size(k: KT, v: VT) -> VT:
+        return SysConfManager._set_integer_helper(k, v)
+
+    @staticmethod
+    def _hook_set_data_btree_buffer_pool_pages(k: KT, v: VT) -> VT:
+        return SysConfManager._set_integer_helper(k, v)
+
+    @staticmethod
+    def _hook_set_data_memory_columnar_vectorized(k: KT, v: VT) -> VT:
+        return SysConfManager._set_boolean_helper(k, v)
+
+    @staticmethod
+    def _hook_set_data_parallel_workers(k: KT, v: VT) -> VT:
+        return SysConfManager._set_integer_helper(k, v)
+
+    @staticmethod
+    def _hook_set_data_parallel_chunk_rows(k: KT, v: VT) -> VT:
+        return SysConfManager._set_integer_helper(k, v)
+
+    @staticmethod
+    def _hook_set_data_cache_size(k: KT, v: VT) -> VT:
+        return SysConfManager._set_integer_helper(k, v)
+
+    @staticmethod
+    def _hook_set_data_cache_max_rows(k: KT, v: VT) -> VT:
+        return SysConfManager._set_integer_helper(k, v)
+
+    @staticmethod
+    def _hook_set_data_memory_max_bytes(k: KT, v: VT) -> VT:
+        return SysConfManager._set_integer_helper(k, v)
+
+    @staticmethod
+    def _hook_set_data_sqlite_cache_size(k: KT, v: VT) -> VT:
+        return SysConfManager._set_integer_helper(k, v)
+
+    @staticmethod
+    def _hook_set_data_partitioned_partitions(k: KT, v: VT) -> VT:
+        return SysConfManager._set_integer_helper(k, v)
+
+    @staticmethod
+    def _hook_set_data_partitioned_batch_size(k: KT, v: VT) -> VT:
+        return SysConfManager._set_integer_helper(k, v)
@@ -35,3 +35,24 @@ def instance(mocker: MockerFixture, sysconf, schema):
 @pytest.fixture
 def mock_pk(mocker: MockerFixture, instance):
     mocker.patch(instance.schema, 'primary_key', TEST_PK)
+
+
+@pytest.fixture
+def build_manager(instance):
+    """A factory of the data managers of a driver class, on top of the
+    sysconf items given, closed after the test.
+
+    The test module of a driver overrides it with a fixture of the same
+    name, which sets the driver up and binds its class.
+    """
+    managers = []
+
+    def build(cls, **sysconf):
+        instance.sysconf.update(sysconf)
+        manager = cls(instance)
+        managers.append(manager)
+        return manager
+
+    yield build
+    for manager in managers:
+        manager.close()
@@ -0,0 +1,27 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+import pytest
+
+from minesqlite.common.bloom import BloomFilter
+
+
+@pytest.mark.parametrize('keys', [
+    [],
+    [1, 2, 3],
+    ['a', 'b', 'c'],
+    list(range(1000)),
+])
+def test_bloom_filter(keys):
+    bloom = BloomFilter.for_capacity(len(keys))
+    for key in keys:
+        bloom.add(key)
+    # no false negatives
+    assert all(key in bloom for key in keys)
+
+    # persisted bits rebuild an identical filter
+    rebuilt = BloomFilter(bloom.num_bits, bloom.num_hashes, bytes(bloom.bits))
+    assert all(key in rebuilt for key in keys)
+
+    # false positives are rare with 10 bits per key
+    misses = [key for key in range(10000, 11000) if key in bloom]
+    assert len(misses) < 50
@@ -1,15 +1,32 @@
 # coding=utf-8
 # Author: @hsiaoxychen
+import datetime
+import functools
+
 import pytest
 from pytest_mock import MockerFixture
 
 from minesqlite import commands, exceptions
 from minesqlite.common import utils
 from minesqlite.command_registry import get_command_info
+from minesqlite.data.base import DataManagerABC
+from minesqlite.data.cache import ResultCache, Versions
+from minesqlite.data.query import encode_token
 from tests.conftest import TEST_PK
 from tests.utils import *
 
 
+def patch_select(mocker: MockerFixture, driver, mock_scan):
+    """Have the mock driver select through the default plan of a scan."""
+    mocker.patch.object(driver, 'scan', mock_scan)
+    mocker.patch.object(driver, 'stats', return_value={})
+    driver._parallel = None
+    driver._cache = ResultCache(0, 0, Versions(), 'id', driver.read_many)
+    for method in ['plan', 'select', 'fetch']:
+        mocker.patch.object(driver, method, functools.partial(
+            getattr(DataManagerABC, method), driver))
+
+
 @pytest.mark.parametrize('arguments', [
     [('id', '12345'), ('name', 'Chen Xiaoyuan')],
 ])
@@ -163,20 +180,85 @@ def test_command_list(mocker: MockerFixture, instance,
         return utils.convert_argument_groups_into_dict(
             [group for group in arguments if not group[0].startswith('$')])
 
-    def mock_build_cursor(*args, **kwargs):
-        return len(data)
-
-    def mock_next_row(cursor, *args, **kwargs):
-        return cursor - 1, data[cursor - 1]
+    def mock_scan(*args, **kwargs):
+        # in batches of at most 2 rows, in reversed order
+        rows = data[::-1]
+        for n in range(0, len(rows), 2):
+            yield rows[n:n + 2]
 
     mocker.patch.object(instance.schema, 'validate_keys')
     mocker.patch.object(instance.schema, 'convert_types', mock_convert_types)
-    mocker.patch.object(instance.data.driver, 'build_cursor', mock_build_cursor)
-    mocker.patch.object(instance.data.driver, 'next_row', mock_next_row)
+    patch_select(mocker, instance.data.driver, mock_scan)
+
+    with expect_exc:
+        got = commands.command_list(instance, arguments)
+        assert list(got) == expect
+
+
+@pytest.mark.parametrize(
+    ['arguments', 'expect_ids', 'expect_exc'],
+    [
+        ([('$gt', 'id=2')], [3, 4], no_raise()),
+        ([('$lt', 'id=3'), ('$between', 'id=2,4')], [2], no_raise()),
+        ([('$between', 'id=2,3'), ('$sort_desc', 'id')], [3, 2], no_raise()),
+        ([('$sort_desc', 'id'), ('$limit', '2')], [4, 3], no_raise()),
+        ([('$limit', '0')], [], no_raise()),
+        ([('$limit', '-1')], None,
+         raises(exceptions.CommandInvalidValueArgument)),
+        ([('$limit', '1'), ('$limit', '2')], None,
+         raises(exceptions.CommandArgumentConflict)),
+        ([('$gt', 'id')], None,
+         raises(exceptions.CommandInvalidValueArgument)),
+        ([('$between', 'id=1')], None,
+         raises(exceptions.CommandInvalidValueArgument)),
+        # ranges only apply to integers and dates
+        ([('$gt', 'name=a')], None,
+         raises(exceptions.CommandInvalidValueArgument)),
+        ([('$where', 'id > 2 or name == n1')], [1, 3, 4], no_raise()),
+        ([('$where', 'id in (1, 4)'), ('$gt', 'id=1')], [4], no_raise()),
+        ([('$where', 'id > 1'), ('$where', 'id < 3')], None,
+         raises(exceptions.CommandArgumentConflict)),
+        ([('$where', 'id >')], None,
+         raises(exceptions.CommandInvalidExpression)),
+        ([('$fields', 'name'), ('$gt', 'id=3')], [4], no_raise()),
+        ([('$fields', ' , ')], None,
+         raises(exceptions.CommandInvalidValueArgument)),
+    ]
+)
+def test_command_list_ranges(mocker: MockerFixture, instance,
+                             arguments, expect_ids, expect_exc):
+    data = [{'id': n, 'name': 'n%d' % n} for n in range(1, 5)]
+    mocker.patch.object(instance.schema, 'primary_key', 'id')
+    mocker.patch.object(instance.schema, 'fields', ['id', 'name'])
+
+    def mock_scan(*args, **kwargs):
+        yield data
+
+    mocker.patch.object(instance.schema, 'validate_keys')
+    mocker.patch.object(instance.schema, 'get_field_type',
+                        lambda field: {'id': 'integer'}.get(field, 'string'))
+    mocker.patch.object(instance.schema, 'convert_types', lambda kvs: {
+        key: int(value) for key, value in kvs.items()})
+    patch_select(mocker, instance.data.driver, mock_scan)
 
     with expect_exc:
         got = commands.command_list(instance, arguments)
-        assert got == expect
+        assert [row['id'] for row in got] == expect_ids
+
+
+def test_command_list_fields(mocker: MockerFixture, instance):
+    data = [{'id': n, 'name': 'n%d' % n, 'age': n} for n in range(1, 4)]
+    mocker.patch.object(instance.schema, 'primary_key', 'id')
+    mocker.patch.object(instance.schema, 'validate_keys')
+    mocker.patch.object(instance.schema, 'convert_types', lambda kvs: kvs)
+    patch_select(mocker, instance.data.driver, lambda *args: iter([data]))
+
+    page = commands.command_list(instance, [('$fields', 'name'),
+                                            ('$sort_desc', 'age')])
+    assert page.fields == ['name']
+    # along with the primary key and the sorted fields
+    assert list(page) == [{'name': 'n%d' % n, 'id': n, 'age': n}
+                          for n in (3, 2, 1)]
 
 
 @pytest.mark.parametrize(
@@ -214,6 +296,286 @@ def test_command_mod(mocker: MockerFixture, instance, arguments, expect_exc):
         assert got == [mock_ret]
 
 
+@pytest.mark.parametrize(
+    ['sysconf_path', 'arguments', 'expect_path', 'expect_exc'],
+    [
+        ('', ['a.bin'], 'a.bin', no_raise()),
+        ('b.bin', ['a.bin'], 'a.bin', no_raise()),
+        # defaults to the configured path
+        ('b.bin', [], 'b.bin', no_raise()),
+        ('', [], None, raises(exceptions.CommandTooFewArguments)),
+    ]
+)
+@pytest.mark.parametrize(
+    ['command', 'handler', 'method'],
+    [
+        ('save', commands.command_save, 'save_snapshot'),
+        ('load', commands.command_load, 'load_snapshot'),
+    ]
+)
+def test_command_snapshot(mocker: MockerFixture, instance,
+                          command, handler, method, sysconf_path, arguments,
+                          expect_path, expect_exc):
+    assert get_command_info(command) is not None
+    instance.sysconf['data.snapshot.path'] = sysconf_path
+    mock_method = mocker.patch.object(instance.data.driver, method)
+    mock_method.return_value = 0
+
+    with expect_exc:
+        assert handler(instance, arguments) == []
+        mock_method.assert_called_once_with(expect_path)
+
+
+@pytest.mark.parametrize(
+    ['name', 'content', 'format_', 'expect_entries', 'expect_out',
+     'expect_exc'],
+    [
+        (
+            'employees.csv',
+            'name,id\na,1\nb,2\n',
+            [],
+            [(1, {'name': 'a'}), (2, {'name': 'b'})],
+            '2 employee(s) imported from {}\n',
+            no_raise(),
+        ),
+        (
+            'employees.txt',
+            '{"id": 1, "name": "a"}\n',
+            ['jsonl'],
+            [(1, {'name': 'a'})],
+            '1 employee(s) imported from {}\n',
+            no_raise(),
+        ),
+        ('employees.txt', '', [], None, '',
+         raises(exceptions.CommandInvalidValueArgument)),
+        ('employees.csv', 'name,id\na,x\n', [], None,
+         '0 employee(s) imported from {} before the error\n',
+         raises(exceptions.DataEntryInvalid)),
+        # the batches before a bad row stay added
+        ('employees.csv', 'name,id\n' + 'a,1\n' * 4096 + 'b,x\n', [], None,
+         '4096 employee(s) imported from {} before the error\n',
+         raises(exceptions.DataEntryInvalid)),
+    ]
+)
+def test_command_import(mocker: MockerFixture, instance, tmp_path, capsys,
+                        name, content, format_, expect_entries, expect_out,
+                        expect_exc):
+    assert get_command_info('import') is not None
+    mocker.patch.object(instance.schema, 'primary_key', 'id')
+    mocker.patch.object(instance.schema, 'fields', ['id', 'name'])
+
+    def mock_convert_column(field, values):
+        if field != 'id':
+            return values
+        if not all(value.isdigit() for value in values):
+            raise exceptions.DataEntryInvalid(reason='invalid integer')
+        return list(map(int, values))
+
+    mocker.patch.object(instance.schema, 'convert_column',
+                        mock_convert_column)
+    mock_create_many = mocker.patch.object(instance.data.driver,
+                                           'create_many', side_effect=len)
+    path = tmp_path / name
+    path.write_text(content)
+
+    with expect_exc:
+        assert commands.command_import(instance,
+                                       [str(path)] + format_) == []
+    assert capsys.readouterr().out == expect_out.format(path)
+    if expect_entries is not None:
+        mock_create_many.assert_called_once_with(expect_entries)
+
+
+@pytest.mark.parametrize(
+    ['arguments', 'expect_pages', 'expect_exc'],
+    [
+        # ties by id, in the direction of the last sort
+        ([('$sort_desc', 'name'), ('$limit', '2')], [[3, 1], [4, 2]],
+         no_raise()),
+        ([('$sort_asc', 'id'), ('$limit', '3')], [[1, 2, 3], [4]],
+         no_raise()),
+        # no token without sorts
+        ([('$limit', '2')], [[1, 2]], no_raise()),
+        # the offset applies to every page
+        ([('$sort_asc', 'id'), ('$limit', '1'), ('$offset', '1')],
+         [[2], [4]], no_raise()),
+        ([('$offset', '1'), ('$offset', '2')], None,
+         raises(exceptions.CommandArgumentConflict)),
+        ([('$offset', 'x')], None,
+         raises(exceptions.CommandInvalidValueArgument)),
+        ([('$sort_asc', 'id'), ('$after', 'x')], None,
+         raises(exceptions.CommandInvalidValueArgument)),
+    ]
+)
+def test_command_list_pages(mocker: MockerFixture, instance,
+                            arguments, expect_pages, expect_exc):
+    data = [{'id': n, 'name': 'n%d' % (n % 2)} for n in range(1, 5)]
+    mocker.patch.object(instance.schema, 'primary_key', 'id')
+    mocker.patch.object(instance.schema, 'get_field_type', {
+        'id': 'integer', 'name': 'string'}.get)
+    mocker.patch.object(instance.schema, 'validate_keys')
+    mocker.patch.object(instance.schema, 'convert_types', lambda kvs: kvs)
+    patch_select(mocker, instance.data.driver, lambda *args: iter([data]))
+
+    with expect_exc:
+        pages = []
+        page = commands.command_list(instance, arguments)
+        pages.append([row['id'] for row in page])
+        while page.next_token is not None:
+            page = commands.command_list(
+                instance, arguments + [('$after', page.next_token)])
+            pages.append([row['id'] for row in page])
+        assert pages == expect_pages
+
+
+def test_command_list_token_of_other_order(mocker: MockerFixture, instance):
+    mocker.patch.object(instance.schema, 'primary_key', 'id')
+    mocker.patch.object(instance.schema, 'validate_keys')
+    mocker.patch.object(instance.schema, 'convert_types', lambda kvs: kvs)
+    token = encode_token(['name', 'id'], ['n1', 1])
+    with raises(exceptions.CommandInvalidValueArgument):
+        commands.command_list(instance, [('$sort_asc', 'id'),
+                                         ('$after', token)])
+
+
+@pytest.mark.parametrize(
+    ['sorts', 'key', 'expect_exc'],
+    [
+        (['in_date', 'id'], [datetime.datetime(2022, 6, 5), 1], no_raise()),
+        (['in_date', 'id'], ['abc', 1],
+         raises(exceptions.CommandInvalidValueArgument)),
+        (['in_date', 'id'], [{'$date': '2022-06-05'}, '1'],
+         raises(exceptions.CommandInvalidValueArgument)),
+        (['id'], ['x'], raises(exceptions.CommandInvalidValueArgument)),
+        (['id'], [True], raises(exceptions.CommandInvalidValueArgument)),
+        (['name', 'id'], [None, 1],
+         raises(exceptions.CommandInvalidValueArgument)),
+    ]
+)
+def test_command_list_token_of_other_types(mocker: MockerFixture, instance,
+                                           sorts, key, expect_exc):
+    mocker.patch.object(instance.schema, 'primary_key', 'id')
+    mocker.patch.object(instance.schema, 'get_field_type', {
+        'id': 'integer', 'name': 'string', 'in_date': 'date'}.get)
+    mocker.patch.object(instance.schema, 'validate_keys')
+    mocker.patch.object(instance.schema, 'convert_types', lambda kvs: kvs)
+    patch_select(mocker, instance.data.driver, lambda *args: iter([[]]))
+    token = encode_token(sorts, key)
+    with expect_exc:
+        commands.command_list(instance, [('$sort_desc', sorts[0]),
+                                         ('$after', token)])
+
+
+def test_command_stats(mocker: MockerFixture, instance, capsys):
+    assert get_command_info('stats') is not None
+    mocker.patch.object(instance.data.driver, 'stats',
+                        return_value={'hits': 1, 'evictions': 2})
+    mocker.patch.object(instance.data.driver, 'cache_stats',
+                        return_value={'cache_hits': 3})
+
+    assert commands.command_stats(instance, []) == []
+    assert capsys.readouterr().out.splitlines() \
+           == ['hits        1', 'evictions   2', 'cache_hits  3']
+
+
+@pytest.mark.parametrize(
+    ['arguments', 'expect_filters', 'expect_ranges', 'expect_limit'],
+    [
+        ([], {}, [], None),
+        ([('name', 'a'), ('$gt', 'id=1'), ('$limit', '5')],
+         {'name': 'a'}, ['id'], 5),
+    ]
+)
+def test_command_count(mocker: MockerFixture, instance, capsys, arguments,
+                       expect_filters, expect_ranges, expect_limit):
+    assert get_command_info('count') is not None
+    mocker.patch.object(instance.schema, 'validate_keys')
+    mocker.patch.object(instance.schema, 'get_field_type',
+                        return_value='integer')
+    mocker.patch.object(instance.schema, 'convert_types', lambda kvs: {
+        key: int(value) if key == 'id' else value
+        for key, value in kvs.items()})
+    mock_count = mocker.patch.object(instance.data.driver, 'count',
+                                     return_value=3)
+
+    assert commands.command_count(instance, arguments) == []
+    assert capsys.readouterr().out == '3 employee(s)\n'
+    query = mock_count.call_args.args[0]
+    assert query.filters == expect_filters
+    assert list(query.ranges) == expect_ranges
+    assert query.limit == expect_limit
+
+
+@pytest.mark.parametrize(
+    ['arguments', 'groups', 'expect_group_by', 'expect_filters',
+     'expect_lines'],
+    [
+        ([('dept', '$count')], {('P2',): 1, ('P1',): 2}, ['dept'], {},
+         ['| DEPT   |   COUNT |', '|--------+---------|',
+          '| P1     |       2 |', '| P2     |       1 |']),
+        ([('pos', '$count'), ('dept', 'P1'), ('dept', '$count')],
+         {('SDE2', 'P1'): 1, ('SDE1', 'P1'): 1}, ['pos', 'dept'],
+         {'dept': 'P1'},
+         ['| POS   | DEPT   |   COUNT |', '|-------+--------+---------|',
+          '| SDE1  | P1     |       1 |', '| SDE2  | P1     |       1 |']),
+    ]
+)
+def test_command_group(mocker: MockerFixture, instance, capsys, arguments,
+                       groups, expect_group_by, expect_filters,
+                       expect_lines):
+    assert get_command_info('group') is not None
+    instance.schema.fields = ['id', 'dept', 'pos']
+    mocker.patch.object(instance.schema, 'validate_keys')
+    mocker.patch.object(instance.schema, 'convert_types', lambda kvs: kvs)
+    mock_aggregate = mocker.patch.object(instance.data.driver, 'aggregate',
+                                         return_value=groups)
+
+    assert commands.command_group(instance, arguments) == []
+    assert capsys.readouterr().out.splitlines() == expect_lines
+    query, group_by = mock_aggregate.call_args.args
+    assert group_by == expect_group_by
+    assert query.filters == expect_filters
+
+
+@pytest.mark.parametrize(
+    ['arguments', 'expect_exception'],
+    [
+        ([('dept', 'P1')], exceptions.CommandTooFewArguments),
+        ([('age', '$count')], exceptions.CommandInvalidKeyArgument),
+        ([('dept', '$count'), ('dept', '$count')],
+         exceptions.CommandArgumentConflict),
+        ([('dept', '$count'), ('$sort_asc', 'id')],
+         exceptions.CommandInvalidKeyArgument),
+        ([('dept', '$count'), ('$limit', '3')],
+         exceptions.CommandInvalidKeyArgument),
+    ]
+)
+def test_command_group_invalid(mocker: MockerFixture, instance, arguments,
+                               expect_exception):
+    instance.schema.fields = ['id', 'dept', 'pos']
+    mocker.patch.object(instance.schema, 'validate_keys')
+    mocker.patch.object(instance.schema, 'convert_types', lambda kvs: kvs)
+    with pytest.raises(expect_exception):
+        commands.command_group(instance, arguments)
+
+
+def test_command_explain(mocker: MockerFixture, instance, capsys):
+    assert get_command_info('explain') is not None
+    data = [{'id': n, 'name': 'n%d' % (n % 2)} for n in range(1, 5)]
+    mocker.patch.object(instance.schema, 'validate_keys')
+    mocker.patch.object(instance.schema, 'convert_types', lambda kvs: kvs)
+    patch_select(mocker, instance.data.driver, lambda *args: iter([data]))
+    mocker.patch.object(instance.data.driver, 'explain', functools.partial(
+        DataManagerABC.explain, instance.data.driver))
+
+    assert commands.command_explain(instance, [('name', 'n1')]) == []
+    assert capsys.readouterr().out.splitlines() == [
+        'project *  (estimated ?, actual 2)',
+        '-> filter name = n1  (estimated ?, actual 2)',
+        '   -> scan  (estimated ?, actual 4)',
+    ]
+
+
 def test_command_help_of_all(mocker: MockerFixture, instance):
     assert get_command_info('help') is not None
 
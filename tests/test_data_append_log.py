@@ -0,0 +1,170 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+import functools
+import os
+
+import pytest
+from pytest_mock import MockerFixture
+
+from minesqlite import exceptions
+from minesqlite.data import codec
+from minesqlite.data.drivers.append_log import (
+    OP_GENERATION,
+    AppendLogDataManager,
+)
+from tests.conftest import TEST_PK
+from tests.utils import *
+
+
+@pytest.fixture
+def log_path(tmp_path):
+    return str(tmp_path / 'data' / 'append.log')
+
+
+@pytest.fixture
+def build_manager(mocker: MockerFixture, instance, log_path,
+                  build_manager):
+    mocker.patch.object(instance.schema, 'primary_key', TEST_PK)
+    mocker.patch.object(instance.schema, 'fields', [TEST_PK, 'k'])
+    instance.sysconf['data.append_log.path'] = log_path
+    instance.sysconf['data.append_log.group_commit_ms'] = 0
+    return functools.partial(build_manager, AppendLogDataManager)
+
+
+def dump(manager: AppendLogDataManager) -> dict:
+    return {pk: manager._layout.to_kvs(manager._store.records[slot])
+            for pk, slot in manager._slots.items()}
+
+
+def test_replay(build_manager):
+    manager = build_manager()
+    manager.create_one('pk1', {'k': 'v1'})
+    manager.create_one('pk2', {'k': 'v2'})
+    manager.create_one('pk3', {'k': 'v3'})
+    manager.update_one('pk2', {'k': 'v22'})
+    manager.delete_one('pk3')
+    with raises(exceptions.DataDuplicateEntry):
+        manager.create_one('pk1', {'k': 'v'})
+    manager.close()
+
+    manager = build_manager()
+    assert dump(manager) == {'pk1': {'k': 'v1'}, 'pk2': {'k': 'v22'}}
+
+
+def test_replay_create_many(build_manager):
+    manager = build_manager()
+    assert manager.create_many([('pk1', {'k': 'v1'}),
+                                ('pk2', {'k': 'v2'})]) == 2
+    with raises(exceptions.DataDuplicateEntry):
+        manager.create_many([('pk3', {'k': 'v3'}), ('pk1', {'k': 'v'})])
+    manager.close()
+
+    manager = build_manager()
+    assert dump(manager) == {'pk1': {'k': 'v1'}, 'pk2': {'k': 'v2'}}
+
+
+def test_replay_torn_tail(build_manager, log_path):
+    manager = build_manager()
+    manager.create_one('pk1', {'k': 'v1'})
+    manager.create_one('pk2', {'k': 'v2'})
+    manager.close()
+
+    # simulate a crash in the middle of writing the last record
+    size = os.path.getsize(log_path)
+    with open(log_path, 'r+b') as f:
+        f.truncate(size - 3)
+
+    manager = build_manager()
+    assert dump(manager) == {'pk1': {'k': 'v1'}}
+    manager.create_one('pk3', {'k': 'v3'})
+    manager.close()
+
+    manager = build_manager()
+    assert dump(manager) == {'pk1': {'k': 'v1'}, 'pk3': {'k': 'v3'}}
+
+
+@pytest.mark.parametrize(
+    ['group_commit_ms', 'expect_fsync_calls'],
+    [
+        # sync every single write
+        (0, 3),
+        # all writes fall into the same window, synced once when closing
+        (60 * 1000, 1),
+    ]
+)
+def test_group_commit(mocker: MockerFixture, instance, build_manager,
+                      group_commit_ms, expect_fsync_calls):
+    instance.sysconf['data.append_log.group_commit_ms'] = group_commit_ms
+    mock_fsync = mocker.patch('os.fsync')
+
+    manager = build_manager()
+    for n in range(3):
+        manager.create_one('pk%d' % n, {'k': n})
+    manager.close()
+
+    assert mock_fsync.call_count == expect_fsync_calls
+
+
+def test_checkpoint(instance, build_manager, log_path, tmp_path):
+    snapshot_path = str(tmp_path / 'snapshot.bin')
+    instance.sysconf['data.snapshot.path'] = snapshot_path
+
+    manager = build_manager()
+    manager.create_one('pk1', {'k': 'v1'})
+    manager.create_one('pk2', {'k': 'v2'})
+    manager.save_snapshot(snapshot_path)
+    # the log is emptied by the checkpoint, but for its generation
+    with open(log_path, 'rb') as f:
+        assert [obj for _, obj in codec.iter_records(f.read())] \
+               == [(OP_GENERATION, 2, None)]
+    manager.delete_one('pk1')
+    manager.close()
+
+    manager = build_manager()
+    assert dump(manager) == {'pk2': {'k': 'v2'}}
+
+
+def test_crash_while_checkpointing(mocker: MockerFixture, instance,
+                                   build_manager, tmp_path):
+    snapshot_path = str(tmp_path / 'snapshot.bin')
+    instance.sysconf['data.snapshot.path'] = snapshot_path
+
+    manager = build_manager()
+    manager.create_one('pk1', {'k': 'v1'})
+    manager.create_one('pk2', {'k': 'v2'})
+    manager.save_snapshot(snapshot_path)
+    manager.delete_one('pk1')
+    manager.create_one('pk3', {'k': 'v3'})
+    # crash after writing the snapshot, before resetting the log
+    mocker.patch.object(manager, '_reset_log', side_effect=SystemExit)
+    with raises(SystemExit):
+        manager.save_snapshot(snapshot_path)
+
+    # the log is covered by the snapshot, not replayed on top of it
+    manager = build_manager()
+    assert dump(manager) == {'pk2': {'k': 'v2'}, 'pk3': {'k': 'v3'}}
+    manager.create_one('pk4', {'k': 'v4'})
+    manager.close()
+
+    manager = build_manager()
+    assert dump(manager) == {'pk2': {'k': 'v2'}, 'pk3': {'k': 'v3'},
+                             'pk4': {'k': 'v4'}}
+
+
+@pytest.mark.parametrize('with_snapshot_path', [False, True])
+def test_load_snapshot(instance, build_manager, tmp_path, with_snapshot_path):
+    if with_snapshot_path:
+        instance.sysconf['data.snapshot.path'] = str(tmp_path / 'main.bin')
+    backup_path = str(tmp_path / 'backup.bin')
+
+    manager = build_manager()
+    manager.create_one('pk1', {'k': 'v1'})
+    manager.save_snapshot(backup_path)
+    manager.create_one('pk2', {'k': 'v2'})
+    manager.load_snapshot(backup_path)
+    manager.create_one('pk3', {'k': 'v3'})
+    manager.close()
+
+    # the rows dropped by loading must not be revived
+    manager = build_manager()
+    assert dump(manager) == {'pk1': {'k': 'v1'}, 'pk3': {'k': 'v3'}}
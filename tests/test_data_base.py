@@ -1,10 +1,18 @@
 # coding=utf-8
 # Author: @hsiaoxychen
 import pytest
+from pytest_mock import MockerFixture
 
 from minesqlite import exceptions
-from minesqlite.data.drivers import memory_dict
-from minesqlite.data.base import DataManager
+from minesqlite.data.drivers import (
+    append_log,
+    btree,
+    lsm,
+    memory_columnar,
+    memory_dict,
+)
+from minesqlite.data.base import DataManager, DataManagerABC, IteratorCursor
+from tests.conftest import TEST_PK
 
 
 def test_data_manager_memory_dict(instance):
@@ -17,3 +25,68 @@ def test_data_manager_illegal_driver(instance):
     instance.sysconf['data.driver'] = 'something_illegal'
     with pytest.raises(exceptions.InternalError):
         DataManager(instance)
+
+
+def test_data_manager_append_log(instance, tmp_path):
+    instance.sysconf['data.driver'] = 'append_log'
+    instance.sysconf['data.append_log.path'] = str(tmp_path / 'append.log')
+    manager = DataManager(instance)
+    assert isinstance(manager.driver, append_log.AppendLogDataManager)
+    manager.driver.close()
+
+
+def test_data_manager_lsm(instance, tmp_path):
+    instance.sysconf['data.driver'] = 'lsm'
+    instance.sysconf['data.lsm.path'] = str(tmp_path / 'lsm')
+    manager = DataManager(instance)
+    assert isinstance(manager.driver, lsm.LSMDataManager)
+    manager.driver.close()
+
+
+def test_data_manager_btree(instance, tmp_path):
+    instance.sysconf['data.driver'] = 'btree'
+    instance.sysconf['data.btree.path'] = str(tmp_path / 'btree.db')
+    manager = DataManager(instance)
+    assert isinstance(manager.driver, btree.BTreeDataManager)
+    manager.driver.close()
+
+
+def test_data_manager_memory_columnar(mocker: MockerFixture, instance):
+    mocker.patch.object(instance.schema, 'primary_key', TEST_PK)
+    mocker.patch.object(instance.schema, 'fields', [TEST_PK])
+    instance.sysconf['data.driver'] = 'memory_columnar'
+    manager = DataManager(instance)
+    assert isinstance(manager.driver,
+                      memory_columnar.MemoryColumnarDataManager)
+
+
+class _ListDataManager(DataManagerABC):
+    """Implements only the per-row cursor API, over a list of rows."""
+
+    def __init__(self, instance, rows):
+        super().__init__(instance)
+        self.rows = rows
+
+    def build_cursor(self):
+        return IteratorCursor(iter(self.rows))
+
+    def next_row(self, cursor=None):
+        return cursor, cursor.advance()
+
+    create_one = read_one = update_one = delete_one = None
+
+
+@pytest.mark.parametrize(
+    ['num_rows', 'batch_size', 'expect_sizes'],
+    [
+        (0, 2, []),
+        (4, 2, [2, 2]),
+        (5, 2, [2, 2, 1]),
+        (5, 10, [5]),
+    ]
+)
+def test_default_scan(instance, num_rows, batch_size, expect_sizes):
+    rows = [{'n': n} for n in range(num_rows)]
+    batches = list(_ListDataManager(instance, rows).scan(batch_size))
+    assert [len(batch) for batch in batches] == expect_sizes
+    assert [row for batch in batches for row in batch] == rows
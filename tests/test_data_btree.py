@@ -0,0 +1,121 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+import functools
+import math
+import random
+
+import pytest
+from pytest_mock import MockerFixture
+
+from minesqlite import exceptions
+from minesqlite.data.drivers.btree import BTreeDataManager
+from tests.conftest import TEST_PK
+from tests.utils import *
+
+
+@pytest.fixture
+def build_manager(mocker: MockerFixture, instance, tmp_path,
+                  build_manager):
+    mocker.patch.object(instance.schema, 'primary_key', TEST_PK)
+    instance.sysconf['data.btree.path'] = str(tmp_path / 'btree.db')
+    instance.sysconf['data.btree.page_size'] = 512
+    instance.sysconf['data.btree.buffer_pool_pages'] = 16
+    return functools.partial(build_manager, BTreeDataManager)
+
+
+def test_crud(build_manager):
+    manager = build_manager()
+    assert not manager.build_cursor()
+
+    pks = list(range(500))
+    random.Random(0).shuffle(pks)
+    for pk in pks:
+        manager.create_one(pk, {'k': 'v%d' % pk})
+    with raises(exceptions.DataDuplicateEntry):
+        manager.create_one(pks[0], {'k': 'v'})
+
+    assert manager.read_one(123) == {TEST_PK: 123, 'k': 'v123'}
+    assert manager.update_one(123, {'k': 'x' * 50}) == \
+           {TEST_PK: 123, 'k': 'x' * 50}
+    assert manager.delete_one(124) == {TEST_PK: 124, 'k': 'v124'}
+    for pk in [124, 1000]:
+        with raises(exceptions.DataEntryNotFound):
+            manager.read_one(pk)
+        with raises(exceptions.DataEntryNotFound):
+            manager.update_one(pk, {'k': 'v'})
+        with raises(exceptions.DataEntryNotFound):
+            manager.delete_one(pk)
+
+    # the scan walks the leaf chain in key order
+    rows = traverse(manager)
+    assert [row[TEST_PK] for row in rows] == \
+           [pk for pk in range(500) if pk != 124]
+    assert rows[123]['k'] == 'x' * 50
+
+
+def test_point_get_touches_log_n_pages(build_manager):
+    manager = build_manager()
+    for pk in range(2000):
+        manager.create_one(pk, {'k': pk})
+
+    before = manager.stats()
+    manager.read_one(1234)
+    after = manager.stats()
+    touches = (after['page_hits'] + after['page_misses']) \
+        - (before['page_hits'] + before['page_misses'])
+    assert touches <= math.ceil(math.log2(manager.stats()['pages'])) + 1
+
+
+def test_reopen(build_manager):
+    manager = build_manager()
+    for pk in range(300):
+        manager.create_one(pk, {'k': pk})
+    manager.delete_one(0)
+    manager.close()
+
+    manager = build_manager()
+    assert traverse(manager) == [{TEST_PK: pk, 'k': pk}
+                                 for pk in range(1, 300)]
+
+
+def test_cursor_survives_modifications(build_manager):
+    manager = build_manager()
+    for pk in range(0, 200, 2):
+        manager.create_one(pk, {'k': pk})
+
+    cursor = manager.build_cursor()
+    cursor, row = manager.next_row(cursor)
+    assert row[TEST_PK] == 0
+    # deletes the next row, and splits the leaf the cursor points to
+    manager.delete_one(2)
+    for pk in range(1, 200, 2):
+        manager.create_one(pk, {'k': pk})
+
+    got = []
+    while cursor:
+        cursor, row = manager.next_row(cursor)
+        got.append(row[TEST_PK])
+    assert got == list(range(3, 200))
+
+
+def test_scan_survives_modifications(build_manager):
+    manager = build_manager()
+    for pk in range(0, 200, 2):
+        manager.create_one(pk, {'k': pk})
+
+    got = []
+    for batch in manager.scan(7):
+        assert 0 < len(batch) <= 7
+        got.extend(row[TEST_PK] for row in batch)
+        if len(got) == 7:
+            # deletes the next row, and splits the leaves ahead
+            manager.delete_one(14)
+            for pk in range(1, 200, 2):
+                manager.create_one(pk, {'k': pk})
+    assert got == list(range(0, 14, 2)) + [13] + list(range(15, 200))
+
+
+def test_entry_too_large(build_manager):
+    manager = build_manager()
+    with raises(exceptions.DataEntryInvalid):
+        manager.create_one(1, {'k': 'x' * 1000})
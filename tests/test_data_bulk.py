@@ -0,0 +1,80 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+import pytest
+
+from minesqlite import exceptions
+from minesqlite.data import bulk
+from tests.utils import *
+
+FIELDS = ['id', 'name', 'age']
+
+
+@pytest.mark.parametrize(
+    ['path', 'expect', 'expect_exc'],
+    [
+        ('employees.csv', 'csv', no_raise()),
+        ('a/employees.JSONL', 'jsonl', no_raise()),
+        ('employees.json', 'jsonl', no_raise()),
+        ('employees.txt', None,
+         raises(exceptions.CommandInvalidValueArgument)),
+        ('employees', None, raises(exceptions.CommandInvalidValueArgument)),
+    ]
+)
+def test_format_of(path, expect, expect_exc):
+    with expect_exc:
+        assert bulk.format_of(path) == expect
+
+
+@pytest.mark.parametrize(
+    ['format_', 'content', 'expect', 'expect_exc'],
+    [
+        # fields in any order, empty lines skipped
+        (
+            'csv',
+            'age, id,name\n30,1,a\n\n"40",2,"b, c"\n31,3,d\n',
+            [{'id': ['1', '2'], 'name': ['a', 'b, c'], 'age': ['30', '40']},
+             {'id': ['3'], 'name': ['d'], 'age': ['31']}],
+            no_raise(),
+        ),
+        ('csv', '', [], no_raise()),
+        ('csv', 'id,name\n1,a\n', None, raises(exceptions.DataEntryInvalid,
+                                               match='line 1: missing')),
+        ('csv', 'id,name,age,x\n', None, raises(exceptions.DataEntryInvalid,
+                                                match='line 1: unexpected')),
+        ('csv', 'id,name,age,id\n', None, raises(exceptions.DataEntryInvalid,
+                                                 match='line 1: a field')),
+        ('csv', 'id,name,age\n1,a,30\n2,b\n', None,
+         raises(exceptions.DataEntryInvalid, match='line 3: expect 3')),
+        # values turned into strings, batches of lines
+        (
+            'jsonl',
+            '{"id": 1, "name": "a", "age": 30}\n\n'
+            '{"age": "40", "name": "b", "id": "2"}\n'
+            '{"id": 3, "name": "d", "age": 31}\n',
+            [{'id': ['1'], 'name': ['a'], 'age': ['30']},
+             {'id': ['2', '3'], 'name': ['b', 'd'], 'age': ['40', '31']}],
+            no_raise(),
+        ),
+        ('jsonl', '\n\n\n', [], no_raise()),
+        ('jsonl', '{"id": 1, "name": "a", "age": 30}\n{"id": 2\n', None,
+         raises(exceptions.DataEntryInvalid, match='line 2: invalid JSON')),
+        ('jsonl', '[1, "a", 30]\n', None,
+         raises(exceptions.DataEntryInvalid, match='line 1: not an object')),
+        ('jsonl', '{"id": 1, "name": "a"}\n', None,
+         raises(exceptions.DataEntryInvalid, match='line 1: missing keys')),
+        ('jsonl', '{"id": 1, "name": "a", "age": 30, "x": 1}\n', None,
+         raises(exceptions.DataEntryInvalid, match='line 1: unexpected')),
+    ]
+)
+def test_read_columns(tmp_path, format_, content, expect, expect_exc):
+    path = tmp_path / ('employees.' + format_)
+    path.write_text(content, encoding='utf-8')
+    with expect_exc:
+        got = list(bulk.read_columns(str(path), format_, FIELDS,
+                                     batch_rows=2))
+        assert got == expect
+
+
+def test_read_columns_invalid_format(tmp_path):
+    with raises(exceptions.CommandInvalidValueArgument):
+        list(bulk.read_columns(str(tmp_path / 'a.csv'), 'xml', FIELDS))
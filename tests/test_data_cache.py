@@ -0,0 +1,154 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+import pytest
+from pytest_mock import MockerFixture
+
+from minesqlite import exceptions
+from minesqlite.data.cache import ResultCache, Versions, cache_key
+from minesqlite.data.drivers.memory_dict import MemoryDictDataManager
+from minesqlite.data.query import Query
+from tests.conftest import TEST_PK
+from tests.utils import *
+
+
+@pytest.fixture
+def manager(mocker: MockerFixture, instance):
+    mocker.patch.object(instance.schema, 'primary_key', TEST_PK)
+    mocker.patch.object(instance.schema, 'fields',
+                        [TEST_PK, 'k1', 'k2', 'k3'])
+    mocker.patch.object(instance.schema, 'indexed_fields', [])
+    mocker.patch.object(instance.schema, 'sorted_indexed_fields', [])
+    mocker.patch.object(instance.schema, 'bitmap_indexed_fields', [])
+    instance.sysconf['data.cache.size'] = 2
+    manager = MemoryDictDataManager(instance)
+    for pk, k1, k2 in [(1, 'a', 3), (2, 'b', 2), (3, 'a', 1)]:
+        manager.create_one(pk, {'k1': k1, 'k2': k2})
+    return manager
+
+
+def test_cache_key():
+    query1, query2 = Query(), Query()
+    query1.filters.update(k1='a', k2=1)
+    query2.filters.update(k2=1, k1='a')
+    query1.add_range('$gt', 'k2', [0])
+    query2.add_range('$gt', 'k2', [0])
+    assert cache_key(query1) == cache_key(query2)
+    query2.add_range('$lt', 'k2', [5])
+    assert cache_key(query1) != cache_key(query2)
+    query2.ranges.clear()
+    query1.ranges.clear()
+    query1.add_sort('$sort_asc', 'k2')
+    assert cache_key(query1) != cache_key(query2)
+
+
+def test_hits_and_misses(manager):
+    query = make_query({'k1': 'a'}, sorts=[('$sort_asc', 'k2')])
+    rows = list(manager.fetch(query))
+    assert [row[TEST_PK] for row in rows] == [3, 1]
+    assert list(manager.fetch(
+        make_query({'k1': 'a'}, sorts=[('$sort_asc', 'k2')]))) == rows
+    stats = manager.cache_stats()
+    assert (stats['cache_hits'], stats['cache_misses']) == (1, 1)
+    assert stats['cache_hit_ratio'] == 0.5
+    assert stats['cache_entries'] == 1
+    assert stats['cache_bytes'] > 0
+
+
+@pytest.mark.parametrize(
+    ['mutate', 'expect_ids', 'expect_k2', 'expect_counters'],
+    [
+        # a new row may match
+        (
+            lambda manager: manager.create_one(4, {'k1': 'a', 'k2': 0}),
+            [4, 3, 1], [0, 1, 3], {'invalidations': 1, 'refreshes': 0},
+        ),
+        (
+            lambda manager: manager.delete_one(3),
+            [1], [3], {'invalidations': 1, 'refreshes': 0},
+        ),
+        # the order may change
+        (
+            lambda manager: manager.update_one(1, {'k2': 0}),
+            [1, 3], [0, 1], {'invalidations': 1, 'refreshes': 0},
+        ),
+        # neither the rows nor their order, but a value
+        (
+            lambda manager: manager.update_one(1, {'k3': 5}),
+            [3, 1], [1, 3], {'invalidations': 0, 'refreshes': 1},
+        ),
+    ]
+)
+def test_invalidate(manager, mutate, expect_ids, expect_k2,
+                    expect_counters):
+    query = make_query({'k1': 'a'}, sorts=[('$sort_asc', 'k2')])
+    list(manager.fetch(query))
+    mutate(manager)
+    rows = list(manager.fetch(query))
+    assert [row[TEST_PK] for row in rows] == expect_ids
+    assert [row['k2'] for row in rows] == expect_k2
+    stats = manager.cache_stats()
+    assert {name: stats['cache_' + name] for name in expect_counters} \
+           == expect_counters
+
+
+def test_refresh_values(manager):
+    query = make_query({'k1': 'a'})
+    list(manager.fetch(query))
+    manager.update_one(1, {'k2': 7})
+    assert [row['k2'] for row in manager.fetch(query)] == [7, 1]
+    assert manager.cache_stats()['cache_refreshes'] == 1
+
+
+def test_refresh_columns(manager):
+    query = make_query({'k1': 'a'})
+    query.columns = (TEST_PK, 'k2')
+    assert list(manager.fetch(query)) == [{TEST_PK: 1, 'k2': 3},
+                                          {TEST_PK: 3, 'k2': 1}]
+    manager.update_one(1, {'k2': 7})
+    assert list(manager.fetch(query)) == [{TEST_PK: 1, 'k2': 7},
+                                          {TEST_PK: 3, 'k2': 1}]
+    # without the primary key, the rows could not be refreshed
+    query.columns = ('k2',)
+    list(manager.fetch(query))
+    assert manager.cache_stats()['cache_entries'] == 1
+
+
+def test_evict(manager):
+    queries = [make_query({'k1': 'a'}), make_query({'k1': 'b'}),
+               make_query({'k2': 1})]
+    for query in queries:
+        list(manager.fetch(query))
+    # the least recently used one
+    list(manager.fetch(queries[0]))
+    stats = manager.cache_stats()
+    assert (stats['cache_evictions'], stats['cache_entries']) == (2, 2)
+    assert stats['cache_misses'] == 4
+
+
+def test_mutation_failed(manager):
+    query = make_query({'k1': 'a'})
+    list(manager.fetch(query))
+    with raises(exceptions.DataEntryNotFound):
+        manager.update_one(9, {'k1': 'b'})
+    list(manager.fetch(query))
+    assert manager.cache_stats()['cache_invalidations'] == 1
+
+
+def test_not_cached(manager):
+    # not all the rows were pulled
+    rows = manager.fetch(make_query({'k1': 'a'}))
+    next(rows)
+    rows.close()
+    # more rows than `data.cache.max_rows`
+    manager._cache.max_rows = 2
+    list(manager.fetch(make_query()))
+    assert manager.cache_stats()['cache_entries'] == 0
+
+
+def test_disabled(mocker: MockerFixture):
+    read_many = mocker.MagicMock()
+    cache = ResultCache(0, 1, Versions(), TEST_PK, read_many)
+    cache.put(Query(), [{TEST_PK: 1}], cache.snapshot(Query()))
+    assert cache.get(Query()) is None
+    assert cache.stats()['cache_entries'] == 0
+    assert cache.stats()['cache_misses'] == 0
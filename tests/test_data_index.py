@@ -0,0 +1,197 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+import collections
+import random
+
+import pytest
+from pytest_mock import MockerFixture
+
+from minesqlite.data.index import (
+    BitmapIndex,
+    BitmapIndexes,
+    HashIndex,
+    RecordIndexes,
+    SortedIndex,
+    bitmap_positions,
+    popcount,
+)
+from minesqlite.data.query import Range
+from minesqlite.data.row import MISSING, RowLayout
+
+
+@pytest.fixture
+def indexes():
+    layout = RowLayout(['id', 'dept', 'pos', 'name'], 'id')
+    return RecordIndexes(layout, ['id', 'dept', 'pos'], ['id', 'name'])
+
+
+def test_hash_index():
+    index = HashIndex('dept')
+    index.add('P1', 1)
+    index.add('P1', 2)
+    index.add('P2', 3)
+    index.add(MISSING, 4)
+    assert index.lookup('P1') == {1, 2}
+    assert index.lookup(MISSING) == set()
+    assert len(index) == 2
+
+    index.discard('P2', 3)
+    index.discard('P3', 3)
+    assert index.lookup('P2') == set()
+    assert len(index) == 1
+
+
+def test_record_indexes(indexes):
+    indexes.rebuild([(1, (1, 'P1', 'SDE1', 'a')),
+                     (2, (2, 'P1', 'SDE2', 'b')),
+                     (3, (3, 'P2', 'SDE1', 'c'))])
+    indexes.insert(4, (4, 'P1', 'SDE1', 'd'))
+    indexes.replace(2, (2, 'P1', 'SDE2', 'b'), (2, 'P2', 'SDE2', 'x'))
+    indexes.remove(3, (3, 'P2', 'SDE1', 'c'))
+    assert indexes.stats() == {'index.dept.values': 2,
+                               'index.pos.values': 2,
+                               'sorted_index.id.keys': 3,
+                               'sorted_index.name.keys': 3}
+    assert indexes.sorted_index('name').keys() \
+           == [('a', 1), ('d', 4), ('x', 2)]
+    assert indexes.sorted_index('dept') is None
+
+    assert indexes.lookup({'name': 'a'}) is None
+    assert indexes.lookup({'dept': 'P1'}) == {1, 4}
+    # the most selective one
+    assert indexes.lookup({'dept': 'P1', 'pos': 'SDE2'}) == {2}
+    assert indexes.lookup({'dept': 'P3', 'pos': 'SDE1'}) == set()
+    assert indexes.count('dept', 'P1') == 2
+    assert indexes.count('name', 'a') is None
+    assert not RecordIndexes(RowLayout(['id'], 'id'), ['id'])
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_sorted_index(mocker: MockerFixture, seed):
+    mocker.patch.object(SortedIndex, 'BUCKET_SIZE', 4)
+    rand = random.Random(seed)
+    index = SortedIndex('age')
+    keys = set()
+    for _ in range(300):
+        key = (rand.randrange(30), rand.randrange(1000))
+        if key in keys and rand.random() < 0.5:
+            keys.discard(key)
+            index.discard(*key)
+        elif key not in keys:
+            keys.add(key)
+            index.add(*key)
+    index.add(MISSING, 1)
+    index.discard(100, 1)
+    assert len(index) == len(keys)
+    assert index.keys() == sorted(keys)
+
+    for range_ in [Range(), Range(10, 20), Range(10, 20, False, False),
+                   Range(lower=25), Range(upper=3, upper_inclusive=False),
+                   Range(20, 10), Range(lower=40)]:
+        for reverse in [False, True]:
+            expect = sorted((key for key in keys if range_.contains(key[0])),
+                            reverse=reverse)
+            assert index.keys(range_, reverse) == expect
+            assert index.count(range_) == len(expect)
+            # chunk by chunk
+            got, after = [], None
+            while True:
+                chunk = index.keys(range_, reverse, after, limit=7)
+                if not chunk:
+                    break
+                got.extend(chunk)
+                after = chunk[-1]
+            assert got == expect
+
+    # merged by a sort or added one by one
+    for size in [len(keys) * 2, 5]:
+        more = {(rand.randrange(30), 1000 + rand.randrange(1000))
+                for _ in range(size)}
+        index.update(list(more) + [(MISSING, 1)])
+        keys |= more
+        assert index.keys() == sorted(keys) and len(index) == len(keys)
+
+    index.load(keys)
+    assert index.keys(limit=10) == sorted(keys)[:10]
+    index.clear()
+    assert index.keys() == [] and len(index) == 0
+
+
+@pytest.mark.parametrize(
+    ['bitmap', 'expect'],
+    [
+        (0, []),
+        (1, [0]),
+        (0b10110, [1, 2, 4]),
+        (1 << 100 | 1 << 8 | 1 << 7, [7, 8, 100]),
+    ]
+)
+def test_bitmap_positions(bitmap, expect):
+    assert bitmap_positions(bitmap) == expect
+    assert popcount(bitmap) == len(expect)
+
+
+def test_bitmap_index():
+    index = BitmapIndex('dept')
+    for slot in [0, 9, 3, 9]:
+        index.add('P1', slot)
+    index.add('P2', 100)
+    index.add(MISSING, 4)
+    assert index.lookup('P1') == 1 << 0 | 1 << 3 | 1 << 9
+    assert index.count('P1') == 3
+    assert index.lookup(MISSING) == 0 and index.count(MISSING) == 0
+    assert len(index) == 2
+
+    index.discard('P1', 4)
+    index.discard('P1', 1000)
+    index.discard('P3', 0)
+    assert index.count('P1') == 3
+    index.discard('P2', 100)
+    assert index.lookup('P2') == 0
+    assert len(index) == 1
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_bitmap_indexes(seed):
+    rand = random.Random(seed)
+    layout = RowLayout(['id', 'dept', 'pos', 'name'], 'id')
+    indexes = BitmapIndexes(layout, ['dept', 'pos'])
+    records = [None] * 50
+    for slot in range(0, 50, 2):
+        records[slot] = (slot, rand.choice('ab'), rand.choice('xyz'), '')
+    indexes.rebuild(records)
+    for _ in range(200):
+        slot = rand.randrange(len(records))
+        record = (slot, rand.choice('abc'), rand.choice('xyz'), '')
+        if records[slot] is None:
+            indexes.insert(slot, record)
+            records[slot] = record
+        elif rand.random() < 0.3:
+            indexes.remove(slot, records[slot])
+            records[slot] = None
+        else:
+            indexes.replace(slot, records[slot], record)
+            records[slot] = record
+
+    assert indexes.lookup({'name': ''}) is None
+    assert indexes.count({'name': ''}) is None
+    assert not indexes.covers({'dept': 'a', 'name': ''})
+    for filters in [{'dept': 'a'}, {'pos': 'y'}, {'dept': 'c', 'pos': 'x'},
+                    {'dept': 'b', 'pos': 'z', 'name': ''}, {'dept': 'd'}]:
+        expect = [slot for slot, record in enumerate(records)
+                  if record is not None
+                  and all(record[layout.indexes[field]] == value
+                          for field, value in filters.items())]
+        assert bitmap_positions(indexes.lookup(filters)) == expect
+        assert indexes.count(filters) == len(expect)
+    for fields, filters in [(['dept'], {}), (['dept', 'pos'], {}),
+                            (['pos'], {'dept': 'a'}),
+                            (['pos', 'dept'], {'dept': 'b', 'pos': 'z'}),
+                            (['pos'], {'dept': 'd'})]:
+        expect = collections.Counter(
+            tuple(record[layout.indexes[field]] for field in fields)
+            for record in records if record is not None
+            and all(record[layout.indexes[field]] == value
+                    for field, value in filters.items()))
+        assert indexes.group(fields, filters) == expect
+    assert indexes.stats()['bitmap_index.pos.values'] == 3
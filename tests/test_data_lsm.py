@@ -0,0 +1,111 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+import functools
+import os
+
+import pytest
+from pytest_mock import MockerFixture
+
+from minesqlite import exceptions
+from minesqlite.data.drivers.lsm import LSMDataManager, merge_entries
+from tests.conftest import TEST_PK
+from tests.utils import *
+
+
+@pytest.fixture
+def build_manager(mocker: MockerFixture, instance, tmp_path,
+                  build_manager):
+    mocker.patch.object(instance.schema, 'primary_key', TEST_PK)
+    instance.sysconf['data.lsm.path'] = str(tmp_path / 'lsm')
+    instance.sysconf['data.lsm.memtable_rows'] = 4
+    # compactions are triggered by hand in the tests
+    instance.sysconf['data.lsm.max_runs'] = 1000
+    return functools.partial(build_manager, LSMDataManager)
+
+
+@pytest.mark.parametrize(
+    ['sources', 'drop_tombstones', 'expect'],
+    [
+        # the newest version wins
+        (
+            [[(1, 'new')], [(1, 'old'), (2, 'old')]],
+            False,
+            [(1, 'new'), (2, 'old')],
+        ),
+        # tombstones shadow older versions
+        (
+            [[(1, None)], [(1, 'old'), (2, 'old')]],
+            False,
+            [(1, None), (2, 'old')],
+        ),
+        (
+            [[(1, None)], [(1, 'old'), (2, 'old')]],
+            True,
+            [(2, 'old')],
+        ),
+    ]
+)
+def test_merge_entries(sources, drop_tombstones, expect):
+    assert list(merge_entries(sources, drop_tombstones)) == expect
+
+
+def test_crud_across_runs(build_manager):
+    manager = build_manager()
+    for n in range(10):
+        manager.create_one(n, {'k': 'v%d' % n})
+    assert manager.stats()['runs'] == 2
+    assert manager.stats()['memtable_rows'] == 2
+
+    # rows in the runs, both in the middle and at the edges
+    assert manager.read_one(0) == {TEST_PK: 0, 'k': 'v0'}
+    assert manager.read_one(5) == {TEST_PK: 5, 'k': 'v5'}
+    with raises(exceptions.DataDuplicateEntry):
+        manager.create_one(3, {'k': 'v'})
+    with raises(exceptions.DataEntryNotFound):
+        manager.read_one(100)
+
+    assert manager.update_one(1, {'k': 'v11'}) == {TEST_PK: 1, 'k': 'v11'}
+    assert manager.delete_one(2) == {TEST_PK: 2, 'k': 'v2'}
+    with raises(exceptions.DataEntryNotFound):
+        manager.read_one(2)
+    with raises(exceptions.DataEntryNotFound):
+        manager.delete_one(2)
+
+    expect = [{TEST_PK: n, 'k': 'v%d' % n} for n in range(10) if n != 2]
+    expect[1]['k'] = 'v11'
+    assert traverse(manager) == expect
+    batches = list(manager.scan(4))
+    assert [len(batch) for batch in batches] == [4, 4, 1]
+    assert [row for batch in batches for row in batch] == expect
+
+
+def test_compaction_and_reopen(build_manager, tmp_path):
+    manager = build_manager()
+    for n in range(10):
+        manager.create_one(n, {'k': n})
+    for n in range(0, 10, 2):
+        manager.delete_one(n)
+    assert manager.stats()['runs'] == 3
+
+    manager.compact()
+    assert manager.stats()['runs'] == 1
+    assert manager.stats()['write_amplification'] > 1
+    assert sorted(os.listdir(tmp_path / 'lsm')) == \
+           ['00000003.run', 'MANIFEST', 'wal.log']
+    expect = [{TEST_PK: n, 'k': n} for n in range(1, 10, 2)]
+    assert traverse(manager) == expect
+    manager.close()
+
+    # the runs are reloaded from the MANIFEST, and the memtable from the WAL
+    manager = build_manager()
+    assert traverse(manager) == expect
+
+
+def test_bloom_filter_skips_runs(build_manager):
+    manager = build_manager()
+    for n in range(8):
+        manager.create_one(n, {'k': n})
+
+    with raises(exceptions.DataEntryNotFound):
+        manager.read_one(100)
+    assert manager.stats()['bloom_skips'] >= 1
@@ -0,0 +1,273 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+import datetime
+import os
+
+import pytest
+from pytest_mock import MockerFixture
+
+from minesqlite import exceptions, schema
+from minesqlite.data.base import DataManagerABC
+from minesqlite.data.drivers.memory_columnar import (
+    Column, MemoryColumnarDataManager,
+)
+from tests.utils import *
+
+
+@pytest.fixture
+def manager(mocker: MockerFixture, instance, sysconf):
+    data = os.linesep.join([
+        'columns:',
+        '  - name: id',
+        '    type: integer',
+        '    attribute: primary_key',
+        '  - name: name',
+        '    type: string',
+        '  - name: in_date',
+        '    type: date',
+    ])
+    sysconf['schema.read.infile'] = mocker.mock_open(read_data=data)()
+    instance.schema = schema.SchemaManager(sysconf)
+    return MemoryColumnarDataManager(instance)
+
+
+def test_crud(manager):
+    for pk in range(3):
+        row = make_row(pk, 'name%d' % pk, pk + 1)
+        kvs = row.copy()
+        kvs.pop('id')
+        assert manager.create_one(pk, kvs) == row
+    with raises(exceptions.DataDuplicateEntry):
+        manager.create_one(0, {'name': 'x', 'in_date': make_row(0)['in_date']})
+
+    assert manager.read_one(1) == make_row(1, 'name1', 2)
+    assert manager.update_one(1, {'name': 'name0'}) == make_row(1, 'name0', 2)
+    assert manager.delete_one(0) == make_row(0, 'name0', 1)
+    for method, args in [('read_one', ()), ('delete_one', ()),
+                         ('update_one', ({'name': 'x'},))]:
+        with raises(exceptions.DataEntryNotFound):
+            getattr(manager, method)(0, *args)
+
+    # the slot of the deleted row is reused
+    manager.create_one(3, {'name': 'name3',
+                           'in_date': make_row(3)['in_date']})
+    assert manager.stats()['slots'] == 3
+    assert traverse(manager) == [make_row(3, 'name3', 1),
+                                 make_row(1, 'name0', 2),
+                                 make_row(2, 'name2', 3)]
+    # equal strings share the same dictionary entry
+    assert manager._columns['name'].dictionary == ['name0', 'name1', 'name2',
+                                                   'name3']
+
+
+@pytest.mark.parametrize(
+    ['pk', 'kvs', 'expect_exc'],
+    [
+        (1, {'name': 'x'}, raises(exceptions.DataEntryInvalid)),
+        (1, {'name': 'x', 'in_date': datetime.datetime(2022, 6, 1),
+             'extra': 'x'},
+         raises(exceptions.DataEntryInvalid)),
+        (2 ** 63, {'name': 'x', 'in_date': datetime.datetime(2022, 6, 1)},
+         raises(exceptions.DataEntryInvalid)),
+    ]
+)
+def test_create_invalid(manager, pk, kvs, expect_exc):
+    with expect_exc:
+        manager.create_one(pk, kvs)
+    assert manager.stats()['rows'] == 0
+
+
+def test_traverse_with_deletion(manager):
+    assert not manager.build_cursor()
+    for pk in range(3):
+        manager.create_one(pk, {'name': 'x', 'in_date': make_row(0)['in_date']})
+
+    cursor = manager.build_cursor()
+    cursor, row = manager.next_row(cursor)
+    assert row['id'] == 0
+    manager.delete_one(1)
+    cursor, row = manager.next_row(cursor)
+    assert row['id'] == 2
+    assert not cursor
+
+
+def test_save_and_load_snapshot(manager, tmp_path):
+    path = str(tmp_path / 'snapshot.bin')
+    for pk in range(3):
+        manager.create_one(pk, {'name': 'x', 'in_date': make_row(0)['in_date']})
+    manager.delete_one(1)
+    assert manager.save_snapshot(path) == 2
+
+    manager.create_one(5, {'name': 'y', 'in_date': make_row(0)['in_date']})
+    assert manager.load_snapshot(path) == 2
+    assert traverse(manager) == [make_row(0, 'x'), make_row(2, 'x')]
+
+
+def test_many_distinct_strings(mocker: MockerFixture, manager):
+    mocker.patch('minesqlite.data.drivers.memory_columnar'
+                 '.DICTIONARY_MIN_VALUES', 4)
+    for pk in range(20):
+        manager.create_one(pk, {'name': 'name%d' % pk,
+                                'in_date': make_row(0)['in_date']})
+    # the column switches from the dictionary to the heap encoding
+    column = manager._columns['name']
+    assert column.dictionary is None
+
+    for n in range(50):
+        manager.update_one(n % 20, {'name': 'new%d' % n})
+    for pk in range(0, 20, 2):
+        manager.delete_one(pk)
+    manager.create_one(100, {'name': 'name100',
+                             'in_date': make_row(0)['in_date']})
+    # overwritten strings are compacted away
+    assert len(column.heap) < 2 * sum(column.lengths)
+    assert manager.read_one(100)['name'] == 'name100'
+    expect_pks = list(range(1, 18, 2)) + [100, 19]
+    assert [row['id'] for row in traverse(manager)] == expect_pks
+    expect_names = ['new%d' % (pk + 40 if pk < 10 else pk + 20)
+                    for pk in expect_pks[:-2]] + ['name100', 'new39']
+    assert [row['name'] for row in traverse(manager)] == expect_names
+
+
+def test_create_many_at_dictionary_limit(manager):
+    day = make_row(0)['in_date']
+    manager.create_many([(pk, {'name': 'name%d' % pk, 'in_date': day})
+                         for pk in range(4096)])
+    assert manager._columns['name'].dictionary is not None
+    # a known name encoded as a code, then a new one switching to the heap
+    manager.create_many([(5000, {'name': 'name0', 'in_date': day}),
+                         (5001, {'name': 'new', 'in_date': day})])
+    assert manager._columns['name'].dictionary is None
+    assert manager.read_one(5000) == make_row(5000, 'name0')
+    assert manager.read_one(5001) == make_row(5001, 'new')
+    manager.create_one(20000, {'name': 'x', 'in_date': day})
+    assert manager.read_one(20000) == make_row(20000, 'x')
+    assert len(traverse(manager)) == 4099
+
+
+def test_create_many_all_or_none(manager):
+    day = make_row(0)['in_date']
+    manager.create_one(0, {'name': 'a', 'in_date': day})
+    with raises(exceptions.DataEntryInvalid):
+        manager.create_many([(1, {'name': 'b', 'in_date': day}),
+                             (2 ** 70, {'name': 'c', 'in_date': day})])
+    with raises(exceptions.DataEntryInvalid):
+        manager.create_many([(1, {'name': 'b', 'in_date': day}),
+                             (2, {'name': 'c'})])
+    assert traverse(manager) == [make_row(0, 'a')]
+    assert manager.create_many([(1, {'name': 'b', 'in_date': day})]) == 1
+    assert traverse(manager) == [make_row(0, 'a'), make_row(1, 'b')]
+
+
+@pytest.mark.parametrize('batch_size', [1, 2, 1024])
+def test_scan(manager, batch_size):
+    for pk in range(5):
+        manager.create_one(pk, {'name': 'name%d' % pk,
+                                'in_date': make_row(0, day=pk + 1)['in_date']})
+    manager.delete_one(1)
+
+    batches = list(manager.scan(batch_size))
+    assert all(0 < len(batch) <= batch_size for batch in batches)
+    assert [row for batch in batches for row in batch] == traverse(manager)
+    assert [row['id'] for batch in batches for row in batch] == [0, 2, 3, 4]
+
+
+def load_for_select(manager):
+    # the dictionary of names is not in order
+    for pk in range(12):
+        manager.create_one(pk, {'name': 'name%d' % ((7 * pk) % 5),
+                                'in_date': make_row(0, day=pk % 4 + 1)
+                                ['in_date']})
+    manager.delete_one(3)
+    manager.delete_one(8)
+    # reuses a slot
+    manager.create_one(20, {'name': 'name1',
+                            'in_date': make_row(0, day=9)['in_date']})
+    manager.update_one(5, {'name': 'name0'})
+
+
+def test_column_key_column():
+    pytest.importorskip('numpy')
+    column = Column()
+    for value in [3.5, 1.0, 3.5, 2.0]:
+        column.append(column.encode(value))
+    keys, key_of, value_of = column.key_column()
+    assert keys.tolist() == [2, 0, 2, 1]
+    assert [key_of(value) for value in [1.0, 3.5, 0.5, 2.5, 4.0]] \
+        == [0, 2, -0.5, 1.5, 2.5]
+    assert [value_of(key) for key in range(3)] == [1.0, 2.0, 3.5]
+
+
+@pytest.mark.parametrize(
+    'query',
+    [
+        make_query(),
+        make_query({'name': 'name1'}),
+        make_query({'name': 'missing'}),
+        make_query({'in_date': make_row(0, day=2)['in_date']},
+                   sorts=[('$sort_desc', 'id')]),
+        make_query(ranges={'id': ('$between', [2, 9]),
+                           'in_date': ('$gt', [make_row(0)['in_date']])}),
+        # between the names in the dictionary
+        make_query(ranges={'name': ('$lt', ['name20'])}),
+        make_query(sorts=[('$sort_asc', 'name'), ('$sort_desc', 'in_date')]),
+        make_query(sorts=[('$sort_desc', 'name')], limit=3, offset=2),
+        make_query(limit=4, offset=1),
+        make_query(sorts=[('$sort_asc', 'name'), ('$sort_asc', 'id')],
+                   after=('name1', 6), limit=3),
+        make_query(sorts=[('$sort_desc', 'name'), ('$sort_desc', 'id')],
+                   after=('name15', 0)),
+    ]
+)
+def test_select_vectorized(manager, query):
+    pytest.importorskip('numpy')
+    manager._vectorized = True
+    load_for_select(manager)
+    expect = [row for batch in DataManagerABC.plan(manager, query).execute(2)
+              for row in batch]
+
+    plan = manager.plan(query)
+    assert list(plan.walk())[-1].operator == 'vectorized'
+    rows = [row for batch in plan.execute(2) for row in batch]
+    assert rows == expect
+    assert manager.count(query) == len(expect)
+
+
+def test_select_not_vectorized(mocker: MockerFixture, manager):
+    mocker.patch('minesqlite.data.drivers.memory_columnar'
+                 '.DICTIONARY_MIN_VALUES', 4)
+    manager._vectorized = True
+    load_for_select(manager)
+    for pk in range(30, 40):
+        manager.create_one(pk, {'name': 'new%d' % pk,
+                                'in_date': make_row(0)['in_date']})
+    # the names are in the heap encoding
+    query = make_query({'name': 'new31'})
+    assert list(manager.plan(query).walk())[-1].operator == 'scan'
+    assert [row['id'] for batch in manager.select(query)
+            for row in batch] == [31]
+
+    # falls back without numpy
+    manager.instance.sysconf['data.memory_columnar.vectorized'] = True
+    mocker.patch('minesqlite.data.drivers.memory_columnar.numpy', None)
+    assert not MemoryColumnarDataManager(manager.instance)._vectorized
+
+
+@pytest.mark.parametrize(
+    ['query', 'group_by'],
+    [
+        (make_query(), ['name']),
+        (make_query({'name': 'name1'}), ['in_date', 'name']),
+        (make_query({'name': 'missing'}), ['name']),
+        (make_query(ranges={'id': ('$gt', [4])}, limit=2), ['in_date']),
+    ]
+)
+def test_aggregate_vectorized(manager, query, group_by):
+    pytest.importorskip('numpy')
+    load_for_select(manager)
+    expect = manager.aggregate(query, group_by)
+    expect_count = manager.count(query)
+
+    manager._vectorized = True
+    assert manager.aggregate(query, group_by) == expect
+    assert manager.count(query) == expect_count
@@ -1,54 +1,142 @@
 # coding=utf-8
 # Author: @hsiaoxychen
-import inspect
+import concurrent.futures
 
 import pytest
 from pytest_mock import MockerFixture
 
 from minesqlite import exceptions
+from minesqlite.data.base import DataManagerABC
 from minesqlite.data.drivers.memory_dict import MemoryDictDataManager
+from minesqlite.data.plan import Parallel
+from minesqlite.data.query import Query
 from tests.conftest import TEST_PK
 from tests.utils import *
 
 
 @pytest.fixture
-def manager(instance):
+def manager(mocker: MockerFixture, instance):
+    mocker.patch.object(instance.schema, 'primary_key', TEST_PK)
+    mocker.patch.object(instance.schema, 'fields', [TEST_PK, 'k1', 'k2', 'k3'])
+    mocker.patch.object(instance.schema, 'indexed_fields', ['k1', 'k2'])
+    mocker.patch.object(instance.schema, 'sorted_indexed_fields', ['k2'])
+    mocker.patch.object(instance.schema, 'bitmap_indexed_fields', ['k3'])
     return MemoryDictDataManager(instance)
 
 
+def load(manager: MemoryDictDataManager, data: dict):
+    manager._reset((pk, manager._layout.pack(pk, kvs))
+                   for pk, kvs in data.items())
+
+
+def dump(manager: MemoryDictDataManager) -> dict:
+    return {pk: manager._layout.to_kvs(manager._store.records[slot])
+            for pk, slot in manager._slots.items()}
+
+
 @pytest.mark.parametrize(
     ['initial_data', 'pk', 'kvs', 'expect_ret', 'expect_exc', 'expect_data'],
     [
         # insert duplicated entry
         (
-            {'pk': ...},
+            {'pk': {'k1': 'v'}},
             'pk',
-            ...,
+            {'k1': 'v1'},
             None,
             raises(exceptions.DataDuplicateEntry),
-            {'pk': ...},
+            {'pk': {'k1': 'v'}},
         ),
         (
-            {'pk1': ...},
+            {'pk1': {'k1': 'v'}},
             'pk2',
-            {'k': 'v'},
-            {TEST_PK: 'pk2', 'k': 'v'},
+            {'k1': 'v'},
+            {TEST_PK: 'pk2', 'k1': 'v'},
             no_raise(),
-            {'pk1': ..., 'pk2': {'k': 'v'}},
+            {'pk1': {'k1': 'v'}, 'pk2': {'k1': 'v'}},
+        ),
+        # unknown field
+        (
+            {},
+            'pk1',
+            {'k4': 'v'},
+            None,
+            raises(exceptions.DataEntryInvalid),
+            {},
         ),
     ]
 )
-def test_create_one(mocker: MockerFixture, instance, manager,
-                    initial_data, pk, kvs, expect_ret, expect_exc, expect_data):
-    mocker.patch.object(instance.schema, 'primary_key', TEST_PK)
-
-    manager._inner_data = initial_data
+def test_create_one(manager, initial_data, pk, kvs,
+                    expect_ret, expect_exc, expect_data):
+    load(manager, initial_data)
 
     with expect_exc:
         got = manager.create_one(pk, kvs)
         assert got == expect_ret
 
-    assert manager._inner_data == expect_data
+    assert dump(manager) == expect_data
+
+
+@pytest.mark.parametrize(
+    ['initial_data', 'entries', 'expect_ret', 'expect_exc', 'expect_data'],
+    [
+        (
+            {'pk1': {'k1': 'v'}},
+            [('pk2', {'k1': 'a', 'k2': 2}), ('pk3', {'k3': 'b'})],
+            2,
+            no_raise(),
+            {'pk1': {'k1': 'v'}, 'pk2': {'k1': 'a', 'k2': 2},
+             'pk3': {'k3': 'b'}},
+        ),
+        # all or none
+        (
+            {'pk1': {'k1': 'v'}},
+            [('pk2', {'k1': 'a'}), ('pk1', {'k1': 'b'})],
+            None,
+            raises(exceptions.DataDuplicateEntry),
+            {'pk1': {'k1': 'v'}},
+        ),
+        (
+            {},
+            [('pk2', {'k1': 'a'}), ('pk2', {'k1': 'b'})],
+            None,
+            raises(exceptions.DataDuplicateEntry),
+            {},
+        ),
+        (
+            {},
+            [('pk2', {'k1': 'a'}), ('pk3', {'k4': 'b'})],
+            None,
+            raises(exceptions.DataEntryInvalid),
+            {},
+        ),
+    ]
+)
+def test_create_many(manager, initial_data, entries,
+                     expect_ret, expect_exc, expect_data):
+    load(manager, initial_data)
+
+    with expect_exc:
+        assert manager.create_many(entries) == expect_ret
+
+    assert dump(manager) == expect_data
+    # the indexes are up to date
+    for pk, kvs in expect_data.items():
+        for field in ['k1', 'k2', 'k3']:
+            if field in kvs:
+                query = Query(filters={field: kvs[field]})
+                assert pk in [row[TEST_PK] for batch in manager.select(query)
+                              for row in batch]
+
+
+def test_create_many_reuses_free_slots(manager):
+    load(manager, {'pk%d' % i: {'k2': i} for i in range(3)})
+    manager.delete_one('pk1')
+    assert manager.create_many([('a', {'k2': 5}), ('b', {'k2': -1})]) == 2
+    assert sorted(manager._slots.values()) == [0, 1, 2, 3]
+    query = Query()
+    query.add_sort('$sort_asc', 'k2')
+    assert [row[TEST_PK] for batch in manager.select(query)
+            for row in batch] == ['b', 'pk0', 'pk2', 'a']
 
 
 @pytest.mark.parametrize(
@@ -56,31 +144,28 @@ def test_create_one(mocker: MockerFixture, instance, manager,
     [
         # read existed entry
         (
-            {'pk': {'k': 'v'}},
+            {'pk': {'k1': 'v'}},
             'pk',
-            {TEST_PK: 'pk', 'k': 'v'},
+            {TEST_PK: 'pk', 'k1': 'v'},
             no_raise(),
         ),
         # read non-exist entry
         (
-            {'pk': {'k': 'v'}},
+            {'pk': {'k1': 'v'}},
             'pk2',
             None,
             raises(exceptions.DataEntryNotFound),
         ),
     ]
 )
-def test_read_one(mocker: MockerFixture, instance, manager,
-                  initial_data, pk, expect_ret, expect_exc):
-    mocker.patch.object(instance.schema, 'primary_key', TEST_PK)
-
-    manager._inner_data = initial_data
+def test_read_one(manager, initial_data, pk, expect_ret, expect_exc):
+    load(manager, initial_data)
 
     with expect_exc:
         got = manager.read_one(pk)
         assert got == expect_ret
 
-    assert manager._inner_data == initial_data
+    assert dump(manager) == initial_data
 
 
 @pytest.mark.parametrize(
@@ -88,15 +173,12 @@ def test_read_one(mocker: MockerFixture, instance, manager,
     [
         (
             {'pk1': {'k1': 'v1'}},
-            {'id': 'pk1', 'k1': 'v1'},
+            {TEST_PK: 'pk1', 'k1': 'v1'},
         ),
     ]
 )
-def test_traverse_one_row(mocker: MockerFixture, instance, manager,
-                          initial_data, expect_ret):
-    mocker.patch.object(instance.schema, 'primary_key', 'id')
-
-    manager._inner_data = initial_data
+def test_traverse_one_row(manager, initial_data, expect_ret):
+    load(manager, initial_data)
     cursor = manager.build_cursor()
     assert cursor
 
@@ -106,7 +188,6 @@ def test_traverse_one_row(mocker: MockerFixture, instance, manager,
 
 
 def test_traverse_no_row(instance, manager):
-    manager._inner_data = {}
     cursor = manager.build_cursor()
     assert not cursor
 
@@ -127,24 +208,31 @@ def test_traverse_no_row(instance, manager):
         (
             {},
             'pk1',
-            {'k': 'v'},
+            {'k1': 'v'},
             None,
             raises(exceptions.DataEntryNotFound),
             {},
         ),
+        # modify the primary key
+        (
+            {'pk1': {'k1': 'v1'}},
+            'pk1',
+            {TEST_PK: 'pk2'},
+            None,
+            raises(exceptions.DataEntryInvalid),
+            {'pk1': {'k1': 'v1'}},
+        ),
     ]
 )
-def test_update_one(mocker: MockerFixture, instance, manager,
-                    initial_data, pk, kvs, expect_ret, expect_exc, expect_data):
-    mocker.patch.object(instance.schema, 'primary_key', TEST_PK)
-
-    manager._inner_data = initial_data
+def test_update_one(manager, initial_data, pk, kvs,
+                    expect_ret, expect_exc, expect_data):
+    load(manager, initial_data)
 
     with expect_exc:
         got = manager.update_one(pk, kvs)
         assert got == expect_ret
 
-    assert manager._inner_data == initial_data
+    assert dump(manager) == expect_data
 
 
 @pytest.mark.parametrize(
@@ -168,14 +256,267 @@ def test_update_one(mocker: MockerFixture, instance, manager,
         ),
     ]
 )
-def test_delete_one(mocker: MockerFixture, instance, manager,
-                    initial_data, pk, expect_ret, expect_exc, expect_data):
-    mocker.patch.object(instance.schema, 'primary_key', TEST_PK)
-
-    manager._inner_data = initial_data
+def test_delete_one(manager, initial_data, pk,
+                    expect_ret, expect_exc, expect_data):
+    load(manager, initial_data)
 
     with expect_exc:
         got = manager.delete_one(pk)
         assert got == expect_ret
 
-    assert manager._inner_data == initial_data
+    assert dump(manager) == expect_data
+
+
+def test_save_and_load_snapshot(instance, manager, tmp_path):
+    path = str(tmp_path / 'snapshot.bin')
+    load(manager, {'pk1': {'k1': 'v1', 'k2': 'v2', 'k3': 'v3'},
+                   'pk2': {'k1': 'v1', 'k2': 'v2'}})
+    assert manager.save_snapshot(path) == 2
+
+    load(manager, {'pk3': {'k1': 'v3'}})
+    assert manager.load_snapshot(path) == 2
+    assert dump(manager) == {'pk1': {'k1': 'v1', 'k2': 'v2', 'k3': 'v3'},
+                             'pk2': {'k1': 'v1', 'k2': 'v2'}}
+
+    # the snapshot is loaded on startup
+    instance.sysconf['data.snapshot.path'] = path
+    assert dump(MemoryDictDataManager(instance)) == dump(manager)
+
+
+@pytest.mark.parametrize('batch_size', [1, 2, 1024])
+def test_scan(manager, batch_size):
+    load(manager, {'pk%d' % n: {'k1': n} for n in range(5)})
+    manager.delete_one('pk1')
+
+    batches = list(manager.scan(batch_size))
+    assert all(0 < len(batch) <= batch_size for batch in batches)
+    assert [row['k1'] for batch in batches for row in batch] == [0, 2, 3, 4]
+
+
+def test_scan_reads_a_snapshot(manager):
+    load(manager, {'pk%d' % n: {'k1': n} for n in range(6)})
+
+    seen = []
+    for batch in manager.scan(2):
+        seen.extend(row['k1'] for row in batch)
+        if len(seen) == 2:
+            manager.delete_one('pk0')
+            manager.delete_one('pk3')
+            manager.create_one('pk6', {'k1': 6})
+            manager.update_one('pk4', {'k1': 44})
+            manager.update_one('pk4', {'k1': 444})
+            assert manager.stats()['old_versions'] == 3
+    # none of the writes made during the scan is seen
+    assert seen == [0, 1, 2, 3, 4, 5]
+    # and the old versions are dropped along with the snapshot
+    assert manager.stats()['old_versions'] == 0
+    assert [row['k1'] for batch in manager.scan(2) for row in batch] == \
+        [1, 2, 6, 444, 5]
+
+
+def test_traverse_reads_a_snapshot(manager):
+    load(manager, {'pk%d' % n: {'k1': n} for n in range(3)})
+
+    cursor = manager.build_cursor()
+    cursor, row = manager.next_row(cursor)
+    assert row['k1'] == 0
+    manager.delete_one('pk1')
+    manager.create_one('pk3', {'k1': 3})
+    cursor, row = manager.next_row(cursor)
+    assert row['k1'] == 1
+    cursor, row = manager.next_row(cursor)
+    assert row['k1'] == 2
+    assert not cursor
+    assert manager.stats()['snapshots'] == 0
+
+
+def select_by_scan(manager: MemoryDictDataManager, query: Query):
+    return DataManagerABC.plan(manager, query).execute(2)
+
+
+def load_for_index(manager: MemoryDictDataManager):
+    load(manager, {pk: {'k1': 'ab'[pk % 2], 'k2': pk % 3,
+                        'k3': 'xy'[pk % 4 == 1]}
+                   for pk in range(10)})
+    manager.create_one(10, {'k1': 'a', 'k2': 1, 'k3': 'x'})
+    manager.update_one(3, {'k1': 'a', 'k3': 'y'})
+    manager.update_one(4, {'k2': 1})
+    manager.delete_one(6)
+    manager.delete_one(9)
+    manager.create_one(11, {'k1': 'b', 'k2': 2, 'k3': 'y'})
+
+
+@pytest.mark.parametrize(
+    ['filters', 'ranges', 'sorts', 'limit', 'use_index'],
+    [
+        ({'k1': 'a'}, {}, [], None, True),
+        ({'k1': 'b', 'k2': 1}, {}, [], None, True),
+        ({'k2': 0, 'k3': 'x'}, {}, [('$sort_desc', TEST_PK)], None, True),
+        ({'k1': 'none'}, {}, [], None, True),
+        # bitmap index on k3
+        ({'k3': 'x'}, {}, [], None, True),
+        ({'k1': 'b', 'k3': 'y'}, {}, [], None, True),
+        ({'k3': 'z'}, {}, [], None, True),
+        ({'k3': 'y'}, {}, [('$sort_asc', 'k2')], 1, True),
+        ({}, {}, [('$sort_asc', 'k1')], None, False),
+        # sorted index on k2
+        ({}, {}, [('$sort_asc', 'k2')], None, True),
+        ({}, {}, [('$sort_desc', 'k2')], 3, True),
+        ({'k1': 'a'}, {}, [('$sort_desc', 'k2')], 2, True),
+        ({'k3': 'x'}, {'k2': ('$gt', [0])}, [('$sort_asc', 'k2')], 4, True),
+        ({}, {'k2': ('$between', [1, 2])}, [], None, True),
+        ({}, {'k2': ('$lt', [2])}, [('$sort_desc', TEST_PK)], 3, True),
+        ({}, {TEST_PK: ('$lt', [5])}, [], 2, False),
+    ]
+)
+def test_select_by_index(mocker: MockerFixture, manager,
+                         filters, ranges, sorts, limit, use_index):
+    load_for_index(manager)
+    query = Query(filters=filters, limit=limit)
+    for field, (magic_key, bounds) in ranges.items():
+        query.add_range(magic_key, field, bounds)
+    for magic_key, field in sorts:
+        query.add_sort(magic_key, field)
+
+    expect = [row for batch in select_by_scan(manager, query)
+              for row in batch]
+    spy_scan = mocker.spy(manager, 'scan')
+    got = [row for batch in manager.select(query, batch_size=2)
+           for row in batch]
+    if sorts:
+        # ties are in any order
+        assert [[row[field] for field, _ in query.sorts] for row in got] \
+               == [[row[field] for field, _ in query.sorts]
+                   for row in expect]
+        assert len(got) == len(expect)
+    else:
+        assert got == expect
+    assert spy_scan.called != use_index
+
+
+@pytest.mark.parametrize(
+    ['filters', 'ranges', 'sorts', 'limit', 'expect_access'],
+    [
+        ({'k3': 'y'}, {}, [], None, 'bitmap_and'),
+        ({'k1': 'none', 'k3': 'y'}, {}, [], None, 'hash_lookup'),
+        ({}, {'k2': ('$between', [2, 2])}, [], None, 'index_range'),
+        ({}, {}, [('$sort_desc', 'k2')], 1, 'index_order'),
+        ({}, {TEST_PK: ('$lt', [5])}, [('$sort_asc', 'k1')], None, 'scan'),
+        # cheaper than a scan and a sort
+        ({}, {TEST_PK: ('$lt', [5])}, [('$sort_asc', 'k2')], None,
+         'index_order'),
+    ]
+)
+def test_plan(manager, filters, ranges, sorts, limit, expect_access):
+    load_for_index(manager)
+    query = Query(filters=filters, limit=limit)
+    for field, (magic_key, bounds) in ranges.items():
+        query.add_range(magic_key, field, bounds)
+    for magic_key, field in sorts:
+        query.add_sort(magic_key, field)
+
+    plan = manager.explain(query)
+    nodes = list(plan.walk())
+    assert nodes[-1].operator == expect_access
+    assert plan.actual == len([row for batch in select_by_scan(manager, query)
+                               for row in batch])
+    # the estimates of the indexes are exact
+    if not query.sorts and query.limit is None:
+        assert plan.estimate == plan.actual
+
+
+@pytest.mark.parametrize('reverse', [False, True])
+@pytest.mark.parametrize('filters', [{}, {'k1': 'a'}])
+def test_pages(manager, reverse, filters):
+    load_for_index(manager)
+    query = Query(filters=filters, limit=3)
+    query.add_sort('$sort_desc' if reverse else '$sort_asc', 'k2')
+    query.break_ties(TEST_PK)
+    expect = [row for batch in select_by_scan(manager, Query(
+        filters=filters, sorts=query.sorts)) for row in batch]
+
+    got = []
+    while True:
+        plan = manager.plan(query)
+        if not filters:
+            # resumes the walk of the index, rather than sorting again
+            assert list(plan.walk())[-1].operator == 'index_order'
+        page = [row for batch in plan.execute(2) for row in batch]
+        got.extend(page)
+        if len(page) < query.limit:
+            break
+        query.after = query.key_of(page[-1])
+    assert got == expect
+
+
+@pytest.mark.parametrize(
+    ['filters', 'ranges', 'limit', 'use_bitmaps'],
+    [
+        ({}, {}, None, True),
+        ({}, {}, 3, True),
+        ({'k3': 'y'}, {}, None, True),
+        ({'k3': 'x'}, {}, 2, True),
+        ({'k3': 'z'}, {}, None, True),
+        ({'k3': 'x'}, {'k2': ('$gt', [0])}, None, False),
+        ({'k1': 'a', 'k3': 'x'}, {}, None, False),
+    ]
+)
+def test_count(mocker: MockerFixture, manager,
+               filters, ranges, limit, use_bitmaps):
+    load_for_index(manager)
+    query = Query(filters=filters, limit=limit)
+    for field, (magic_key, bounds) in ranges.items():
+        query.add_range(magic_key, field, bounds)
+
+    expect = sum(len(batch) for batch in select_by_scan(manager, query))
+    spy_select = mocker.spy(manager, 'select')
+    assert manager.count(query) == expect
+    assert spy_select.called != use_bitmaps
+
+
+@pytest.mark.parametrize(
+    ['group_by', 'filters', 'ranges', 'use_bitmaps'],
+    [
+        (['k3'], {}, {}, True),
+        (['k3'], {'k3': 'y'}, {}, True),
+        (['k3'], {'k1': 'a'}, {}, False),
+        (['k3'], {}, {'k2': ('$gt', [0])}, False),
+        (['k1', 'k3'], {}, {}, False),
+        (['k2'], {'k3': 'x'}, {}, False),
+    ]
+)
+def test_aggregate(mocker: MockerFixture, manager,
+                   group_by, filters, ranges, use_bitmaps):
+    load_for_index(manager)
+    query = Query(filters=filters)
+    for field, (magic_key, bounds) in ranges.items():
+        query.add_range(magic_key, field, bounds)
+
+    expect = {}
+    for batch in select_by_scan(manager, query):
+        for row in batch:
+            key = tuple(row[field] for field in group_by)
+            expect[key] = expect.get(key, 0) + 1
+    spy_select = mocker.spy(manager, 'select')
+    assert manager.aggregate(query, group_by) == expect
+    assert spy_select.called != use_bitmaps
+
+
+@pytest.mark.parametrize('executor_type', [
+    concurrent.futures.ThreadPoolExecutor,
+    concurrent.futures.ProcessPoolExecutor,
+])
+def test_select_in_parallel(manager, executor_type):
+    load_for_index(manager)
+    query = Query()
+    query.add_range('$lt', 'k2', [2])
+    query.add_sort('$sort_desc', 'k1')
+    expect = [row for batch in select_by_scan(manager, query)
+              for row in batch]
+
+    with executor_type(2) as executor:
+        manager._parallel = Parallel(executor, 3)
+        plan = manager.plan(query)
+        assert plan.child.operator == 'parallel'
+        rows = [row for batch in plan.execute(2) for row in batch]
+    assert rows == expect
@@ -0,0 +1,85 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+import gc
+import threading
+
+from minesqlite.data.mvcc import VersionStore
+
+
+def test_read_as_of_snapshots():
+    store = VersionStore()
+    store.extend(['a0', 'b0'])
+    snapshot1 = store.snapshot()
+    store.write(0, 'a1')
+    store.append('c1')
+    snapshot2 = store.snapshot()
+    store.write(0, 'a2')
+    store.write(1, None)
+
+    assert snapshot1.read(0, 10) == ['a0', 'b0']
+    assert snapshot2.read(0, 10) == ['a1', 'b0', 'c1']
+    assert store.snapshot().read(0, 10) == ['a2', None, 'c1']
+    assert store.stats()['old_versions'] == 3
+
+    # `a0` is only visible to the first snapshot
+    snapshot1.release()
+    assert store.stats()['old_versions'] == 2
+    assert snapshot2.read(0, 10) == ['a1', 'b0', 'c1']
+    snapshot2.release()
+    assert store.stats() == {'commit_ts': 5, 'snapshots': 0,
+                             'old_versions': 0}
+
+
+def test_no_versions_kept_without_snapshots():
+    store = VersionStore()
+    store.append('a0')
+    for n in range(10):
+        store.write(0, 'a%d' % n)
+    assert store.stats()['old_versions'] == 0
+
+
+def test_abandoned_snapshot_is_released():
+    store = VersionStore()
+    store.append('a0')
+    with store.snapshot():
+        pass
+    snapshot = store.snapshot()
+    store.write(0, 'a1')
+    assert store.stats()['snapshots'] == 1
+    del snapshot
+    gc.collect()
+    assert store.stats() == {'commit_ts': 2, 'snapshots': 0,
+                             'old_versions': 0}
+
+
+def test_concurrent_writer():
+    store = VersionStore()
+    store.extend([(n, 0) for n in range(1000)])
+    stopped = threading.Event()
+
+    def write():
+        version = 0
+        while not stopped.is_set():
+            version += 1
+            for slot in range(0, 1000, 7):
+                store.write(slot, (slot, version))
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    try:
+        for _ in range(20):
+            with store.snapshot() as snapshot:
+                records = []
+                for start in range(0, 1000, 64):
+                    records.extend(snapshot.read(start, start + 64))
+                # nothing written after the snapshot is seen
+                assert snapshot.read(0, 1000) == records
+            assert [slot for slot, _ in records] == list(range(1000))
+            # the writer was caught in the middle of a single pass
+            versions = [version for slot, version in records
+                        if slot % 7 == 0]
+            assert versions == sorted(versions, reverse=True)
+            assert versions[0] - versions[-1] <= 1
+    finally:
+        stopped.set()
+        writer.join()
@@ -0,0 +1,170 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+import os
+
+import pytest
+from pytest_mock import MockerFixture
+
+from minesqlite import exceptions, schema
+from minesqlite.data.drivers.partitioned import PartitionedDataManager
+from minesqlite.data.query import Query
+from tests.utils import *
+
+
+@pytest.fixture
+def manager(mocker: MockerFixture, instance, sysconf):
+    data = os.linesep.join([
+        'columns:',
+        '  - name: id',
+        '    type: integer',
+        '    attribute: primary_key',
+        '  - name: name',
+        '    type: string',
+        '  - name: in_date',
+        '    type: date',
+    ])
+    sysconf['schema.read.infile'] = mocker.mock_open(read_data=data)()
+    sysconf['data.partitioned.partitions'] = 3
+    sysconf['data.partitioned.batch_size'] = 2
+    instance.schema = schema.SchemaManager(sysconf)
+    manager = PartitionedDataManager(instance)
+    yield manager
+    manager.close()
+
+
+def test_crud(manager):
+    for pk in range(10):
+        assert create(manager, make_row(pk, 'name%d' % pk)) \
+               == make_row(pk, 'name%d' % pk)
+    with raises(exceptions.DataDuplicateEntry):
+        create(manager, make_row(0))
+
+    assert manager.read_one(1) == make_row(1, 'name1')
+    assert manager.update_one(1, {'name': 'x'}) == make_row(1, 'x')
+    assert manager.delete_one(0) == make_row(0, 'name0')
+    for method, args in [('read_one', ()), ('delete_one', ()),
+                         ('update_one', ({'name': 'x'},))]:
+        with raises(exceptions.DataEntryNotFound):
+            getattr(manager, method)(0, *args)
+
+    # the rows are spread across the partitions
+    stats = manager.stats()
+    assert stats['partitions'] == 3
+    counts = [stats['partition%d.rows' % index] for index in range(3)]
+    assert sum(counts) == 9 and max(counts) < 9
+
+
+def test_create_many(manager):
+    entries = [(pk, {'name': 'name%d' % pk}) for pk in range(6)]
+    assert manager.create_many(entries) == 6
+    assert manager.read_one(5) == {'id': 5, 'name': 'name5'}
+    # all or none, across the partitions
+    with raises(exceptions.DataDuplicateEntry):
+        manager.create_many([(pk, {'name': 'x'}) for pk in range(6, 12)]
+                            + [(0, {'name': 'x'})])
+    assert sum(manager.stats()['partition%d.rows' % index]
+               for index in range(3)) == 6
+    assert manager.read_one(0) == {'id': 0, 'name': 'name0'}
+
+
+def test_select(manager):
+    for pk in range(10):
+        create(manager, make_row(pk, 'name%d' % (pk % 3), pk % 4 + 1))
+
+    rows = [row for batch in manager.scan() for row in batch]
+    assert sorted(row['id'] for row in rows) == list(range(10))
+
+    query = Query(filters={'name': 'name1'})
+    query.add_sort('$sort_desc', 'in_date')
+    query.add_sort('$sort_asc', 'id')
+    batches = list(manager.select(query, batch_size=2))
+    assert [len(batch) for batch in batches] == [2, 1]
+    assert [row['id'] for batch in batches for row in batch] == [7, 1, 4]
+
+    query = Query()
+    query.add_sort('$sort_desc', 'id')
+    rows = [row for batch in manager.select(query) for row in batch]
+    assert [row['id'] for row in rows] == list(range(9, -1, -1))
+
+    query = Query(limit=4)
+    query.add_sort('$sort_desc', 'id')
+    query.add_range('$lt', 'id', [8])
+    rows = [row for batch in manager.select(query) for row in batch]
+    assert [row['id'] for row in rows] == [7, 6, 5, 4]
+    query = Query(limit=3)
+    assert len([row for batch in manager.select(query) for row in batch]) \
+           == 3
+    assert manager.count(query) == 3
+    query = Query(limit=3, offset=8)
+    query.add_sort('$sort_asc', 'id')
+    rows = [row for batch in manager.select(query) for row in batch]
+    assert [row['id'] for row in rows] == [8, 9]
+    assert manager.count(query) == 2
+    assert manager.count(Query(filters={'name': 'name1'})) == 3
+    assert manager.aggregate(Query(), ['name']) \
+           == {('name0',): 4, ('name1',): 3, ('name2',): 3}
+
+
+def test_abandoned_select(manager):
+    for pk in range(10):
+        create(manager, make_row(pk))
+    query = Query()
+    query.add_sort('$sort_asc', 'id')
+    batches = manager.select(query, batch_size=1)
+    assert next(batches) == [make_row(0)]
+    batches.close()
+
+    # the rest of the abandoned results are dropped
+    assert manager.read_one(5) == make_row(5)
+    assert len([row for batch in manager.scan() for row in batch]) == 10
+
+
+def test_snapshot(manager, tmp_path):
+    for pk in range(10):
+        create(manager, make_row(pk))
+    path = str(tmp_path / 'snapshot.bin')
+    assert manager.save_snapshot(path) == 10
+    assert sorted(os.listdir(tmp_path)) \
+           == ['snapshot.bin.%d' % index for index in range(3)]
+
+    manager.delete_one(0)
+    assert manager.load_snapshot(path) == 10
+    assert manager.read_one(0) == make_row(0)
+
+
+def test_failing_call(manager, tmp_path):
+    for pk in range(10):
+        create(manager, make_row(pk))
+    path = str(tmp_path / 'snapshot.bin')
+    manager.save_snapshot(path)
+    os.remove(path + '.1')
+
+    # every partition replies, whether some of them fail or all
+    for failing_path in [path, str(tmp_path / 'missing' / 'snapshot.bin')]:
+        with raises(exceptions.MineSQLiteException):
+            manager.load_snapshot(failing_path)
+        for pk in range(10):
+            assert manager.read_one(pk) == make_row(pk)
+        assert manager.count(Query()) == 10
+
+
+@pytest.mark.parametrize(
+    ['key', 'value', 'expect_path'],
+    [
+        ('data.snapshot.path', 'data/snapshot.bin', 'data/snapshot.bin.1'),
+        ('data.snapshot.path', '', ''),
+        ('repl.banner', 'hello', 'hello'),
+    ]
+)
+def test_partition_sysconf(manager, key, value, expect_path):
+    manager.instance.sysconf[key] = value
+    sysconf = manager._build_sysconf(1, 'memory_dict')
+    assert sysconf[key] == expect_path
+    assert sysconf['data.driver'] == 'memory_dict'
+    assert 'schema.read.infile' not in sysconf
+
+
+def test_nested_partitions(instance, sysconf):
+    sysconf['data.partitioned.driver'] = 'partitioned'
+    with raises(exceptions.InternalError):
+        PartitionedDataManager(instance)
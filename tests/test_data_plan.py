@@ -0,0 +1,177 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+import concurrent.futures
+import datetime
+
+import pytest
+
+from minesqlite.data.plan import Access, Parallel, Planner, describe_range
+from minesqlite.data.query import Range, batched
+from tests.utils import *
+
+ROWS = [{'id': n, 'dept': 'ab'[n % 2], 'age': n % 5} for n in range(10)]
+
+
+def scan(batch_size):
+    return batched(ROWS, batch_size)
+
+
+@pytest.mark.parametrize(
+    ['query', 'expect_lines', 'expect_ids'],
+    [
+        (
+            make_query(),
+            ['project *  (estimated 10, actual 10)',
+             '-> scan  (estimated 10, actual 10)'],
+            list(range(10)),
+        ),
+        (
+            make_query({'dept': 'a'}, {'age': ('$gt', [1])},
+                       [('$sort_desc', 'id')], 2),
+            # 0.1 * 1 / 3 of the rows for the fields without statistics
+            ['project *  (estimated 1, actual 2)',
+             '-> limit 2  (estimated 1, actual 2)',
+             '   -> top 2 by id desc  (estimated 1, actual 2)',
+             '      -> filter dept = a, age > 1  (estimated 1, actual 3)',
+             '         -> scan  (estimated 10, actual 10)'],
+            [8, 4],
+        ),
+        (
+            make_query(sorts=[('$sort_desc', 'age'), ('$sort_asc', 'id')],
+                       limit=3),
+            ['project *  (estimated 3, actual 3)',
+             '-> limit 3  (estimated 3, actual 3)',
+             '   -> top 3 by age desc, id  (estimated 3, actual 3)',
+             '      -> scan  (estimated 10, actual 10)'],
+            [4, 9, 3],
+        ),
+    ]
+)
+def test_plan_on_scan(query, expect_lines, expect_ids):
+    plan = Planner(len(ROWS)).plan(query, [Access('scan', scan, len(ROWS))])
+    assert [row['id'] for batch in plan.execute(3) for row in batch] \
+           == expect_ids
+    assert plan.format() == expect_lines
+
+
+def test_project():
+    query = make_query({'dept': 'a'}, limit=2)
+    query.columns = ('id', 'age')
+    plan = Planner(len(ROWS)).plan(query, [Access('scan', scan, len(ROWS))])
+    assert [row for batch in plan.execute(3) for row in batch] \
+           == [{'id': 0, 'age': 0}, {'id': 2, 'age': 2}]
+    assert plan.format()[0] == 'project id, age  (estimated 1, actual 2)'
+
+
+def test_unknown_estimates():
+    plan = Planner(None).plan(make_query({'dept': 'a'}, limit=1),
+                              [Access('scan', scan)])
+    assert plan.format()[:2] == ['project *  (estimated ?, actual ?)',
+                                 '-> limit 1  (estimated ?, actual ?)']
+    assert len([row for batch in plan.execute(4) for row in batch]) == 1
+
+
+@pytest.mark.parametrize(
+    ['query', 'expect'],
+    [
+        (make_query(), 1000),
+        (make_query({'dept': 'a'}), 250),
+        # 0.1 of the rows for the fields without statistics
+        (make_query({'dept': 'a', 'name': 'x'}), 25),
+        (make_query(ranges={'age': ('$lt', [5])}), 100),
+        (make_query(ranges={'name': ('$gt', ['x'])}), 334),
+        (make_query({'dept': 'c'}), 0),
+    ]
+)
+def test_estimate(query, expect):
+    planner = Planner(
+        1000,
+        lambda field, value: {'a': 250, 'c': 0}[value]
+        if field == 'dept' else None,
+        lambda field, range_: 100 if field == 'age' else None)
+    assert planner.estimate(query) == expect
+
+
+@pytest.mark.parametrize(
+    ['query', 'expect_access'],
+    [
+        (make_query({'dept': 'a'}), 'lookup'),
+        (make_query({'dept': 'b'}), 'scan'),
+        # the walk in order stops after about 10 * 1000 / 100 rows
+        (make_query({'dept': 'a'}, sorts=[('$sort_asc', 'age')], limit=10),
+         'ordered'),
+        (make_query({'dept': 'a'}, sorts=[('$sort_asc', 'age')]), 'lookup'),
+    ]
+)
+def test_cheapest_access(query, expect_access):
+    planner = Planner(1000,
+                      lambda field, value: {'a': 100, 'b': 1000}[value])
+    paths = [
+        Access('scan', scan, 1000),
+        Access('lookup', scan, planner.estimate(query)),
+        Access('ordered', scan, planner.ordered_reads(query, 1000),
+               ordered=True),
+    ]
+    plan = planner.plan(query, paths)
+    assert list(plan.walk())[-1].operator == expect_access
+
+
+@pytest.mark.parametrize(
+    ['query', 'expect_lines', 'expect_ids'],
+    [
+        (
+            make_query({'dept': 'a'}, sorts=[('$sort_desc', 'age')]),
+            ['project *  (estimated 1, actual 5)',
+             '-> parallel filter dept = a, sort age desc, '
+             'in chunks of 3 rows  (estimated 1, actual 5)',
+             '   -> scan  (estimated 10, actual 10)'],
+            [4, 8, 2, 6, 0],
+        ),
+        (
+            make_query(sorts=[('$sort_asc', 'age')], limit=3),
+            ['project *  (estimated 3, actual 3)',
+             '-> limit 3  (estimated 3, actual 3)',
+             '   -> parallel sort age, in chunks of 3 rows  '
+             '(estimated 10, actual 4)',
+             '      -> scan  (estimated 10, actual 10)'],
+            [0, 5, 1],
+        ),
+        (
+            make_query(ranges={'age': ('$lt', [2])}),
+            ['project *  (estimated 4, actual 4)',
+             '-> parallel filter age < 2, in chunks of 3 rows  '
+             '(estimated 4, actual 4)',
+             '   -> scan  (estimated 10, actual 10)'],
+            [0, 1, 5, 6],
+        ),
+        (
+            # the scan stops at the limit
+            make_query({'dept': 'a'}, limit=1),
+            ['project *  (estimated 1, actual 1)',
+             '-> limit 1  (estimated 1, actual 1)',
+             '   -> filter dept = a  (estimated 1, actual 1)',
+             '      -> scan  (estimated 10, actual 2)'],
+            [0],
+        ),
+    ]
+)
+def test_plan_in_parallel(query, expect_lines, expect_ids):
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        planner = Planner(len(ROWS), parallel=Parallel(executor, 3))
+        plan = planner.plan(query, [Access('scan', scan, len(ROWS))])
+        assert [row['id'] for batch in plan.execute(2) for row in batch] \
+               == expect_ids
+    assert plan.format() == expect_lines
+
+
+@pytest.mark.parametrize(
+    ['range_', 'expect'],
+    [
+        (Range(1, 2), 'age >= 1 and age <= 2'),
+        (Range(lower=1, lower_inclusive=False), 'age > 1'),
+        (Range(upper=datetime.datetime(2022, 6, 5), upper_inclusive=False),
+         'age < 2022-06-05'),
+    ]
+)
+def test_describe_range(range_, expect):
+    assert describe_range('age', range_) == expect
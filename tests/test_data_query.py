@@ -0,0 +1,194 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+import datetime
+import pickle
+
+import pytest
+from pytest_mock import MockerFixture
+
+from minesqlite import exceptions
+from minesqlite.data.query import (
+    Query,
+    Range,
+    batched,
+    decode_token,
+    encode_token,
+)
+from tests.utils import *
+
+ROWS = [
+    {'id': 1, 'name': 'b', 'age': 30},
+    {'id': 2, 'name': 'a', 'age': 20},
+    {'id': 3, 'name': 'b', 'age': 20},
+]
+
+
+@pytest.mark.parametrize(
+    ['filters', 'sorts', 'expect_ids'],
+    [
+        ({}, [], [1, 2, 3]),
+        ({'name': 'b'}, [], [1, 3]),
+        ({'name': 'c'}, [], []),
+        ({}, [('$sort_desc', 'id')], [3, 2, 1]),
+        ({}, [('$sort_asc', 'age'), ('$sort_desc', 'id')], [3, 2, 1]),
+        ({}, [('$sort_asc', 'name'), ('$sort_asc', 'age')], [2, 3, 1]),
+        ({'age': 20}, [('$sort_desc', 'name')], [3, 2]),
+    ]
+)
+def test_filter_and_sort(filters, sorts, expect_ids):
+    query = Query(filters=filters)
+    for magic_key, field in sorts:
+        query.add_sort(magic_key, field)
+    rows = query.filter(list(ROWS))
+    query.sort(rows)
+    assert [row['id'] for row in rows] == expect_ids
+
+
+@pytest.mark.parametrize(
+    'sorts',
+    [
+        [('$sort_asc', 'id')],
+        [('$sort_desc', 'name'), ('$sort_desc', 'id')],
+        [('$sort_asc', 'name'), ('$sort_desc', 'age'), ('$sort_asc', 'id')],
+        [('$sort_desc', 'age'), ('$sort_asc', 'name'), ('$sort_desc', 'id')],
+    ]
+)
+@pytest.mark.parametrize('count', [0, 1, 2, 10])
+def test_top(sorts, count):
+    rows = [{'id': n, 'name': 'abc'[n * 7 % 3], 'age': n * 5 % 4}
+            for n in range(8)]
+    query = Query()
+    for magic_key, field in sorts:
+        query.add_sort(magic_key, field)
+    expect = list(rows)
+    for magic_key, field in reversed(sorts):
+        expect.sort(key=lambda row: row[field],
+                    reverse=magic_key == '$sort_desc')
+    assert query.top(iter(rows), count) == expect[:count]
+    query.sort(rows)
+    assert rows == expect
+
+
+def test_invalid_sort():
+    with raises(exceptions.InternalError):
+        Query().add_sort('$sort', 'id')
+
+
+@pytest.mark.parametrize(
+    ['range_', 'value', 'expect'],
+    [
+        (Range(), 5, True),
+        (Range(), None, False),
+        (Range(lower=5), 5, True),
+        (Range(lower=5, lower_inclusive=False), 5, False),
+        (Range(upper=5), 6, False),
+        (Range(upper=5, upper_inclusive=False), 5, False),
+        (Range(1, 5), 3, True),
+        (Range(1, 5), 0, False),
+    ]
+)
+def test_range_contains(range_, value, expect):
+    assert range_.contains(value) == expect
+
+
+def test_add_range():
+    query = Query()
+    query.add_range('$gt', 'age', [10])
+    query.add_range('$between', 'age', [10, 30])
+    query.add_range('$lt', 'age', [40])
+    assert query.ranges == {'age': Range(10, 30, False, True)}
+    query.add_range('$lt', 'id', [3])
+    rows = query.filter(list(ROWS) + [{'id': 0, 'name': 'c'}])
+    assert [row['id'] for row in rows] == [1, 2]
+
+    for magic_key, bounds in [('$gt', [1, 2]), ('$between', [1])]:
+        with raises(exceptions.CommandInvalidValueArgument):
+            query.add_range(magic_key, 'age', bounds)
+    with raises(exceptions.InternalError):
+        query.add_range('$ge', 'age', [1])
+
+
+@pytest.mark.parametrize(
+    ['limit', 'offset', 'expect_batches', 'expect_rest'],
+    [
+        (None, 0, [[1, 2], [3, 4], [5]], None),
+        (3, 0, [[1, 2], [3]], [5]),
+        (4, 0, [[1, 2], [3, 4]], [5]),
+        (0, 0, [], [1, 2]),
+        (None, 1, [[2], [3, 4], [5]], None),
+        (None, 2, [[3, 4], [5]], None),
+        (2, 3, [[4], [5]], None),
+        (1, 10, [], None),
+    ]
+)
+def test_truncate(limit, offset, expect_batches, expect_rest):
+    query = Query(limit=limit, offset=offset)
+    batches = batched(range(1, 6), 2)
+    assert list(query.truncate(batches)) == expect_batches
+    # no batch is pulled past the limit
+    assert next(batches, None) == expect_rest
+    assert query.clip(5) == sum(map(len, expect_batches))
+
+
+@pytest.mark.parametrize(
+    ['sorts', 'after', 'expect_ids'],
+    [
+        ([('$sort_asc', 'id')], (1,), [2, 3]),
+        ([('$sort_desc', 'id')], (2,), [1]),
+        ([('$sort_asc', 'name'), ('$sort_desc', 'id')], ('b', 3), [1]),
+        ([('$sort_desc', 'age'), ('$sort_asc', 'id')], (20, 2), [3]),
+        ([('$sort_desc', 'age'), ('$sort_asc', 'id')], (30, 1), [2, 3]),
+    ]
+)
+def test_after(sorts, after, expect_ids):
+    query = Query(after=after)
+    for magic_key, field in sorts:
+        query.add_sort(magic_key, field)
+    rows = query.filter(ROWS)
+    assert [row['id'] for row in rows] == expect_ids
+
+
+def test_predicate_built_once(mocker: MockerFixture):
+    from minesqlite.data import where
+    compile_predicate = mocker.spy(where, 'compile_predicate')
+    query = make_query({'name': 'b'}, {'age': ('$gt', [25])})
+    assert [row['id'] for row in ROWS if query.match(row)] == [1]
+    assert query.filter(ROWS) == ROWS[:1]
+    assert compile_predicate.call_count == 1
+
+    # without the compiled predicate, built again once unpickled
+    copy = pickle.loads(pickle.dumps(query))
+    assert copy == query and copy.filter(ROWS) == ROWS[:1]
+
+
+def test_break_ties():
+    query = Query()
+    query.break_ties('id')
+    assert query.sorts == []
+    query.add_sort('$sort_desc', 'age')
+    query.break_ties('id')
+    query.break_ties('id')
+    assert query.sorts == [('age', True), ('id', True)]
+    assert query.key_of(ROWS[0]) == (30, 1)
+
+
+@pytest.mark.parametrize(
+    ['fields', 'key'],
+    [
+        (['id'], (1,)),
+        (['in_date', 'name'], (datetime.datetime(2022, 6, 5), 'a"b')),
+    ]
+)
+def test_token(fields, key):
+    token = encode_token(fields, key)
+    assert token.isascii() and ' ' not in token
+    assert decode_token(token) == (fields, key)
+
+
+@pytest.mark.parametrize(
+    'token', ['', 'not-base64!', encode_token(['id'], [])[:-2],
+              # valid base64 and JSON, not a token
+              'WzFd', 'W1siaWQiXSxbMSwyXV0', 'W1siaWQiXSxbeyJ4IjoxfV1d'])
+def test_invalid_token(token):
+    with raises(exceptions.CommandInvalidValueArgument):
+        decode_token(token)
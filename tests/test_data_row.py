@@ -0,0 +1,85 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+import pickle
+
+import pytest
+
+from minesqlite import exceptions
+from minesqlite.data.row import MISSING, RowLayout, RowView
+from tests.utils import *
+
+
+@pytest.fixture
+def layout():
+    return RowLayout(['id', 'name', 'age'], 'id')
+
+
+@pytest.mark.parametrize(
+    ['fields', 'pk', 'expect_fields'],
+    [
+        (['id', 'name'], 'id', ('id', 'name')),
+        (['name', 'id'], 'id', ('name', 'id')),
+        # the primary key always has a place
+        (['name'], 'id', ('id', 'name')),
+    ]
+)
+def test_layout_fields(fields, pk, expect_fields):
+    layout = RowLayout(fields, pk)
+    assert layout.fields == expect_fields
+    assert layout.fields[layout.pk_index] == pk
+
+
+@pytest.mark.parametrize(
+    ['pk', 'kvs', 'expect_record', 'expect_exc'],
+    [
+        (1, {'name': 'n', 'age': 2}, (1, 'n', 2), no_raise()),
+        (1, {'age': 2}, (1, MISSING, 2), no_raise()),
+        (1, {'id': 3, 'name': 'n'}, (1, 'n', MISSING), no_raise()),
+        (1, {'extra': 2}, None, raises(exceptions.DataEntryInvalid)),
+    ]
+)
+def test_pack(layout, pk, kvs, expect_record, expect_exc):
+    with expect_exc:
+        assert layout.pack(pk, kvs) == expect_record
+
+
+def test_replace(layout):
+    record = layout.pack(1, {'age': 2})
+    assert layout.replace(record, {'name': 'n'}) == (1, 'n', 2)
+    with raises(exceptions.DataEntryInvalid):
+        layout.replace(record, {'extra': 2})
+    assert layout.to_kvs(record) == {'age': 2}
+
+
+def test_view(layout):
+    record = layout.pack(1, {'name': 'n'})
+    view = layout.view(record)
+    assert view == {'id': 1, 'name': 'n'}
+    assert {'id': 1, 'name': 'n'} == view
+    assert len(view) == 2
+    assert list(view) == ['id', 'name']
+    assert view.get('age') is None
+    assert 'age' not in view
+    with raises(KeyError):
+        _ = view['extra']
+    # read-only
+    with raises(TypeError):
+        view['name'] = 'x'
+
+    copied = view.to_dict()
+    assert type(copied) is dict and copied == view
+    copied['name'] = 'x'
+    assert view['name'] == 'n'
+
+
+def test_record_of(layout):
+    record = layout.pack(1, {'name': 'n'})
+    assert layout.record_of(layout.view(record)) is record
+    assert layout.record_of({'id': 1, 'name': 'n'}) == record
+    other = RowLayout(['name', 'id'], 'id')
+    assert layout.record_of(other.view(('n', 1))) == record
+
+
+def test_missing_pickle():
+    assert pickle.loads(pickle.dumps(MISSING)) is MISSING
+    assert isinstance(RowLayout(['id'], 'id').view((1,)), RowView)
@@ -0,0 +1,77 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+import datetime
+
+import pytest
+from pytest_mock import MockerFixture
+
+from minesqlite import exceptions
+from minesqlite.data import snapshot
+from tests.utils import *
+
+
+@pytest.mark.parametrize('num_rows', [0, 1, 10])
+def test_write_and_read(mocker: MockerFixture, tmp_path, num_rows):
+    mocker.patch.object(snapshot, 'CHUNK_ROWS', 3)
+    path = str(tmp_path / 'dir' / 'snapshot.bin')
+    fields = ['k', 'date']
+    entries = [(n, ('v%d' % n, datetime.datetime(2022, 6, n + 1)))
+               for n in range(num_rows)]
+
+    snapshot.write_snapshot(path, fields, iter(entries), len(entries))
+    got = []
+    for got_fields, (pks, rows) in snapshot.read_snapshot(path):
+        assert got_fields == fields
+        assert len(pks) <= 3
+        got.extend(zip(pks, rows))
+    assert got == entries
+
+
+def test_write_and_read_mixed_column(tmp_path):
+    path = str(tmp_path / 'snapshot.bin')
+    # the time of the day is kept
+    entries = [(1, (datetime.datetime(2022, 6, 1),)),
+               (2, (datetime.datetime(2022, 6, 1, 12, 30),)),
+               (3, (None,))]
+
+    snapshot.write_snapshot(path, ['k'], entries, len(entries))
+    (_, (pks, rows)), = snapshot.read_snapshot(path)
+    assert list(zip(pks, rows)) == entries
+
+
+@pytest.mark.parametrize(
+    ['corrupt', 'expect_exc'],
+    [
+        (lambda content: content, no_raise()),
+        (lambda content: b'', raises(exceptions.DataSnapshotInvalid)),
+        (lambda content: content[:5], raises(exceptions.DataSnapshotInvalid)),
+        (lambda content: content[:-1], raises(exceptions.DataSnapshotInvalid)),
+        (lambda content: b'XXXX' + content[4:],
+         raises(exceptions.DataSnapshotInvalid)),
+        # unsupported version
+        (lambda content: content[:4] + b'\xff' + content[5:],
+         raises(exceptions.DataSnapshotInvalid)),
+    ]
+)
+def test_read_invalid(tmp_path, corrupt, expect_exc):
+    path = tmp_path / 'snapshot.bin'
+    snapshot.write_snapshot(str(path), ['k'], [(1, ('v',))], 1)
+    path.write_bytes(corrupt(path.read_bytes()))
+
+    with expect_exc:
+        list(snapshot.read_snapshot(str(path)))
+
+
+def test_generation(tmp_path):
+    path = str(tmp_path / 'snapshot.bin')
+    snapshot.write_snapshot(path, ['k'], [(1, ('v',))], 1, generation=7)
+    assert snapshot.read_generation(path) == 7
+    assert list(snapshot.read_snapshot(path)) == [(['k'], ([1], [('v',)]))]
+
+    # the first version, without the generation
+    with open(path, 'rb') as f:
+        content = f.read()
+    with open(path, 'wb') as f:
+        f.write(content[:4] + b'\x01\x00' + content[6:14] + content[22:])
+    assert snapshot.read_generation(path) == 0
+    assert list(snapshot.read_snapshot(path)) == [(['k'], ([1], [('v',)]))]
@@ -0,0 +1,281 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+import functools
+import datetime
+import os
+
+import pytest
+from pytest_mock import MockerFixture
+
+from minesqlite import exceptions, schema
+from minesqlite.data.drivers.sqlite import SQLiteDataManager
+from minesqlite.data.query import Query
+from minesqlite.data.where import compile_where
+from tests.utils import *
+
+
+@pytest.fixture
+def build_manager(mocker: MockerFixture, instance, sysconf, tmp_path,
+                  build_manager):
+    data = os.linesep.join([
+        'columns:',
+        '  - name: id',
+        '    type: integer',
+        '    attribute: primary_key',
+        '  - name: name',
+        '    type: string',
+        '    attribute: index',
+        '  - name: in_date',
+        '    type: date',
+    ])
+    sysconf['schema.read.infile'] = mocker.mock_open(read_data=data)()
+    sysconf['data.sqlite.path'] = str(tmp_path / 'sqlite.db')
+    instance.schema = schema.SchemaManager(sysconf)
+    return functools.partial(build_manager, SQLiteDataManager)
+
+
+@pytest.fixture
+def manager(build_manager):
+    return build_manager()
+
+
+def test_crud(manager):
+    for pk in range(3):
+        assert create(manager, make_row(pk, 'name%d' % pk, pk + 1)) \
+               == make_row(pk, 'name%d' % pk, pk + 1)
+    with raises(exceptions.DataDuplicateEntry):
+        create(manager, make_row(0))
+
+    assert manager.read_one(1) == make_row(1, 'name1', 2)
+    assert manager.update_one(1, {'name': 'x'}) == make_row(1, 'x', 2)
+    assert manager.delete_one(0) == make_row(0, 'name0', 1)
+    for method, args in [('read_one', ()), ('delete_one', ()),
+                         ('update_one', ({'name': 'x'},))]:
+        with raises(exceptions.DataEntryNotFound):
+            getattr(manager, method)(0, *args)
+    assert manager.stats()['rows'] == 2
+
+
+@pytest.mark.parametrize(
+    ['method', 'kvs'],
+    [
+        ('create_one', {'extra': 1}),
+        ('update_one', {'extra': 1}),
+        ('update_one', {'id': 2}),
+    ]
+)
+def test_invalid_entry(manager, method, kvs):
+    create(manager, make_row(1))
+    with raises(exceptions.DataEntryInvalid):
+        getattr(manager, method)(1, kvs)
+    assert manager.read_one(1) == make_row(1)
+
+
+@pytest.mark.parametrize(
+    ['pks', 'kvs', 'expect_pks', 'expect_exc'],
+    [
+        ([2, 3], {}, [1, 2, 3], no_raise()),
+        # all or none
+        ([2, 1], {}, [1], raises(exceptions.DataDuplicateEntry, match='1')),
+        ([2, 2], {}, [1], raises(exceptions.DataDuplicateEntry, match='2')),
+        ([2, 3], {'extra': 1}, [1], raises(exceptions.DataEntryInvalid)),
+    ]
+)
+def test_create_many(mocker: MockerFixture, manager, pks, kvs,
+                     expect_pks, expect_exc):
+    mocker.patch('minesqlite.data.drivers.sqlite.READ_MANY_BATCH_SIZE', 1)
+    create(manager, make_row(1))
+    entries = []
+    for pk in pks:
+        row = {**make_row(pk, day=pk), **kvs}
+        entries.append((row.pop('id'), row))
+    with expect_exc:
+        assert manager.create_many(entries) == len(entries)
+    assert [row['id'] for row in traverse(manager)] == expect_pks
+
+
+def test_read_many(mocker: MockerFixture, manager):
+    mocker.patch('minesqlite.data.drivers.sqlite.READ_MANY_BATCH_SIZE', 2)
+    for pk in range(5):
+        create(manager, make_row(pk, day=pk + 1))
+    assert manager.read_many([3, 0, 4, 1, 2]) \
+           == [make_row(pk, day=pk + 1) for pk in [3, 0, 4, 1, 2]]
+    assert manager.read_many([]) == []
+    with raises(exceptions.DataEntryNotFound):
+        manager.read_many([1, 9])
+
+
+def test_partial_row(manager):
+    assert manager.create_one(1, {'name': 'n'}) == {'id': 1, 'name': 'n'}
+    assert manager.read_one(1) == {'id': 1, 'name': 'n'}
+
+
+def test_reopen(build_manager):
+    manager = build_manager()
+    create(manager, make_row(1))
+    manager.close()
+    assert build_manager().read_one(1) == make_row(1)
+
+
+@pytest.mark.parametrize('batch_size', [1, 2, 100])
+def test_scan(manager, batch_size):
+    for pk in [5, 3, 1, 4, 2]:
+        create(manager, make_row(pk))
+    batches = manager.scan(batch_size)
+    first = next(batches)
+    # keyset pagination sees the modifications made meanwhile
+    manager.delete_one(5)
+    create(manager, make_row(6))
+    rows = first + [row for batch in batches for row in batch]
+    assert len(first) == min(batch_size, 5)
+    expect_pks = [1, 2, 3, 4, 6] if batch_size < 5 \
+        else [1, 2, 3, 4, 5, 6]
+    assert [row['id'] for row in rows] == expect_pks
+    assert [row['id'] for row in traverse(manager)] == [1, 2, 3, 4, 6]
+
+
+@pytest.mark.parametrize(
+    ['filters', 'ranges', 'sorts', 'limit', 'expect_sql', 'expect_pks'],
+    [
+        ({}, {}, [], None,
+         'SELECT "id", "name", "in_date" FROM "employees"',
+         [0, 1, 2, 3, 4, 5]),
+        ({'name': 'name1'}, {}, [], None,
+         'SELECT "id", "name", "in_date" FROM "employees" '
+         'WHERE "name" = ?',
+         [1, 4]),
+        ({'in_date': datetime.datetime(2022, 6, 1)}, {},
+         [('$sort_desc', 'id')], None,
+         'SELECT "id", "name", "in_date" FROM "employees" '
+         'WHERE "in_date" = ? ORDER BY "id" DESC',
+         [4, 2, 0]),
+        ({}, {}, [('$sort_asc', 'name'), ('$sort_desc', 'in_date')], None,
+         'SELECT "id", "name", "in_date" FROM "employees" '
+         'ORDER BY "name", "in_date" DESC',
+         [3, 0, 1, 4, 5, 2]),
+        ({}, {'id': ('$gt', [1]),
+              'in_date': ('$between', [datetime.datetime(2022, 6, 1)] * 2)},
+         [('$sort_asc', 'id')], 2,
+         'SELECT "id", "name", "in_date" FROM "employees" '
+         'WHERE "id" > ? AND "in_date" >= ? AND "in_date" <= ? '
+         'ORDER BY "id" LIMIT ?',
+         [2, 4]),
+    ]
+)
+def test_select(manager, filters, ranges, sorts, limit,
+                expect_sql, expect_pks):
+    for pk in range(6):
+        create(manager, make_row(pk, 'name%d' % (pk % 3), pk % 2 + 1))
+    query = Query(filters=dict(filters), limit=limit)
+    for field, (magic_key, bounds) in ranges.items():
+        query.add_range(magic_key, field, bounds)
+    for magic_key, field in sorts:
+        query.add_sort(magic_key, field)
+
+    sql, _ = manager.build_sql(query)
+    assert sql == expect_sql
+    rows = [row for batch in manager.select(query, batch_size=2)
+            for row in batch]
+    assert [row['id'] for row in rows] == expect_pks
+    assert manager.count(query) == len(expect_pks)
+
+
+def test_aggregate(manager):
+    for pk in range(6):
+        create(manager, make_row(pk, 'name%d' % (pk % 3), pk % 2 + 1))
+    day1, day2 = datetime.datetime(2022, 6, 1), datetime.datetime(2022, 6, 2)
+    assert manager.aggregate(Query(), ['in_date']) == {(day1,): 3,
+                                                       (day2,): 3}
+    query = Query(filters={'name': 'name0'})
+    query.add_range('$gt', 'id', [0])
+    assert manager.aggregate(query, ['name', 'in_date']) \
+           == {('name0', day2): 1}
+    with pytest.raises(exceptions.DataEntryInvalid):
+        manager.aggregate(Query(), ['age'])
+
+
+def test_select_after(manager):
+    for pk in range(6):
+        create(manager, make_row(pk, 'name%d' % (pk % 3), pk % 2 + 1))
+    query = Query(after=('name1', datetime.datetime(2022, 6, 1), 4),
+                  offset=1)
+    query.add_sort('$sort_desc', 'name')
+    query.add_sort('$sort_asc', 'in_date')
+    query.break_ties('id')
+    sql, params = manager.build_sql(query)
+    assert sql.endswith(
+        'WHERE "name" <= ? AND (("name" < ?) '
+        'OR ("name" = ? AND "in_date" > ?) '
+        'OR ("name" = ? AND "in_date" = ? AND "id" > ?)) '
+        'ORDER BY "name" DESC, "in_date", "id" LIMIT ? OFFSET ?')
+    day = datetime.datetime(2022, 6, 1).toordinal()
+    assert params == ['name1', 'name1', 'name1', day, 'name1', day, 4, -1, 1]
+    # after name1 on day 1 (pk 4): pk 1, then name0 (pk 0 and 3)
+    rows = [row for batch in manager.select(query) for row in batch]
+    assert [row['id'] for row in rows] == [0, 3]
+    assert manager.count(query) == 2
+
+
+@pytest.mark.parametrize(
+    ['text', 'expect_where', 'expect_pks'],
+    [
+        ('name in (name1, name2) and not in_date == 2022-06-01',
+         '("name" IN (?, ?) AND "in_date" != ?)', [1, 5]),
+        ('id < 2 or id > 4 and name != name2',
+         '(("id" < ?) OR (("id" > ?) AND "name" != ?))', [0, 1]),
+        ('not (id >= 1 and id <= 4)', '(("id" < ?) OR ("id" > ?))', [0, 5]),
+        ('id > 3 and id < 2', '0', []),
+    ]
+)
+def test_select_where(instance, manager, text, expect_where, expect_pks):
+    for pk in range(6):
+        create(manager, make_row(pk, 'name%d' % (pk % 3), pk % 2 + 1))
+    query = Query(where=compile_where(instance.schema, text))
+    sql, _ = manager.build_sql(query)
+    assert sql.endswith(' WHERE ' + expect_where)
+    rows = [row for batch in manager.select(query) for row in batch]
+    assert [row['id'] for row in rows] == expect_pks
+    assert manager.count(query) == len(expect_pks)
+
+
+def test_select_columns(manager):
+    for pk in range(3):
+        create(manager, make_row(pk, 'name%d' % pk))
+    query = Query(columns=('in_date', 'id'), limit=2)
+    query.add_sort('$sort_desc', 'id')
+    sql, _ = manager.build_sql(query)
+    assert sql.startswith('SELECT "in_date", "id" FROM "employees"')
+    day = datetime.datetime(2022, 6, 1)
+    assert [row for batch in manager.select(query) for row in batch] \
+           == [{'in_date': day, 'id': 2}, {'in_date': day, 'id': 1}]
+    assert manager.plan(query).describe() == \
+           'project in_date, id, pushed down'
+
+
+def test_explain(manager):
+    for pk in range(6):
+        create(manager, make_row(pk, 'name%d' % (pk % 3)))
+    plan = manager.explain(Query(filters={'name': 'name1'}))
+    access = list(plan.walk())[-1]
+    assert access.operator == 'sqlite'
+    assert 'USING INDEX employees_name' in access.detail
+    assert plan.actual == access.actual == 2
+
+
+def test_save_and_load_snapshot(manager, tmp_path):
+    for pk in range(5):
+        create(manager, make_row(pk, 'name%d' % pk))
+    path = str(tmp_path / 'snapshot.bin')
+    assert manager.save_snapshot(path) == 5
+
+    manager.delete_one(0)
+    create(manager, make_row(10))
+    assert manager.load_snapshot(path) == 5
+    assert traverse(manager) == [make_row(pk, 'name%d' % pk)
+                                 for pk in range(5)]
+
+
+def test_invalid_synchronous(instance, sysconf, build_manager):
+    sysconf['data.sqlite.synchronous'] = 'sometimes'
+    with raises(exceptions.InternalError):
+        build_manager()
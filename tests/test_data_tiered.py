@@ -0,0 +1,131 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+import pytest
+from pytest_mock import MockerFixture
+
+from minesqlite import exceptions
+from minesqlite.data.drivers import tiered
+from minesqlite.data.drivers.tiered import TieredDataManager, record_size
+from tests.conftest import TEST_PK
+from tests.utils import *
+
+
+def make_kvs(pk: int) -> dict:
+    return {'k': 'v%03d' % pk}
+
+
+# about the size of a row made by `make_kvs`
+ROW_BYTES = record_size((1, 'v001'))
+
+
+@pytest.fixture
+def build_manager(mocker: MockerFixture, instance, tmp_path, build_manager):
+    mocker.patch.object(instance.schema, 'primary_key', TEST_PK)
+    mocker.patch.object(instance.schema, 'fields', [TEST_PK, 'k'])
+    instance.sysconf['data.tiered.spill_path'] = str(tmp_path / 'spill.bin')
+
+    def build(max_rows: int = 4):
+        return build_manager(TieredDataManager, **{
+            'data.memory.max_bytes': max_rows * ROW_BYTES})
+
+    return build
+
+
+def test_crud(build_manager):
+    manager = build_manager()
+    for pk in range(10):
+        manager.create_one(pk, make_kvs(pk))
+    with raises(exceptions.DataDuplicateEntry):
+        manager.create_one(0, make_kvs(0))
+
+    stats = manager.stats()
+    assert stats['rows'] == 10
+    assert stats['hot_rows'] == 4 and stats['hot_bytes'] <= 4 * ROW_BYTES
+    assert stats['evictions'] == stats['spill_writes'] == 6
+
+    for pk in [0, 9]:
+        assert manager.read_one(pk) == {TEST_PK: pk, **make_kvs(pk)}
+    assert manager.update_one(1, {'k': 'x'}) == {TEST_PK: 1, 'k': 'x'}
+    assert manager.delete_one(2) == {TEST_PK: 2, **make_kvs(2)}
+    assert manager.delete_one(8) == {TEST_PK: 8, **make_kvs(8)}
+    for pk in [2, 8, 100]:
+        with raises(exceptions.DataEntryNotFound):
+            manager.read_one(pk)
+        with raises(exceptions.DataEntryNotFound):
+            manager.delete_one(pk)
+    with raises(exceptions.DataEntryInvalid):
+        manager.update_one(1, {TEST_PK: 2})
+
+    stats = manager.stats()
+    assert stats['rows'] == 8
+    assert stats['hits'] == 1 and stats['misses'] == 2
+    assert sorted(row[TEST_PK] for row in traverse(manager)) \
+           == [0, 1, 3, 4, 5, 6, 7, 9]
+
+
+def test_lru(build_manager):
+    manager = build_manager(max_rows=2)
+    for pk in range(3):
+        manager.create_one(pk, make_kvs(pk))
+    # 0 has been evicted, reading 1 keeps it hot over 2
+    manager.read_one(1)
+    manager.read_one(0)
+    assert list(manager._hot) == [1, 0]
+    assert manager.stats()['misses'] == 1
+
+    # 2 is evicted again, without rewriting its spilled copy
+    spill_writes = manager.stats()['spill_writes']
+    manager.read_one(2)
+    manager.read_one(1)
+    assert manager.stats()['spill_writes'] == spill_writes + 1
+
+
+def test_scan_does_not_promote(build_manager):
+    manager = build_manager()
+    for pk in range(10):
+        manager.create_one(pk, make_kvs(pk))
+    hot = list(manager._hot)
+
+    batches = list(manager.scan(batch_size=3))
+    assert [len(batch) for batch in batches] == [3, 3, 3, 1]
+    assert sorted(row[TEST_PK] for batch in batches for row in batch) \
+           == list(range(10))
+    assert list(manager._hot) == hot
+    assert manager.stats()['spill_reads'] == 6
+
+
+def test_unlimited(build_manager):
+    manager = build_manager(max_rows=0)
+    for pk in range(100):
+        manager.create_one(pk, make_kvs(pk))
+    assert manager.stats()['hot_rows'] == 100
+    assert manager.stats()['spill_bytes'] == 0
+
+
+def test_compaction(mocker: MockerFixture, build_manager):
+    mocker.patch.object(tiered, 'COMPACTION_MIN_BYTES', 1)
+    manager = build_manager(max_rows=1)
+    for pk in range(10):
+        manager.create_one(pk, make_kvs(pk))
+    for pk in range(5):
+        manager.delete_one(pk)
+    stats = manager.stats()
+    assert stats['compactions'] >= 1
+    assert stats['spill_garbage_bytes'] * 2 < stats['spill_bytes']
+    assert [manager.read_one(pk)['k'] for pk in range(5, 10)] \
+           == [make_kvs(pk)['k'] for pk in range(5, 10)]
+
+
+def test_save_and_load_snapshot(build_manager, tmp_path):
+    manager = build_manager()
+    for pk in range(10):
+        manager.create_one(pk, make_kvs(pk))
+    path = str(tmp_path / 'snapshot.bin')
+    assert manager.save_snapshot(path) == 10
+
+    manager.delete_one(0)
+    manager.create_one(10, make_kvs(10))
+    assert manager.load_snapshot(path) == 10
+    assert manager.stats()['hot_rows'] == 4
+    assert sorted(row[TEST_PK] for row in traverse(manager)) \
+           == list(range(10))
@@ -0,0 +1,137 @@
+# coding=utf-8
+# Author: @hsiaoxychen
+import datetime
+import os
+import pickle
+
+import pytest
+
+from minesqlite import exceptions, schema
+from minesqlite.data.query import Query, Range
+from minesqlite.data.where import FALSE, TRUE, compile_predicate, \
+    compile_where
+from tests.utils import *
+
+DAY = datetime.datetime
+ROWS = [
+    {'id': 1, 'name': 'b', 'age': 30, 'in_date': DAY(2021, 1, 1)},
+    {'id': 2, 'name': 'a', 'age': 20, 'in_date': DAY(2022, 1, 1)},
+    {'id': 3, 'name': 'b', 'age': 20, 'in_date': DAY(2023, 1, 1)},
+    {'id': 4, 'name': 'c', 'age': None, 'in_date': None},
+]
+
+
+@pytest.fixture
+def manager():
+    return schema.SchemaManager({'schema.read.infile': os.linesep.join([
+        'columns:',
+        '  - name: id',
+        '    type: integer',
+        '    attribute: primary_key',
+        '  - name: name',
+        '    type: string',
+        '  - name: age',
+        '    type: integer',
+        '  - name: in_date',
+        '    type: date',
+    ])})
+
+
+@pytest.mark.parametrize(
+    ['text', 'expect_ids'],
+    [
+        ('name == b', [1, 3]),
+        ('name = b', [1, 3]),
+        ('name != b', [2, 4]),
+        ('age > 20', [1]),
+        ('age >= 20', [1, 2, 3]),
+        ('age < 30', [2, 3]),
+        ('age <= 30 and age > 20', [1]),
+        ('in_date >= 2022-01-01', [2, 3]),
+        ('name in (a, c)', [2, 4]),
+        ('name not in (a, c)', [1, 3]),
+        ('name IN ("a")', [2]),
+        ("name == 'b' and not age == 30", [3]),
+        ('name == a or age == 30', [1, 2]),
+        ('name == a or name == b and age == 30', [1, 2]),
+        ('(name == a or name == b) and age == 20', [2, 3]),
+        ('not (name == a or id > 2)', [1]),
+        # no value is neither in a range nor out of it
+        ('not age > 20', [2, 3]),
+        ('not (age >= 20 and age <= 25)', [1]),
+        ('not not name == c', [4]),
+        ('age > 30 and age < 10', []),
+        ('name == a and name == b', []),
+        ('name == a or not name == a', [1, 2, 3, 4]),
+    ]
+)
+def test_where(manager, text, expect_ids):
+    query = Query(where=compile_where(manager, text))
+    assert [row['id'] for row in query.filter(ROWS)] == expect_ids
+
+
+@pytest.mark.parametrize(
+    ['text', 'expect_node'],
+    [
+        ('age > 1 and age <= 5',
+         ('range', 'age', Range(1, 5, lower_inclusive=False))),
+        ('id == 1 and (age > 1 and name == a)',
+         ('and', (('eq', 'id', 1), ('range', 'age', Range(1, None, False)),
+                  ('eq', 'name', 'a')))),
+        ('not id in (1)', ('ne', 'id', 1)),
+        ('not age < 3', ('range', 'age', Range(lower=3))),
+        ('id == 1 and id == 2', FALSE),
+        ('age < 3 and age >= 3', FALSE),
+        ('age < 3 and age >= 3 or name == a', ('eq', 'name', 'a')),
+        ('not (age < 3 and age >= 3)', TRUE),
+        ('in_date < 2022-01-01',
+         ('range', 'in_date',
+          Range(upper=DAY(2022, 1, 1), upper_inclusive=False))),
+    ]
+)
+def test_fold(manager, text, expect_node):
+    where = compile_where(manager, text)
+    assert where.node == expect_node
+
+
+@pytest.mark.parametrize(
+    ['text', 'expect_exc'],
+    [
+        ('', raises(exceptions.CommandInvalidExpression)),
+        ('name', raises(exceptions.CommandInvalidExpression)),
+        ('name ==', raises(exceptions.CommandInvalidExpression)),
+        ('name == a b', raises(exceptions.CommandInvalidExpression)),
+        ('(name == a', raises(exceptions.CommandInvalidExpression)),
+        ('name in a', raises(exceptions.CommandInvalidExpression)),
+        ('name in (a,)', raises(exceptions.CommandInvalidExpression)),
+        ('name == a and', raises(exceptions.CommandInvalidExpression)),
+        ('name ~ a', raises(exceptions.CommandInvalidExpression)),
+        ('title == a', raises(exceptions.CommandInvalidExpression)),
+        ('age > x', raises(exceptions.DataEntryInvalid)),
+        ('in_date > 2022-13-01', raises(exceptions.DataEntryInvalid)),
+        ('name == "a b" or age in (1, 2)', no_raise()),
+    ]
+)
+def test_invalid(manager, text, expect_exc):
+    with expect_exc:
+        compile_where(manager, text)
+
+
+def test_compiled_once(manager):
+    assert compile_where(manager, 'age > 1') is compile_where(manager,
+                                                              'age > 1')
+    # the same function for the same conditions, whatever the values
+    predicate1 = compile_predicate(compile_where(manager, 'age > 1').node)
+    predicate2 = compile_predicate(compile_where(manager, 'age > 25').node)
+    assert predicate1.__code__ is predicate2.__code__
+    assert [predicate1(row) for row in ROWS] == [True, True, True, False]
+    assert [predicate2(row) for row in ROWS] == [True, False, False, False]
+
+
+def test_with_filters(manager):
+    query = Query(filters={'name': 'b'},
+                  where=compile_where(manager, 'age == 20 or id == 1'))
+    query.add_range('$gt', 'id', [1])
+    assert [row['id'] for row in query.filter(ROWS)] == [3]
+    assert query.fields == {'name', 'age', 'id'}
+    assert pickle.loads(pickle.dumps(query)) == query
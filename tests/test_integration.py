@@ -60,7 +60,7 @@ def test_integration(mocker: MockerFixture, tmp_path: Path):
         sysconf_kwargs={'conf_file': mock_open()})
 
     # assert that no any data right now
-    assert commands.command_list(instance, []) == []
+    assert list(commands.command_list(instance, [])) == []
 
     # normally add then get, and get a not found entry
     expect_data = {
@@ -89,9 +89,9 @@ def test_integration(mocker: MockerFixture, tmp_path: Path):
     # add an entry then delete
     commands.command_add(
         instance, [('id', '1234'), ('name', 'A'), ('date', '2022-06-25')])
-    assert len(commands.command_list(instance, [])) == 2
+    assert len(list(commands.command_list(instance, []))) == 2
     commands.command_del(instance, ['1234'])
-    assert len(commands.command_list(instance, [])) == 1
+    assert len(list(commands.command_list(instance, []))) == 1
 
     # delete a non-existed entry
     with pytest.raises(exceptions.DataEntryNotFound):
@@ -100,12 +100,12 @@ def test_integration(mocker: MockerFixture, tmp_path: Path):
     # add some other test data and then test list
     for n, test_data in enumerate(test_datas[1:]):
         assert commands.command_add(instance, test_data) == [expect_datas[n+1]]
-    assert commands.command_list(instance, []) == expect_datas
-    assert len(commands.command_list(instance, [('name', 'A')])) == 2
-    assert commands.command_list(instance,
-                                 [('$sort_asc', 'date'),
-                                  ('$sort_desc', 'name'),
-                                  ('$sort_asc', 'id')]) \
+    assert list(commands.command_list(instance, [])) == expect_datas
+    assert len(list(commands.command_list(instance, [('name', 'A')]))) == 2
+    assert list(commands.command_list(instance,
+                                      [('$sort_asc', 'date'),
+                                       ('$sort_desc', 'name'),
+                                       ('$sort_asc', 'id')])) \
            == [{'id': 104, 'name': 'D',
                 'date': datetime.datetime(2022, 6, 23, 0, 0)},
                {'id': 103, 'name': 'C',
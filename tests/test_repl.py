@@ -1,13 +1,16 @@
 # coding=utf-8
 # Author: @hsiaoxychen
+import datetime
 import inspect
 import os
 
 import pytest
 from pytest_mock import MockerFixture
+from tabulate import tabulate
 
 from minesqlite import repl
 from minesqlite import exceptions
+from minesqlite.data.query import Page
 from tests.utils import *
 
 
@@ -69,6 +72,10 @@ def test_read_interrupted(instance):
         ('$test', False),
         ('$sort_asc', True),
         ('$sort_desc', True),  # TODO: constant
+        ('$between', True),
+        ('$limit', True),
+        ('$offset', True),
+        ('$after', True),
     ]
 )
 def test_validate_key(data, success):
@@ -271,3 +278,75 @@ def test_repl_loop(mocker: MockerFixture, instance, raise_exc):
 
     if not raise_exc:
         mock_print_results.assert_called_once_with(instance, mock_rows)
+
+
+def test_print_results_with_token(mocker: MockerFixture, instance, capsys):
+    mocker.patch.object(instance.schema, 'fields', ['id'])
+    repl.print_results(instance, Page([{'id': 1}], next_token='abc'))
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[-1] == 'next page: $after abc'
+    assert len(lines) == 4
+
+
+@pytest.mark.parametrize(
+    'rows',
+    [
+        [{'id': 1, 'name': 'ab', 'date': datetime.datetime(2022, 1, 1)},
+         {'id': 100, 'name': 'c', 'date': datetime.datetime(2022, 1, 2)}],
+        [{'id': 1, 'name': 'a long name'}, {'id': 2, 'name': None}],
+    ]
+)
+def test_print_results_like_tabulate(mocker: MockerFixture, instance,
+                                     capsys, rows):
+    fields = ['id', 'name', 'date']
+    mocker.patch.object(instance.schema, 'fields', fields)
+    repl.print_results(instance, iter(rows))
+    assert capsys.readouterr().out == tabulate(
+        [[row.get(field) for field in fields] for row in rows],
+        headers=[field.upper() for field in fields],
+        tablefmt='orgtbl') + '\n'
+
+
+def test_print_results_in_chunks(mocker: MockerFixture, instance, capsys):
+    mocker.patch('minesqlite.repl.PRINT_CHUNK_ROWS', 2)
+    mocker.patch.object(instance.schema, 'fields', ['id', 'name'])
+    pulled = []
+
+    def generate():
+        for n, name in enumerate(['a', 'b', 'a longer name']):
+            pulled.append(n)
+            yield {'id': n, 'name': name}
+
+    def counting_print(*args, **kwargs):
+        pulled_when_printed.append(len(pulled))
+        print(*args, **kwargs)
+
+    pulled_when_printed = []
+    mocker.patch('minesqlite.repl.print', counting_print, create=True)
+    repl.print_results(instance, generate())
+    # the first chunk is printed before the next rows are pulled
+    assert pulled_when_printed == [2, 3]
+    assert capsys.readouterr().out.splitlines() == [
+        '|   ID | NAME   |',
+        '|------+--------|',
+        '|    0 | a      |',
+        '|    1 | b      |',
+        # cut to the width of the column
+        '|    2 | a lon… |',
+    ]
+
+
+def test_print_results_of_fields(mocker: MockerFixture, instance, capsys):
+    mocker.patch.object(instance.schema, 'fields', ['id', 'name'])
+    repl.print_results(instance, Page([{'id': 1, 'name': 'a'}],
+                                      fields=['name']))
+    assert capsys.readouterr().out.splitlines() == [
+        '| NAME   |',
+        '|--------|',
+        '| a      |',
+    ]
+
+
+def test_print_results_empty(instance, capsys):
+    repl.print_results(instance, iter([]))
+    assert capsys.readouterr().out == ''
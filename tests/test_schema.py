@@ -242,12 +242,22 @@ def test_convert_types_integer(mocker: MockerFixture, sysconf,
             datetime.datetime.strptime('2022-06-25', '%Y-%m-%d'),
             no_raise(),
         ),
+        (
+            '2022-6-5',
+            datetime.datetime(2022, 6, 5),
+            no_raise(),
+        ),
         # invalid test cases
         (
             '2022-06-251',
             None,
             raises(exceptions.DataEntryInvalid),
         ),
+        (
+            '2022-02-30',
+            None,
+            raises(exceptions.DataEntryInvalid),
+        ),
     ]
 )
 def test_convert_types_date(mocker: MockerFixture, sysconf,
@@ -258,3 +268,78 @@ def test_convert_types_date(mocker: MockerFixture, sysconf,
         manager = schema.SchemaManager(sysconf)
         got = manager.convert_types({'key': value})
         assert got == {'key': expect}
+
+
+@pytest.mark.parametrize(
+    ['field', 'values', 'expect', 'expect_exc'],
+    [
+        ('id1', ['2', '1', '2'], [2, 1, 2], no_raise()),
+        ('id2', ['2022-06-25', '2022-06-25'],
+         [datetime.datetime(2022, 6, 25)] * 2, no_raise()),
+        ('id1', ['1', 'a'], None, raises(exceptions.DataEntryInvalid)),
+    ]
+)
+def test_convert_column(mocker: MockerFixture, sysconf,
+                        field, values, expect, expect_exc):
+    data = os.linesep.join([
+        'columns:',
+        '  - name: id1',
+        '    type: integer',
+        '    attribute: primary_key',
+        '  - name: id2',
+        '    type: date',
+    ])
+    mock_open = mocker.mock_open(read_data=data)
+    sysconf['schema.read.infile'] = mock_open()
+    manager = schema.SchemaManager(sysconf)
+    with expect_exc:
+        assert manager.convert_column(field, values) == expect
+
+
+@pytest.mark.parametrize(
+    ['field', 'expect', 'expect_exc'],
+    [
+        ('id1', 'integer', no_raise()),
+        ('id2', 'date', no_raise()),
+        ('id3', None, raises(exceptions.InternalError)),
+    ]
+)
+def test_get_field_type(mocker: MockerFixture, sysconf,
+                        field, expect, expect_exc):
+    data = os.linesep.join([
+        'columns:',
+        '  - name: id1',
+        '    type: integer',
+        '    attribute: primary_key',
+        '  - name: id2',
+        '    type: date',
+    ])
+    mock_open = mocker.mock_open(read_data=data)
+    sysconf['schema.read.infile'] = mock_open()
+    manager = schema.SchemaManager(sysconf)
+    with expect_exc:
+        assert manager.get_field_type(field) == expect
+
+
+def test_indexed_fields(mocker: MockerFixture, sysconf):
+    data = os.linesep.join([
+        'columns:',
+        '  - name: id1',
+        '    type: integer',
+        '    attribute: primary_key,index',
+        '  - name: id2',
+        '    type: date',
+        '    attribute: index',
+        '  - name: id3',
+        '    type: string',
+        '    attribute: sorted_index',
+        '  - name: id4',
+        '    type: string',
+        '    attribute: bitmap_index',
+    ])
+    mock_open = mocker.mock_open(read_data=data)
+    sysconf['schema.read.infile'] = mock_open()
+    manager = schema.SchemaManager(sysconf)
+    assert manager.indexed_fields == ['id1', 'id2']
+    assert manager.sorted_indexed_fields == ['id3']
+    assert manager.bitmap_indexed_fields == ['id4']
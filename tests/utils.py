@@ -1,10 +1,49 @@
 # coding=utf-8
 # Author: @hsiaoxychen
+import datetime
 from contextlib import nullcontext
 
 import pytest
 
-__all__ = ['raises', 'no_raise']
+from minesqlite.data.query import Query
+
+__all__ = ['raises', 'no_raise', 'traverse', 'make_row', 'create',
+           'make_query']
 
 raises = pytest.raises
 no_raise = nullcontext
+
+
+def traverse(manager) -> list:
+    """All the rows of a data manager, through its cursors."""
+    rows = []
+    cursor = manager.build_cursor()
+    while cursor:
+        cursor, row = manager.next_row(cursor)
+        rows.append(row)
+    return rows
+
+
+def make_row(pk: int, name: str = 'name', day: int = 1) -> dict:
+    """A row of the schema of `id`, `name` and `in_date`."""
+    return {'id': pk, 'name': name,
+            'in_date': datetime.datetime(2022, 6, day)}
+
+
+def create(manager, row: dict) -> dict:
+    """Create a row holding its primary key, by `create_one`."""
+    kvs = row.copy()
+    return manager.create_one(kvs.pop('id'), kvs)
+
+
+def make_query(filters=None, ranges=None, sorts=(), limit=None, offset=0,
+               after=None) -> Query:
+    """A query of the filters, the `{field: (magic_key, bounds)}` ranges
+    and the `(magic_key, field)` sorts."""
+    query = Query(filters=dict(filters or {}), limit=limit, offset=offset,
+                  after=after)
+    for field, (magic_key, bounds) in (ranges or {}).items():
+        query.add_range(magic_key, field, bounds)
+    for magic_key, field in sorts:
+        query.add_sort(magic_key, field)
+    return query